@@ -0,0 +1,95 @@
+"""下载引擎并发流数基准：thread 和 async 引擎在 1 / 16 / 256 个并发流下的吞吐和 CPU 开销。
+
+测试仓库（tests/fake_registry.py）在子进程中运行，只统计拉取端进程的 CPU 时间。
+每一轮下载 --total 字节，平均分给 N 个 blob，每个 blob 一个流（--total 不超过 50MB 的分片阈值，
+单个流的一轮也不会被拆成分片）。
+
+    python benchmarks/bench_streams.py
+    python benchmarks/bench_streams.py --total 33554432 --streams 1,16,256 --engines thread,async --repeat 3
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import docker_image_puller as dip  # noqa: E402
+
+
+def start_registry(blobs: int, size: int):
+    """在子进程中启动测试仓库，返回 (进程, 仓库信息)"""
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'tests', 'fake_registry.py'), '--blobs', str(blobs), '--size', str(size)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+    return proc, json.loads(proc.stdout.readline())
+
+
+def run_engine(engine: str, info: dict, streams: int, workdir: str) -> bool:
+    ctx = dip.PullContext(cli_output=False)
+    session = dip.SessionManager.get_session()
+    jobs = []
+    for i, blob in enumerate(info['blobs']):
+        url = f'{info["url"]}/v2/{info["repository"]}/blobs/{blob["digest"]}'
+        desc = f'blob{i}'
+        ctx.progress.add_layer(desc, blob['size'], i + 1, len(info['blobs']))
+        jobs.append((url, os.path.join(workdir, blob['digest'][7:]), desc, blob['digest'], blob['size']))
+
+    if engine == 'async':
+        return dip.AsyncDownloadEngine(max_streams=streams, ctx=ctx).run(
+            [job[:4] for job in jobs], {}, ctx.stats
+        )
+    with ThreadPoolExecutor(max_workers=streams) as executor:
+        futures = [
+            executor.submit(ctx.run, dip.download_file_with_progress, session, url, {}, path, desc,
+                            expected_digest=digest, stats=ctx.stats, expected_size=size, ctx=ctx)
+            for url, path, desc, digest, size in jobs
+        ]
+        return all(future.result() for future in futures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较 thread / async 下载引擎在不同并发流数下的吞吐和 CPU 开销')
+    parser.add_argument('--total', type=int, default=48 * 1024 * 1024, help='每一轮下载的总字节数（不超过 50MB）')
+    parser.add_argument('--streams', default='1,16,256', help='逗号分隔的并发流数')
+    parser.add_argument('--engines', default='thread,async', help='逗号分隔的引擎')
+    parser.add_argument('--repeat', type=int, default=1, help='每种组合重复的次数，取最快的一次')
+    args = parser.parse_args()
+    if args.total > dip.AsyncDownloadEngine.CHUNK_THRESHOLD:
+        parser.error('--total 超过分片阈值，单个流的一轮会被拆成分片')
+
+    logging.disable(logging.WARNING)
+    print(f'{"engine":>8} {"streams":>8} {"blob":>10} {"wall s":>8} {"MB/s":>9} {"CPU s/GB":>9}')
+    for streams in [int(s) for s in args.streams.split(',')]:
+        size = args.total // streams
+        proc, info = start_registry(streams, size)
+        try:
+            for engine in args.engines.split(','):
+                best = None
+                for _ in range(args.repeat):
+                    with tempfile.TemporaryDirectory() as workdir:
+                        wall, cpu = time.perf_counter(), time.process_time()
+                        ok = run_engine(engine, info, streams, workdir)
+                        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+                    if not ok:
+                        raise SystemExit(f'{engine} / {streams} 流下载失败')
+                    if best is None or wall < best[0]:
+                        best = (wall, cpu)
+                wall, cpu = best
+                total = size * streams
+                print(f'{engine:>8} {streams:>8} {dip.LayerProgress.format_size(size):>10} {wall:>8.2f} '
+                      f'{total / wall / 1024 / 1024:>9.1f} {cpu / (total / 1024 ** 3):>9.2f}')
+        finally:
+            proc.stdin.close()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,14 @@ import json
 import hashlib
 import shutil
 import threading
+import queue
+import asyncio
+import contextvars
+import weakref
+import ssl
 import time
 import warnings
+import random
 import re
 
 # Set default encoding to UTF-8
@@ -22,16 +28,43 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import tarfile
+import socket
+import stat
+import sqlite3
+import http.client
+import http.server
+import socketserver
+import collections
 import urllib3
+import urllib3.util.connection
 import argparse
 import logging
 import base64
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import copy
+import csv
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from dataclasses import dataclass, field
 from typing import Optional, Dict, List, Tuple, Any, Callable
 from pathlib import Path
+from urllib.parse import urlsplit, urljoin, quote
 import io
 import signal
+import zlib
+import struct
+from contextlib import contextmanager
+
+try:
+    # 可选依赖：pip install "httpx[http2]"，安装后 https 请求走 HTTP/2 多路复用
+    import httpx
+    import h2.exceptions
+except ImportError:
+    httpx = None
+
+try:
+    # 可选依赖：pip install zstandard，安装后支持导出 .tar.zst
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 urllib3.disable_warnings()
@@ -62,17 +95,20 @@ class GUILogHandler(logging.Handler):
     
     属性:
         log_callback: 回调函数，接收格式化后的日志字符串
+        context: 所属的拉取上下文，其他拉取线程产生的日志不会转发到该回调
     """
     
-    def __init__(self, log_callback=None):
+    def __init__(self, log_callback=None, context=None):
         """
         初始化GUI日志处理器
         
         参数:
             log_callback: 回调函数，用于将日志发送到GUI显示
+            context: 所属的 PullContext，为 None 时转发所有日志
         """
         super().__init__()
         self.log_callback = log_callback
+        self.context = context
 
     def emit(self, record):
         """
@@ -82,6 +118,10 @@ class GUILogHandler(logging.Handler):
         参数:
             record: logging.LogRecord对象，包含日志级别、消息等信息
         """
+        # 同一进程内并发拉取时，只转发本拉取线程或未绑定拉取的线程产生的日志
+        current = current_pull_context()
+        if self.context is not None and current is not None and current is not self.context:
+            return
         if self.log_callback:
             msg = self.format(record)
             self.log_callback(msg + '\n')
@@ -93,9 +133,11 @@ logging.basicConfig(
     encoding='utf-8'
 )
 logger = logging.getLogger(__name__)
+# httpx 默认以 INFO 级别记录每个请求，会淹没进度输出
+logging.getLogger('httpx').setLevel(logging.WARNING)
 
+# 进程级停止信号（Ctrl+C、GUI 取消/退出），所有拉取上下文都会响应
 stop_event = threading.Event()
-progress_lock = threading.Lock()
 original_sigint_handler = None
 
 
@@ -110,6 +152,8 @@ def signal_handler(signum, frame):
         sys.exit(1)
     
     stop_event.set()
+    for ctx in active_pulls():
+        ctx.cancel()
     print('\n⚠️ 收到中断信号，正在保存进度并退出...')
     print('💡 再次按 Ctrl+C 强制退出')
 
@@ -119,27 +163,63 @@ original_sigint_handler = signal.signal(signal.SIGINT, signal_handler)
 
 @dataclass
 class ImageInfo:
-    """镜像信息数据类：存储仓库地址、镜像名称、标签和协议等信息"""
+    """镜像信息数据类：存储仓库地址、镜像名称、标签和协议等信息。
+
+    digest 不为空时（image@sha256:... 形式）清单按 digest 获取，标签只用于命名。
+    """
     registry: str
     repository: str
     image_name: str
     tag: str
     protocol: str = 'https'
+    digest: Optional[str] = None
+
+    @property
+    def reference(self) -> str:
+        """获取清单时使用的引用：固定的 digest 优先于标签"""
+        return self.digest or self.tag
 
 
 @dataclass
 class DownloadStats:
-    """下载统计信息：总大小、已下载大小、下载速度等"""
+    """下载统计信息：总大小、已下载大小、下载速度等。
+
+    由多个下载线程同时更新，所有读-改-写操作都通过方法在锁内完成，不依赖 GIL。
+    """
     total_size: int = 0
     downloaded_size: int = 0
     start_time: float = 0.0
+    first_byte_time: float = 0.0
     speeds: List[float] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add_total(self, size: int):
+        """累加本次需要下载的字节数，并在首次调用时记录开始时间"""
+        with self._lock:
+            self.total_size += size
+            if self.start_time == 0:
+                self.start_time = time.time()
+
+    def record_speed(self, speed: float):
+        """记录一次速度采样"""
+        with self._lock:
+            self.speeds.append(speed)
+
+    def mark_first_byte(self):
+        """记录首个数据块到达的时间"""
+        if self.first_byte_time:
+            return
+        with self._lock:
+            if self.first_byte_time == 0:
+                self.first_byte_time = time.time()
 
     def get_avg_speed(self) -> float:
         """获取平均下载速度（取最近10次速度的平均值）"""
-        if not self.speeds:
+        with self._lock:
+            recent = self.speeds[-10:]
+        if not recent:
             return 0.0
-        return sum(self.speeds[-10:]) / len(self.speeds[-10:])
+        return sum(recent) / len(recent)
 
     def format_size(self, size: int) -> str:
         """格式化文件大小显示（B/KB/MB/GB/TB）"""
@@ -211,29 +291,55 @@ class ProgressDisplay:
         self.log_callback = log_callback  # GUI回调函数
         # 当 sys.stdout 为 None 时（PyInstaller -w 模式），禁用 CLI 输出
         self.cli_output = bool(cli_output and sys.stdout and hasattr(sys.stdout, 'write'))
+        self._render_stop = threading.Event()
+        self._render_thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start_render_timer(self):
+        """启动定时渲染线程：下载线程只更新计数，由该线程按 update_interval 刷新显示"""
+        if self._render_thread is not None:
+            return
+        self._render_stop.clear()
+
+        def _loop():
+            while not self._render_stop.wait(self.update_interval):
+                self._refresh_display()
+
+        self._render_thread = threading.Thread(target=_loop, name='progress-render', daemon=True)
+        self._render_thread.start()
+
+    def stop_render_timer(self):
+        """停止定时渲染线程"""
+        self._render_stop.set()
+        if self._render_thread is not None:
+            self._render_thread.join(timeout=1)
+            self._render_thread = None
 
     def add_layer(self, name: str, total_size: int, index: int, total_layers: int):
         """添加一个新的镜像层到进度显示列表中"""
-        with progress_lock:
+        with self._lock:
             self.layers[name] = LayerProgress(name, total_size, index, total_layers)
     
     def update_layer(self, name: str, downloaded: int):
-        """更新指定层的已下载大小"""
-        with progress_lock:
-            if name in self.layers:
-                self.layers[name].downloaded_size = downloaded
-                self.layers[name].status = 'downloading'
-        self._refresh_display()
+        """更新指定层的已下载大小（热路径：只写计数不加锁，显示由定时渲染线程刷新）。
+
+        每个层只由一个线程写入（单流下载的工作线程，或分片下载的汇总线程），
+        属性赋值本身是原子的，无 GIL 时也不会读到损坏的值，最多显示上一轮的计数。
+        """
+        layer = self.layers.get(name)
+        if layer is not None:
+            layer.downloaded_size = downloaded
+            layer.status = 'downloading'
 
     def update_layer_size(self, name: str, total_size: int):
         """更新指定层的总大小"""
-        with progress_lock:
+        with self._lock:
             if name in self.layers:
                 self.layers[name].set_total_size(total_size)
 
     def complete_layer(self, name: str):
         """标记指定层为已完成状态"""
-        with progress_lock:
+        with self._lock:
             if name in self.layers:
                 layer = self.layers[name]
                 if layer.total_size == 0:
@@ -245,19 +351,20 @@ class ProgressDisplay:
     
     def set_chunk_info(self, name: str, current: int, total: int):
         """设置指定层的分片下载信息"""
-        with progress_lock:
+        with self._lock:
             if name in self.layers:
                 self.layers[name].current_chunk = current
                 self.layers[name].total_chunks = total
 
     def _refresh_display(self):
         """刷新进度显示：计算当前进度并输出到终端或GUI"""
-        current_time = time.time()
-        if current_time - self.last_update < self.update_interval:
-            return
-        self.last_update = current_time
+        with self._lock:
+            # 节流判断放在锁内：渲染线程与 complete_layer 同时刷新时只输出一次
+            current_time = time.time()
+            if current_time - self.last_update < self.update_interval:
+                return
+            self.last_update = current_time
 
-        with progress_lock:
             lines = []
             for name, layer in sorted(self.layers.items(), key=lambda x: x[1].index):
                 line = self._format_layer_line(layer)
@@ -325,7 +432,7 @@ class ProgressDisplay:
 
     def print_initial(self):
         """打印初始进度显示（所有层尚未开始下载）"""
-        with progress_lock:
+        with self._lock:
             for name, layer in sorted(self.layers.items(), key=lambda x: x[1].index):
                 line = self._format_layer_line(layer)
                 print(line)
@@ -335,13 +442,11 @@ class ProgressDisplay:
             self.initialized = True
 
 
-progress_display = ProgressDisplay()
-
-
 def cancel_current_pull():
-    """取消当前正在进行的拉取操作，发送停止信号并关闭会话连接"""
-    global stop_event
+    """取消所有正在进行的拉取操作，发送停止信号并关闭会话连接"""
     stop_event.set()
+    for ctx in active_pulls():
+        ctx.cancel()
     logger.info('⚠️ 已发送取消信号')
     # 强制关闭所有进行中的session连接
     try:
@@ -350,10 +455,232 @@ def cancel_current_pull():
         logger.debug(f'关闭session时出错: {e}')
 
 
+DNS_CACHE_TTL = 300   # DNS 解析结果的缓存时间（秒）
+
+
+class DNSCache:
+    """DNS解析缓存：每个主机在 ttl 秒内只解析一次，后续连接直接复用解析结果。
+
+    过期后重新解析，长时间运行的进程（serve、daemon）能跟上仓库和 CDN 的地址变化。
+    """
+    def __init__(self, ttl: float = DNS_CACHE_TTL):
+        self.ttl = ttl
+        self._cache: Dict[Tuple[str, int], Tuple[List[str], float]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int) -> List[str]:
+        """解析主机地址，返回去重后的IP列表（缓存未过期时不再发起DNS查询）"""
+        key = (host, port)
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None and time.monotonic() < cached[1]:
+            return cached[0]
+
+        family = urllib3.util.connection.allowed_gai_family()
+        addresses = []
+        for _, _, _, _, sockaddr in socket.getaddrinfo(host, port, family, socket.SOCK_STREAM):
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+        with self._lock:
+            self._cache[key] = (addresses, time.monotonic() + self.ttl)
+        logger.debug(f'DNS解析 {host}: {", ".join(addresses)}')
+        return addresses
+
+    def invalidate(self, host: str, port: int):
+        """移除指定主机的缓存（缓存的地址全部连接失败时调用）"""
+        with self._lock:
+            self._cache.pop((host, port), None)
+
+    def clear(self):
+        """清空全部缓存"""
+        with self._lock:
+            self._cache.clear()
+
+
+# Docker Hub 的 blob 请求会被重定向到 CDN，预热时一并建立到 CDN 的连接
+BLOB_HOST_HINTS = {
+    'registry-1.docker.io': 'production.cloudflare.docker.com',
+    'registry.hub.docker.com': 'production.cloudflare.docker.com',
+}
+
+
+class _HTTP2ResponseBody:
+    """把 httpx 流式响应包装成 requests 需要的 raw 对象（read / stream / close）"""
+    # 提前关闭时剩余数据不超过该值则读完丢弃，否则整条连接作废
+    DRAIN_LIMIT = 1024 * 1024
+
+    def __init__(self, resp: 'httpx.Response', adapter: 'HTTP2Adapter'):
+        self._resp = resp
+        self._adapter = adapter
+        self._iter = None
+        self._pending = b''
+        self.closed = False
+
+    def read(self, amt: Optional[int] = None, decode_content: Optional[bool] = None) -> bytes:
+        """读取至多 amt 字节未解码的响应体，amt 为空时读到结尾"""
+        if self._iter is None:
+            self._iter = self._resp.iter_raw()
+        chunks = [self._pending]
+        size = len(self._pending)
+        try:
+            while amt is None or size < amt:
+                data = next(self._iter, b'')
+                if not data:
+                    break
+                chunks.append(data)
+                size += len(data)
+        except httpx.TransportError as e:
+            raise _translate_httpx_error(e, body=True) from e
+        data = b''.join(chunks)
+        if amt is None:
+            self._pending = b''
+            return data
+        self._pending = data[amt:]
+        return data[:amt]
+
+    def stream(self, amt: int = 65536, decode_content: bool = True):
+        """供 Response.iter_content 使用；decode_content 时按 Content-Encoding 解码"""
+        if not decode_content:
+            while True:
+                data = self.read(amt)
+                if not data:
+                    return
+                yield data
+        self._iter = self._resp.iter_bytes(amt)
+        try:
+            yield from self._iter
+        except httpx.TransportError as e:
+            raise _translate_httpx_error(e, body=True) from e
+
+    def close(self):
+        """关闭响应。
+
+        httpcore 提前关闭 HTTP/2 流时不会发送 RST_STREAM，服务端继续发送的数据也不会被确认，
+        会永久占用连接级流控窗口，最终使同一连接上的其他流停滞。
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if not self._resp.is_closed and self._resp.http_version == 'HTTP/2':
+            length = self._resp.headers.get('content-length')
+            remaining = int(length) - self._resp.num_bytes_downloaded if length and length.isdigit() else None
+            if remaining is not None and remaining <= self.DRAIN_LIMIT:
+                try:
+                    for _ in (self._iter if self._iter is not None else self._resp.iter_raw()):
+                        pass
+                except (httpx.HTTPError, httpx.StreamError):
+                    pass
+            elif remaining is None or remaining > 0:
+                self._adapter.reset_connections()
+        self._resp.close()
+
+    def release_conn(self):
+        self.close()
+
+
+def _translate_httpx_error(error: BaseException, body: bool = False) -> requests.exceptions.RequestException:
+    """把 httpx 异常转换为对应的 requests 异常，使重试策略的错误分类保持不变"""
+    if isinstance(error, httpx.ConnectTimeout):
+        return requests.exceptions.ConnectTimeout(str(error))
+    if isinstance(error, httpx.TimeoutException):
+        return requests.exceptions.ReadTimeout(str(error))
+    if body:
+        return requests.exceptions.ChunkedEncodingError(str(error))
+    return requests.exceptions.ConnectionError(str(error))
+
+
+class HTTP2Adapter(requests.adapters.BaseAdapter):
+    """HTTP/2 传输适配器：同一主机的清单、HEAD 和分片请求复用一条连接（多路复用）。
+
+    服务端不支持 HTTP/2（ALPN 协商为 HTTP/1.1）或握手出错的主机会被记住，
+    之后的请求交给原有的 requests/urllib3 适配器处理；使用代理、客户端证书或自定义 CA 证书时同样直接回退，
+    因为共享的 httpx 客户端无法按请求设置这些 TLS 参数。
+    """
+    # HTTP/2 禁止逐跳头部，requests 默认会带上 Connection: keep-alive
+    HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'}
+
+    def __init__(self, fallback: HTTPAdapter):
+        super().__init__()
+        self.fallback = fallback
+        self._http1_hosts = set()
+        self._lock = threading.Lock()
+        self._client = self._create_client()
+
+    @staticmethod
+    def _create_client() -> 'httpx.Client':
+        return httpx.Client(
+            http2=True,
+            verify=False,
+            follow_redirects=False,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+        )
+
+    def reset_connections(self):
+        """丢弃当前所有 HTTP/2 连接，之后的请求建立新连接；进行中的流会报错并由重试策略续传"""
+        with self._lock:
+            client, self._client = self._client, self._create_client()
+        logger.debug('HTTP/2 流被提前关闭，重建连接')
+        client.close()
+
+    def _use_fallback(self, host: str, reason: str):
+        with self._lock:
+            if host in self._http1_hosts:
+                return
+            self._http1_hosts.add(host)
+        logger.debug(f'{host} {reason}，改用 HTTP/1.1 连接池')
+
+    @staticmethod
+    def _timeout(timeout) -> 'httpx.Timeout':
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect)
+        return httpx.Timeout(timeout)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        parts = urlsplit(request.url)
+        host = parts.netloc
+        if (proxies or {}).get(parts.scheme) or cert or isinstance(verify, str) or host in self._http1_hosts:
+            return self.fallback.send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in self.HOP_BY_HOP_HEADERS]
+        try:
+            client = self._client
+            h2_request = client.build_request(
+                request.method, request.url, headers=headers, content=request.body, timeout=self._timeout(timeout)
+            )
+            h2_response = client.send(h2_request, stream=True)
+        except httpx.TimeoutException as e:
+            raise _translate_httpx_error(e) from e
+        except (httpx.TransportError, h2.exceptions.H2Error) as e:
+            self._use_fallback(host, f'HTTP/2 请求失败（{e}）')
+            return self.fallback.send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+
+        if h2_response.http_version != 'HTTP/2':
+            self._use_fallback(host, '不支持 HTTP/2')
+
+        response = requests.Response()
+        response.status_code = h2_response.status_code
+        response.reason = h2_response.reason_phrase
+        response.headers = requests.structures.CaseInsensitiveDict(h2_response.headers.items())
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.raw = _HTTP2ResponseBody(h2_response, self)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        self._client.close()
+        self.fallback.close()
+
+
 class SessionManager:
     """HTTP会话管理器：管理全局requests会话，支持连接池和代理"""
     _instance: Optional[requests.Session] = None
     _lock = threading.Lock()
+    http2_enabled = httpx is not None
+    dns_cache = DNSCache()
+    _blob_hosts: Dict[str, str] = {}
 
     @classmethod
     def get_session(cls) -> requests.Session:
@@ -375,18 +702,34 @@ class SessionManager:
                     logger.debug(f'关闭session连接时出错: {e}')
                 finally:
                     cls._instance = None
+            cls.dns_cache.clear()
+
+    @classmethod
+    def remember_blob_host(cls, request_url: str, final_url: str):
+        """记录 blob 请求重定向后的实际主机，供下次预热连接使用"""
+        origin = urlsplit(request_url)
+        target = urlsplit(final_url)
+        if target.netloc and target.netloc != origin.netloc:
+            with cls._lock:
+                cls._blob_hosts[origin.netloc] = f'{target.scheme}://{target.netloc}'
+
+    @classmethod
+    def predict_blob_host(cls, registry: str, protocol: str = 'https') -> Optional[str]:
+        """预测 blob 下载实际使用的主机（优先使用本会话观察到的重定向目标）"""
+        with cls._lock:
+            learned = cls._blob_hosts.get(registry)
+        if learned:
+            return learned
+        hint = BLOB_HOST_HINTS.get(registry)
+        return f'https://{hint}' if hint else None
 
     @classmethod
     def _create_session(cls) -> requests.Session:
         """创建配置好的HTTP会话：设置重试策略、连接池和代理"""
         session = requests.Session()
 
-        retry_strategy = Retry(
-            total=3,    # http/https连接超时重试次数
-            backoff_factor=3,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["GET", "HEAD", "OPTIONS"]
-        )
+        # 连接层不再自动重试，所有重试统一由 RetryPolicy 处理，避免多层重试叠加
+        retry_strategy = Retry(total=0, read=False)
 
         adapter = HTTPAdapter(
             max_retries=retry_strategy,
@@ -396,7 +739,13 @@ class SessionManager:
         )
 
         session.mount("http://", adapter)
-        session.mount("https://", adapter)
+        if cls.http2_enabled and httpx is not None:
+            # HTTP/2 需要 TLS（ALPN 协商），明文 http 仍走 HTTP/1.1
+            session.mount("https://", HTTP2Adapter(adapter))
+            logger.debug('已启用 HTTP/2 传输（httpx）')
+        else:
+            session.mount("https://", adapter)
+        session.hooks['response'].append(rate_limiter.observe)
         session.timeout = (30, 600)    # http/https连接超时30秒, 读取超时600秒
 
         session.proxies = {
@@ -409,6 +758,558 @@ class SessionManager:
         return session
 
 
+_original_create_connection = urllib3.util.connection.create_connection
+
+
+def _create_connection_with_dns_cache(address, *args, **kwargs):
+    """替换 urllib3 的建连函数：优先使用 DNSCache 中的地址，全部失败时回退到重新解析"""
+    host, port = address
+    try:
+        addresses = SessionManager.dns_cache.resolve(host.strip('[]'), port)
+    except OSError:
+        return _original_create_connection(address, *args, **kwargs)
+
+    for ip in addresses:
+        try:
+            return _original_create_connection((ip, port), *args, **kwargs)
+        except OSError as e:
+            logger.debug(f'连接 {host}({ip}) 失败: {e}')
+
+    SessionManager.dns_cache.invalidate(host.strip('[]'), port)
+    return _original_create_connection(address, *args, **kwargs)
+
+
+urllib3.util.connection.create_connection = _create_connection_with_dns_cache
+
+
+def prewarm_connections(
+    session: requests.Session,
+    registry: str,
+    protocol: str = 'https',
+    count: int = 4
+) -> Optional[threading.Thread]:
+    """在后台预先建立到仓库和 blob 主机的连接，与认证、清单请求并行进行。
+
+    每个主机同时发起 count 个 HEAD 请求，并在全部返回前保持响应打开，
+    确保连接池中留下 count 个已完成 TCP+TLS 握手的独立连接。
+    """
+    if count <= 0:
+        return None
+
+    targets = [f'{protocol}://{registry}/v2/']
+    blob_host = SessionManager.predict_blob_host(registry, protocol)
+    if blob_host:
+        targets.append(f'{blob_host}/')
+
+    def _warm(url: str, barrier: threading.Barrier):
+        try:
+            with session.head(url, verify=False, timeout=(10, 30), stream=True, allow_redirects=False):
+                barrier.wait(timeout=10)
+        except (requests.exceptions.RequestException, threading.BrokenBarrierError) as e:
+            logger.debug(f'预热连接 {url} 失败: {e}')
+
+    def _run():
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=count * len(targets)) as executor:
+            for url in targets:
+                barrier = threading.Barrier(count)
+                for _ in range(count):
+                    executor.submit(_warm, url, barrier)
+        logger.debug(f'🔥 已预热 {len(targets)} 个主机的连接 (每个 {count} 个)，耗时 {time.time() - started:.2f}秒')
+
+    thread = threading.Thread(target=_run, name='prewarm', daemon=True)
+    thread.start()
+    return thread
+
+
+@dataclass
+class RateLimitBudget:
+    """单个仓库的限流配额：来自 ratelimit-limit / ratelimit-remaining / Retry-After 响应头"""
+    limit: int = 0
+    remaining: int = 0
+    window: float = 0.0
+    retry_at: float = 0.0
+    last_request: float = 0.0
+    updated_at: float = 0.0
+
+
+class RateLimiter:
+    """仓库限流感知：跟踪每个仓库的剩余配额，配额不足时按窗口速率放慢请求节奏。
+
+    以 requests 响应钩子的方式接入会话，所有响应都会更新配额；
+    RetryState.check() 在每次请求前调用 acquire()：所有请求都遵守 Retry-After，
+    计入限额的请求（清单 GET）在配额不足时匀速发送，保证批量拉取贴近限额但不触发 429。
+    """
+    def __init__(self, reserve_ratio: float = 0.1):
+        self.reserve_ratio = reserve_ratio
+        self._budgets: Dict[str, RateLimitBudget] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse_quota(value: Optional[str]) -> Tuple[Optional[int], float]:
+        """解析形如 "100;w=21600" 的配额头，返回 (数量, 窗口秒数)"""
+        if not value:
+            return None, 0.0
+        m = re.match(r'\s*(\d+)(?:\s*;\s*w=(\d+))?', value)
+        if not m:
+            return None, 0.0
+        return int(m.group(1)), float(m.group(2) or 0)
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """解析 Retry-After 头（秒数或 HTTP 日期），返回需要等待的秒数"""
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            from email.utils import parsedate_to_datetime
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def observe(self, resp: requests.Response, *args, **kwargs):
+        """响应钩子：从响应头中更新对应仓库的配额"""
+        host = urlsplit(resp.url).netloc
+        limit, window = self._parse_quota(resp.headers.get('ratelimit-limit'))
+        remaining, _ = self._parse_quota(resp.headers.get('ratelimit-remaining'))
+        retry_after = self.parse_retry_after(resp.headers.get('Retry-After')) if resp.status_code in (429, 503) else None
+        if limit is None and remaining is None and retry_after is None:
+            return
+
+        with self._lock:
+            budget = self._budgets.setdefault(host, RateLimitBudget())
+            if limit is not None:
+                budget.limit = limit
+                budget.window = window
+            if remaining is not None:
+                budget.remaining = remaining
+            if resp.status_code == 429:
+                budget.remaining = 0
+            if retry_after is not None:
+                budget.retry_at = time.time() + retry_after
+            budget.updated_at = time.time()
+            logger.debug(f'{host} 限流配额: {budget.remaining}/{budget.limit} (窗口 {budget.window:.0f}秒)')
+
+    def budget(self, host: str) -> Optional[RateLimitBudget]:
+        """获取指定仓库当前已知配额的快照（未返回限流头的仓库为 None）"""
+        with self._lock:
+            budget = self._budgets.get(host)
+            return RateLimitBudget(**vars(budget)) if budget is not None else None
+
+    def _budget_low(self, budget: RateLimitBudget) -> bool:
+        return budget.limit > 0 and budget.remaining <= max(1, int(budget.limit * self.reserve_ratio))
+
+    def is_low(self, host: str) -> bool:
+        """配额是否已低于保留比例"""
+        with self._lock:
+            budget = self._budgets.get(host)
+            return budget is not None and self._budget_low(budget)
+
+    def _reserve(self, host: str, paced: bool) -> Tuple[float, bool]:
+        """计算下一次请求前需要等待的秒数，返回 (等待秒数, 是否已预占发送时刻)。
+
+        遵守 Retry-After；paced 请求在配额不足时按 窗口/限额 的速率匀速发送，
+        发送时刻在锁内计算并预占，多个线程同时请求时依次排开，不会挤在同一时刻。
+        """
+        now = time.time()
+        with self._lock:
+            budget = self._budgets.get(host)
+            if budget is None:
+                return 0.0, False
+            if budget.retry_at > now:
+                return budget.retry_at - now, False
+            if not paced:
+                return 0.0, False
+            if not self._budget_low(budget) or budget.window <= 0:
+                budget.last_request = now
+                return 0.0, True
+            slot = max(now, budget.last_request + budget.window / budget.limit)
+            budget.last_request = slot
+            return slot - now, True
+
+    def acquire(self, host: str, paced: bool = False, cancel=None) -> bool:
+        """请求前调用：必要时等待配额，返回 False 表示等待期间已取消（cancel 为取消令牌，默认 stop_event）"""
+        cancel = cancel or stop_event
+        while True:
+            delay, reserved = self._reserve(host, paced)
+            if delay > 0:
+                logger.info(f'⏳ {host} 限流配额不足，{delay:.1f}秒后继续请求')
+                if cancel.wait(delay):
+                    return False
+            # Retry-After 等待结束后重新计算，paced 请求还需预占发送时刻
+            if reserved or delay <= 0:
+                return True
+
+
+rate_limiter = RateLimiter()
+
+
+class TokenBucket:
+    """令牌桶限速器：按字节发放令牌，允许短暂透支后按速率平滑偿还。
+
+    容量只保留 0.1 秒的突发量，等待以不超过 0.1 秒的片段进行，
+    因此速率在运行中调整后能立即生效，限速效果平滑而不突发。
+    """
+    BURST_SECONDS = 0.1
+
+    def __init__(self, rate: float = 0):
+        self.rate = rate
+        self.tokens = 0.0
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float):
+        """调整速率（字节/秒），0 表示不限速"""
+        with self._lock:
+            self._refill()
+            self.rate = max(0.0, rate)
+            self.tokens = min(self.tokens, self.rate * self.BURST_SECONDS)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self.tokens = min(self.rate * self.BURST_SECONDS, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _debit(self, amount: int):
+        with self._lock:
+            if self.rate > 0:
+                self._refill()
+                self.tokens -= amount
+
+    def _next_wait(self) -> float:
+        """透支尚未偿还时返回下一段等待时长（不超过 0.1 秒），否则返回 0"""
+        with self._lock:
+            if self.rate <= 0:
+                self.tokens = 0.0
+                return 0.0
+            self._refill()
+            if self.tokens >= 0:
+                return 0.0
+            return min(-self.tokens / self.rate, 0.1)
+
+    def consume(self, amount: int, cancel=None) -> bool:
+        """取走 amount 字节的令牌，令牌不足时等待；返回 False 表示等待期间已取消"""
+        cancel = cancel or stop_event
+        self._debit(amount)
+        while True:
+            delay = self._next_wait()
+            if delay <= 0:
+                return True
+            if cancel.wait(delay):
+                return False
+
+    async def consume_async(self, amount: int, cancel=None) -> bool:
+        """consume 的 asyncio 版本，等待期间不阻塞事件循环"""
+        cancel = cancel or stop_event
+        self._debit(amount)
+        while True:
+            delay = self._next_wait()
+            if delay <= 0:
+                return True
+            if cancel.is_set():
+                return False
+            await asyncio.sleep(delay)
+
+
+class BandwidthLimiter:
+    """带宽限制：全局令牌桶加按仓库的令牌桶，所有下载流共享"""
+    def __init__(self):
+        self.global_bucket = TokenBucket()
+        self._registry_buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse_rate(value: Optional[str]) -> float:
+        """解析速率字符串（如 "500K"、"10M"、"1.5G"，单位字节/秒），空值或 0 表示不限速"""
+        if not value:
+            return 0.0
+        m = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)(?:i?B)?(?:/s)?\s*', str(value), re.IGNORECASE)
+        if not m:
+            raise ValueError(f'无效的速率: {value}')
+        scale = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[m.group(2).upper()]
+        return float(m.group(1)) * scale
+
+    def set_global_rate(self, rate: float):
+        """设置全局速率上限（字节/秒），运行中调用立即生效"""
+        self.global_bucket.set_rate(rate)
+        logger.info(f'🚦 全局限速: {LayerProgress.format_size(int(rate)) + "/s" if rate else "不限速"}')
+
+    def set_registry_rate(self, registry: str, rate: float):
+        """设置单个仓库的速率上限（字节/秒）"""
+        registry = _normalize_registry(registry)
+        with self._lock:
+            bucket = self._registry_buckets.setdefault(registry, TokenBucket())
+        bucket.set_rate(rate)
+        logger.info(f'🚦 {registry} 限速: {LayerProgress.format_size(int(rate)) + "/s" if rate else "不限速"}')
+
+    def consume(self, url: str, amount: int, cancel=None) -> bool:
+        """下载流收到 amount 字节后调用，依次受仓库和全局速率约束"""
+        with self._lock:
+            bucket = self._registry_buckets.get(urlsplit(url).netloc)
+        if bucket is not None and not bucket.consume(amount, cancel):
+            return False
+        return self.global_bucket.consume(amount, cancel)
+
+    async def consume_async(self, url: str, amount: int, cancel=None) -> bool:
+        """consume 的 asyncio 版本"""
+        with self._lock:
+            bucket = self._registry_buckets.get(urlsplit(url).netloc)
+        if bucket is not None and not await bucket.consume_async(amount, cancel):
+            return False
+        return await self.global_bucket.consume_async(amount, cancel)
+
+
+bandwidth_limiter = BandwidthLimiter()
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """目标主机处于熔断状态：直接失败，不再排队等待重试"""
+
+
+class RequestCancelledError(requests.exceptions.RequestException):
+    """限流等待期间拉取已被取消：不再发送请求，也不重试"""
+
+
+class CircuitBreaker:
+    """单主机熔断器：连续失败达到阈值后打开，冷却期过后进入半开状态。
+
+    半开状态只放行一次试探请求，其余请求在试探结果出来之前继续被拒绝；
+    试探成功则关闭熔断器，失败则重新打开。试探请求被放弃（既未成功也未失败）时，
+    再过一个冷却期放行下一次试探。
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否允许向该主机发起请求：关闭时总是允许，半开时只放行一次试探请求"""
+        with self._lock:
+            if not self.opened_at:
+                return True
+            now = time.time()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            if self.probe_at and now - self.probe_at < self.reset_timeout:
+                return False
+            self.probe_at = now
+            return True
+
+    def record_success(self):
+        """请求成功：清零失败计数并关闭熔断器"""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = 0.0
+            self.probe_at = 0.0
+
+    def record_failure(self) -> bool:
+        """记录一次失败，返回熔断器是否因此打开；半开状态下的试探失败立即重新打开"""
+        with self._lock:
+            self.failures += 1
+            if self.probe_at or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+                self.probe_at = 0.0
+                return True
+            return False
+
+
+class RetryState:
+    """单个逻辑请求的重试状态：尝试次数、上次退避时间和截止时间。
+
+    ctx 为所属的拉取上下文，提供取消令牌和整次拉取的截止时间；为 None 时只响应全局 stop_event。
+    """
+    def __init__(self, policy: 'RetryPolicy', url: str, max_attempts: int, deadline: float, paced: bool = False,
+                 ctx: Optional['PullContext'] = None):
+        self.policy = policy
+        self.host = urlsplit(url).netloc
+        self.paced = paced
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.deadline_at = time.time() + deadline
+        self.pull_deadline_at = ctx.deadline_at if ctx else 0.0
+        self.cancel = ctx or stop_event
+        self.attempt = 0
+        self.last_delay = policy.base_delay
+
+    @property
+    def remaining(self) -> float:
+        """距离最近截止时间（单请求或整次拉取）的剩余秒数"""
+        deadline_at = self.deadline_at
+        if self.pull_deadline_at:
+            deadline_at = min(deadline_at, self.pull_deadline_at)
+        return deadline_at - time.time()
+
+    def check(self):
+        """发起请求前检查熔断器和限流配额：熔断中抛出 CircuitOpenError，已取消时抛出 RequestCancelledError"""
+        if not self.policy.breaker(self.host).allow():
+            raise CircuitOpenError(f'{self.host} 连续失败已熔断，暂停请求')
+        if self.cancel.is_set() or not rate_limiter.acquire(self.host, self.paced, self.cancel):
+            raise RequestCancelledError('用户已取消操作')
+
+    def sleep(self, delay: float) -> bool:
+        """等待退避时间，期间被取消时立即返回 True"""
+        return self.cancel.wait(delay)
+
+    def timeout(self, default: float) -> float:
+        """单次请求超时不超过剩余的截止时间"""
+        return max(1.0, min(default, self.remaining))
+
+    def progressed(self):
+        """请求已取得进展（收到数据），重新计算单请求截止时间"""
+        self.deadline_at = time.time() + self.deadline
+
+    def succeeded(self):
+        """请求成功"""
+        self.policy.breaker(self.host).record_success()
+
+    def next_delay(self, error: BaseException) -> Optional[float]:
+        """根据错误类型决定是否重试，返回退避秒数；返回 None 表示放弃"""
+        kind = self.policy.classify(error)
+        if kind != 'transient' and getattr(error, 'response', None) is not None:
+            # 主机给出了 HTTP 响应（404、429 等），说明它仍可用：结束半开状态的试探，清零连续失败计数
+            self.policy.breaker(self.host).record_success()
+        if kind == 'fatal':
+            return None
+        if kind == 'transient' and self.policy.breaker(self.host).record_failure():
+            logger.warning(f'⛔ {self.host} 连续失败 {self.policy.failure_threshold} 次，已熔断 {self.policy.reset_timeout:.0f} 秒')
+            return None
+
+        self.attempt += 1
+        if self.attempt >= self.max_attempts:
+            return None
+        remaining = self.remaining
+        if remaining <= 0:
+            logger.warning(f'⏱️ {self.host} 已超出重试截止时间')
+            return None
+
+        # 去相关抖动（decorrelated jitter）：在 [base, 上次退避*3] 间随机取值
+        delay = min(self.policy.max_delay, random.uniform(self.policy.base_delay, self.last_delay * 3))
+        self.last_delay = delay
+
+        # 服务端给出 Retry-After 时至少等待该时长；超出截止时间则直接放弃
+        response = getattr(error, 'response', None)
+        if response is not None:
+            retry_after = RateLimiter.parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                if retry_after > remaining:
+                    logger.warning(f'⏱️ {self.host} 要求 {retry_after:.0f}秒后重试，超出截止时间')
+                    return None
+                delay = max(delay, retry_after)
+        return min(delay, remaining)
+
+
+class RetryPolicy:
+    """统一重试策略：错误分类、带抖动的退避、单请求截止时间以及按主机熔断。
+
+    整次拉取的截止时间属于各自的 PullContext，由 begin 传入的 ctx 提供。
+    """
+    RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+    FATAL_STATUS = {401, 403, 404, 405, 416}
+
+    def __init__(
+        self,
+        max_attempts: int = 10,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        request_deadline: float = 600.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.request_deadline = request_deadline
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        """获取指定主机的熔断器"""
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[host]
+
+    def classify(self, error: BaseException) -> str:
+        """错误分类：fatal（不重试）、transient（网络/服务端故障，计入熔断）、retry（可重试但不计入熔断）。
+
+        429 属于限流而非主机故障，按 retry 处理，由 Retry-After 和 RateLimiter 控制等待时间。
+        """
+        if isinstance(error, (CircuitOpenError, RequestCancelledError)):
+            return 'fatal'
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            status = error.response.status_code
+            if status in self.FATAL_STATUS:
+                return 'fatal'
+            if status >= 500:
+                return 'transient'
+            # 400 可能是令牌过期等临时问题，允许重试
+            return 'retry'
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                              requests.exceptions.ChunkedEncodingError, ConnectionError, TimeoutError,
+                              http.client.IncompleteRead, asyncio.TimeoutError, asyncio.IncompleteReadError)):
+            return 'transient'
+        if isinstance(error, (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema)):
+            return 'fatal'
+        return 'retry'
+
+    def begin(
+        self,
+        url: str,
+        max_attempts: Optional[int] = None,
+        deadline: Optional[float] = None,
+        paced: bool = False,
+        ctx: Optional['PullContext'] = None
+    ) -> RetryState:
+        """为一个逻辑请求创建重试状态；paced 表示该请求计入仓库限额。
+        未指定 ctx 时使用当前线程绑定的拉取上下文。
+        """
+        return RetryState(self, url, max_attempts or self.max_attempts, deadline or self.request_deadline, paced,
+                          ctx or current_pull_context())
+
+
+retry_policy = RetryPolicy()
+
+
+def request_with_retry(
+    session: requests.Session,
+    method: str,
+    url: str,
+    desc: str,
+    max_retries: Optional[int] = None,
+    timeout: float = 60,
+    paced: bool = False,
+    ctx: Optional['PullContext'] = None,
+    **kwargs
+) -> requests.Response:
+    """按统一重试策略发起请求：可重试的状态码和网络错误自动重试，其余响应原样返回。
+    paced=True 的请求（清单 GET）计入仓库限额，配额不足时由 RateLimiter 控制节奏。
+    """
+    state = retry_policy.begin(url, max_retries, paced=paced, ctx=ctx)
+    while True:
+        try:
+            state.check()
+            resp = session.request(method, url, timeout=state.timeout(timeout), **kwargs)
+            if resp.status_code in RetryPolicy.RETRY_STATUS:
+                resp.raise_for_status()
+            state.succeeded()
+            return resp
+        except requests.exceptions.RequestException as e:
+            delay = state.next_delay(e)
+            if delay is None:
+                raise
+            logger.warning(f'{desc}失败，{delay:.1f}秒后重试 ({state.attempt}/{state.max_attempts}): {e}')
+            if state.sleep(delay):
+                raise
+
+
 def _normalize_registry(reg: str) -> str:
     """规范化仓库字符串：移除协议与尾部斜杠"""
     if not reg:
@@ -534,17 +1435,68 @@ def load_auth_credentials(current_registry_host: str) -> Tuple[Optional[str], Op
     return None, None
 
 
-def get_output_dir(repository: str, tag: str, arch: str, output_path: Optional[str] = None) -> Path:
-    """获取输出目录路径，创建以镜像名_tag_arch命名的目录"""
+def user_state_dir() -> Path:
+    """当前用户的状态目录：Windows 为 %LOCALAPPDATA%，其他系统为 $XDG_STATE_HOME（默认 ~/.local/state）"""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or Path.home() / 'AppData' / 'Local'
+    else:
+        base = os.environ.get('XDG_STATE_HOME') or Path.home() / '.local' / 'state'
+    return Path(base) / 'docker-image-puller'
+
+
+# 各仓库最近的下载吞吐量，用于估算下载时间；按用户保存，不随工作目录变化
+THROUGHPUT_HISTORY_FILE = str(user_state_dir() / 'throughput_history.json')
+THROUGHPUT_HISTORY_SIZE = 20                          # 每个仓库保留的样本数
+_throughput_lock = threading.Lock()
+
+
+def _load_throughput_history(path: str = THROUGHPUT_HISTORY_FILE) -> Dict[str, List[Dict[str, Any]]]:
+    """读取吞吐量历史，文件不存在或损坏时返回空记录"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+        return history if isinstance(history, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def record_throughput(registry: str, size: int, seconds: float, path: str = THROUGHPUT_HISTORY_FILE):
+    """记录一次下载的字节数和耗时（按仓库地址），太小的样本不能反映带宽，不记录"""
+    if size < 1024 * 1024 or seconds <= 0:
+        return
+    with _throughput_lock:
+        history = _load_throughput_history(path)
+        samples = history.setdefault(_normalize_registry(registry), [])
+        samples.append({'bytes': size, 'seconds': round(seconds, 3), 'at': int(time.time())})
+        del samples[:-THROUGHPUT_HISTORY_SIZE]
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(history, f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.debug(f'保存吞吐量历史失败: {e}')
+
+
+def estimate_throughput(registry: str, path: str = THROUGHPUT_HISTORY_FILE) -> Optional[float]:
+    """按历史样本估算仓库的下载吞吐量（字节/秒，按字节数加权），没有历史时返回 None"""
+    samples = _load_throughput_history(path).get(_normalize_registry(registry), [])
+    seconds = sum(sample.get('seconds', 0) for sample in samples)
+    return sum(sample.get('bytes', 0) for sample in samples) / seconds if seconds > 0 else None
+
+
+def get_output_dir(repository: str, tag: str, arch: str, output_path: Optional[str] = None, create: bool = True) -> Path:
+    """获取输出目录路径，创建以镜像名_tag_arch命名的目录（create 为 False 时只计算路径）"""
     safe_repo = repository.replace("/", "_").replace(":", "_")
-    dir_name = f"{safe_repo}_{tag}_{arch}"
+    dir_name = f"{safe_repo}_{tag}_{platform_label(arch)}"
 
     if output_path:
         output_dir = Path(output_path) / dir_name
     else:
         output_dir = Path.cwd() / dir_name
 
-    output_dir.mkdir(parents=True, exist_ok=True)
+    if create:
+        output_dir.mkdir(parents=True, exist_ok=True)
     return output_dir
 
 
@@ -572,6 +1524,12 @@ def parse_image_input(image_input: str, custom_registry: Optional[str] = None) -
         protocol = 'http'
         image_input = image_input[7:]
 
+    # image[:tag]@sha256:... 固定到不可变的 digest；没有标签时用 digest 前缀作为命名用的标签
+    image_input, _, digest = image_input.partition('@')
+    if digest and not re.fullmatch(r'sha256:[0-9a-f]{64}', digest):
+        raise ValueError(f'无效的镜像 digest: {digest}')
+    default_tag = f'sha256-{digest[7:19]}' if digest else 'latest'
+
     if '/' in image_input and ('.' in image_input.split('/')[0] or ':' in image_input.split('/')[0]):
         registry, remainder = image_input.split('/', 1)
         parts = remainder.split('/')
@@ -584,17 +1542,17 @@ def parse_image_input(image_input: str, custom_registry: Optional[str] = None) -
             img_tag = parts[-1]
 
         img, *tag_parts = img_tag.split(':')
-        tag = tag_parts[0] if tag_parts else 'latest'
+        tag = tag_parts[0] if tag_parts else default_tag
         repository = remainder.split(':')[0]
 
-        return ImageInfo(registry, repository, img, tag, protocol)
+        return ImageInfo(registry, repository, img, tag, protocol, digest or None)
     else:
         parts = image_input.split('/')
         if len(parts) == 1:
             # 单名称镜像（如 java, nginx），需要判断 namespace
             img_tag = parts[0]
             img, *tag_parts = img_tag.split(':')
-            tag = tag_parts[0] if tag_parts else 'latest'
+            tag = tag_parts[0] if tag_parts else default_tag
             
             # 尝试从 Docker Hub API 获取 namespace，默认为 library
             namespace = _get_namespace_from_docker_hub(img)
@@ -603,7 +1561,7 @@ def parse_image_input(image_input: str, custom_registry: Optional[str] = None) -
             repo = '/'.join(parts[:-1])
             img_tag = parts[-1]
             img, *tag_parts = img_tag.split(':')
-            tag = tag_parts[0] if tag_parts else 'latest'
+            tag = tag_parts[0] if tag_parts else default_tag
             repository = f'{repo}/{img}'
 
         if not registry_host:
@@ -611,7 +1569,43 @@ def parse_image_input(image_input: str, custom_registry: Optional[str] = None) -
         else:
             registry = registry_host
 
-        return ImageInfo(registry, repository, img, tag, protocol)
+        return ImageInfo(registry, repository, img, tag, protocol, digest or None)
+
+
+class TokenCache:
+    """Bearer token 进程级缓存：按认证地址、scope 和用户名缓存到过期前，长时间运行的进程（daemon、GUI）重复拉取时不再换取 token"""
+    # 在 token 过期前这么多秒就不再使用，避免请求途中过期
+    EXPIRY_MARGIN = 30
+
+    def __init__(self):
+        self._cache: Dict[Tuple[str, Optional[str], Optional[str]], Tuple[str, str, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, username: Optional[str], password: Optional[str]) -> Optional[str]:
+        """返回未过期的 token，没有时返回 None"""
+        with self._lock:
+            cached = self._cache.get((url, username, password))
+        if cached is None or time.monotonic() >= cached[2]:
+            return None
+        return cached[0]
+
+    def put(self, url: str, username: Optional[str], password: Optional[str], repository: str, token: str,
+            expires_in: Optional[float]):
+        """缓存 token，expires_in 缺省时按规范的 60 秒计算"""
+        ttl = (expires_in or 60) - self.EXPIRY_MARGIN
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._cache[(url, username, password)] = (token, repository, time.monotonic() + ttl)
+
+    def invalidate(self, repository: str):
+        """丢弃该镜像仓库路径的所有 token（被仓库拒绝后重新获取）"""
+        with self._lock:
+            for key in [k for k, v in self._cache.items() if v[1] == repository]:
+                self._cache.pop(key, None)
+
+
+token_cache = TokenCache()
 
 
 def get_auth_head(
@@ -621,43 +1615,49 @@ def get_auth_head(
     repository: str,
     username: Optional[str] = None,
     password: Optional[str] = None,
-    max_retries: int = 3    # 认证请求重试次数
+    max_retries: int = 3,   # 认证请求重试次数
+    actions: str = 'pull',
+    extra_scopes: Tuple[str, ...] = ()
 ) -> Dict[str, str]:
-    """向认证服务器请求Bearer token，返回带认证头的请求头字典"""
-    for attempt in range(max_retries):
-        try:
-            url = f'{auth_url}?service={reg_service}&scope=repository:{repository}:pull'
-
-            headers = {}
-            if username and password:
-                auth_string = f"{username}:{password}"
-                encoded_auth = base64.b64encode(auth_string.encode('utf-8')).decode('utf-8')
-                headers['Authorization'] = f'Basic {encoded_auth}'
+    """向认证服务器请求Bearer token，返回带认证头的请求头字典。
 
-            logger.debug(f"获取认证头: {url}")
-
-            resp = session.get(url, headers=headers, verify=False, timeout=60)
+    actions 为对 repository 申请的权限（推送时为 pull,push），extra_scopes 为额外的 scope（如跨仓库挂载的来源仓库）。
+    """
+    url = f'{auth_url}?service={reg_service}&scope=repository:{repository}:{actions}'
+    url += ''.join(f'&scope={scope}' for scope in extra_scopes)
+
+    headers = {}
+    if username and password:
+        auth_string = f"{username}:{password}"
+        encoded_auth = base64.b64encode(auth_string.encode('utf-8')).decode('utf-8')
+        headers['Authorization'] = f'Basic {encoded_auth}'
+
+    access_token = token_cache.get(url, username, password)
+    if access_token is None:
+        logger.debug(f"获取认证头: {url}")
+        try:
+            resp = request_with_retry(
+                session, 'GET', url, '认证请求', max_retries=max_retries, headers=headers, verify=False
+            )
             resp.raise_for_status()
-            access_token = resp.json()['token']
-            auth_head = {
-                'Authorization': f'Bearer {access_token}',
-                'Accept': ', '.join([
-                    'application/vnd.docker.distribution.manifest.v2+json',
-                    'application/vnd.docker.distribution.manifest.list.v2+json',
-                    'application/vnd.oci.image.index.v1+json',
-                    'application/vnd.oci.image.manifest.v1+json',
-                ])
-            }
-
-            return auth_head
+            token_json = resp.json()
+            access_token = token_json.get('token') or token_json['access_token']
         except requests.exceptions.RequestException as e:
-            if attempt < max_retries - 1:
-                wait_time = 2 ** attempt
-                logger.warning(f'认证请求失败，{wait_time}秒后重试 ({attempt + 1}/{max_retries}): {e}')
-                time.sleep(wait_time)
-            else:
-                logger.error(f'请求认证失败: {e}')
-                raise
+            logger.error(f'请求认证失败: {e}')
+            raise
+        token_cache.put(url, username, password, repository, access_token, token_json.get('expires_in'))
+
+    auth_head = {
+        'Authorization': f'Bearer {access_token}',
+        'Accept': ', '.join([
+            'application/vnd.docker.distribution.manifest.v2+json',
+            'application/vnd.docker.distribution.manifest.list.v2+json',
+            'application/vnd.oci.image.index.v1+json',
+            'application/vnd.oci.image.manifest.v1+json',
+        ])
+    }
+
+    return auth_head
 
 
 def _get_available_tags_from_docker_hub(repository: str) -> List[str]:
@@ -682,6 +1682,24 @@ def _get_available_tags_from_docker_hub(repository: str) -> List[str]:
     return []
 
 
+def head_manifest(
+    session: requests.Session,
+    registry: str,
+    repository: str,
+    reference: str,
+    auth_head: Dict[str, str],
+    protocol: str = 'https',
+    max_retries: int = 3
+) -> Tuple[requests.Response, Optional[str]]:
+    """用 HEAD 检查清单是否存在并获取其 digest（Docker Hub 不将 HEAD 计入拉取限额）"""
+    url = f'{protocol}://{registry}/v2/{repository}/manifests/{reference}'
+    logger.debug(f'检查镜像清单: {url}')
+    resp = request_with_retry(
+        session, 'HEAD', url, '清单检查', max_retries=max_retries, headers=auth_head, verify=False
+    )
+    return resp, resp.headers.get('Docker-Content-Digest')
+
+
 def fetch_manifest(
     session: requests.Session,
     registry: str,
@@ -692,77 +1710,182 @@ def fetch_manifest(
     max_retries: int = 3    # 清单获取重试次数
 ) -> Tuple[requests.Response, int]:
     """获取镜像清单（manifest），返回响应对象和HTTP状态码"""
-    for attempt in range(max_retries):
-        try:
-            url = f'{protocol}://{registry}/v2/{repository}/manifests/{tag}'
+    url = f'{protocol}://{registry}/v2/{repository}/manifests/{tag}'
+
+    try:
+        resp = None
+        if rate_limiter.budget(registry) is not None:
+            # 仓库有拉取配额时先用不计入限额的 HEAD 确认清单存在，避免为不存在或未授权的标签消耗 GET 配额
+            resp, digest = head_manifest(session, registry, repository, tag, auth_head, protocol, max_retries)
+            logger.debug(f'清单 digest: {digest or "未返回digest"}')
+        if resp is None or resp.status_code not in (401, 404):
             logger.debug(f'获取镜像清单: {url}')
+            resp = request_with_retry(
+                session, 'GET', url, '清单请求', max_retries=max_retries, paced=True, headers=auth_head, verify=False
+            )
+        if resp.status_code == 401:
+            logger.info('需要认证。')
+            return resp, 401
+        if resp.status_code == 404:
+            # Tag 不存在，尝试获取可用标签列表
+            logger.error(f'镜像标签 "{tag}" 不存在')
+            available_tags = _get_available_tags_from_docker_hub(repository)
+            if available_tags:
+                logger.info(f'💡 可用标签: {", ".join(available_tags[:10])}{"..." if len(available_tags) > 10 else ""}')
+                logger.info(f'💡 请使用 -i {repository.split("/")[-1]}:<tag> 指定正确的标签')
+            return resp, 404
+        resp.raise_for_status()
+        budget = rate_limiter.budget(registry)
+        if budget and budget.limit:
+            logger.info(f'📉 仓库剩余拉取配额: {budget.remaining}/{budget.limit}')
+        return resp, 200
+    except requests.exceptions.RequestException as e:
+        logger.error(f'请求清单失败: {e}')
+        raise
 
-            resp = session.get(url, headers=auth_head, verify=False, timeout=60)
-            if resp.status_code == 401:
-                logger.info('需要认证。')
-                return resp, 401
-            if resp.status_code == 404:
-                # Tag 不存在，尝试获取可用标签列表
-                logger.error(f'镜像标签 "{tag}" 不存在')
-                available_tags = _get_available_tags_from_docker_hub(repository)
-                if available_tags:
-                    logger.info(f'💡 可用标签: {", ".join(available_tags[:10])}{"..." if len(available_tags) > 10 else ""}')
-                    logger.info(f'💡 请使用 -i {repository.split("/")[-1]}:<tag> 指定正确的标签')
-                return resp, 404
-            resp.raise_for_status()
-            return resp, 200
-        except requests.exceptions.RequestException as e:
-            if attempt < max_retries - 1:
-                wait_time = 2 ** attempt
-                logger.warning(f'清单请求失败，{wait_time}秒后重试 ({attempt + 1}/{max_retries}): {e}')
-                time.sleep(wait_time)
-            else:
-                logger.error(f'请求清单失败: {e}')
-                raise
 
+def parse_platform(arch: str) -> Tuple[str, Optional[str]]:
+    """把架构参数解析为 (architecture, variant)。
 
-def select_manifest(manifests: List[Dict], arch: str) -> Optional[str]:
-    """从多架构清单中选择指定架构的镜像digest"""
+    支持 amd64、arm/v7、linux/arm64/v8 以及 bashbrew 风格的 arm64v8、arm32v7、i386。
+    """
+    arch = arch.strip().lower()
+    if arch.startswith('linux/'):
+        arch = arch[len('linux/'):]
+    if '/' in arch:
+        architecture, _, variant = arch.partition('/')
+        return architecture, variant or None
+    m = re.fullmatch(r'(arm64|arm32)(v\d+)', arch)
+    if m:
+        return ('arm64' if m.group(1) == 'arm64' else 'arm'), m.group(2)
+    if arch == 'i386':
+        return '386', None
+    return arch, None
+
+
+def parse_arch_list(arch: str) -> List[str]:
+    """解析 -a 参数：逗号分隔的多个架构，或 all 表示清单中的全部平台"""
+    archs = list(dict.fromkeys(a.strip() for a in arch.split(',') if a.strip()))
+    return ['all'] if 'all' in archs else archs
+
+
+def platform_label(arch: str) -> str:
+    """用于文件名的架构标签（arm/v7 → arm_v7）"""
+    return arch.replace('/', '_')
+
+
+def list_platforms(manifests: List[Dict]) -> List[str]:
+    """多架构清单中的 linux 平台列表，格式为 architecture[/variant]（跳过 attestation 等 unknown 条目）"""
+    platforms = []
     for m in manifests:
-        if (m.get('annotations', {}).get('com.docker.official-images.bashbrew.arch') == arch or
-            m.get('platform', {}).get('architecture') == arch) and \
-                m.get('platform', {}).get('os') == 'linux':
+        platform = m.get('platform', {})
+        if platform.get('os') != 'linux' or platform.get('architecture') in (None, 'unknown'):
+            continue
+        name = platform['architecture'] + (f'/{platform["variant"]}' if platform.get('variant') else '')
+        if name not in platforms:
+            platforms.append(name)
+    return platforms
+
+
+def select_manifest(manifests: List[Dict], arch: str) -> Optional[str]:
+    """从多架构清单中选择指定架构的镜像digest。
+
+    先按 bashbrew 架构注解精确匹配，再按 platform 的 architecture 和 variant 匹配：
+    指定了 variant 时必须一致（arm64 未标注 variant 视为 v8），未指定时优先选择没有 variant 的条目。
+    """
+    linux = [m for m in manifests if m.get('platform', {}).get('os') == 'linux']
+    for m in linux:
+        if m.get('annotations', {}).get('com.docker.official-images.bashbrew.arch') == arch:
             return m.get('digest')
-    return None
+
+    architecture, variant = parse_platform(arch)
+    candidates = [m for m in linux if m['platform'].get('architecture') == architecture]
+    if variant:
+        default_variant = 'v8' if architecture == 'arm64' else None
+        for m in candidates:
+            if (m['platform'].get('variant') or default_variant) == variant:
+                return m.get('digest')
+        return None
+    # sorted 是稳定排序：没有 variant 的条目在前，其余保持清单中的顺序
+    candidates = sorted(candidates, key=lambda m: bool(m['platform'].get('variant')))
+    return candidates[0].get('digest') if candidates else None
 
 
 class DownloadProgressManager:
-    """下载进度管理器：保存和恢复下载进度，支持断点续传"""
-    def __init__(self, output_dir: Path, repository: str, tag: str, arch: str):
+    """下载进度管理器：以追加日志记录各 blob 的下载状态，支持断点续传。
+
+    每次状态变更只向 progress.journal 追加一行（按时间批量 fsync），
+    日志超过阈值时压缩为 progress.json 快照（临时文件 + 原子重命名）。
+    进度按 blob digest 记录，同一目录下标签变更或更换镜像站后，共享的层仍可续传。
+    """
+    SYNC_INTERVAL = 1.0        # fsync 批量间隔（秒）
+    COMPACT_THRESHOLD = 1000   # 日志行数超过该值时压缩
+
+    def __init__(self, output_dir: Path, repository: str, tag: str, arch: str, read_only: bool = False):
         self.output_dir = output_dir
         self.repository = repository
         self.tag = tag
         self.arch = arch
         self.progress_file = output_dir / 'progress.json'
+        self.journal_file = output_dir / 'progress.journal'
+        self._lock = threading.Lock()
+        self._journal_lines = 0
         self.progress_data = self.load_progress()
+        self._last_sync = time.time()
+        if read_only:
+            # 只查询进度（例如 --dry-run），不创建或修改进度文件
+            self._journal = None
+            return
+        self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        if self._journal.tell() > 0 and not self._journal_ends_with_newline():
+            # 上次崩溃留下的半行单独结束，避免与新记录拼接
+            self._journal.write('\n')
+
+    def _journal_ends_with_newline(self) -> bool:
+        with open(self.journal_file, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
 
     def load_progress(self) -> Dict[str, Any]:
-        """从进度文件加载已保存的下载进度"""
+        """加载进度快照并重放追加日志"""
+        data = self._create_new_progress()
         if self.progress_file.exists():
             try:
                 with open(self.progress_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-
-                    metadata = data.get('metadata', {})
-                    if (metadata.get('repository') == self.repository and
-                            metadata.get('tag') == self.tag and
-                            metadata.get('arch') == self.arch):
-
-                        logger.info(f'📋 加载已有下载进度，共 {len(data.get("layers", {}))} 个文件')
-                        return data
-                    else:
-                        logger.warning(f'进度文件镜像信息不匹配，将创建新的进度')
-                        return self._create_new_progress()
-
+                    snapshot = json.load(f)
+                data['blobs'] = snapshot.get('blobs', {})
+                data['config'] = snapshot.get('config')
+                # 兼容旧版按 layers/config 分开保存的进度文件
+                data['blobs'].update(snapshot.get('layers', {}))
+                if isinstance(data['config'], dict):
+                    legacy = data['config']
+                    data['config'] = legacy.get('digest')
+                    if data['config']:
+                        data['blobs'][data['config']] = legacy
+
+                metadata = snapshot.get('metadata', {})
+                if (metadata.get('repository'), metadata.get('tag'), metadata.get('arch')) != \
+                        (self.repository, self.tag, self.arch):
+                    logger.info(f'📋 进度文件来自 {metadata.get("repository")}:{metadata.get("tag")}，按 digest 复用其中的层')
             except Exception as e:
                 logger.warning(f'加载进度文件失败: {e}')
 
-        return self._create_new_progress()
+        if self.journal_file.exists():
+            try:
+                with open(self.journal_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        self._journal_lines += 1
+                        try:
+                            self._apply(data, json.loads(line))
+                        except (json.JSONDecodeError, TypeError):
+                            # 崩溃时最后一行可能只写了一半，忽略即可
+                            continue
+            except OSError as e:
+                logger.warning(f'读取进度日志失败: {e}')
+
+        if data['blobs']:
+            logger.info(f'📋 加载已有下载进度，共 {len(data["blobs"])} 个文件')
+        return data
 
     def _create_new_progress(self) -> Dict[str, Any]:
         """创建新的进度数据结构"""
@@ -773,59 +1896,123 @@ class DownloadProgressManager:
                 'arch': self.arch,
                 'created_at': time.strftime('%Y-%m-%d %H:%M:%S')
             },
-            'layers': {},
+            'blobs': {},
             'config': None
         }
 
-    def save_progress(self):
-        """保存当前下载进度到文件"""
+    @staticmethod
+    def _apply(data: Dict[str, Any], record: Dict[str, Any]):
+        """把一条日志记录应用到进度数据"""
+        if 'config' in record:
+            data['config'] = record['config']
+        digest = record.get('digest')
+        if digest:
+            data['blobs'].setdefault(digest, {}).update(
+                {k: v for k, v in record.items() if k not in ('digest', 'config')}
+            )
+
+    def _append(self, record: Dict[str, Any]):
+        """追加一条日志记录，按 SYNC_INTERVAL 批量 fsync，日志过长时压缩"""
+        with self._lock:
+            self._apply(self.progress_data, record)
+            try:
+                self._journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+                self._journal.flush()
+                self._journal_lines += 1
+                if time.time() - self._last_sync >= self.SYNC_INTERVAL:
+                    os.fsync(self._journal.fileno())
+                    self._last_sync = time.time()
+            except (OSError, ValueError) as e:
+                logger.error(f'写入进度日志失败: {e}')
+                return
+            if self._journal_lines >= self.COMPACT_THRESHOLD:
+                self._compact()
+
+    def _compact(self):
+        """把当前进度写成快照（临时文件 + fsync + 原子重命名），然后清空日志"""
+        tmp_file = self.progress_file.with_suffix('.json.tmp')
         try:
-            with open(self.progress_file, 'w', encoding='utf-8') as f:
-                json.dump(self.progress_data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            logger.error(f'保存进度文件失败: {e}')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.progress_data, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.progress_file)
+            self._journal.close()
+            self._journal = open(self.journal_file, 'w', encoding='utf-8')
+            self._journal_lines = 0
+        except OSError as e:
+            logger.error(f'压缩进度日志失败: {e}')
+
+    def save_progress(self):
+        """立即生成进度快照并同步到磁盘"""
+        with self._lock:
+            self._compact()
+
+    def close(self):
+        """同步并关闭进度日志"""
+        with self._lock:
+            if self._journal and not self._journal.closed:
+                try:
+                    self._journal.flush()
+                    os.fsync(self._journal.fileno())
+                except OSError:
+                    pass
+                self._journal.close()
 
     def update_layer_status(self, digest: str, status: str, **kwargs):
         """更新指定层的下载状态"""
-        if digest not in self.progress_data['layers']:
-            self.progress_data['layers'][digest] = {}
-
-        self.progress_data['layers'][digest]['status'] = status
-        self.progress_data['layers'][digest].update(kwargs)
-        self.save_progress()
+        self._append({'digest': digest, 'status': status, **kwargs})
 
     def get_layer_status(self, digest: str) -> Dict[str, Any]:
         """获取指定层的下载状态"""
-        return self.progress_data['layers'].get(digest, {})
+        return self.progress_data['blobs'].get(digest, {})
 
     def is_layer_completed(self, digest: str) -> bool:
         """检查指定层是否已完成下载"""
         layer_info = self.get_layer_status(digest)
         return layer_info.get('status') == 'completed'
 
-    def update_config_status(self, status: str, **kwargs):
-        """更新Config文件的下状态"""
-        if self.progress_data['config'] is None:
-            self.progress_data['config'] = {}
-        self.progress_data['config']['status'] = status
-        self.progress_data['config'].update(kwargs)
-        self.save_progress()
-
+    def claim_completed_blob(self, digest: str, save_path: str) -> bool:
+        """已完成的 blob 若保存在其他路径（例如标签变更后层的父链不同），移动到 save_path 复用"""
+        if not self.is_layer_completed(digest):
+            return False
+        if os.path.exists(save_path):
+            return True
+        old_path = self.get_layer_status(digest).get('path')
+        if not old_path or not os.path.exists(old_path):
+            return False
+        try:
+            os.replace(old_path, save_path)
+        except OSError as e:
+            logger.debug(f'复用已下载的层 {digest[:19]} 失败: {e}')
+            return False
+        self.update_layer_status(digest, 'completed', path=save_path)
+        return True
+
+    def update_config_status(self, status: str, **kwargs):
+        """更新Config文件的下载状态"""
+        digest = kwargs.pop('digest', None) or self.progress_data.get('config')
+        if not digest:
+            return
+        self._append({'config': digest, 'digest': digest, 'status': status, **kwargs})
+
     def is_config_completed(self) -> bool:
         """检查Config文件是否已完成下载"""
-        config_data = self.progress_data.get('config')
-        if config_data is None:
+        config_digest = self.progress_data.get('config')
+        if config_digest is None:
             return False
-        return config_data.get('status') == 'completed'
+        return self.is_layer_completed(config_digest)
 
     def clear_progress(self):
         """清除进度文件（下载完成后调用）"""
-        if self.progress_file.exists():
-            try:
-                self.progress_file.unlink()
-                logger.debug('进度文件已清除')
-            except Exception as e:
-                logger.error(f'清除进度文件失败: {e}')
+        self.close()
+        for path in (self.progress_file, self.journal_file):
+            if path.exists():
+                try:
+                    path.unlink()
+                except Exception as e:
+                    logger.error(f'清除进度文件失败: {e}')
+        logger.debug('进度文件已清除')
 
 
 def get_file_size(session: requests.Session, url: str, headers: Dict[str, str]) -> int:
@@ -839,6 +2026,408 @@ def get_file_size(session: requests.Session, url: str, headers: Dict[str, str])
     return 0
 
 
+RECV_BUFFER_SIZE = 1024 * 1024    # 接收缓冲区大小，同时也是单次写盘的块大小
+PIPELINE_QUEUE_DEPTH = 4          # 每个下载流的哈希/写盘队列中最多排队的缓冲区数，写盘慢时只阻塞该流的读取
+
+
+def _response_readinto(resp: requests.Response) -> Callable[[memoryview], int]:
+    """返回把响应体直接读入缓冲区的函数。
+
+    未使用 Content-Encoding 时直接调用底层 http.client 响应的 readinto，
+    数据从 socket 直接写入调用方的缓冲区；否则回退到 urllib3 的解码读取。
+    """
+    raw = resp.raw
+    fp = getattr(raw, '_fp', None)
+    if fp is not None and hasattr(fp, 'readinto') and not resp.headers.get('content-encoding'):
+        return fp.readinto
+
+    def _readinto(view: memoryview) -> int:
+        data = raw.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    return _readinto
+
+
+class BufferPool:
+    """接收缓冲区池：所有下载流共享，缓冲区总数即流水线占用内存的上限。
+
+    读取阶段拿不到空闲缓冲区时阻塞，形成对网络读取的背压。
+    """
+    def __init__(self, memory_limit: int = 64 * 1024 * 1024, buffer_size: int = RECV_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._free: List[bytearray] = []
+        self._allocated = 0
+        self._capacity = max(2, memory_limit // buffer_size)
+        self._cond = threading.Condition()
+
+    @property
+    def memory_limit(self) -> int:
+        return self._capacity * self.buffer_size
+
+    def resize(self, memory_limit: int):
+        """调整内存上限（已分配的缓冲区在归还时按新上限回收）"""
+        with self._cond:
+            self._capacity = max(2, memory_limit // self.buffer_size)
+            self._cond.notify_all()
+
+    def acquire(self, cancel=None) -> Optional[bytearray]:
+        """取一个空闲缓冲区，池已满时等待其他阶段归还；取消时返回 None"""
+        cancel = cancel or stop_event
+        with self._cond:
+            while True:
+                if self._free:
+                    return self._free.pop()
+                if self._allocated < self._capacity:
+                    self._allocated += 1
+                    return bytearray(self.buffer_size)
+                if cancel.is_set():
+                    return None
+                self._cond.wait(0.1)
+
+    def release(self, buf: bytearray):
+        """归还缓冲区"""
+        with self._cond:
+            if self._allocated > self._capacity:
+                self._allocated -= 1
+            else:
+                self._free.append(buf)
+            self._cond.notify()
+
+
+buffer_pool = BufferPool()
+
+
+class PipelineStats:
+    """流水线各阶段的累计忙碌时间，用于判断拉取受限于网络、CPU（哈希）还是磁盘"""
+    STAGES = {'network': '网络', 'hash': '哈希(CPU)', 'disk': '磁盘'}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.busy = {stage: 0.0 for stage in self.STAGES}
+            self.stream_time = 0.0
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.busy[stage] += seconds
+
+    def add_stream(self, seconds: float):
+        with self._lock:
+            self.stream_time += seconds
+
+    def utilisation(self) -> Dict[str, float]:
+        """各阶段忙碌时间占所有下载流存活时间的比例"""
+        with self._lock:
+            if self.stream_time <= 0:
+                return {stage: 0.0 for stage in self.STAGES}
+            return {stage: min(1.0, busy / self.stream_time) for stage, busy in self.busy.items()}
+
+    def summary(self) -> str:
+        """格式化各阶段利用率并给出瓶颈阶段"""
+        usage = self.utilisation()
+        bottleneck = max(usage, key=usage.get)
+        parts = ' / '.join(f'{self.STAGES[stage]} {value * 100:.0f}%' for stage, value in usage.items())
+        return f'{parts}，瓶颈: {self.STAGES[bottleneck]}'
+
+
+_current_pull = contextvars.ContextVar('current_pull', default=None)
+_active_pulls: 'weakref.WeakSet[PullContext]' = weakref.WeakSet()
+_active_pulls_lock = threading.Lock()
+
+
+@dataclass(eq=False)
+class PullContext:
+    """单次拉取的运行上下文：取消令牌、进度显示、下载统计、会话和临时目录。
+
+    每个拉取持有自己的 PullContext，并通过参数传给 download_layers / download_file_* 等函数，
+    因此同一进程内可以并发进行多个拉取，它们共享 SessionManager 的连接池、DNS 缓存和缓冲区池。
+    PullContext 实现了 threading.Event 的 is_set()/wait()，可以直接作为取消令牌传给限流器；
+    全局 stop_event（Ctrl+C、GUI 取消）会同时取消所有拉取。
+    """
+    log_callback: Optional[Callable] = None
+    cli_output: bool = True
+    deadline: Optional[float] = None
+    session: Optional[requests.Session] = None
+    scratch_dir: Optional[str] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    stats: DownloadStats = field(default_factory=DownloadStats, repr=False)
+    pipeline_stats: PipelineStats = field(default_factory=PipelineStats, repr=False)
+    progress: ProgressDisplay = field(init=False, repr=False)
+    deadline_at: float = field(init=False)
+
+    def __post_init__(self):
+        self.progress = ProgressDisplay(log_callback=self.log_callback, cli_output=self.cli_output)
+        self.progress.stats = self.stats
+        # 整次拉取的截止时间（0 表示不限制）
+        self.deadline_at = time.time() + self.deadline if self.deadline else 0.0
+        with _active_pulls_lock:
+            _active_pulls.add(self)
+
+    @classmethod
+    def current(cls) -> 'PullContext':
+        """当前线程绑定的拉取上下文；未绑定时创建一个独立的上下文"""
+        return current_pull_context() or cls()
+
+    def is_set(self) -> bool:
+        """是否已取消（本次拉取被取消或收到全局停止信号）"""
+        return self.cancel_event.is_set() or stop_event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待最多 timeout 秒，期间被取消时立即返回 True"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not self.is_set():
+            remaining = 0.1 if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # 全局 stop_event 与本上下文的事件无法同时等待，按 0.1 秒片段轮询
+            self.cancel_event.wait(min(remaining, 0.1))
+        return True
+
+    def cancel(self):
+        """取消本次拉取，不影响其他拉取"""
+        self.cancel_event.set()
+
+    def claim_scratch_dir(self, path: str):
+        """登记本次拉取的临时目录；其他进行中的拉取正在使用同一目录时抛出 RuntimeError"""
+        path = os.path.abspath(path)
+        with _active_pulls_lock:
+            for other in _active_pulls:
+                if other is not self and other.scratch_dir == path:
+                    raise RuntimeError(f'另一个拉取正在使用目录 {path}，请等待其完成')
+            self.scratch_dir = path
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """在绑定本上下文的情况下调用 fn，用于提交到线程池的任务"""
+        token = _current_pull.set(self)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_pull.reset(token)
+
+    def close(self):
+        """拉取结束：停止进度渲染并从进行中的拉取列表中移除"""
+        self.progress.stop_render_timer()
+        with _active_pulls_lock:
+            _active_pulls.discard(self)
+
+
+def current_pull_context() -> Optional[PullContext]:
+    """当前线程（或 asyncio 任务）绑定的拉取上下文"""
+    return _current_pull.get()
+
+
+def active_pulls() -> List[PullContext]:
+    """所有进行中的拉取上下文"""
+    with _active_pulls_lock:
+        return list(_active_pulls)
+
+
+class StageWorkerPool:
+    """流水线阶段的工作线程池：每个阶段占用一个线程直到该流结束，结束后线程留作下一个阶段复用。
+
+    没有空闲线程时立即新建（阶段之间互相等待，不能排队等线程），空闲超过 idle_timeout 秒的线程退出。
+    """
+    def __init__(self, idle_timeout: float = 30.0):
+        self.idle_timeout = idle_timeout
+        self._tasks: 'collections.deque[Callable[[], None]]' = collections.deque()
+        self._idle = 0
+        self._cond = threading.Condition()
+
+    def submit(self, fn: Callable[[], None]):
+        with self._cond:
+            self._tasks.append(fn)
+            if self._idle >= len(self._tasks):
+                self._cond.notify()
+                return
+        threading.Thread(target=self._worker, name='pipeline-stage', daemon=True).start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._idle += 1
+                while not self._tasks:
+                    if not self._cond.wait(self.idle_timeout) and not self._tasks:
+                        self._idle -= 1
+                        return
+                self._idle -= 1
+                fn = self._tasks.popleft()
+            try:
+                fn()
+            except Exception as e:
+                logger.debug(f'流水线阶段异常退出: {e}')
+
+
+stage_workers = StageWorkerPool()
+
+
+class StreamPipeline:
+    """单个下载流的三级流水线：读取（调用线程）→ 哈希 → 写盘。
+
+    阶段之间用有界队列（PIPELINE_QUEUE_DEPTH）传递缓冲区，缓冲区来自共享的 BufferPool，
+    某个流写盘慢时只有该流的读取因队列满而停顿，不会占满缓冲区池拖慢其他流。
+    哈希和写盘阶段运行在 stage_workers 复用的线程上。
+    """
+    _END = None
+
+    def __init__(self, file, sha256_hash=None, pool: Optional[BufferPool] = None,
+                 stats: Optional[PipelineStats] = None):
+        self.file = file
+        self.sha256_hash = sha256_hash
+        self.pool = pool or buffer_pool
+        self.stats = stats or PipelineStats()
+        self.error: Optional[BaseException] = None
+        self._write_queue: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+        stages = [self._write_stage]
+        if sha256_hash is not None:
+            self._hash_queue: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+            stages.append(self._hash_stage)
+        self._finished = threading.Semaphore(0)
+        self._stage_count = len(stages)
+        for stage in stages:
+            stage_workers.submit(lambda stage=stage: self._run_stage(stage))
+
+    def _run_stage(self, stage: Callable[[], None]):
+        try:
+            stage()
+        finally:
+            self._finished.release()
+
+    def submit(self, buf: bytearray, size: int):
+        """提交一个已填充的缓冲区，该流的队列已满时阻塞"""
+        if self.error is not None:
+            raise self.error
+        if self.sha256_hash is not None:
+            self._hash_queue.put((buf, size))
+        else:
+            self._write_queue.put((buf, size))
+
+    def _hash_stage(self):
+        while True:
+            item = self._hash_queue.get()
+            if item is self._END:
+                self._write_queue.put(self._END)
+                return
+            buf, size = item
+            if self.error is None:
+                started = time.perf_counter()
+                try:
+                    self.sha256_hash.update(memoryview(buf)[:size])
+                except Exception as e:
+                    self.error = e
+                self.stats.add('hash', time.perf_counter() - started)
+            self._write_queue.put(item)
+
+    def _write_stage(self):
+        while True:
+            item = self._write_queue.get()
+            if item is self._END:
+                return
+            buf, size = item
+            if self.error is None:
+                started = time.perf_counter()
+                try:
+                    # 无缓冲的 FileIO 可能只写入一部分，写完为止
+                    view = memoryview(buf)[:size]
+                    while view:
+                        view = view[self.file.write(view):]
+                except Exception as e:
+                    self.error = e
+                self.stats.add('disk', time.perf_counter() - started)
+            self.pool.release(buf)
+
+    def close(self):
+        """等待所有已提交的缓冲区处理完毕；任一阶段出错时抛出该错误"""
+        (self._hash_queue if self.sha256_hash is not None else self._write_queue).put(self._END)
+        for _ in range(self._stage_count):
+            self._finished.acquire()
+        if self.error is not None:
+            raise self.error
+
+
+def receive_to_file(
+    resp: requests.Response,
+    file,
+    url: str,
+    sha256_hash=None,
+    on_progress: Optional[Callable[[int], None]] = None,
+    ctx: Optional[PullContext] = None
+) -> Optional[int]:
+    """把响应体写入文件：读取、哈希、写盘三个阶段并行，缓冲区来自共享的 BufferPool。
+
+    读取阶段用 readinto 直接填充缓冲区，攒满后交给哈希和写盘阶段，
+    每次读取后回调 on_progress(本次响应已接收字节数)。
+    返回接收的字节数；ctx 被取消时返回 None。
+    接收的字节数与 Content-Length 不符（连接中途断开）时抛出可重试的 ConnectionError，连接不放回连接池。
+    """
+    ctx = ctx or PullContext.current()
+    readinto = _response_readinto(resp)
+    # 直接从 socket 读取时绕过了 urllib3 的长度检查，断开的连接 readinto 同样返回 0，需要自行核对长度
+    length = resp.headers.get('Content-Length', '')
+    expected = int(length) if length.isdigit() and not resp.headers.get('content-encoding') else None
+    pipeline = StreamPipeline(file, sha256_hash, stats=ctx.pipeline_stats)
+    stream_started = time.perf_counter()
+    received = 0
+    buf = None
+
+    try:
+        while True:
+            if buf is None:
+                buf = buffer_pool.acquire(ctx)
+                if buf is None:
+                    return None
+                view = memoryview(buf)
+                filled = 0
+            if ctx.is_set():
+                return None
+
+            started = time.perf_counter()
+            n = readinto(view[filled:])
+            ctx.pipeline_stats.add('network', time.perf_counter() - started)
+            if not n:
+                break
+            filled += n
+            received += n
+            if not bandwidth_limiter.consume(url, n, ctx):
+                return None
+            if on_progress:
+                on_progress(received)
+            if filled == len(buf):
+                pipeline.submit(buf, filled)
+                buf = None
+
+        if buf is not None and filled:
+            pipeline.submit(buf, filled)
+            buf = None
+    finally:
+        if buf is not None:
+            buffer_pool.release(buf)
+        pipeline.close()
+        ctx.pipeline_stats.add_stream(time.perf_counter() - stream_started)
+
+    if expected is not None and received != expected:
+        resp.raw.close()
+        raise requests.exceptions.ConnectionError(f'响应体不完整: 收到 {received} 字节，应为 {expected} 字节 ({url})')
+
+    # 响应体已完整读完，连接可以放回连接池复用
+    resp._content_consumed = True
+    return received
+
+
+def hash_file(path: str, sha256_hash, buffer_size: int = RECV_BUFFER_SIZE):
+    """用复用缓冲区把已有文件内容追加到哈希对象中"""
+    view = memoryview(bytearray(buffer_size))
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(view)
+            if not n:
+                break
+            sha256_hash.update(view[:n])
+
+
 def download_file_with_progress(
     session: requests.Session,
     url: str,
@@ -848,32 +2437,53 @@ def download_file_with_progress(
     expected_digest: Optional[str] = None,
     max_retries: int = 10,    # 文件下载重试次数
     stats: Optional[DownloadStats] = None,
-    chunk_size: int = 10 * 1024 * 1024
+    chunk_size: int = 10 * 1024 * 1024,
+    expected_size: int = 0,
+    ctx: Optional[PullContext] = None
 ) -> bool:
-    """带进度显示的文件下载函数，支持断点续传和SHA256校验"""
+    """带进度显示的文件下载函数，支持断点续传和SHA256校验。
+
+    expected_size 为清单中记录的大小，已知且超过分片阈值时直接分片下载，
+    不再先发起一次随后被丢弃的整块 GET。
+    ctx 为所属的拉取上下文（取消令牌、进度显示），未指定时使用当前线程绑定的上下文。
+    """
     CHUNK_THRESHOLD = 50 * 1024 * 1024
-    
-    for attempt in range(max_retries):
-        if stop_event.is_set():
+    ctx = ctx or PullContext.current()
+
+    if expected_size > CHUNK_THRESHOLD and not os.path.exists(save_path):
+        return download_file_in_chunks(
+            session, url, headers, save_path, desc,
+            expected_size, expected_digest, max_retries, stats, chunk_size, ctx
+        )
+
+    retry = retry_policy.begin(url, max_retries, ctx=ctx)
+    first_attempt = True
+
+    while True:
+        if ctx.is_set():
             return False
 
         resume_pos = 0
         if os.path.exists(save_path):
             resume_pos = os.path.getsize(save_path)
-            if resume_pos > 0 and attempt == 0:
+            if resume_pos > 0 and first_attempt:
                 logger.info(f'📎 {desc} 检测到已下载 {LayerProgress.format_size(resume_pos)}，尝试断点续传...')
+        first_attempt = False
 
         download_headers = headers.copy()
         if resume_pos > 0:
             download_headers['Range'] = f'bytes={resume_pos}-'
 
         try:
-            with session.get(url, headers=download_headers, verify=False, timeout=120, stream=True) as resp:
+            retry.check()
+            with session.get(url, headers=download_headers, verify=False, timeout=retry.timeout(120), stream=True) as resp:
                 if resp.status_code == 416:
-                    progress_display.complete_layer(desc)
+                    retry.succeeded()
+                    ctx.progress.complete_layer(desc)
                     return True
 
                 resp.raise_for_status()
+                SessionManager.remember_blob_host(url, resp.url)
 
                 content_range = resp.headers.get('content-range')
                 if content_range:
@@ -881,55 +2491,49 @@ def download_file_with_progress(
                 else:
                     total_size = int(resp.headers.get('content-length', 0)) + resume_pos
 
-                progress_display.update_layer_size(desc, total_size)
+                ctx.progress.update_layer_size(desc, total_size)
 
                 if total_size - resume_pos > CHUNK_THRESHOLD and resume_pos == 0:
+                    retry.succeeded()
+                    # 先关闭整块响应：HTTP/2 下未读取的流会占满连接级流控窗口，使同一连接上的分片请求停滞
+                    resp.close()
                     return download_file_in_chunks(
                         session, url, headers, save_path, desc, 
-                        total_size, expected_digest, max_retries, stats, chunk_size
+                        total_size, expected_digest, max_retries, stats, chunk_size, ctx
                     )
 
                 mode = 'ab' if resume_pos > 0 else 'wb'
                 sha256_hash = hashlib.sha256() if expected_digest else None
 
                 if resume_pos > 0 and sha256_hash:
-                    with open(save_path, 'rb') as existing_file:
-                        while True:
-                            chunk = existing_file.read(65536)
-                            if not chunk:
-                                break
-                            sha256_hash.update(chunk)
+                    hash_file(save_path, sha256_hash)
 
                 if stats:
-                    stats.total_size += total_size - resume_pos
-                    if stats.start_time == 0:
-                        stats.start_time = time.time()
+                    stats.add_total(total_size - resume_pos)
 
-                downloaded_size = resume_pos
                 last_update_time = time.time()
                 last_downloaded = resume_pos
 
-                with open(save_path, mode) as file:
-                    for chunk in resp.iter_content(chunk_size=65536):
-                        if stop_event.is_set():
-                            return False
-
-                        if chunk:
-                            file.write(chunk)
-                            downloaded_size += len(chunk)
-
-                            if sha256_hash:
-                                sha256_hash.update(chunk)
-
-                            progress_display.update_layer(desc, downloaded_size)
+                def _on_progress(received: int):
+                    nonlocal last_update_time, last_downloaded
+                    downloaded_size = resume_pos + received
+                    ctx.progress.update_layer(desc, downloaded_size)
+                    if stats:
+                        stats.mark_first_byte()
+                        current_time = time.time()
+                        if current_time - last_update_time >= 0.5:
+                            speed = (downloaded_size - last_downloaded) / (current_time - last_update_time)
+                            stats.record_speed(speed)
+                            last_downloaded = downloaded_size
+                            last_update_time = current_time
+
+                with open(save_path, mode, buffering=0) as file:
+                    received = receive_to_file(resp, file, url, sha256_hash, _on_progress, ctx)
+                if received is None:
+                    return False
 
-                            if stats:
-                                current_time = time.time()
-                                if current_time - last_update_time >= 0.5:
-                                    speed = (downloaded_size - last_downloaded) / (current_time - last_update_time)
-                                    stats.speeds.append(speed)
-                                    last_downloaded = downloaded_size
-                                    last_update_time = current_time
+                if received > 0:
+                    retry.progressed()
 
                 if expected_digest and sha256_hash:
                     actual_digest = f'sha256:{sha256_hash.hexdigest()}'
@@ -937,64 +2541,64 @@ def download_file_with_progress(
                         logger.error(f'❌ {desc} 校验失败！')
                         if os.path.exists(save_path):
                             os.remove(save_path)
-                        if attempt < max_retries - 1:
-                            wait_time = min(2 ** attempt, 60)
-                            time.sleep(wait_time)
-                        continue
+                        raise ValueError(f'{desc} 摘要不匹配: {actual_digest}')
 
-                progress_display.complete_layer(desc)
+                retry.succeeded()
+                ctx.progress.complete_layer(desc)
                 return True
 
         except KeyboardInterrupt:
             return False
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
-            if attempt < max_retries - 1:
-                wait_time = min(2 ** attempt, 60)
-                logger.info(f'🔄 {desc} 连接超时/失败，{wait_time}秒后重试 ({attempt + 1}/{max_retries})')
-                time.sleep(wait_time)
-                continue
-            else:
-                logger.error(f'❌ {desc} 下载失败')
-                return False
-        except requests.exceptions.HTTPError as e:
-            status_code = e.response.status_code
+        except Exception as e:
             # 检查是否已取消
-            if stop_event.is_set():
+            if ctx.is_set():
                 return False
-            # 400错误可能是认证令牌过期或权限问题，尝试刷新认证
-            if status_code == 400 and attempt < max_retries - 1:
-                wait_time = min(2 ** attempt, 30)
-                logger.warning(f'🔄 {desc} HTTP 400 (可能是认证问题)，{wait_time}秒后重试 ({attempt + 1}/{max_retries})')
-                # 使用stop_event.wait代替time.sleep，可以立即响应取消信号
-                if stop_event.wait(wait_time):
-                    return False
-                continue
-            elif status_code in [401, 403]:
-                logger.error(f'❌ {desc} 下载失败: 认证失败或无权限访问 (HTTP {status_code})')
-                logger.info(f'💡 提示：该镜像可能需要认证，请检查用户名和密码是否正确')
+            status_code = e.response.status_code if isinstance(e, requests.exceptions.HTTPError) and e.response is not None else None
+            wait_time = retry.next_delay(e)
+            if wait_time is None:
+                if isinstance(e, CircuitOpenError):
+                    logger.error(f'❌ {desc} 下载失败: {e}')
+                elif status_code in [401, 403]:
+                    logger.error(f'❌ {desc} 下载失败: 认证失败或无权限访问 (HTTP {status_code})')
+                    logger.info(f'💡 提示：该镜像可能需要认证，请检查用户名和密码是否正确')
+                elif status_code:
+                    logger.error(f'❌ {desc} 下载失败: HTTP {status_code} - {e}')
+                else:
+                    logger.error(f'❌ {desc} 下载失败: {e}')
                 return False
-            elif status_code in [429, 500, 502, 503, 504] and attempt < max_retries - 1:
-                wait_time = min(2 ** attempt, 60)
-                logger.info(f'🔄 {desc} HTTP {status_code}，{wait_time}秒后重试 ({attempt + 1}/{max_retries})')
-                # 使用stop_event.wait代替time.sleep，可以立即响应取消信号
-                if stop_event.wait(wait_time):
-                    return False
-                continue
+
+            if isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+                logger.info(f'🔄 {desc} 连接超时/失败，{wait_time:.1f}秒后重试 ({retry.attempt}/{retry.max_attempts})')
+            elif status_code == 400:
+                # 400错误可能是认证令牌过期或权限问题
+                logger.warning(f'🔄 {desc} HTTP 400 (可能是认证问题)，{wait_time:.1f}秒后重试 ({retry.attempt}/{retry.max_attempts})')
+            elif status_code:
+                logger.info(f'🔄 {desc} HTTP {status_code}，{wait_time:.1f}秒后重试 ({retry.attempt}/{retry.max_attempts})')
             else:
-                logger.error(f'❌ {desc} 下载失败: HTTP {status_code} - {e}')
+                logger.info(f'🔄 {desc} 下载异常，{wait_time:.1f}秒后重试 ({retry.attempt}/{retry.max_attempts}): {e}')
+            # 使用可取消的等待代替time.sleep，可以立即响应取消信号
+            if retry.sleep(wait_time):
                 return False
-        except Exception as e:
-            if attempt < max_retries - 1:
-                wait_time = min(2 ** attempt, 60)
-                logger.info(f'🔄 {desc} 下载异常，{wait_time}秒后重试 ({attempt + 1}/{max_retries}): {e}')
-                # 使用stop_event.wait代替time.sleep，可以立即响应取消信号
-                if stop_event.wait(wait_time):
-                    return False
-                continue
-            logger.error(f'❌ {desc} 下载失败: {e}')
-            return False
 
-    return False
+
+def merge_chunk_files(chunk_files: List[Tuple[int, int, str]], save_path: str, sha256_hash=None, cancel=None) -> bool:
+    """按顺序合并分片文件并计算哈希；收到取消信号时返回 False"""
+    cancel = cancel or stop_event
+    merge_view = memoryview(bytearray(RECV_BUFFER_SIZE))
+    with open(save_path, 'wb', buffering=0) as outfile:
+        for _, _, chunk_file in chunk_files:
+            if cancel.is_set():
+                return False
+
+            with open(chunk_file, 'rb', buffering=0) as infile:
+                while True:
+                    n = infile.readinto(merge_view)
+                    if not n:
+                        break
+                    outfile.write(merge_view[:n])
+                    if sha256_hash:
+                        sha256_hash.update(merge_view[:n])
+    return True
 
 
 def download_file_in_chunks(
@@ -1007,13 +2611,15 @@ def download_file_in_chunks(
     expected_digest: Optional[str] = None,
     max_retries: int = 10,    # 分片下载重试次数
     stats: Optional[DownloadStats] = None,
-    chunk_size: int = 10 * 1024 * 1024
+    chunk_size: int = 10 * 1024 * 1024,
+    ctx: Optional[PullContext] = None
 ) -> bool:
     """分片下载大文件，将文件分成多个小块并发下载，最后合并"""
+    ctx = ctx or PullContext.current()
     num_chunks = (total_size + chunk_size - 1) // chunk_size
     temp_dir = save_path + '.chunks'
     
-    progress_display.set_chunk_info(desc, 0, num_chunks)
+    ctx.progress.set_chunk_info(desc, 0, num_chunks)
     
     try:
         os.makedirs(temp_dir, exist_ok=True)
@@ -1031,17 +2637,17 @@ def download_file_in_chunks(
                 completed_size += os.path.getsize(existing_chunk_file)
         
         if stats:
-            stats.total_size += total_size - completed_size
-            if stats.start_time == 0:
-                stats.start_time = time.time()
+            stats.add_total(total_size - completed_size)
         
         sha256_hash = hashlib.sha256() if expected_digest else None
+        # completed_chunks 只由本线程（汇总线程）读写；工作线程只写 chunk_progress 中自己的槽位
         completed_chunks = [False] * num_chunks
         chunk_sizes = [end - start for start, end, _ in chunk_files]
+        chunk_progress = [0] * num_chunks
         
         def download_single_chunk(i: int, start: int, end: int, chunk_file: str) -> bool:
             """下载单个分片的内部函数"""
-            if stop_event.is_set():
+            if ctx.is_set():
                 return False
             
             if os.path.exists(chunk_file):
@@ -1053,43 +2659,47 @@ def download_file_in_chunks(
             
             chunk_headers = headers.copy()
             chunk_headers['Range'] = f'bytes={start}-{end-1}'
-            
-            for attempt in range(max_retries):
-                if stop_event.is_set():
+
+            retry = retry_policy.begin(url, max_retries, ctx=ctx)
+            while True:
+                if ctx.is_set():
                     return False
                 
                 try:
-                    with session.get(url, headers=chunk_headers, verify=False, timeout=120, stream=True) as resp:
+                    retry.check()
+                    with session.get(url, headers=chunk_headers, verify=False, timeout=retry.timeout(120), stream=True) as resp:
                         resp.raise_for_status()
+                        SessionManager.remember_blob_host(url, resp.url)
                         
-                        with open(chunk_file, 'wb') as f:
-                            for data in resp.iter_content(chunk_size=65536):
-                                if stop_event.is_set():
-                                    return False
-                                if data:
-                                    f.write(data)
+                        def _on_progress(received: int):
+                            # 各分片独立写入自己的槽位，主线程汇总，无需加锁
+                            chunk_progress[i] = received
+                            if stats:
+                                stats.mark_first_byte()
+
+                        with open(chunk_file, 'wb', buffering=0) as f:
+                            if receive_to_file(resp, f, url, on_progress=_on_progress, ctx=ctx) is None:
+                                return False
                         
-                        if os.path.getsize(chunk_file) == end - start:
-                            return True
-                        else:
-                            if os.path.exists(chunk_file):
-                                os.remove(chunk_file)
-                            if attempt < max_retries - 1:
-                                wait_time = min(2 ** attempt, 60)
-                                time.sleep(wait_time)
-                                continue
-                            return False
+                        if os.path.getsize(chunk_file) != end - start:
+                            raise requests.exceptions.ChunkedEncodingError(
+                                f'分片大小不符: {os.path.getsize(chunk_file)} != {end - start}'
+                            )
+                        retry.succeeded()
+                        return True
                 except Exception as e:
-                    if attempt < max_retries - 1:
-                        wait_time = min(2 ** attempt, 60)
-                        logger.info(f'🔄 {desc} 分片 {i+1} 下载失败，{wait_time}秒后重试 ({attempt + 1}/{max_retries}): {e}')
-                        time.sleep(wait_time)
-                        continue
-                    else:
+                    chunk_progress[i] = 0
+                    if os.path.exists(chunk_file):
+                        os.remove(chunk_file)
+                    if ctx.is_set():
+                        return False
+                    wait_time = retry.next_delay(e)
+                    if wait_time is None:
                         logger.error(f'❌ {desc} 分片 {i+1} 下载失败: {e}')
                         return False
-            
-            return False
+                    logger.info(f'🔄 {desc} 分片 {i+1} 下载失败，{wait_time:.1f}秒后重试 ({retry.attempt}/{retry.max_attempts}): {e}')
+                    if retry.sleep(wait_time):
+                        return False
         
         max_workers = min(num_chunks, 4)
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
@@ -1098,46 +2708,33 @@ def download_file_in_chunks(
                 if os.path.exists(chunk_file) and os.path.getsize(chunk_file) == end - start:
                     completed_chunks[i] = True
                     continue
-                futures[executor.submit(download_single_chunk, i, start, end, chunk_file)] = i
+                futures[executor.submit(ctx.run, download_single_chunk, i, start, end, chunk_file)] = i
             
-            while futures:
-                for future in list(futures.keys()):
-                    if future.done():
-                        i = futures.pop(future)
-                        try:
-                            result = future.result()
-                            if result:
-                                completed_chunks[i] = True
-                                progress_display.set_chunk_info(desc, sum(completed_chunks), num_chunks)
-                            else:
-                                logger.error(f'❌ {desc} 分片 {i+1} 下载失败')
-                                return False
-                        except Exception as e:
-                            logger.error(f'❌ {desc} 分片 {i+1} 下载异常: {e}')
-                            return False
-                
-                current_completed = sum(1 for c in completed_chunks if c)
-                current_size = sum(chunk_sizes[i] for i in range(num_chunks) if completed_chunks[i])
-                progress_display.update_layer(desc, current_size)
-                progress_display.set_chunk_info(desc, current_completed, num_chunks)
-                
-                time.sleep(0.1)
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f'❌ {desc} 分片 {i+1} 下载异常: {e}')
+                        return False
+                    if not result:
+                        logger.error(f'❌ {desc} 分片 {i+1} 下载失败')
+                        return False
+                    completed_chunks[i] = True
+
+                current_size = sum(
+                    chunk_sizes[i] if completed_chunks[i] else chunk_progress[i] for i in range(num_chunks)
+                )
+                ctx.progress.update_layer(desc, current_size)
+                ctx.progress.set_chunk_info(desc, sum(completed_chunks), num_chunks)
         
         logger.info(f'{desc}: 合并 {num_chunks} 个分片...')
         
-        with open(save_path, 'wb') as outfile:
-            for i, (_, _, chunk_file) in enumerate(chunk_files):
-                if stop_event.is_set():
-                    return False
-                
-                with open(chunk_file, 'rb') as infile:
-                    while True:
-                        data = infile.read(65536)
-                        if not data:
-                            break
-                        outfile.write(data)
-                        if sha256_hash:
-                            sha256_hash.update(data)
+        if not merge_chunk_files(chunk_files, save_path, sha256_hash, ctx):
+            return False
         
         shutil.rmtree(temp_dir, ignore_errors=True)
         
@@ -1149,7 +2746,7 @@ def download_file_in_chunks(
                     os.remove(save_path)
                 return False
         
-        progress_display.complete_layer(desc)
+        ctx.progress.complete_layer(desc)
         return True
         
     except Exception as e:
@@ -1159,120 +2756,758 @@ def download_file_in_chunks(
         return False
 
 
-def download_layers(
-    session: requests.Session,
-    registry: str,
-    repository: str,
-    layers: List[Dict],
-    auth_head: Dict[str, str],
-    imgdir: str,
-    resp_json: Dict,
-    imgparts: List[str],
-    img: str,
-    tag: str,
-    arch: str,
-    output_dir: Path,
-    log_callback: Optional[Callable] = None,
-    protocol: str = 'https'
-):
-    """下载所有镜像层，包括Config文件和各个layer，支持断点续传"""
-    global progress_display
-    progress_display = ProgressDisplay(log_callback=log_callback)
+def _shim_response(url: str, status: int, headers: Dict[str, str]) -> requests.Response:
+    """把 asyncio 引擎的响应包装成 requests.Response，以复用限流解析和重试分类"""
+    resp = requests.Response()
+    resp.url = url
+    resp.status_code = status
+    resp.headers = requests.structures.CaseInsensitiveDict(headers)
+    return resp
 
-    os.makedirs(imgdir, exist_ok=True)
 
-    progress_manager = DownloadProgressManager(output_dir, repository, tag, arch)
-    stats = DownloadStats()
-    progress_display.stats = stats
+class _AsyncConnection:
+    """asyncio 引擎的一条 keep-alive 连接"""
+    def __init__(self, key: Tuple[str, str, int], reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.reusable = True
 
-    try:
-        config_digest = resp_json['config']['digest']
-        config_filename = f'{config_digest[7:]}.json'
-        config_path = os.path.join(imgdir, config_filename)
-        config_url = f'{protocol}://{registry}/v2/{repository}/blobs/{config_digest}'
+    def close(self):
+        self.reusable = False
+        try:
+            self.writer.close()
+        except Exception:
+            pass
 
-        if progress_manager.is_config_completed() and os.path.exists(config_path):
-            logger.info(f'✅ Config 已存在，跳过下载')
+
+class AsyncHTTPResponse:
+    """asyncio 引擎的 HTTP 响应：按 Content-Length 或 chunked 编码读取响应体，读完后归还连接"""
+    def __init__(self, client: 'AsyncHTTPClient', conn: _AsyncConnection, url: str,
+                 status: int, headers: Dict[str, str], method: str):
+        self.client = client
+        self.conn = conn
+        self.url = url
+        self.status = status
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self._done = False
+        self._chunked = False
+        self._chunk_left = 0
+        self._remaining: Optional[int] = None
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            self._finish()
+        elif 'chunked' in self.headers.get('transfer-encoding', '').lower():
+            self._chunked = True
+        elif 'content-length' in self.headers:
+            self._remaining = int(self.headers['content-length'])
+            if self._remaining == 0:
+                self._finish()
         else:
-            progress_manager.update_config_status('downloading', digest=config_digest)
-            
-            # 尝试获取config大小，如果失败则使用默认值
-            try:
-                config_size = get_file_size(session, config_url, auth_head)
-            except Exception as e:
-                logger.debug(f'获取Config大小失败: {e}，使用默认值')
-                config_size = 0
-            
-            progress_display.add_layer('Config', config_size, 0, len(layers) + 1)
-            
-            # 下载config，添加特殊错误处理
+            # 没有长度信息时读到连接关闭为止，连接不可复用
+            conn.reusable = False
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            self.client.release(self.conn)
+
+    async def read(self, n: int) -> bytes:
+        """读取至多 n 字节响应体，读完时返回 b''"""
+        if self._done:
+            return b''
+        reader = self.conn.reader
+        timeout = self.client.read_timeout
+
+        if self._chunked:
+            if self._chunk_left == 0:
+                line = await asyncio.wait_for(reader.readline(), timeout)
+                size = int(line.split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    while (await asyncio.wait_for(reader.readline(), timeout)) not in (b'\r\n', b'\n', b''):
+                        pass
+                    self._finish()
+                    return b''
+                self._chunk_left = size
+            data = await asyncio.wait_for(reader.read(min(n, self._chunk_left)), timeout)
+            if not data:
+                raise ConnectionError('连接在响应体结束前关闭')
+            self._chunk_left -= len(data)
+            if self._chunk_left == 0:
+                await asyncio.wait_for(reader.readexactly(2), timeout)
+            return data
+
+        if self._remaining is None:
+            data = await asyncio.wait_for(reader.read(n), timeout)
+            if not data:
+                self._finish()
+            return data
+
+        data = await asyncio.wait_for(reader.read(min(n, self._remaining)), timeout)
+        if not data:
+            raise ConnectionError('连接在响应体结束前关闭')
+        self._remaining -= len(data)
+        if self._remaining == 0:
+            self._finish()
+        return data
+
+    async def drain(self):
+        """丢弃剩余响应体（用于重定向和错误响应），使连接可以复用"""
+        while await self.read(RECV_BUFFER_SIZE):
+            pass
+
+    def close(self):
+        """响应体未读完时直接关闭连接"""
+        if not self._done:
+            self._done = True
+            self.conn.close()
+
+
+class AsyncHTTPClient:
+    """基于 asyncio 的最小 HTTP/1.1 客户端：按主机复用 keep-alive 连接，跟随重定向。
+
+    与 requests 会话一样不校验证书（verify=False），并使用 SessionManager 的 DNS 缓存。
+    """
+    MAX_REDIRECTS = 5
+
+    def __init__(self, connect_timeout: float = 30, read_timeout: float = 120):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._idle: Dict[Tuple[str, str, int], List[_AsyncConnection]] = {}
+        self._ssl = ssl.create_default_context()
+        self._ssl.check_hostname = False
+        self._ssl.verify_mode = ssl.CERT_NONE
+
+    async def _connect(self, key: Tuple[str, str, int]) -> _AsyncConnection:
+        scheme, host, port = key
+        loop = asyncio.get_running_loop()
+        addresses = await loop.run_in_executor(None, SessionManager.dns_cache.resolve, host, port)
+        error: Optional[BaseException] = None
+        for ip in addresses:
             try:
-                success = download_file_with_progress(
-                    session, config_url, auth_head, config_path, "Config",
-                    expected_digest=config_digest, stats=stats
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(
+                        ip, port,
+                        ssl=self._ssl if scheme == 'https' else None,
+                        server_hostname=host if scheme == 'https' else None,
+                        limit=RECV_BUFFER_SIZE
+                    ),
+                    self.connect_timeout
                 )
-                # 检查是否已取消
-                if stop_event.is_set():
-                    raise KeyboardInterrupt("用户已取消操作")
-                
-                if not success:
-                    # 如果下载失败，检查是否是认证问题
-                    logger.error(f'❌ Config 下载失败')
-                    # 尝试不带认证头重新下载（某些仓库可能不需要认证）
-                    if 'Authorization' in auth_head:
-                        logger.info('🔄 尝试使用匿名方式重新下载Config...')
-                        anon_headers = {k: v for k, v in auth_head.items() if k != 'Authorization'}
-                        success = download_file_with_progress(
-                            session, config_url, anon_headers, config_path, "Config",
-                            expected_digest=config_digest, stats=stats
-                        )
-                        # 检查是否已取消
-                        if stop_event.is_set():
-                            raise KeyboardInterrupt("用户已取消操作")
-                    
-                    if not success:
-                        progress_manager.update_config_status('failed')
-                        # Config下载失败不终止整个流程，继续尝试下载layers
-                        logger.warning('⚠️ Config下载失败，尝试继续下载镜像层...')
-                    else:
-                        progress_manager.update_config_status('completed', digest=config_digest)
-                else:
-                    progress_manager.update_config_status('completed', digest=config_digest)
-            except KeyboardInterrupt:
-                raise
-            except Exception as download_e:
-                logger.error(f'❌ Config 下载异常: {download_e}')
-                progress_manager.update_config_status('failed')
-                # 不终止流程，继续尝试下载layers
-                logger.warning('⚠️ Config下载异常，尝试继续下载镜像层...')
-
-    except Exception as e:
-        logging.error(f'请求配置失败: {e}')
-        # 不终止流程，继续尝试下载layers
-        logger.warning('⚠️ 配置处理失败，尝试继续下载镜像层...')
+                return _AsyncConnection(key, reader, writer)
+            except (OSError, asyncio.TimeoutError) as e:
+                error = e
+        SessionManager.dns_cache.invalidate(host, port)
+        raise requests.exceptions.ConnectionError(f'连接 {host}:{port} 失败: {error}')
+
+    def release(self, conn: _AsyncConnection):
+        """响应读完后归还连接"""
+        if conn.reusable and not conn.reader.at_eof():
+            self._idle.setdefault(conn.key, []).append(conn)
+        else:
+            conn.close()
 
-    repo_tag = f'{"/".join(imgparts)}/{img}:{tag}' if imgparts else f'{img}:{tag}'
-    content = [{'Config': config_filename, 'RepoTags': [repo_tag], 'Layers': []}]
-    parentid = ''
-    layer_json_map: Dict[str, Dict] = {}
+    async def _send(self, key: Tuple[str, str, int], request: bytes) -> Tuple[_AsyncConnection, bytes]:
+        """发送请求并读取响应头；复用的空闲连接已被服务端关闭时换新连接重试一次"""
+        idle = self._idle.get(key)
+        conn = idle.pop() if idle else None
+        if conn is not None:
+            try:
+                conn.writer.write(request)
+                await conn.writer.drain()
+                return conn, await asyncio.wait_for(conn.reader.readuntil(b'\r\n\r\n'), self.read_timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                conn.close()
+        conn = await self._connect(key)
+        try:
+            conn.writer.write(request)
+            await conn.writer.drain()
+            return conn, await asyncio.wait_for(conn.reader.readuntil(b'\r\n\r\n'), self.read_timeout)
+        except BaseException:
+            conn.close()
+            raise
 
-    layers_to_download = []
-    skipped_count = 0
+    async def request(self, method: str, url: str, headers: Dict[str, str]) -> AsyncHTTPResponse:
+        """发起请求并返回响应（响应头已读取，响应体待读取）"""
+        headers = dict(headers)
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            scheme = parts.scheme or 'https'
+            key = (scheme, parts.hostname or '', parts.port or (443 if scheme == 'https' else 80))
+            path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+            lines = [f'{method} {path} HTTP/1.1', f'Host: {parts.netloc}',
+                     f'User-Agent: docker-image-puller/{VERSION}', 'Accept-Encoding: identity',
+                     'Connection: keep-alive']
+            lines += [f'{k}: {v}' for k, v in headers.items()]
+            request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+            conn, head = await self._send(key, request)
+            status_line, *header_lines = head.decode('latin-1').split('\r\n')
+            status = int(status_line.split()[1])
+            resp_headers: Dict[str, str] = {}
+            for line in header_lines:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    resp_headers[name.strip()] = value.strip()
+            if resp_headers.get('Connection', resp_headers.get('connection', '')).lower() == 'close':
+                conn.reusable = False
+
+            resp = AsyncHTTPResponse(self, conn, url, status, resp_headers, method)
+            rate_limiter.observe(_shim_response(url, status, resp_headers))
+
+            location = resp.headers.get('location')
+            if status in (301, 302, 303, 307, 308) and location:
+                await resp.drain()
+                new_url = requests.compat.urljoin(url, location)
+                if urlsplit(new_url).netloc != parts.netloc:
+                    # 与 requests 一致：跨主机重定向时不携带认证头
+                    headers.pop('Authorization', None)
+                url = new_url
+                continue
+            return resp
+        raise requests.exceptions.TooManyRedirects(f'重定向次数超过 {self.MAX_REDIRECTS} 次')
 
-    for layer in layers:
-        ublob = layer['digest']
-        fake_layerid = hashlib.sha256((parentid + '\n' + ublob + '\n').encode('utf-8')).hexdigest()
-        layerdir = f'{imgdir}/{fake_layerid}'
-        os.makedirs(layerdir, exist_ok=True)
-        layer_json_map[fake_layerid] = {"id": fake_layerid, "parent": parentid if parentid else None}
-        parentid = fake_layerid
+    def close(self):
+        """关闭所有空闲连接"""
+        for conns in self._idle.values():
+            for conn in conns:
+                conn.close()
+        self._idle.clear()
 
-        save_path = f'{layerdir}/layer_gzip.tar'
 
-        if progress_manager.is_layer_completed(ublob) and os.path.exists(save_path):
-            skipped_count += 1
-        else:
-            layers_to_download.append((ublob, fake_layerid, layerdir, save_path))
+class AsyncDownloadEngine:
+    """asyncio 下载引擎：在单个事件循环上驱动所有层和分片的下载流。
+
+    续传、分片、SHA256 校验、进度显示、重试与限速的行为与 download_file_with_progress /
+    download_file_in_chunks 一致（分片文件布局相同，两种引擎可以互相续传），
+    哈希计算和写盘交给线程池执行，不阻塞事件循环。
+    ctx 为所属的拉取上下文，提供取消令牌、进度显示和流水线统计。
+    """
+    CHUNK_THRESHOLD = 50 * 1024 * 1024
+
+    def __init__(self, max_streams: int = 64, chunk_size: int = 10 * 1024 * 1024, max_retries: int = 10,
+                 ctx: Optional[PullContext] = None):
+        self.max_streams = max_streams
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.ctx = ctx or PullContext.current()
+
+    def run(
+        self,
+        jobs: List[Tuple],
+        headers: Dict[str, str],
+        stats: Optional[DownloadStats] = None,
+        on_done: Optional[Callable[[str, bool], None]] = None
+    ) -> bool:
+        """下载一组 blob，jobs 为 (url, 保存路径, 显示名, digest[, 请求头]) 列表；全部成功时返回 True。
+
+        job 自带请求头时使用自己的请求头（批量拉取中来自不同仓库的 blob），否则使用 headers。
+        """
+        return self.ctx.run(asyncio.run, self._run(jobs, headers, stats, on_done))
+
+    async def _run(self, jobs, headers, stats, on_done) -> bool:
+        self.client = AsyncHTTPClient()
+        self.streams = asyncio.Semaphore(self.max_streams)
+        self.executor = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4))
+        self.stats = stats
+
+        async def _one(url, save_path, desc, digest, job_headers=None):
+            ok = await self._download(url, job_headers or headers, save_path, desc, digest)
+            if on_done:
+                on_done(digest, ok)
+            return ok
+
+        try:
+            results = await asyncio.gather(*(_one(*job) for job in jobs))
+            return all(results)
+        finally:
+            self.client.close()
+            self.executor.shutdown(wait=True)
+
+    def _write_block(self, file, block: bytearray, sha256_hash):
+        """在线程池中执行：计算哈希并写盘"""
+        started = time.perf_counter()
+        if sha256_hash is not None:
+            sha256_hash.update(block)
+        hashed = time.perf_counter()
+        file.write(block)
+        self.ctx.pipeline_stats.add('hash', hashed - started)
+        self.ctx.pipeline_stats.add('disk', time.perf_counter() - hashed)
+
+    async def _stream_to_file(self, resp: AsyncHTTPResponse, file, url: str, sha256_hash,
+                              on_progress: Callable[[int], None]) -> Optional[int]:
+        """把响应体写入文件：攒满一个缓冲块后交给线程池哈希并写盘，同时继续接收下一块"""
+        loop = asyncio.get_running_loop()
+        stream_started = time.perf_counter()
+        pending = None
+        block = bytearray()
+        received = 0
+        try:
+            while True:
+                if self.ctx.is_set():
+                    return None
+                started = time.perf_counter()
+                data = await resp.read(RECV_BUFFER_SIZE - len(block))
+                self.ctx.pipeline_stats.add('network', time.perf_counter() - started)
+                if not data:
+                    break
+                block += data
+                received += len(data)
+                if not await bandwidth_limiter.consume_async(url, len(data), self.ctx):
+                    return None
+                on_progress(received)
+                if len(block) >= RECV_BUFFER_SIZE:
+                    if pending is not None:
+                        await pending
+                    pending = loop.run_in_executor(self.executor, self._write_block, file, block, sha256_hash)
+                    block = bytearray()
+            if block:
+                if pending is not None:
+                    await pending
+                pending = loop.run_in_executor(self.executor, self._write_block, file, block, sha256_hash)
+                block = bytearray()
+            return received
+        finally:
+            if pending is not None:
+                await pending
+            if block:
+                # 连接中途断开或已取消：不足一块的已收数据也写入文件，重试时从这里续传
+                await loop.run_in_executor(self.executor, self._write_block, file, block, sha256_hash)
+            self.ctx.pipeline_stats.add_stream(time.perf_counter() - stream_started)
+
+    def _speed_tracker(self, desc: str, base: int) -> Callable[[int], None]:
+        """生成进度回调：更新层进度并按 0.5 秒间隔记录下载速度"""
+        stats = self.stats
+        state = {'time': time.time(), 'size': base}
+
+        def _on_progress(received: int):
+            downloaded = base + received
+            self.ctx.progress.update_layer(desc, downloaded)
+            if stats:
+                stats.mark_first_byte()
+                now = time.time()
+                if now - state['time'] >= 0.5:
+                    stats.record_speed((downloaded - state['size']) / (now - state['time']))
+                    state['time'], state['size'] = now, downloaded
+        return _on_progress
+
+    async def _retry_wait(self, retry: RetryState, error: BaseException, message: str) -> bool:
+        """按重试策略等待；返回 False 表示放弃"""
+        if self.ctx.is_set():
+            return False
+        delay = retry.next_delay(error)
+        if delay is None:
+            logger.error(f'❌ {message}: {error}')
+            return False
+        logger.info(f'🔄 {message}，{delay:.1f}秒后重试 ({retry.attempt}/{retry.max_attempts}): {error}')
+        deadline = time.time() + delay
+        while time.time() < deadline:
+            if self.ctx.is_set():
+                return False
+            await asyncio.sleep(min(0.2, deadline - time.time()))
+        return True
+
+    async def _download(self, url: str, headers: Dict[str, str], save_path: str, desc: str,
+                        expected_digest: Optional[str]) -> bool:
+        """下载单个 blob，大文件转交 _download_ranges 分片并发下载"""
+        retry = retry_policy.begin(url, self.max_retries, ctx=self.ctx)
+        first_attempt = True
+        while True:
+            if self.ctx.is_set():
+                return False
+            resume_pos = os.path.getsize(save_path) if os.path.exists(save_path) else 0
+            if resume_pos > 0 and first_attempt:
+                logger.info(f'📎 {desc} 检测到已下载 {LayerProgress.format_size(resume_pos)}，尝试断点续传...')
+            first_attempt = False
+
+            request_headers = headers.copy()
+            if resume_pos > 0:
+                request_headers['Range'] = f'bytes={resume_pos}-'
+
+            ranged_total = 0
+            try:
+                await asyncio.to_thread(retry.check)
+                async with self.streams:
+                    resp = await self.client.request('GET', url, request_headers)
+                    try:
+                        if resp.status == 416:
+                            retry.succeeded()
+                            self.ctx.progress.complete_layer(desc)
+                            return True
+                        if resp.status >= 400:
+                            raise requests.exceptions.HTTPError(
+                                f'{resp.status} Error for url: {url}',
+                                response=_shim_response(resp.url, resp.status, dict(resp.headers))
+                            )
+                        SessionManager.remember_blob_host(url, resp.url)
+
+                        content_range = resp.headers.get('content-range')
+                        if content_range:
+                            total_size = int(content_range.split('/')[1])
+                        else:
+                            total_size = int(resp.headers.get('content-length', 0)) + resume_pos
+                        self.ctx.progress.update_layer_size(desc, total_size)
+
+                        if total_size - resume_pos > self.CHUNK_THRESHOLD and resume_pos == 0:
+                            ranged_total = total_size
+                        else:
+                            sha256_hash = hashlib.sha256() if expected_digest else None
+                            if resume_pos > 0 and sha256_hash:
+                                await asyncio.get_running_loop().run_in_executor(
+                                    self.executor, hash_file, save_path, sha256_hash
+                                )
+                            if self.stats:
+                                self.stats.add_total(total_size - resume_pos)
+
+                            with open(save_path, 'ab' if resume_pos > 0 else 'wb', buffering=0) as file:
+                                received = await self._stream_to_file(
+                                    resp, file, url, sha256_hash, self._speed_tracker(desc, resume_pos)
+                                )
+                            if received is None:
+                                return False
+                            if received > 0:
+                                retry.progressed()
+                            if sha256_hash and f'sha256:{sha256_hash.hexdigest()}' != expected_digest:
+                                logger.error(f'❌ {desc} 校验失败！')
+                                os.remove(save_path)
+                                raise ValueError(f'{desc} 摘要不匹配')
+                            retry.succeeded()
+                            self.ctx.progress.complete_layer(desc)
+                            return True
+                    finally:
+                        resp.close()
+            except Exception as e:
+                if not await self._retry_wait(retry, e, f'{desc} 下载失败'):
+                    return False
+                continue
+
+            retry.succeeded()
+            return await self._download_ranges(url, headers, save_path, desc, ranged_total, expected_digest)
+
+    async def _download_ranges(self, url: str, headers: Dict[str, str], save_path: str, desc: str,
+                               total_size: int, expected_digest: Optional[str]) -> bool:
+        """分片并发下载大文件，分片文件布局与 download_file_in_chunks 相同"""
+        num_chunks = (total_size + self.chunk_size - 1) // self.chunk_size
+        temp_dir = save_path + '.chunks'
+        os.makedirs(temp_dir, exist_ok=True)
+        chunk_files = []
+        for i in range(num_chunks):
+            start = i * self.chunk_size
+            end = min((i + 1) * self.chunk_size, total_size)
+            chunk_files.append((start, end, os.path.join(temp_dir, f'chunk_{i:04d}')))
+
+        completed_size = sum(end - start for start, end, path in chunk_files
+                             if os.path.exists(path) and os.path.getsize(path) == end - start)
+        if self.stats:
+            self.stats.add_total(total_size - completed_size)
+
+        progress = {'done': completed_size, 'chunks': 0}
+        self.ctx.progress.set_chunk_info(desc, 0, num_chunks)
+
+        async def _range(i: int, start: int, end: int, chunk_file: str) -> bool:
+            if os.path.exists(chunk_file):
+                if os.path.getsize(chunk_file) == end - start:
+                    progress['chunks'] += 1
+                    return True
+                os.remove(chunk_file)
+            retry = retry_policy.begin(url, self.max_retries, ctx=self.ctx)
+            range_headers = headers.copy()
+            range_headers['Range'] = f'bytes={start}-{end - 1}'
+            while True:
+                if self.ctx.is_set():
+                    return False
+                received_here = 0
+
+                def _on_progress(received: int):
+                    nonlocal received_here
+                    progress['done'] += received - received_here
+                    received_here = received
+                    self.ctx.progress.update_layer(desc, progress['done'])
+                    if self.stats:
+                        self.stats.mark_first_byte()
+
+                try:
+                    await asyncio.to_thread(retry.check)
+                    async with self.streams:
+                        resp = await self.client.request('GET', url, range_headers)
+                        try:
+                            if resp.status >= 400:
+                                raise requests.exceptions.HTTPError(
+                                    f'{resp.status} Error for url: {url}',
+                                    response=_shim_response(resp.url, resp.status, dict(resp.headers))
+                                )
+                            with open(chunk_file, 'wb', buffering=0) as f:
+                                if await self._stream_to_file(resp, f, url, None, _on_progress) is None:
+                                    return False
+                        finally:
+                            resp.close()
+                    if os.path.getsize(chunk_file) != end - start:
+                        raise requests.exceptions.ChunkedEncodingError(
+                            f'分片大小不符: {os.path.getsize(chunk_file)} != {end - start}'
+                        )
+                    retry.succeeded()
+                    progress['chunks'] += 1
+                    self.ctx.progress.set_chunk_info(desc, progress['chunks'], num_chunks)
+                    return True
+                except Exception as e:
+                    progress['done'] -= received_here
+                    if os.path.exists(chunk_file):
+                        os.remove(chunk_file)
+                    if not await self._retry_wait(retry, e, f'{desc} 分片 {i + 1} 下载失败'):
+                        return False
+
+        results = await asyncio.gather(*(_range(i, *chunk) for i, chunk in enumerate(chunk_files)))
+        if not all(results):
+            return False
+
+        logger.info(f'{desc}: 合并 {num_chunks} 个分片...')
+        sha256_hash = hashlib.sha256() if expected_digest else None
+        merged = await asyncio.get_running_loop().run_in_executor(
+            self.executor, merge_chunk_files, chunk_files, save_path, sha256_hash, self.ctx
+        )
+        if not merged:
+            return False
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        if sha256_hash and f'sha256:{sha256_hash.hexdigest()}' != expected_digest:
+            logger.error(f'❌ {desc} 校验失败！')
+            os.remove(save_path)
+            return False
+        self.ctx.progress.complete_layer(desc)
+        return True
+
+
+def decompress_layer(layerdir: str, cancel=None, index: bool = False) -> Optional[List[Tuple]]:
+    """把层目录中的 layer_gzip.tar 解压为 layer.tar，可在多个线程中对不同层并行调用。
+
+    index 为 True 时返回解压过程中顺带读出的文件列表（见 gunzip_file），层已解压过时返回 None。
+    """
+    if (cancel or stop_event).is_set():
+        raise KeyboardInterrupt("用户已取消操作")
+
+    gz_path = f'{layerdir}/layer_gzip.tar'
+    tar_path = f'{layerdir}/layer.tar'
+    rows = None
+    if os.path.exists(gz_path):
+        rows = gunzip_file(gz_path, tar_path, index=index)
+        os.remove(gz_path)
+    return rows
+
+
+def file_digest(path: str) -> str:
+    """计算文件的 sha256 digest（sha256:<hex>）"""
+    sha256_hash = hashlib.sha256()
+    hash_file(path, sha256_hash)
+    return 'sha256:' + sha256_hash.hexdigest()
+
+
+def gzip_uncompressed_size(path: str) -> Optional[int]:
+    """从 gzip 文件尾部的 ISIZE 字段读取解压后的大小（按 4GB 取模，超过时不准确），不是 gzip 时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            if f.read(2) != b'\x1f\x8b':
+                return None
+            f.seek(-4, os.SEEK_END)
+            return int.from_bytes(f.read(4), 'little')
+    except OSError:
+        return None
+
+
+class _TeeReader:
+    """按 RECV_BUFFER_SIZE 大块读取 src 并原样写入 dst，同时向 tarfile 提供只能向前 seek 的读取接口。
+
+    解压数据的写盘方式与 shutil.copyfileobj 相同，tar 头从内存中的块里解析，跳过文件内容只是移动读取位置。
+    """
+
+    def __init__(self, src, dst):
+        self.src = src
+        self.dst = dst
+        self.buffer = b''
+        self.offset = 0      # 当前读取位置在 buffer 中的偏移
+        self.position = 0    # 当前读取位置在整个流中的偏移
+
+    def _fill(self) -> bool:
+        data = self.src.read(RECV_BUFFER_SIZE)
+        if not data:
+            return False
+        self.dst.write(data)
+        self.buffer = self.buffer[self.offset:] + data
+        self.offset = 0
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while (size < 0 or len(self.buffer) - self.offset < size) and self._fill():
+            pass
+        end = len(self.buffer) if size < 0 else self.offset + size
+        data = self.buffer[self.offset:end]
+        self.offset += len(data)
+        self.position += len(data)
+        return data
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence != io.SEEK_SET or offset < self.position:
+            raise io.UnsupportedOperation('只能向前 seek')
+        skip = offset - self.position
+        while skip > len(self.buffer) - self.offset:
+            skip -= len(self.buffer) - self.offset
+            self.position += len(self.buffer) - self.offset
+            self.buffer, self.offset = b'', 0
+            if not self._fill():
+                return self.position
+        self.offset += skip
+        self.position += skip
+        return self.position
+
+
+def gunzip_file(src: str, dst: str, index: bool = False) -> Optional[List[Tuple]]:
+    """把 gzip 压缩的 src 解压到 dst（先写临时文件再重命名，中断时不会留下不完整的 dst）。
+
+    index 为 True 时在同一遍解压中解析 tar 头，返回每个条目的
+    (路径, 大小, 权限, 类型, 数据在 layer.tar 中的偏移, 链接目标)，不是合法 tar 时返回 None。
+    """
+    tmp_path = dst + '.tmp'
+    rows = None
+    with gzip.open(src, 'rb') as gz, open(tmp_path, 'wb') as file:
+        if index:
+            try:
+                with tarfile.open(fileobj=_TeeReader(gz, file), mode='r:') as tar:
+                    rows = [
+                        (_layer_path(member.name), member.size, member.mode, member.type.decode('ascii', 'replace'),
+                         member.offset_data, member.linkname or None)
+                        for member in tar
+                    ]
+            except tarfile.TarError as e:
+                logger.debug(f'解析层文件列表失败: {e}')
+                rows = None
+        # 解析 tar 头时读过的数据已经写入，剩余部分（包括结尾的填充块）直接复制
+        shutil.copyfileobj(gz, file, RECV_BUFFER_SIZE)
+    os.replace(tmp_path, dst)
+    return rows
+
+
+def download_layers(
+    session: requests.Session,
+    registry: str,
+    repository: str,
+    layers: List[Dict],
+    auth_head: Dict[str, str],
+    imgdir: str,
+    resp_json: Dict,
+    imgparts: List[str],
+    img: str,
+    tag: str,
+    arch: str,
+    output_dir: Path,
+    log_callback: Optional[Callable] = None,
+    protocol: str = 'https',
+    pull_started_at: Optional[float] = None,
+    engine: str = 'thread',
+    max_streams: int = 64,
+    ctx: Optional[PullContext] = None,
+    layer_index: Optional[Dict[str, List[Tuple]]] = None
+):
+    """下载所有镜像层，包括Config文件和各个layer，支持断点续传。
+
+    ctx 为本次拉取的上下文，未指定时按 log_callback 新建一个独立的上下文。
+    传入 layer_index 时在解压的同时记录各层的文件列表，以层的 diff_id 为键写入其中（见 write_image_index）。
+    """
+    ctx = ctx or PullContext(log_callback=log_callback)
+
+    os.makedirs(imgdir, exist_ok=True)
+
+    progress_manager = DownloadProgressManager(output_dir, repository, tag, arch)
+    stats = ctx.stats
+
+    try:
+        config_digest = resp_json['config']['digest']
+        config_filename = f'{config_digest[7:]}.json'
+        config_path = os.path.join(imgdir, config_filename)
+        config_url = f'{protocol}://{registry}/v2/{repository}/blobs/{config_digest}'
+
+        if progress_manager.is_config_completed() and os.path.exists(config_path):
+            logger.info(f'✅ Config 已存在，跳过下载')
+        else:
+            progress_manager.update_config_status('downloading', digest=config_digest)
+            
+            # 尝试获取config大小，如果失败则使用默认值
+            try:
+                config_size = get_file_size(session, config_url, auth_head)
+            except Exception as e:
+                logger.debug(f'获取Config大小失败: {e}，使用默认值')
+                config_size = 0
+            
+            ctx.progress.add_layer('Config', config_size, 0, len(layers) + 1)
+            
+            # 下载config，添加特殊错误处理
+            try:
+                success = download_file_with_progress(
+                    session, config_url, auth_head, config_path, "Config",
+                    expected_digest=config_digest, stats=stats, ctx=ctx
+                )
+                # 检查是否已取消
+                if ctx.is_set():
+                    raise KeyboardInterrupt("用户已取消操作")
+                
+                if not success:
+                    # 如果下载失败，检查是否是认证问题
+                    logger.error(f'❌ Config 下载失败')
+                    # 尝试不带认证头重新下载（某些仓库可能不需要认证）
+                    if 'Authorization' in auth_head:
+                        logger.info('🔄 尝试使用匿名方式重新下载Config...')
+                        anon_headers = {k: v for k, v in auth_head.items() if k != 'Authorization'}
+                        success = download_file_with_progress(
+                            session, config_url, anon_headers, config_path, "Config",
+                            expected_digest=config_digest, stats=stats, ctx=ctx
+                        )
+                        # 检查是否已取消
+                        if ctx.is_set():
+                            raise KeyboardInterrupt("用户已取消操作")
+                    
+                    if not success:
+                        progress_manager.update_config_status('failed')
+                        # Config下载失败不终止整个流程，继续尝试下载layers
+                        logger.warning('⚠️ Config下载失败，尝试继续下载镜像层...')
+                    else:
+                        progress_manager.update_config_status('completed', digest=config_digest)
+                else:
+                    progress_manager.update_config_status('completed', digest=config_digest)
+            except KeyboardInterrupt:
+                raise
+            except Exception as download_e:
+                logger.error(f'❌ Config 下载异常: {download_e}')
+                progress_manager.update_config_status('failed')
+                # 不终止流程，继续尝试下载layers
+                logger.warning('⚠️ Config下载异常，尝试继续下载镜像层...')
+
+    except Exception as e:
+        logging.error(f'请求配置失败: {e}')
+        # 不终止流程，继续尝试下载layers
+        logger.warning('⚠️ 配置处理失败，尝试继续下载镜像层...')
+
+    repo_tag = f'{"/".join(imgparts)}/{img}:{tag}' if imgparts else f'{img}:{tag}'
+    content = [{'Config': config_filename, 'RepoTags': [repo_tag], 'Layers': []}]
+    parentid = ''
+    layer_json_map: Dict[str, Dict] = {}
+
+    layers_to_download = []
+    skipped_count = 0
+
+    for layer in layers:
+        ublob = layer['digest']
+        fake_layerid = hashlib.sha256((parentid + '\n' + ublob + '\n').encode('utf-8')).hexdigest()
+        layerdir = f'{imgdir}/{fake_layerid}'
+        os.makedirs(layerdir, exist_ok=True)
+        layer_json_map[fake_layerid] = {"id": fake_layerid, "parent": parentid if parentid else None}
+        parentid = fake_layerid
+
+        save_path = f'{layerdir}/layer_gzip.tar'
+
+        if progress_manager.claim_completed_blob(ublob, save_path):
+            skipped_count += 1
+        else:
+            layers_to_download.append((ublob, fake_layerid, layerdir, save_path))
 
     if skipped_count > 0:
         logger.info(f'📦 跳过 {skipped_count} 个已下载的层，还需下载 {len(layers_to_download)} 个层')
@@ -1280,69 +3515,110 @@ def download_layers(
     for idx, (ublob, fake_layerid, layerdir, save_path) in enumerate(layers_to_download):
         url = f'{protocol}://{registry}/v2/{repository}/blobs/{ublob}'
         layer_size = get_file_size(session, url, auth_head)
-        progress_display.add_layer(ublob[:12], layer_size, idx + 1, len(layers_to_download))
+        ctx.progress.add_layer(ublob[:12], layer_size, idx + 1, len(layers_to_download))
 
-    progress_display.print_initial()
+    ctx.progress.print_initial()
+    ctx.progress.start_render_timer()
+    cpu_started_at = time.process_time()
 
-    num_workers = min(len(layers_to_download), 4) if layers_to_download else 1
+    if engine == 'async' and any(session.proxies.values()):
+        logger.warning('⚠️ asyncio 引擎不支持代理，改用线程引擎')
+        engine = 'thread'
 
-    with ThreadPoolExecutor(max_workers=num_workers) as executor:
-        futures = {}
-        try:
-            for idx, (ublob, fake_layerid, layerdir, save_path) in enumerate(layers_to_download):
-                if stop_event.is_set():
-                    raise KeyboardInterrupt
+    try:
+        if engine == 'async':
+            def _on_layer_done(digest: str, ok: bool):
+                if ok:
+                    progress_manager.update_layer_status(digest, 'completed', path=blob_paths[digest])
+                else:
+                    progress_manager.update_layer_status(digest, 'failed')
 
-                url = f'{protocol}://{registry}/v2/{repository}/blobs/{ublob}'
+            blob_paths = {}
+            jobs = []
+            for ublob, fake_layerid, layerdir, save_path in layers_to_download:
                 progress_manager.update_layer_status(ublob, 'downloading')
+                blob_paths[ublob] = save_path
+                jobs.append((f'{protocol}://{registry}/v2/{repository}/blobs/{ublob}', save_path, ublob[:12], ublob))
+
+            engine_ok = AsyncDownloadEngine(max_streams=max_streams, ctx=ctx).run(jobs, auth_head, stats, _on_layer_done)
+            if ctx.is_set():
+                raise KeyboardInterrupt("用户已取消操作")
+            if not engine_ok:
+                failed = [d[:12] for d in blob_paths if progress_manager.get_layer_status(d).get('status') == 'failed']
+                raise Exception(f'层 {", ".join(failed)} 下载失败')
+        else:
+            num_workers = min(len(layers_to_download), 4) if layers_to_download else 1
+            layer_sizes = {layer['digest']: layer.get('size', 0) for layer in layers}
 
-                futures[executor.submit(
-                    download_file_with_progress,
-                    session,
-                    url,
-                    auth_head,
-                    save_path,
-                    ublob[:12],
-                    expected_digest=ublob,
-                    stats=stats
-                )] = (ublob, save_path)
-
-            for future in as_completed(futures):
-                if stop_event.is_set():
-                    raise KeyboardInterrupt
-
-                ublob, save_path = futures[future]
-                result = future.result()
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                futures = {}
+                try:
+                    for idx, (ublob, fake_layerid, layerdir, save_path) in enumerate(layers_to_download):
+                        if ctx.is_set():
+                            raise KeyboardInterrupt
+
+                        url = f'{protocol}://{registry}/v2/{repository}/blobs/{ublob}'
+                        progress_manager.update_layer_status(ublob, 'downloading')
+
+                        futures[executor.submit(
+                            ctx.run,
+                            download_file_with_progress,
+                            session,
+                            url,
+                            auth_head,
+                            save_path,
+                            ublob[:12],
+                            expected_digest=ublob,
+                            stats=stats,
+                            expected_size=layer_sizes.get(ublob, 0),
+                            ctx=ctx
+                        )] = (ublob, save_path)
+
+                    for future in as_completed(futures):
+                        if ctx.is_set():
+                            raise KeyboardInterrupt
+
+                        ublob, save_path = futures[future]
+                        result = future.result()
+
+                        if not result:
+                            progress_manager.update_layer_status(ublob, 'failed')
+                            raise Exception(f'层 {ublob[:12]} 下载失败')
+                        else:
+                            progress_manager.update_layer_status(ublob, 'completed', path=save_path)
 
-                if not result:
-                    progress_manager.update_layer_status(ublob, 'failed')
-                    raise Exception(f'层 {ublob[:12]} 下载失败')
-                else:
-                    progress_manager.update_layer_status(ublob, 'completed')
+                except KeyboardInterrupt:
+                    logging.error("用户终止下载，保存当前进度...")
+                    ctx.cancel()
+                    executor.shutdown(wait=False)
+                    raise
+    finally:
+        ctx.progress.stop_render_timer()
 
-        except KeyboardInterrupt:
-            logging.error("用户终止下载，保存当前进度...")
-            stop_event.set()
-            executor.shutdown(wait=False)
-            raise
+    ctx.progress._refresh_display()
+    cpu_used = time.process_time() - cpu_started_at
+    if stats.start_time > 0:
+        record_throughput(registry, stats.total_size, time.time() - stats.start_time)
 
     # CLI模式下才打印空行，GUI模式下跳过
     if sys.stdout and hasattr(sys.stdout, 'write'):
         print()
 
-    for fake_layerid in layer_json_map.keys():
-        if stop_event.is_set():
-            raise KeyboardInterrupt("用户已取消操作")
-
-        layerdir = f'{imgdir}/{fake_layerid}'
-        gz_path = f'{layerdir}/layer_gzip.tar'
-        tar_path = f'{layerdir}/layer.tar'
+    # 各层解压互不依赖，按 CPU 数并行（zlib 解压时释放 GIL，自由线程构建下同样可以完全并行）
+    layer_dirs = [f'{imgdir}/{fake_layerid}' for fake_layerid in layer_json_map]
+    with ThreadPoolExecutor(max_workers=max(1, min(len(layer_dirs), os.cpu_count() or 1))) as executor:
+        futures = [executor.submit(ctx.run, decompress_layer, layerdir, ctx, layer_index is not None) for layerdir in layer_dirs]
+        layer_rows = [future.result() for future in futures]
 
-        if os.path.exists(gz_path):
-            with gzip.open(gz_path, 'rb') as gz, open(tar_path, 'wb') as file:
-                shutil.copyfileobj(gz, file)
-            os.remove(gz_path)
+    if layer_index is not None and os.path.exists(config_path):
+        with open(config_path) as file:
+            diff_ids = json.load(file).get('rootfs', {}).get('diff_ids', [])
+        for diff_id, rows in zip(diff_ids, layer_rows):
+            if rows is not None:
+                layer_index[diff_id] = rows
 
+    for fake_layerid in layer_json_map.keys():
+        layerdir = f'{imgdir}/{fake_layerid}'
         json_path = f'{layerdir}/json'
         with open(json_path, 'w') as file:
             json.dump(layer_json_map[fake_layerid], file)
@@ -1362,17 +3638,154 @@ def download_layers(
         avg_speed = stats.get_avg_speed()
         logger.info(f'📊 平均下载速度: {stats.format_size(int(avg_speed))}/s')
         logger.info(f'⏱️  总耗时: {stats.format_time(elapsed)}')
+    if pull_started_at and stats.first_byte_time > 0:
+        logger.info(f'⏱️  首字节耗时: {stats.first_byte_time - pull_started_at:.2f}秒')
+    if stats.total_size > 0:
+        logger.info(f'🧮 下载流水线利用率: {ctx.pipeline_stats.summary()}')
+        logger.debug(f'🧮 下载阶段 CPU 耗时: {cpu_used:.2f}秒 ({cpu_used / (stats.total_size / 1024 ** 3):.2f}秒/GB)')
 
     logging.info(f'✅ 镜像 {img}:{tag} 下载完成！')
     progress_manager.clear_progress()
 
 
-def create_image_tar(imgdir: str, repository: str, tag: str, arch: str, output_dir: Path) -> str:
-    """将下载的镜像层打包成Docker兼容的tar文件，并清理临时目录"""
+GZIP_BLOCK_SIZE = 1024 * 1024    # 并行 gzip 每块的输入大小
+GZIP_WINDOW = 32 * 1024          # deflate 窗口大小，前一块的末尾作为下一块的预设字典
+ARCHIVE_SUFFIXES = {'gzip': ('.tar.gz', '.tgz'), 'zstd': ('.tar.zst', '.tzst')}
+DEFAULT_COMPRESS_LEVEL = {'gzip': 6, 'zstd': 3}
+
+
+@dataclass
+class CompressionOptions:
+    """导出 tar 的压缩方式：format 为 gzip 或 zstd，level 为空时用各格式的默认级别，threads 为 0 时用全部 CPU"""
+    format: str
+    level: Optional[int] = None
+    threads: int = 0
+
+    @property
+    def suffix(self) -> str:
+        return ARCHIVE_SUFFIXES[self.format][0]
+
+    @classmethod
+    def for_path(cls, path: str, default: Optional['CompressionOptions'] = None) -> Optional['CompressionOptions']:
+        """按文件扩展名（.tar.gz / .tgz / .tar.zst / .tzst）确定压缩格式，扩展名不表示压缩时返回 default"""
+        for fmt, suffixes in ARCHIVE_SUFFIXES.items():
+            if path.endswith(suffixes):
+                return cls(fmt, default.level if default else None, default.threads if default else 0)
+        return default
+
+
+class ParallelGzipWriter:
+    """pigz 式的多线程 gzip 压缩流。
+
+    输入按 GZIP_BLOCK_SIZE 分块，各块以前一块末尾 32KB 为预设字典在线程池中压缩为 raw deflate
+    （以 Z_SYNC_FLUSH 结束，字节对齐），按顺序拼接成一个标准 gzip 成员，压缩率与单线程 gzip 相当。
+    只向 file 顺序写入，可以写到管道；在途的块数有上限，内存占用与线程数成正比。
+    """
+
+    def __init__(self, file, level: int = 6, threads: int = 0, block_size: int = GZIP_BLOCK_SIZE):
+        self.file = file
+        self.level = level
+        self.block_size = block_size
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='gzip')
+        self.pending: List = []
+        self.buffer = bytearray()
+        self.dictionary = b''
+        self.crc = 0
+        self.size = 0
+        # gzip 头：无文件名，mtime 为 0，XFL 按压缩级别，OS 为 unknown
+        xfl = 2 if level >= 9 else 4 if level <= 1 else 0
+        self.file.write(bytes([0x1f, 0x8b, 8, 0, 0, 0, 0, 0, xfl, 255]))
+
+    def _compress(self, block: bytes, dictionary: bytes) -> bytes:
+        if dictionary:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY, dictionary)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def _submit(self, block: bytes):
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self.pending.append(self.executor.submit(self._compress, block, self.dictionary))
+        self.dictionary = block[-GZIP_WINDOW:]
+        while len(self.pending) > self.threads * 2:
+            self.file.write(self.pending.pop(0).result())
+
+    def write(self, data) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        """写出剩余数据、结束块和 gzip 尾（CRC32 与原始长度），不关闭 file"""
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+        try:
+            for future in self.pending:
+                self.file.write(future.result())
+        finally:
+            self.pending.clear()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.file.write(zlib.compressobj(self.level, zlib.DEFLATED, -15).flush())
+        self.file.write((self.crc & 0xffffffff).to_bytes(4, 'little') + (self.size & 0xffffffff).to_bytes(4, 'little'))
+
+
+def open_compressor(file, compression: CompressionOptions):
+    """在 file 上打开压缩流（需要 write 和 close，close 不关闭 file）"""
+    level = compression.level if compression.level is not None else DEFAULT_COMPRESS_LEVEL[compression.format]
+    if compression.format == 'gzip':
+        return ParallelGzipWriter(file, level, compression.threads)
+    if zstandard is None:
+        raise RuntimeError('导出 zstd 需要安装 zstandard（pip install zstandard）')
+    compressor = zstandard.ZstdCompressor(level=level, threads=compression.threads or -1)
+    return compressor.stream_writer(file, closefd=False)
+
+
+@contextmanager
+def open_archive_writer(path: str, compression: Optional[CompressionOptions] = None):
+    """打开要写入的 docker-archive tar，返回 TarFile。
+
+    path 为 - 时写到标准输出；指定 compression 时边打包边压缩，未压缩的 tar 不落盘。
+    文件先写入临时文件，成功后原子替换，覆盖已有的 tar 时读取方不会看到写了一半的文件。
+    """
+    tmp_path = None if path == '-' else path + '.tmp'
+    file = sys.__stdout__.buffer if tmp_path is None else open(tmp_path, 'wb')
+    try:
+        stream = open_compressor(file, compression) if compression else file
+        with tarfile.open(fileobj=stream, mode='w|', bufsize=RECV_BUFFER_SIZE, copybufsize=RECV_BUFFER_SIZE) as tar:
+            yield tar
+        if compression:
+            stream.close()
+        file.flush()
+    except BaseException:
+        if tmp_path:
+            file.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+    if tmp_path:
+        file.close()
+        os.replace(tmp_path, path)
+
+
+def image_tar_path(repository: str, tag: str, arch: str, output_dir: Path,
+                   compression: Optional[CompressionOptions] = None) -> str:
+    """单个镜像导出的 tar 文件路径"""
     safe_repo = repository.replace("/", "_")
-    docker_tar = str(output_dir / f'{safe_repo}_{tag}_{arch}.tar')
+    suffix = compression.suffix if compression else '.tar'
+    return str(output_dir / f'{safe_repo}_{tag}_{platform_label(arch)}{suffix}')
+
+
+def create_image_tar(imgdir: str, repository: str, tag: str, arch: str, output_dir: Path,
+                     compression: Optional[CompressionOptions] = None) -> str:
+    """将下载的镜像层打包成Docker兼容的tar文件（可选 gzip / zstd 压缩），并清理临时目录。"""
+    docker_tar = image_tar_path(repository, tag, arch, output_dir, compression)
     try:
-        with tarfile.open(docker_tar, "w") as tar:
+        with open_archive_writer(docker_tar, compression) as tar:
             tar.add(imgdir, arcname='/')
         logger.debug(f'Docker 镜像已拉取：{docker_tar}')
         
@@ -1389,9 +3802,11 @@ def create_image_tar(imgdir: str, repository: str, tag: str, arch: str, output_d
         raise
 
 
-def cleanup_tmp_dir():
-    """清理临时目录（tmp目录），释放磁盘空间"""
-    tmp_dir = 'tmp'
+def cleanup_tmp_dir(tmp_dir: str = 'tmp'):
+    """清理临时目录（默认 tmp 目录），释放磁盘空间；仍有其他拉取在进行时跳过"""
+    if active_pulls():
+        logger.debug(f'仍有拉取在进行，暂不清理临时目录: {tmp_dir}')
+        return
     try:
         if os.path.exists(tmp_dir):
             logger.debug(f'清理临时目录: {tmp_dir}')
@@ -1449,7 +3864,7 @@ def _handle_authentication(
     logger.info(f'🔍 探测仓库入口: {url}')
     
     try:
-        resp = session.get(url, verify=False, timeout=60)
+        resp = request_with_retry(session, 'GET', url, '探测仓库', max_retries=3, verify=False)
     except requests.exceptions.RequestException as e:
         return _get_default_auth_head(), False, f'连接仓库失败: {e}'
     
@@ -1536,235 +3951,4447 @@ def _handle_authentication(
         return _get_default_auth_head(), True, None
 
 
-# GUI兼容的拉取镜像函数
-def pull_image_logic(
-    image: str,
-    registry: Optional[str] = None,
-    arch: str = "amd64",
-    username: Optional[str] = None,
-    password: Optional[str] = None,
-    debug: bool = False,
-    log_callback: Optional[Callable] = None
-):
-    """核心逻辑函数，供GUI调用"""
-    global stop_event
-    stop_event.clear()
+# GUI兼容的拉取镜像函数
+def fetch_image_manifest(
+    session: requests.Session,
+    image_info: ImageInfo,
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    store_dir: Optional[Path] = None
+) -> Optional[Tuple[Dict[str, str], Dict, str]]:
+    """认证并获取标签对应的清单（可能是多架构索引），返回 (认证头, 清单, digest)；失败时记录原因并返回 None。
+
+    指定 store_dir 时把清单原始内容按 digest 缓存到 blob 仓库，导出时原样使用。
+    """
+    # 处理认证
+    auth_head, auth_success, error_msg = _handle_authentication(
+        session, image_info.registry, image_info.repository, username, password, image_info.protocol
+    )
+    
+    if not auth_success:
+        logger.error(f'❌ {error_msg}')
+        if 'auth.json' in str(error_msg) or '用户名' in str(error_msg):
+            logger.info('💡 提示：可以在 auth.json 文件中配置认证信息，或使用环境变量 DOCKER_REGISTRY_USERNAME/PASSWORD')
+        return None
+    
+    # 获取manifest
+    resp, http_code = fetch_manifest(
+        session, image_info.registry, image_info.repository,
+        image_info.reference, auth_head, image_info.protocol
+    )
+    
+    # 如果返回401，尝试重新认证（某些仓库在获取manifest时才需要认证）
+    if http_code == 401:
+        logger.warning('⚠️ 获取清单时需要重新认证')
+        token_cache.invalidate(image_info.repository)
+        www_auth = resp.headers.get('WWW-Authenticate', '')
+        scheme, auth_url, reg_service = parse_www_authenticate(www_auth)
+        
+        # 重新加载凭据
+        user_from_file, pwd_from_file = load_auth_credentials(image_info.registry)
+        effective_username = username or user_from_file or os.environ.get('DOCKER_REGISTRY_USERNAME') or os.environ.get('REGISTRY_USERNAME')
+        effective_password = password or pwd_from_file or os.environ.get('DOCKER_REGISTRY_PASSWORD') or os.environ.get('REGISTRY_PASSWORD')
+        
+        if scheme and scheme.lower().startswith('bearer') and auth_url and reg_service and effective_username and effective_password:
+            try:
+                auth_head = get_auth_head(
+                    session, auth_url, reg_service, image_info.repository,
+                    effective_username, effective_password
+                )
+                # 重试获取manifest
+                resp, http_code = fetch_manifest(
+                    session, image_info.registry, image_info.repository,
+                    image_info.reference, auth_head, image_info.protocol
+                )
+            except Exception as e:
+                logger.error(f'❌ 重新认证失败: {e}')
+                return None
+        elif scheme and scheme.lower().startswith('basic') and effective_username and effective_password:
+            auth_head = _create_basic_auth_head(effective_username, effective_password)
+            resp, http_code = fetch_manifest(
+                session, image_info.registry, image_info.repository,
+                image_info.reference, auth_head, image_info.protocol
+            )
+        
+        if http_code == 401:
+            logger.error('❌ 认证失败，无法访问该镜像')
+            logger.info('💡 提示：请检查用户名和密码是否正确')
+            return None
+
+    if http_code != 200:
+        logger.error(f'❌ 获取清单失败，HTTP状态码: {http_code}')
+        return None
+
+    digest = 'sha256:' + hashlib.sha256(resp.content).hexdigest()
+    if image_info.digest and digest != image_info.digest:
+        logger.error(f'❌ 清单内容与固定的 digest {image_info.digest} 不符')
+        return None
+
+    try:
+        resp_json = resp.json()
+    except Exception as e:
+        logger.error(f'❌ 解析清单失败: {e}')
+        return None
+    if store_dir is not None:
+        cache_blob_bytes(store_dir, digest, resp.content)
+    return auth_head, resp_json, digest
+
+
+def fetch_platform_manifest(
+    session: requests.Session,
+    image_info: ImageInfo,
+    auth_head: Dict[str, str],
+    manifests: List[Dict],
+    arch: str,
+    store_dir: Optional[Path] = None
+) -> Optional[Tuple[Dict, str]]:
+    """从多架构索引中选出 arch 对应的条目并获取其单架构清单，返回 (清单, digest)；失败时记录原因并返回 None。
+
+    清单内容按索引中的 digest 校验，指定 store_dir 时原始内容缓存到 blob 仓库。
+    """
+    digest = select_manifest(manifests, arch)
+    if not digest:
+        logger.error(f'在清单中找不到指定的架构 {arch}')
+        logger.info(f'可用架构: {", ".join(list_platforms(manifests))}')
+        return None
+
+    url = f'{image_info.protocol}://{image_info.registry}/v2/{image_info.repository}/manifests/{digest}'
+    logger.debug(f'获取架构清单: {url}')
+
+    manifest_resp = request_with_retry(session, 'GET', url, '架构清单请求', max_retries=3, paced=True, headers=auth_head, verify=False)
+    try:
+        manifest_resp.raise_for_status()
+        resp_json = manifest_resp.json()
+    except Exception as e:
+        logger.error(f'获取架构清单失败: {e}')
+        return None
+    actual = 'sha256:' + hashlib.sha256(manifest_resp.content).hexdigest()
+    if actual != digest:
+        logger.error(f'架构清单内容与 digest 不符: 期望 {digest}，实际 {actual}')
+        return None
+
+    if 'layers' not in resp_json:
+        logger.error('错误：清单中没有层')
+        return None
+
+    if 'config' not in resp_json:
+        logger.error('错误：清单中没有配置信息')
+        return None
+    if store_dir is not None:
+        cache_blob_bytes(store_dir, digest, manifest_resp.content)
+    return resp_json, digest
+
+
+def resolve_image_manifest(
+    session: requests.Session,
+    image_info: ImageInfo,
+    arch: str,
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    store_dir: Optional[Path] = None
+) -> Optional[Tuple[Dict[str, str], Dict, str, str]]:
+    """认证并获取镜像清单，多架构清单按 arch 选出对应的单架构清单。
+
+    返回 (认证头, 清单, 实际架构, 清单 digest)；失败时记录原因并返回 None。
+    只有一个可用架构时自动选择该架构，因此返回的架构可能与 arch 不同。
+    指定 store_dir 时清单原始内容缓存到 blob 仓库。
+    """
+    fetched = fetch_image_manifest(session, image_info, username, password, store_dir)
+    if fetched is None:
+        return None
+    auth_head, resp_json, digest = fetched
+
+    manifests = resp_json.get('manifests')
+    if manifests is not None:
+        archs = list_platforms(manifests)
+
+        if archs:
+            logger.info(f'📋 当前可用架构：{", ".join(archs)}')
+
+        if len(archs) == 1:
+            arch = archs[0]
+            logger.info(f'✅ 自动选择唯一可用架构: {arch}')
+
+        platform_manifest = fetch_platform_manifest(session, image_info, auth_head, manifests, arch, store_dir)
+        if platform_manifest is None:
+            return None
+        resp_json, digest = platform_manifest
+    else:
+        actual = fetch_config_platform(session, image_info, auth_head, resp_json)
+        arch = single_platform_arch(f'{image_info.repository}:{image_info.tag}', actual, [arch])
+
+    if 'layers' not in resp_json or 'config' not in resp_json:
+        logger.error('错误：清单格式不完整，缺少必要字段')
+        return None
+
+    return auth_head, resp_json, arch, digest
+
+
+def fetch_config_platform(
+    session: requests.Session,
+    image_info: ImageInfo,
+    auth_head: Dict[str, str],
+    manifest: Dict
+) -> Optional[str]:
+    """单架构清单没有平台信息，从镜像配置中读取实际架构，返回 architecture[/variant]；失败时返回 None"""
+    config_digest = manifest.get('config', {}).get('digest')
+    if not config_digest:
+        return None
+    config_url = f'{image_info.protocol}://{image_info.registry}/v2/{image_info.repository}/blobs/{config_digest}'
+    logger.debug(f'获取镜像配置: {config_url}')
+    try:
+        config_resp = request_with_retry(session, 'GET', config_url, '配置请求', max_retries=3, headers=auth_head, verify=False)
+        config_resp.raise_for_status()
+        config_json = config_resp.json()
+    except Exception as e:
+        logger.warning(f'获取镜像配置失败: {e}')
+        return None
+    actual_arch = config_json.get('architecture', 'unknown')
+    actual_os = config_json.get('os', 'unknown')
+    logger.info(f'📋 镜像实际架构: {actual_os}/{actual_arch}')
+    return actual_arch + (f'/{config_json["variant"]}' if config_json.get('variant') else '')
+
+
+def platform_matches(arch: str, platform: str) -> bool:
+    """请求的架构（-a 中的一项）是否与 architecture[/variant] 形式的实际平台一致，匹配规则与 select_manifest 相同"""
+    architecture, variant = parse_platform(platform)
+    entry = {'platform': {'os': 'linux', 'architecture': architecture, 'variant': variant}, 'digest': platform}
+    return select_manifest([entry], arch) is not None
+
+
+def single_platform_arch(image_name: str, actual: Optional[str], archs: List[str]) -> str:
+    """单架构镜像导出时使用的架构标签。
+
+    actual 为从配置中读取的实际平台（未知时为 None）。与请求的某个架构一致时沿用该架构，
+    都不一致时记录警告并使用实际平台，不会把镜像按请求的架构错误地命名。
+    """
+    if archs == ['all']:
+        return actual or 'unknown'
+    if actual is None:
+        return archs[0]
+    matched = next((arch for arch in archs if platform_matches(arch, actual)), None)
+    if matched is None:
+        logger.warning(f'⚠️ {image_name} 只有 {actual} 平台，与请求的 {", ".join(archs)} 不符，按实际平台导出')
+        return actual
+    return matched
+
+
+def resolve_platform_manifests(
+    session: requests.Session,
+    image_info: ImageInfo,
+    archs: List[str],
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    store_dir: Optional[Path] = None
+) -> Optional[Tuple[Dict[str, str], List[Tuple[str, Dict, str]]]]:
+    """一次认证和索引请求后并发获取多个平台的清单，archs 为 ['all'] 时获取索引中的全部平台。
+
+    返回 (认证头, [(架构, 清单, 清单 digest), ...])，找不到的平台记录错误后跳过；索引获取失败时返回 None。
+    指定 store_dir 时清单原始内容缓存到 blob 仓库。
+    """
+    fetched = fetch_image_manifest(session, image_info, username, password, store_dir)
+    if fetched is None:
+        return None
+    auth_head, resp_json, digest = fetched
+
+    manifests = resp_json.get('manifests')
+    if manifests is None:
+        if 'layers' not in resp_json or 'config' not in resp_json:
+            logger.error('错误：清单格式不完整，缺少必要字段')
+            return None
+        image_name = f'{image_info.repository}:{image_info.tag}'
+        logger.warning(f'⚠️ {image_name} 不是多架构镜像，只拉取其唯一的平台')
+        actual = fetch_config_platform(session, image_info, auth_head, resp_json)
+        return auth_head, [(single_platform_arch(image_name, actual, archs), resp_json, digest)]
+
+    available = list_platforms(manifests)
+    logger.info(f'📋 {image_info.repository}:{image_info.tag} 可用架构：{", ".join(available)}')
+    if archs == ['all']:
+        archs = available
+
+    ctx = PullContext.current()
+    with ThreadPoolExecutor(max_workers=max(1, len(archs))) as executor:
+        results = list(executor.map(
+            lambda arch: ctx.run(fetch_platform_manifest, session, image_info, auth_head, manifests, arch, store_dir), archs
+        ))
+    return auth_head, [(arch,) + result for arch, result in zip(archs, results) if result is not None]
+
+
+def read_cached_blob(store_dir: Path, digest: str) -> Optional[bytes]:
+    """从 blob 仓库读取按 digest 缓存的清单、配置等小文件，不存在或内容与 digest 不符时返回 None"""
+    try:
+        data = (store_dir / digest[7:]).read_bytes()
+    except OSError:
+        return None
+    return data if 'sha256:' + hashlib.sha256(data).hexdigest() == digest else None
+
+
+def cache_blob_bytes(store_dir: Path, digest: str, data: bytes):
+    """把清单等小文件按 digest 写入 blob 仓库（先写临时文件再替换）；预演模式不创建 blob 仓库，此时不缓存"""
+    if not store_dir.is_dir():
+        return
+    tmp_path = store_dir / f'{digest[7:]}.{threading.get_ident()}.tmp'
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, store_dir / digest[7:])
+
+
+def fetch_blob_bytes(session: requests.Session, url: str, headers: Dict[str, str], digest: str) -> bytes:
+    """GET 一个小 blob（配置等）并校验 digest，内容不符时抛出 ValueError"""
+    resp = request_with_retry(session, 'GET', url, '配置请求', max_retries=3, headers=headers, verify=False)
+    resp.raise_for_status()
+    actual = 'sha256:' + hashlib.sha256(resp.content).hexdigest()
+    if actual != digest:
+        raise ValueError(f'内容与 digest 不符: 期望 {digest}，实际 {actual}')
+    return resp.content
+
+
+def fetch_pinned_manifest(
+    session: requests.Session,
+    image_info: ImageInfo,
+    digest: str,
+    store_dir: Path,
+    auth: Callable[[], Dict[str, str]]
+) -> Dict:
+    """按 digest 获取清单：内容不可变，已缓存时直接读取，不向仓库确认；否则下载、校验后写入缓存。
+
+    auth 在确实需要发请求时才调用，用于延迟认证。
+    """
+    data = read_cached_blob(store_dir, digest)
+    if data is None:
+        url = f'{image_info.protocol}://{image_info.registry}/v2/{image_info.repository}/manifests/{digest}'
+        logger.debug(f'获取固定 digest 的清单: {url}')
+        resp = request_with_retry(session, 'GET', url, '清单请求', max_retries=3, paced=True, headers=auth(), verify=False)
+        resp.raise_for_status()
+        data = resp.content
+        actual = 'sha256:' + hashlib.sha256(data).hexdigest()
+        if actual != digest:
+            raise ValueError(f'清单内容与 digest 不符: 期望 {digest}，实际 {actual}')
+        cache_blob_bytes(store_dir, digest, data)
+    return json.loads(data)
+
+
+def resolve_pinned_manifests(
+    session: requests.Session,
+    image_info: ImageInfo,
+    archs: List[str],
+    store_dir: Path,
+    username: Optional[str] = None,
+    password: Optional[str] = None
+) -> Optional[Tuple[Optional[Dict[str, str]], List[Tuple[str, Dict, str]]]]:
+    """解析固定 digest 的镜像：跳过标签解析，索引和平台清单都按 digest 从缓存读取或获取一次。
+
+    只有缓存未命中时才认证，全部命中时不发任何请求，返回的认证头为 None。
+    返回 (认证头, [(架构, 清单, 清单 digest), ...])，找不到的平台记录错误后跳过；失败时返回 None。
+    """
+    auth_head = None
+    auth_lock = threading.Lock()
+
+    def _auth() -> Dict[str, str]:
+        nonlocal auth_head
+        with auth_lock:
+            if auth_head is None:
+                head, auth_success, error_msg = _handle_authentication(
+                    session, image_info.registry, image_info.repository, username, password, image_info.protocol
+                )
+                if not auth_success:
+                    raise PermissionError(error_msg)
+                auth_head = head
+            return auth_head
+
+    try:
+        top = fetch_pinned_manifest(session, image_info, image_info.digest, store_dir, _auth)
+        manifests = top.get('manifests')
+        if manifests is None:
+            if 'layers' not in top or 'config' not in top:
+                logger.error('错误：清单格式不完整，缺少必要字段')
+                return None
+            # 配置已缓存时从中读取平台，否则向仓库获取
+            config = read_cached_blob(store_dir, top['config']['digest'])
+            if config is not None:
+                config_json = json.loads(config)
+                actual = config_json.get('architecture', 'unknown') + \
+                    (f'/{config_json["variant"]}' if config_json.get('variant') else '')
+            else:
+                actual = fetch_config_platform(session, image_info, _auth(), top)
+            arch = single_platform_arch(f'{image_info.repository}@{image_info.digest}', actual, archs)
+            return auth_head, [(arch, top, image_info.digest)]
+
+        available = list_platforms(manifests)
+        if archs == ['all'] or (len(archs) == 1 and len(available) == 1):
+            archs = available
+        found = []
+        for arch in archs:
+            digest = select_manifest(manifests, arch)
+            if not digest:
+                logger.error(f'在清单中找不到指定的架构 {arch}')
+                logger.info(f'可用架构: {", ".join(available)}')
+                continue
+            found.append((arch, fetch_pinned_manifest(session, image_info, digest, store_dir, _auth), digest))
+    except (requests.exceptions.RequestException, ValueError, PermissionError) as e:
+        logger.error(f'❌ 获取 {image_info.repository}@{image_info.digest} 的清单失败: {e}')
+        return None
+    return auth_head, found
+
+
+def pull_image_logic(
+    image: str,
+    registry: Optional[str] = None,
+    arch: str = "amd64",
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    debug: bool = False,
+    log_callback: Optional[Callable] = None,
+    prewarm: int = 4,
+    deadline: Optional[float] = None,
+    engine: str = 'thread',
+    streams: int = 64,
+    ctx: Optional[PullContext] = None,
+    squash: bool = False,
+    index: bool = False,
+    dry_run: bool = False,
+    space_check: bool = True,
+    compression: Optional[CompressionOptions] = None
+):
+    """核心逻辑函数，供GUI调用。
+
+    每次调用使用独立的 PullContext，可在多个线程中并发调用（输出目录不能相同），
+    各拉取共享连接池。传入 ctx 时可以用 ctx.cancel() 单独取消本次拉取，
+    cancel_current_pull() 则取消所有进行中的拉取。squash 为 True 时导出为单层镜像，
+    index 为 True 时在 tar 旁边写入文件索引（见 write_image_index），compression 指定时导出压缩的 tar。
+    下载前检查磁盘空间（space_check），dry_run 时只输出拉取计划，不下载任何层。
+    """
+    ctx = ctx or PullContext(log_callback=log_callback, deadline=deadline)
+    ctx_token = _current_pull.set(ctx)
+
+    # 添加GUI日志处理器，只接收本次拉取线程产生的日志
+    gui_handler = None
+    if log_callback:
+        gui_handler = GUILogHandler(log_callback, context=ctx)
+        gui_handler.setLevel(logging.INFO)
+        formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
+        gui_handler.setFormatter(formatter)
+        logger.addHandler(gui_handler)
+        
+        # 配置 urllib3 日志，使其在连接超时时能在GUI中显示警告信息
+        # 这样可以捕获类似 "Retrying...connection broken by 'ConnectTimeoutError'..." 的警告
+        urllib3_logger = logging.getLogger("urllib3.connectionpool")
+        urllib3_logger.setLevel(logging.WARNING)
+        urllib3_logger.addHandler(gui_handler)
+
+    try:
+        if debug:
+            logger.setLevel(logging.DEBUG)
+
+        logger.info("准备下载...")
+        
+        image_info = parse_image_input(image, registry)
+        
+        logger.info(f"开始拉取镜像：{image_info.image_name}:{image_info.tag}")
+        logger.info(f"仓库地址：{image_info.registry}")
+        logger.info(f"架构：{arch}")
+
+        pull_started_at = time.time()
+        session = SessionManager.get_session()
+        ctx.session = session
+        prewarm_connections(session, image_info.registry, image_info.protocol, prewarm)
+        
+        resolved = resolve_image_manifest(session, image_info, arch, username, password)
+        if resolved is None:
+            return
+        auth_head, resp_json, arch, _ = resolved
+
+        # 计算镜像总大小
+        total_size = 0
+        if 'layers' in resp_json:
+            for layer in resp_json['layers']:
+                total_size += layer.get('size', 0)
+        if 'config' in resp_json and resp_json['config'].get('size', 0):
+            total_size += resp_json['config'].get('size', 0)
+        
+        # 格式化大小显示
+        def format_size(size: int) -> str:
+            for unit in ['B', 'KB', 'MB', 'GB']:
+                if size < 1024:
+                    return f"{size:.1f}{unit}"
+                size /= 1024
+            return f"{size:.1f}TB"
+        
+        size_str = format_size(total_size)
+
+        logger.info(f'📦 仓库地址：{image_info.registry}')
+        logger.info(f'📦 镜像：{image_info.repository}')
+        logger.info(f'📦 标签：{image_info.tag}')
+        logger.info(f'📦 架构：{arch}')
+        logger.info(f'📦 镜像大小（压缩后的）：{size_str}')
+
+        if dry_run or space_check:
+            plan = plan_single_pull(session, image_info, image, resp_json, arch, auth_head,
+                                    get_output_dir(image_info.repository, image_info.tag, arch, create=False),
+                                    squash, fetch_config=dry_run, compressed_output=compression is not None)
+            if not preflight_pull(plan, dry_run):
+                return
+
+        output_dir = get_output_dir(image_info.repository, image_info.tag, arch)
+        imgdir = str(output_dir / 'layers')
+        ctx.claim_scratch_dir(imgdir)
+        os.makedirs(imgdir, exist_ok=True)
+        logger.info(f'📁 输出目录：{output_dir}')
+        logger.info('📥 开始下载...')
+
+        if image_info.registry in ('registry-1.docker.io', 'registry.hub.docker.com', 'docker.io') and image_info.repository.startswith('library/'):
+            imgparts = []
+        else:
+            imgparts = image_info.repository.split('/')[:-1]
+
+        layer_index = {} if index else None
+        download_layers(
+            session, image_info.registry, image_info.repository,
+            resp_json['layers'], auth_head, imgdir, resp_json,
+            imgparts, image_info.image_name, image_info.tag, arch,
+            output_dir,
+            log_callback=log_callback,
+            protocol=image_info.protocol,
+            pull_started_at=pull_started_at,
+            engine=engine,
+            max_streams=streams,
+            ctx=ctx,
+            layer_index=layer_index
+        )
+
+        if squash:
+            squash_image_dir(imgdir, ctx)
+        if index:
+            write_image_index(index_path_for(image_tar_path(image_info.repository, image_info.tag, arch, output_dir)),
+                              imgdir, layer_index)
+        output_file = create_image_tar(imgdir, image_info.repository, image_info.tag, arch, output_dir, compression)
+        logger.info(f'✅ 镜像已保存为: {output_file}')
+        logger.info(f'💡 导入命令: docker load -i {output_file}')
+
+    except KeyboardInterrupt:
+        logger.info('⚠️ 用户取消操作。')
+    except Exception as e:
+        logger.error(f'❌ 程序运行过程中发生异常: {e}')
+        raise
+    finally:
+        ctx.close()
+        _current_pull.reset(ctx_token)
+        if gui_handler:
+            logger.removeHandler(gui_handler)
+            logging.getLogger("urllib3.connectionpool").removeHandler(gui_handler)
+        cleanup_tmp_dir()
+
+
+def read_image_list(path: str) -> List[str]:
+    """读取镜像列表文件（'-' 表示标准输入）：每行一个镜像，忽略空行和 # 注释，重复项只保留一次"""
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    images = (line.split('#', 1)[0].strip() for line in lines)
+    return list(dict.fromkeys(image for image in images if image))
+
+
+def read_lockfile(path: str) -> List[str]:
+    """读取锁定文件，返回 镜像@digest 形式的引用列表（'-' 表示标准输入）。
+
+    支持 resolve 子命令输出的 NDJSON（每行一条记录，取 image 和 digest），
+    也支持手写的每行一个 镜像@sha256:... 的列表；空行和 # 注释被忽略，没有固定 digest 的行记录警告后跳过。
+    """
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    refs = []
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('{'):
+            record = json.loads(line)
+            if record.get('error') or not record.get('digest'):
+                logger.warning(f'⚠️ 锁定文件第 {lineno} 行 {record.get("ref")} 没有解析出 digest，跳过')
+                continue
+            line = f'{record.get("image") or record["ref"]}@{record["digest"]}'
+        else:
+            line = line.split('#', 1)[0].strip()
+        if '@' not in line:
+            logger.warning(f'⚠️ 锁定文件第 {lineno} 行 {line} 没有固定 digest，跳过')
+            continue
+        refs.append(line)
+    return list(dict.fromkeys(refs))
+
+
+def _image_repo_name(image_info: ImageInfo) -> str:
+    """docker load 后的镜像名：Docker Hub 官方镜像省略 library/ 前缀，其余保留完整仓库路径"""
+    if image_info.registry in ('registry-1.docker.io', 'registry.hub.docker.com', 'docker.io') and \
+            image_info.repository.startswith('library/'):
+        return image_info.image_name
+    return '/'.join(image_info.repository.split('/')[:-1] + [image_info.image_name])
+
+
+def _link_or_copy(src: str, dst: str):
+    """优先用硬链接复用已有文件（同一文件系统内不占额外空间），失败时复制"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+@dataclass
+class BatchImage:
+    """批量拉取中的一个镜像：引用、解析出的清单和认证头（固定 digest 且清单来自缓存时为 None，需要下载时再认证）。
+
+    digest 为仓库中清单的 digest，清单原始内容按它缓存在 blob 仓库中。
+    """
+    ref: str
+    info: ImageInfo
+    auth_head: Optional[Dict[str, str]]
+    manifest: Dict
+    arch: str
+    digest: Optional[str] = None
+
+    @property
+    def blobs(self) -> List[Dict]:
+        """镜像引用的所有 blob 描述（config 在前）"""
+        return [self.manifest['config']] + self.manifest['layers']
+
+
+def _export_image_layout(imgdir: str, image: BatchImage, store_dir: Path,
+                         tag: Optional[str] = None) -> Tuple[Dict, str, str]:
+    """把镜像写成 docker-archive 目录布局，层文件硬链接自 blob 仓库。
+
+    层目录 ID 与 download_layers 的计算方式相同，多个镜像写入同一目录时共享的层只出现一次。
+    tag 默认为镜像自身的标签。返回 (manifest.json 条目, repositories 中的镜像名, 顶层 ID)。
+    """
+    parentid = ''
+    layer_paths = []
+    for layer in image.manifest['layers']:
+        ublob = layer['digest']
+        fake_layerid = hashlib.sha256((parentid + '\n' + ublob + '\n').encode('utf-8')).hexdigest()
+        layerdir = os.path.join(imgdir, fake_layerid)
+        os.makedirs(layerdir, exist_ok=True)
+        tar_path = os.path.join(layerdir, 'layer.tar')
+        if not os.path.exists(tar_path):
+            _link_or_copy(str(store_dir / f'{ublob[7:]}.tar'), tar_path)
+        with open(os.path.join(layerdir, 'json'), 'w') as file:
+            json.dump({"id": fake_layerid, "parent": parentid if parentid else None}, file)
+        layer_paths.append(f'{fake_layerid}/layer.tar')
+        parentid = fake_layerid
+
+    config_digest = image.manifest['config']['digest']
+    config_filename = f'{config_digest[7:]}.json'
+    config_path = os.path.join(imgdir, config_filename)
+    if not os.path.exists(config_path):
+        _link_or_copy(str(store_dir / config_digest[7:]), config_path)
+
+    name = _image_repo_name(image.info)
+    entry = {'Config': config_filename, 'RepoTags': [f'{name}:{tag or image.info.tag}'], 'Layers': layer_paths}
+    return entry, name, parentid
+
+
+def _archive_tags(images: List[BatchImage]) -> List[str]:
+    """多个镜像写入同一个 docker-archive 时各自的标签：一个标签只能对应一个平台，同一镜像的多个平台以 标签-架构 区分"""
+    platform_count: Dict[Tuple[str, str], int] = {}
+    for image in images:
+        key = (_image_repo_name(image.info), image.info.tag)
+        platform_count[key] = platform_count.get(key, 0) + 1
+    return [
+        f'{image.info.tag}-{platform_label(image.arch)}'
+        if platform_count[(_image_repo_name(image.info), image.info.tag)] > 1 else image.info.tag
+        for image in images
+    ]
+
+
+def _write_archive_metadata(imgdir: str, entries: List[Dict], repositories: Dict[str, Dict[str, str]]):
+    """写入 docker-archive 的 manifest.json 和 repositories"""
+    with open(os.path.join(imgdir, 'manifest.json'), 'w') as file:
+        json.dump(entries, file)
+    with open(os.path.join(imgdir, 'repositories'), 'w') as file:
+        json.dump(repositories, file)
+
+
+WHITEOUT_PREFIX = '.wh.'
+WHITEOUT_OPAQUE = '.wh..wh..opq'
+
+
+def _layer_path(name: str) -> str:
+    """层 tar 成员名规范化为不带 ./、/ 前后缀的路径"""
+    while name.startswith('./'):
+        name = name[2:]
+    return name.strip('/')
+
+
+def _path_hidden(path: str, layer: int, hide_below: Dict[str, int]) -> bool:
+    """path 的某个上级目录是否被更上层删除、设为不透明或替换为非目录（只比较 layer 之上的层）"""
+    parent = path
+    while '/' in parent:
+        parent = parent.rpartition('/')[0]
+        if hide_below.get(parent, -1) > layer:
+            return True
+    return False
+
+
+class _HashingWriter:
+    """写入时同时计算 sha256 的文件包装，导出合并层时不必再读一遍算 diff_id"""
+
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        return self.file.write(data)
+
+
+def _squashed_member(member: tarfile.TarInfo, path: str, **changes) -> tarfile.TarInfo:
+    """复制层 tar 成员用于写入合并层：名称规范化，去掉会覆盖名称和大小的 pax 头"""
+    member = copy.copy(member)
+    member.name = path
+    member.pax_headers = {k: v for k, v in member.pax_headers.items() if k not in ('path', 'linkpath', 'size')}
+    for key, value in changes.items():
+        setattr(member, key, value)
+    return member
+
+
+def squash_layers(layer_paths: List[str], output_path: str, ctx: Optional[PullContext] = None) -> str:
+    """把按从下到上顺序排列的层 tar 合并为一个层 tar，返回新层的 diff_id。
+
+    第一遍从上往下只读 tar 头，建立 路径 → 最终提供该路径的层 的索引，
+    按 OCI 规则处理 .wh. 删除标记和 .wh..wh..opq 不透明目录，内存只与路径数量有关；
+    第二遍从下往上流式复制索引中保留的条目，目标已被覆盖或删除的硬链接改写为普通文件。
+    """
+    cancel = ctx or current_pull_context() or stop_event
+    # owner：提供该路径最终内容的层；shadow / hide_below：路径本身 / 其下的内容对哪一层以下不可见
+    owner: Dict[str, int] = {}
+    shadow: Dict[str, int] = {}
+    hide_below: Dict[str, int] = {}
+    for index in range(len(layer_paths) - 1, -1, -1):
+        if cancel.is_set():
+            raise KeyboardInterrupt("用户已取消操作")
+        with tarfile.open(layer_paths[index], 'r:') as tar:
+            for member in tar:
+                path = _layer_path(member.name)
+                if not path or _path_hidden(path, index, hide_below):
+                    continue
+                parent, _, base = path.rpartition('/')
+                if base == WHITEOUT_OPAQUE:
+                    hide_below.setdefault(parent, index)
+                elif base.startswith(WHITEOUT_PREFIX):
+                    target = f'{parent}/{base[len(WHITEOUT_PREFIX):]}'.lstrip('/')
+                    shadow.setdefault(target, index)
+                    hide_below.setdefault(target, index)
+                elif shadow.get(path, index) <= index:
+                    # 同一层内重复的条目都保留，解包时以后出现的为准
+                    owner[path] = shadow[path] = index
+                    if not member.isdir():
+                        hide_below.setdefault(path, index)
+
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        writer = _HashingWriter(file)
+        with tarfile.open(fileobj=writer, mode='w|', format=tarfile.PAX_FORMAT) as out:
+            for index, layer_path in enumerate(layer_paths):
+                if cancel.is_set():
+                    raise KeyboardInterrupt("用户已取消操作")
+                with tarfile.open(layer_path, 'r:') as tar:
+                    for member in tar:
+                        path = _layer_path(member.name)
+                        if not path or owner.get(path) != index:
+                            continue
+                        if member.islnk():
+                            target = _layer_path(member.linkname)
+                            if owner.get(target) == index:
+                                out.addfile(_squashed_member(member, path, linkname=target))
+                            else:
+                                # 硬链接目标被上层覆盖或删除，按链接当时指向的内容写成普通文件
+                                data = tar.extractfile(member)
+                                size = data.seek(0, io.SEEK_END)
+                                data.seek(0)
+                                out.addfile(_squashed_member(member, path, type=tarfile.REGTYPE, linkname='', size=size), data)
+                        elif member.isreg():
+                            out.addfile(_squashed_member(member, path, type=tarfile.REGTYPE), tar.extractfile(member))
+                        else:
+                            out.addfile(_squashed_member(member, path))
+        diff_id = 'sha256:' + writer.sha256.hexdigest()
+    os.replace(tmp_path, output_path)
+    return diff_id
+
+
+def squash_image_dir(imgdir: str, ctx: Optional[PullContext] = None) -> int:
+    """把 docker-archive 目录中的每个镜像合并为单层镜像，返回去除的字节数。
+
+    配置中的 rootfs.diff_ids 改为合并层的 diff_id，history 保留不产生层的记录并追加一条合并记录，
+    manifest.json 和 repositories 随之更新，不再被引用的原层目录和配置文件被删除。
+    """
+    with open(os.path.join(imgdir, 'manifest.json')) as file:
+        entries = json.load(file)
+
+    eliminated = 0
+    repositories: Dict[str, Dict[str, str]] = {}
+    for entry in entries:
+        started_at = time.time()
+        layer_paths = [os.path.join(imgdir, layer) for layer in entry['Layers']]
+        input_size = sum(os.path.getsize(path) for path in layer_paths)
+
+        squashed_path = os.path.join(imgdir, 'squashed.tar')
+        diff_id = squash_layers(layer_paths, squashed_path, ctx)
+        layerid = hashlib.sha256(('\n' + diff_id + '\n').encode('utf-8')).hexdigest()
+        layerdir = os.path.join(imgdir, layerid)
+        os.makedirs(layerdir, exist_ok=True)
+        os.replace(squashed_path, os.path.join(layerdir, 'layer.tar'))
+        with open(os.path.join(layerdir, 'json'), 'w') as file:
+            json.dump({"id": layerid, "parent": None}, file)
+        output_size = os.path.getsize(os.path.join(layerdir, 'layer.tar'))
+
+        with open(os.path.join(imgdir, entry['Config'])) as file:
+            config = json.load(file)
+        config['rootfs'] = {'type': 'layers', 'diff_ids': [diff_id]}
+        config['history'] = [h for h in config.get('history', []) if h.get('empty_layer')] + [{
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'created_by': f'docker_image_puller --squash ({len(layer_paths)} layers)',
+            'comment': 'squashed',
+        }]
+        config_bytes = json.dumps(config).encode('utf-8')
+        config_filename = f'{hashlib.sha256(config_bytes).hexdigest()}.json'
+        with open(os.path.join(imgdir, config_filename), 'wb') as file:
+            file.write(config_bytes)
+
+        entry['Config'] = config_filename
+        entry['Layers'] = [f'{layerid}/layer.tar']
+        for repo_tag in entry.get('RepoTags') or []:
+            name, _, tag = repo_tag.rpartition(':')
+            repositories.setdefault(name, {})[tag] = layerid
+
+        eliminated += max(0, input_size - output_size)
+        logger.info(f'🗜️ {", ".join(entry.get("RepoTags") or [])}: 合并 {len(layer_paths)} 层 → 1 层，'
+                    f'{LayerProgress.format_size(input_size)} → {LayerProgress.format_size(output_size)}，'
+                    f'去除被覆盖或删除的数据 {LayerProgress.format_size(max(0, input_size - output_size))}，'
+                    f'耗时 {time.time() - started_at:.1f}秒')
+
+    referenced = {entry['Config'] for entry in entries} | {entry['Layers'][0].split('/')[0] for entry in entries}
+    for name in os.listdir(imgdir):
+        if name not in referenced and name not in ('manifest.json', 'repositories'):
+            path = os.path.join(imgdir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+    _write_archive_metadata(imgdir, entries, repositories)
+    return eliminated
+
+
+IMAGE_INDEX_SCHEMA = """
+CREATE TABLE images (id INTEGER PRIMARY KEY, tags TEXT, os TEXT, architecture TEXT, config TEXT);
+CREATE TABLE layers (image INTEGER, position INTEGER, diff_id TEXT, path TEXT, size INTEGER);
+CREATE TABLE files (layer TEXT, path TEXT, size INTEGER, mode INTEGER, type TEXT, offset INTEGER, linkname TEXT);
+"""
+
+
+def is_archive_path(path: str) -> bool:
+    """是否为 docker-archive tar 的文件名（含 gzip / zstd 压缩的扩展名）"""
+    return path.endswith('.tar') or any(path.endswith(suffixes) for suffixes in ARCHIVE_SUFFIXES.values())
+
+
+def index_path_for(tar_path: str) -> str:
+    """镜像 tar 对应的文件索引路径：与 tar 同目录、同名，扩展名为 .index.db"""
+    for suffix in sum(ARCHIVE_SUFFIXES.values(), ('.tar',)):
+        if tar_path.endswith(suffix):
+            return tar_path[:-len(suffix)] + '.index.db'
+    return os.path.splitext(tar_path)[0] + '.index.db'
+
+
+def scan_layer_tar(path: str) -> List[Tuple]:
+    """只读 tar 头列出未压缩层中的文件（数据部分直接跳过），行格式与 gunzip_file 的 index 相同"""
+    with tarfile.open(path, 'r:') as tar:
+        return [
+            (_layer_path(member.name), member.size, member.mode, member.type.decode('ascii', 'replace'),
+             member.offset_data, member.linkname or None)
+            for member in tar
+        ]
+
+
+def write_image_index(db_path: str, imgdir: str, layer_rows: Optional[Dict[str, List[Tuple]]] = None):
+    """为 docker-archive 目录中的镜像写入 SQLite 文件索引。
+
+    images / layers / files 三张表：layers 记录每个镜像各层的位置、diff_id 和在 tar 中的路径，
+    files 以 diff_id 关联层，记录路径、大小、权限、类型和数据在 layer.tar 中的偏移，多个镜像共享的层只记录一次。
+    layer_rows 是解压时顺带得到的文件列表（以 diff_id 为键），缺少的层（例如合并后的层）只读 tar 头补齐。
+    """
+    layer_rows = layer_rows or {}
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    with open(os.path.join(imgdir, 'manifest.json')) as file:
+        entries = json.load(file)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(IMAGE_INDEX_SCHEMA)
+        indexed = set()
+        for entry in entries:
+            with open(os.path.join(imgdir, entry['Config'])) as file:
+                config = json.load(file)
+            diff_ids = config.get('rootfs', {}).get('diff_ids', [])
+            image_id = conn.execute(
+                'INSERT INTO images (tags, os, architecture, config) VALUES (?, ?, ?, ?)',
+                (' '.join(entry.get('RepoTags') or []), config.get('os'), config.get('architecture'), entry['Config'])
+            ).lastrowid
+            for position, layer in enumerate(entry['Layers']):
+                layer_path = os.path.join(imgdir, layer)
+                diff_id = diff_ids[position] if position < len(diff_ids) else file_digest(layer_path)
+                conn.execute('INSERT INTO layers VALUES (?, ?, ?, ?, ?)',
+                             (image_id, position, diff_id, layer, os.path.getsize(layer_path)))
+                if diff_id in indexed:
+                    continue
+                indexed.add(diff_id)
+                rows = layer_rows.get(diff_id)
+                if rows is None:
+                    rows = scan_layer_tar(layer_path)
+                conn.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', ((diff_id,) + row for row in rows))
+        # 数据插入完再建索引，比逐行维护索引快
+        conn.execute('CREATE INDEX files_path ON files (path)')
+        conn.execute('CREATE INDEX files_layer_size ON files (layer, size)')
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    logger.info(f'🗂️ 文件索引已保存为: {db_path}')
+
+
+OCI_IMAGE_INDEX = 'application/vnd.oci.image.index.v1+json'
+OCI_IMAGE_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+DOCKER_MANIFEST_LIST = 'application/vnd.docker.distribution.manifest.list.v2+json'
+DOCKER_MANIFEST = 'application/vnd.docker.distribution.manifest.v2+json'
+
+
+def write_oci_layout(oci_dir: str, images: List[BatchImage], store_dir: Path, exclude: Optional[set] = None):
+    """把镜像写成 OCI 镜像布局（oci-layout、index.json、blobs/sha256），blob 硬链接自 blob 仓库。
+
+    同一镜像的多个平台写入一个嵌套的镜像索引，index.json 中每个镜像一个条目；
+    平台清单都是 Docker 格式时嵌套索引写成 Docker manifest list，否则写成 OCI 索引。
+    清单原样写入 blob 仓库中缓存的仓库原始内容，digest 与仓库一致；缓存缺失时才按解析结果重新序列化。
+    exclude 中的 blob 不写入（差量包中目标环境已有的层），清单仍完整引用它们。
+    """
+    blob_dir = Path(oci_dir) / 'blobs' / 'sha256'
+    blob_dir.mkdir(parents=True, exist_ok=True)
+
+    def _put(data: bytes, media_type: str) -> Dict:
+        digest = 'sha256:' + hashlib.sha256(data).hexdigest()
+        path = blob_dir / digest[7:]
+        if not path.exists():
+            path.write_bytes(data)
+        return {'mediaType': media_type, 'digest': digest, 'size': len(data)}
+
+    groups: Dict[str, List[BatchImage]] = {}
+    for image in images:
+        groups.setdefault(image.ref, []).append(image)
+
+    index_entries = []
+    for platforms in groups.values():
+        descriptors = []
+        for image in platforms:
+            for blob in image.blobs:
+                path = blob_dir / blob['digest'][7:]
+                if exclude and blob['digest'] in exclude:
+                    continue
+                if not path.exists():
+                    _link_or_copy(str(store_dir / blob['digest'][7:]), str(path))
+            with open(store_dir / image.manifest['config']['digest'][7:], 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            # 平台以解析时选中的索引条目为准，未注明变体时再用配置补全
+            architecture, variant = parse_platform(image.arch)
+            platform = {'architecture': architecture, 'os': config.get('os', 'linux')}
+            if variant or config.get('variant'):
+                platform['variant'] = variant or config['variant']
+            data = read_cached_blob(store_dir, image.digest) if image.digest else None
+            if data is None:
+                data = json.dumps(image.manifest).encode('utf-8')
+            descriptor = _put(data, image.manifest.get('mediaType', OCI_IMAGE_MANIFEST))
+            descriptor['platform'] = platform
+            descriptors.append(descriptor)
+
+        if len(descriptors) == 1:
+            entry = descriptors[0]
+        else:
+            index_type = DOCKER_MANIFEST_LIST if all(d['mediaType'] == DOCKER_MANIFEST for d in descriptors) \
+                else OCI_IMAGE_INDEX
+            entry = _put(json.dumps({'schemaVersion': 2, 'mediaType': index_type, 'manifests': descriptors}).encode('utf-8'),
+                         index_type)
+        info = platforms[0].info
+        entry['annotations'] = {
+            'io.containerd.image.name': f'{_image_repo_name(info)}:{info.tag}',
+            'org.opencontainers.image.ref.name': info.tag,
+        }
+        index_entries.append(entry)
+
+    with open(os.path.join(oci_dir, 'oci-layout'), 'w') as file:
+        json.dump({'imageLayoutVersion': '1.0.0'}, file)
+    with open(os.path.join(oci_dir, 'index.json'), 'w') as file:
+        json.dump({'schemaVersion': 2, 'mediaType': OCI_IMAGE_INDEX, 'manifests': index_entries}, file)
+
+
+BUNDLE_FILE = 'bundle.json'
+
+
+@dataclass
+class DeltaBaseline:
+    """差量包的基线：目标环境已有的压缩 blob digest 和未压缩层的 diff_id"""
+    blobs: set = field(default_factory=set)
+    diff_ids: set = field(default_factory=set)
+
+    def has_layer(self, digest: str, diff_id: Optional[str] = None) -> bool:
+        """目标环境是否已有该层（按压缩后的 digest 或 diff_id 判断）"""
+        return digest in self.blobs or (diff_id is not None and diff_id in self.diff_ids)
+
+    @classmethod
+    def load(cls, path: str) -> 'DeltaBaseline':
+        """读取基线，支持以下格式：
+
+        - 以前生成的差量包（tar）或其中的 bundle.json：包含的和省略的内容都视为目标已有
+        - docker-archive tar（docker save 的输出）或 OCI 镜像布局目录
+        - docker image inspect 的 JSON 输出（RootFS.Layers 中的 diff_id）
+        - 每行一个 sha256:... 的文本，blob digest 或 diff_id 均可
+        """
+        baseline = cls()
+        data: Any = None
+        if os.path.isdir(path):
+            baseline.blobs.update(f'sha256:{name}' for name in os.listdir(Path(path) / 'blobs' / 'sha256'))
+        elif tarfile.is_tarfile(path):
+            with tarfile.open(path) as tar:
+                names = {name.lstrip('/') for name in tar.getnames()}
+                if BUNDLE_FILE in names:
+                    data = json.load(tar.extractfile(BUNDLE_FILE))
+                else:
+                    member = _tar_member(tar, 'manifest.json')
+                    data = [
+                        {'RootFS': {'Layers': json.load(tar.extractfile(_tar_member(tar, entry['Config'])))
+                                    .get('rootfs', {}).get('diff_ids', [])}}
+                        for entry in json.load(tar.extractfile(member))
+                    ]
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            try:
+                data = json.loads(text)
+            except json.JSONDecodeError:
+                digests = re.findall(r'sha256:[0-9a-f]{64}', text)
+                baseline.blobs.update(digests)
+                baseline.diff_ids.update(digests)
+
+        if isinstance(data, dict):
+            baseline.blobs.update(data.get('blobs', {}))
+            baseline.blobs.update(data.get('omitted', {}))
+            baseline.diff_ids.update(data.get('diffIDs', {}).values())
+        elif isinstance(data, list):
+            for item in data:
+                baseline.diff_ids.update(item.get('RootFS', {}).get('Layers') or [])
+        logger.info(f'📋 基线：{len(baseline.blobs)} 个 blob digest，{len(baseline.diff_ids)} 个层 diff_id')
+        return baseline
+
+
+def _tar_member(tar: tarfile.TarFile, name: str) -> tarfile.TarInfo:
+    """按名称查找 tar 成员，兼容以 / 开头的成员名"""
+    for member in tar.getmembers():
+        if member.name.lstrip('/') == name:
+            return member
+    raise KeyError(name)
+
+
+def write_delta_bundle(path: str, images: List[BatchImage], store_dir: Path, omitted: Dict[str, Dict[str, Any]]):
+    """写出差量包：一个 OCI 镜像布局的 tar，清单和配置完整，omitted 中目标已有的层不打包。
+
+    bundle.json 记录包内的 blob、省略的层及其 diff_id，apply 据此在目标环境补齐并校验。
+    """
+    staging = Path(f'{path}.staging')
+    shutil.rmtree(staging, ignore_errors=True)
+    write_oci_layout(str(staging), images, store_dir, exclude=set(omitted))
+
+    diff_ids: Dict[str, str] = {}
+    for image in images:
+        with open(store_dir / image.manifest['config']['digest'][7:], 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        diff_ids.update(zip((layer['digest'] for layer in image.manifest['layers']), config['rootfs']['diff_ids']))
+    blob_dir = staging / 'blobs' / 'sha256'
+    metadata = {
+        'bundleVersion': 1,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'images': sorted({f'{_image_repo_name(image.info)}:{image.info.tag}' for image in images}),
+        'blobs': {f'sha256:{name}': (blob_dir / name).stat().st_size for name in sorted(os.listdir(blob_dir))},
+        'omitted': omitted,
+        'diffIDs': diff_ids,
+    }
+    with open(staging / BUNDLE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2)
+
+    # bundle.json 放在最前面，作为基线读取时不需要扫描整个 tar
+    with tarfile.open(f'{path}.tmp', 'w') as tar:
+        for name in (BUNDLE_FILE, 'oci-layout', 'index.json', 'blobs'):
+            tar.add(str(staging / name), arcname=name)
+    os.replace(f'{path}.tmp', path)
+    shutil.rmtree(staging, ignore_errors=True)
+    logger.info(
+        f'📦 差量包包含 {len(metadata["blobs"])} 个 blob '
+        f'({LayerProgress.format_size(sum(metadata["blobs"].values()))})，省略目标已有的 {len(omitted)} 个层 '
+        f'({LayerProgress.format_size(sum(o.get("size", 0) for o in omitted.values()))})'
+    )
+
+
+UNCOMPRESSED_RATIO_ESTIMATE = 2.5   # 没有本地 blob 时按经验值估算 gzip 层解压后的大小
+
+
+@dataclass
+class PullPlan:
+    """一次拉取的计划：各层大小和缓存情况、需要下载的字节数、估计耗时和磁盘需求（--dry-run / inspect 的输出）"""
+    images: List[Dict[str, Any]]
+    compressed_bytes: int
+    cached_bytes: int
+    download_bytes: int
+    uncompressed_bytes: int
+    throughput: Optional[float]
+    disk: List[Dict[str, Any]]
+
+    @property
+    def estimated_seconds(self) -> Optional[float]:
+        return self.download_bytes / self.throughput if self.throughput else None
+
+    @property
+    def disk_ok(self) -> bool:
+        return all(item['ok'] for item in self.disk)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'images': self.images,
+            'compressed_bytes': self.compressed_bytes,
+            'cached_bytes': self.cached_bytes,
+            'download_bytes': self.download_bytes,
+            'uncompressed_bytes': self.uncompressed_bytes,
+            'throughput': self.throughput,
+            'estimated_seconds': self.estimated_seconds,
+            'disk': self.disk,
+            'disk_ok': self.disk_ok,
+        }
+
+
+def _existing_parent(path: str) -> str:
+    """path 本身或最近的已存在的上级目录，用于在创建目录之前查询所在文件系统"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+def check_disk_space(needs: List[Tuple[str, str, int]]) -> List[Dict[str, Any]]:
+    """按文件系统检查剩余空间：needs 为 (用途, 路径, 需要的字节数)，位于同一文件系统的需求合并计算"""
+    items = []
+    device_need: Dict[int, int] = {}
+    for label, path, need in needs:
+        anchor = _existing_parent(path)
+        device = os.stat(anchor).st_dev
+        device_need[device] = device_need.get(device, 0) + need
+        items.append((device, {'label': label, 'path': os.path.abspath(path), 'need': need,
+                               'free': shutil.disk_usage(anchor).free}))
+    for device, item in items:
+        item['ok'] = device_need[device] <= item['free']
+    return [item for _, item in items]
+
+
+def build_pull_plan(
+    images: List[BatchImage],
+    cached_blob: Callable[[Dict], Optional[str]],
+    scratch_dir: str,
+    output_path: str,
+    output_kind: str = 'tar',
+    squash: bool = False,
+    configs: Optional[Dict[str, Dict]] = None,
+    compressed_output: bool = False
+) -> PullPlan:
+    """根据清单计算拉取计划，不下载任何层。
+
+    cached_blob 返回 blob 描述对应的本地已下载文件（没有时返回 None）；已缓存的层从 gzip 尾部读出解压后的大小，
+    其余按 UNCOMPRESSED_RATIO_ESTIMATE 估算。output_kind 为 tar（每个镜像一个 tar）、archive、oci 或 bundle，
+    决定输出位置需要的空间（compressed_output 时 tar 按压缩后的层大小估算，output_path 为 - 时不占输出空间）；
+    传入 configs（config digest → 配置）时列出每层的构建命令。
+    """
+    blobs: Dict[str, Dict[str, Any]] = {}
+    plan_images = []
+    for image in images:
+        config = (configs or {}).get(image.manifest['config']['digest'], {})
+        history = [h for h in config.get('history', []) if not h.get('empty_layer')]
+        layers = []
+        for position, layer in enumerate(image.manifest['layers']):
+            digest = layer['digest']
+            if digest not in blobs:
+                path = cached_blob(layer)
+                size = layer.get('size', 0)
+                uncompressed = gzip_uncompressed_size(path) if path else None
+                blobs[digest] = {
+                    'size': size,
+                    'cached': path is not None,
+                    'uncompressed': uncompressed if uncompressed is not None else int(size * UNCOMPRESSED_RATIO_ESTIMATE),
+                    'exact': uncompressed is not None,
+                }
+            layers.append({'digest': digest, **blobs[digest],
+                           'created_by': history[position].get('created_by') if position < len(history) else None})
+        config_desc = image.manifest['config']
+        if config_desc['digest'] not in blobs:
+            blobs[config_desc['digest']] = {'size': config_desc.get('size', 0), 'cached': cached_blob(config_desc) is not None,
+                                            'uncompressed': 0, 'exact': True}
+        plan_images.append({'ref': image.ref, 'arch': image.arch, 'layers': layers,
+                            'compressed_bytes': sum(layer['size'] for layer in layers),
+                            'uncompressed_bytes': sum(layer['uncompressed'] for layer in layers)})
+
+    compressed = sum(blob['size'] for blob in blobs.values())
+    cached = sum(blob['size'] for blob in blobs.values() if blob['cached'])
+    pending = [blob['size'] for blob in blobs.values() if not blob['cached']]
+    uncompressed = sum(blob['uncompressed'] for blob in blobs.values())
+
+    # 临时位置：下载的 blob、分片合并时最大的层再占一份，docker-archive 输出还需要解压后的层
+    scratch_need = sum(pending) + max(pending, default=0)
+    if output_kind in ('tar', 'archive'):
+        scratch_need += uncompressed
+    if squash:
+        scratch_need += max((image['uncompressed_bytes'] for image in plan_images), default=0)
+    if output_kind == 'tar':
+        output_need = sum(image['compressed_bytes' if compressed_output else 'uncompressed_bytes'] for image in plan_images)
+    elif output_kind == 'archive':
+        output_need = compressed if compressed_output else uncompressed
+    elif output_kind == 'bundle':
+        output_need = compressed
+    else:
+        # OCI 布局从 blob 仓库硬链接，只有不在同一文件系统时才需要复制
+        same_fs = os.stat(_existing_parent(scratch_dir)).st_dev == os.stat(_existing_parent(output_path)).st_dev
+        output_need = 0 if same_fs else compressed
+
+    registries = {image.info.registry for image in images}
+    throughputs = [t for t in (estimate_throughput(registry) for registry in registries) if t]
+    return PullPlan(
+        images=plan_images,
+        compressed_bytes=compressed,
+        cached_bytes=cached,
+        download_bytes=sum(pending),
+        uncompressed_bytes=uncompressed,
+        throughput=min(throughputs) if len(throughputs) == len(registries) and throughputs else None,
+        disk=check_disk_space([('临时目录', scratch_dir, scratch_need)] +
+                              ([('输出位置', output_path, output_need)] if output_path != '-' else [])),
+    )
+
+
+def log_pull_plan(plan: PullPlan, verbose: bool = True):
+    """输出拉取计划：verbose 时列出每一层，否则只输出汇总和磁盘检查结果"""
+    fmt = LayerProgress.format_size
+    if verbose:
+        for image in plan.images:
+            logger.info(f'📋 {image["ref"]} ({image["arch"]}): {len(image["layers"])} 层，'
+                        f'压缩后 {fmt(image["compressed_bytes"])}，解压后约 {fmt(image["uncompressed_bytes"])}')
+            for position, layer in enumerate(image['layers']):
+                created_by = (layer['created_by'] or '').replace('\n', ' ')
+                logger.info(f'   #{position:<3} {layer["digest"][:19]}  {fmt(layer["size"]):>9}  '
+                            f'{"已缓存" if layer["cached"] else "需下载"}  '
+                            f'解压后{"" if layer["exact"] else "约"} {fmt(layer["uncompressed"])}'
+                            f'{"  " + created_by[:80] if created_by else ""}')
+    eta = plan.estimated_seconds
+    logger.info(f'📊 共 {fmt(plan.compressed_bytes)}（去重后），已缓存 {fmt(plan.cached_bytes)}，'
+                f'需下载 {fmt(plan.download_bytes)}，解压后约 {fmt(plan.uncompressed_bytes)}')
+    if eta is not None:
+        logger.info(f'⏱️  按历史吞吐量 {fmt(int(plan.throughput))}/s 估计下载耗时 {DownloadStats().format_time(eta)}')
+    elif plan.download_bytes:
+        logger.info('⏱️  没有该仓库的吞吐量历史，无法估计下载耗时')
+    for item in plan.disk:
+        logger.info(f'💾 {item["label"]} {item["path"]}: 需要约 {fmt(item["need"])}，可用 {fmt(item["free"])} '
+                    f'{"✅" if item["ok"] else "❌"}')
+
+
+def preflight_pull(plan: PullPlan, dry_run: bool) -> bool:
+    """根据拉取计划判断是否继续：预演模式输出完整计划后停止，磁盘空间不足时报错停止"""
+    if dry_run:
+        log_pull_plan(plan)
+        logger.info('🔍 预演模式（--dry-run），未下载任何层')
+        return False
+    if not plan.disk_ok:
+        log_pull_plan(plan, verbose=False)
+        logger.error('❌ 磁盘空间不足，已在下载前中止（可用 --skip-space-check 跳过检查）')
+        return False
+    return True
+
+
+def plan_single_pull(
+    session: requests.Session,
+    image_info: ImageInfo,
+    ref: str,
+    manifest: Dict,
+    arch: str,
+    auth_head: Dict[str, str],
+    output_dir: Path,
+    squash: bool = False,
+    fetch_config: bool = False,
+    compressed_output: bool = False
+) -> PullPlan:
+    """单镜像拉取的计划：缓存按输出目录中的下载进度判断（只读，不创建目录）；fetch_config 时获取配置以列出构建命令"""
+    image = BatchImage(ref, image_info, auth_head, manifest, arch)
+    progress = DownloadProgressManager(output_dir, image_info.repository, image_info.tag, arch, read_only=True) \
+        if output_dir.exists() else None
+
+    def _cached(blob: Dict) -> Optional[str]:
+        if not progress or not progress.is_layer_completed(blob['digest']):
+            return None
+        path = progress.get_layer_status(blob['digest']).get('path') or \
+            str(output_dir / 'layers' / f'{blob["digest"][7:]}.json')
+        return path if os.path.exists(path) else None
+
+    configs = {}
+    if fetch_config:
+        config_digest = manifest['config']['digest']
+        url = f'{image_info.protocol}://{image_info.registry}/v2/{image_info.repository}/blobs/{config_digest}'
+        try:
+            configs[config_digest] = json.loads(fetch_blob_bytes(session, url, auth_head, config_digest))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f'⚠️ 获取镜像配置失败: {e}')
+    return build_pull_plan([image], _cached, str(output_dir / 'layers'), str(output_dir), 'tar', squash, configs,
+                           compressed_output)
+
+
+def pull_images_batch(
+    images: List[str],
+    registry: Optional[str] = None,
+    arch: str = "amd64",
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    output_path: Optional[str] = None,
+    archive: Optional[str] = None,
+    oci_dir: Optional[str] = None,
+    workers: int = 4,
+    engine: str = 'thread',
+    max_streams: int = 64,
+    resolve_workers: int = 8,
+    deadline: Optional[float] = None,
+    log_callback: Optional[Callable] = None,
+    ctx: Optional[PullContext] = None,
+    on_exported: Optional[Callable[[BatchImage, str], None]] = None,
+    bundle: Optional[str] = None,
+    baseline: Optional['DeltaBaseline'] = None,
+    squash: bool = False,
+    index: bool = False,
+    dry_run: bool = False,
+    space_check: bool = True,
+    on_plan: Optional[Callable[[PullPlan], None]] = None,
+    compression: Optional[CompressionOptions] = None
+) -> bool:
+    """批量拉取一组镜像：并发解析清单，按 digest 去重后每个 blob 只下载一次，再逐个导出。
+
+    arch 可以是逗号分隔的多个架构或 all，每个镜像的索引只获取一次，各平台清单并发获取，
+    所有镜像所有平台的 blob 在同一个调度下去重下载。
+    blob 下载到输出目录下的 blobs 目录（按 digest 记录进度，中断后重新运行可续传），
+    下载并发受 workers（thread 引擎同时下载的 blob 数）或 max_streams（async 引擎）统一约束。
+    默认每个镜像（每个平台）导出为单独的 tar；指定 archive 时全部导出到同一个多镜像 docker-archive，
+    指定 oci_dir 时写成一个多平台 OCI 镜像布局。全部镜像导出成功时返回 True。
+    指定 bundle 时写成用于离线传输的差量包，baseline 中目标环境已有的层既不下载也不打包。
+    squash 为 True 时 docker-archive 中的每个镜像合并为单层，index 为 True 时在每个 tar 旁边写入文件索引。
+    compression 指定导出 tar 的压缩方式，archive 以 .tar.gz / .tar.zst 等结尾时按扩展名压缩，为 - 时写到标准输出。
+    下载前按清单检查磁盘空间（space_check），不足时中止；dry_run 时只获取清单和配置并输出拉取计划，
+    计划（PullPlan）同时传给 on_plan。
+    on_exported 在每个镜像（平台）导出后以 (镜像, 输出路径) 调用。
+    """
+    ctx = ctx or PullContext(log_callback=log_callback, deadline=deadline)
+    ctx_token = _current_pull.set(ctx)
+    base_dir = Path(output_path) if output_path else Path.cwd()
+    store_dir = base_dir / 'blobs'
+    progress_manager = None
+
+    try:
+        ctx.claim_scratch_dir(str(store_dir))
+        created_dirs = [path for path in (base_dir, store_dir) if not path.exists()]
+        if not dry_run:
+            store_dir.mkdir(parents=True, exist_ok=True)
+        session = ctx.session = ctx.session or SessionManager.get_session()
+
+        # 1. 并发解析所有镜像的清单
+        logger.info(f'📋 解析 {len(images)} 个镜像的清单...')
+
+        archs = parse_arch_list(arch)
+
+        def _resolve(ref: str) -> Tuple[List[BatchImage], int]:
+            """返回解析出的各平台镜像和失败的数量"""
+            expected = 1 if archs == ['all'] else len(archs)
+            try:
+                info = parse_image_input(ref, registry)
+                if info.digest:
+                    platforms = resolve_pinned_manifests(session, info, archs, store_dir, username, password)
+                elif archs != ['all'] and len(archs) == 1:
+                    resolved = resolve_image_manifest(session, info, archs[0], username, password, store_dir)
+                    platforms = resolved and (resolved[0], [(resolved[2], resolved[1], resolved[3])])
+                else:
+                    platforms = resolve_platform_manifests(session, info, archs, username, password, store_dir)
+            except Exception as e:
+                logger.error(f'❌ {ref} 解析失败: {e}')
+                return [], expected
+            if not platforms or not platforms[1]:
+                logger.error(f'❌ {ref} 解析失败，跳过')
+                return [], expected
+            auth_head, manifests = platforms
+            found = [BatchImage(ref, info, auth_head, manifest, image_arch, digest)
+                     for image_arch, manifest, digest in manifests]
+            return found, max(0, expected - len(found))
+
+        # 拉取配额已不足的仓库上的镜像排到后面，先解析其他仓库的镜像，解析线程不会都卡在匀速等待上
+        hosts = {}
+        for ref in images:
+            try:
+                hosts[ref] = parse_image_input(ref, registry).registry
+            except ValueError:
+                hosts[ref] = ''
+        pending = list(enumerate(images))
+        pending_lock = threading.Lock()
+        results: List[Tuple[List[BatchImage], int]] = [([], 0)] * len(images)
+
+        def _resolve_next():
+            while not ctx.is_set():
+                with pending_lock:
+                    if not pending:
+                        return
+                    pick = next((i for i, (_, ref) in enumerate(pending) if not rate_limiter.is_low(hosts[ref])), 0)
+                    position, ref = pending.pop(pick)
+                results[position] = _resolve(ref)
+
+        worker_count = max(1, min(resolve_workers, len(images)))
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            for future in [executor.submit(ctx.run, _resolve_next) for _ in range(worker_count)]:
+                future.result()
+        if ctx.is_set():
+            raise KeyboardInterrupt("用户已取消操作")
+        resolved_images = [image for found, _ in results for image in found]
+        failed_count = sum(missing for _, missing in results)
+        if not resolved_images:
+            logger.error('❌ 没有可拉取的镜像')
+            return False
+
+        # 2. 计算所有镜像 blob 的并集，每个 digest 只从第一个引用它的仓库下载
+        blobs: Dict[str, Tuple[str, int, BatchImage]] = {}
+        naive_size = 0
+        ref_count = 0
+        for image in resolved_images:
+            for blob in image.blobs:
+                ref_count += 1
+                naive_size += blob.get('size', 0)
+                digest = blob['digest']
+                if digest not in blobs:
+                    url = f'{image.info.protocol}://{image.info.registry}/v2/{image.info.repository}/blobs/{digest}'
+                    blobs[digest] = (url, blob.get('size', 0), image)
+        unique_size = sum(size for _, size, _ in blobs.values())
+        saved = naive_size - unique_size
+        logger.info(
+            f'🧩 {len(resolved_images)} 个镜像（平台）共引用 {ref_count} 个 blob，去重后 {len(blobs)} 个 '
+            f'({LayerProgress.format_size(unique_size)})，逐个拉取需要 {LayerProgress.format_size(naive_size)}，'
+            f'节省 {LayerProgress.format_size(saved)} ({saved / naive_size * 100 if naive_size else 0:.1f}%)'
+        )
+
+        # 固定 digest 且清单全部来自缓存的镜像还没有认证，只为确实要请求 blob 的仓库认证一次
+        auth_heads: Dict[Tuple[str, str, str], Dict[str, str]] = {}
+
+        def _ensure_auth(image: BatchImage):
+            if image.auth_head is None:
+                key = (image.info.protocol, image.info.registry, image.info.repository)
+                if key not in auth_heads:
+                    auth_head, auth_success, error_msg = _handle_authentication(
+                        session, image.info.registry, image.info.repository, username, password, image.info.protocol
+                    )
+                    if not auth_success:
+                        logger.error(f'❌ {image.ref} 认证失败: {error_msg}')
+                    auth_heads[key] = auth_head
+                image.auth_head = auth_heads[key]
+
+        if dry_run or space_check:
+            def _cached(blob: Dict) -> Optional[str]:
+                path = store_dir / blob['digest'][7:]
+                return str(path) if path.is_file() and path.stat().st_size == blob.get('size', path.stat().st_size) else None
+
+            configs = {}
+            if dry_run:
+                for image in resolved_images:
+                    config_digest = image.manifest['config']['digest']
+                    if config_digest in configs:
+                        continue
+                    data = read_cached_blob(store_dir, config_digest)
+                    if data is None:
+                        _ensure_auth(image)
+                        try:
+                            data = fetch_blob_bytes(session, blobs[config_digest][0], image.auth_head, config_digest)
+                        except (requests.exceptions.RequestException, ValueError) as e:
+                            logger.warning(f'⚠️ {image.ref} 获取配置失败: {e}')
+                            continue
+                    configs[config_digest] = json.loads(data)
+            output_kind = 'bundle' if bundle else 'oci' if oci_dir else 'archive' if archive else 'tar'
+            plan = build_pull_plan(resolved_images, _cached, str(store_dir), bundle or oci_dir or archive or str(base_dir),
+                                   output_kind, squash, configs,
+                                   compressed_output=bool(CompressionOptions.for_path(archive or '', compression)))
+            if on_plan:
+                on_plan(plan)
+            if not preflight_pull(plan, dry_run):
+                # 空间不足时不留下本次新建的目录（其中只有清单缓存）
+                for path in reversed(created_dirs):
+                    shutil.rmtree(path, ignore_errors=True)
+                return dry_run and plan.disk_ok and failed_count == 0
+
+        progress_manager = DownloadProgressManager(store_dir, 'batch', '', arch)
+        omitted: Dict[str, Dict[str, Any]] = {}
+        if bundle and baseline:
+            # 差量包：先取各镜像的配置（体积很小）得到层的 diff_id，目标环境已有的层不下载
+            for image in resolved_images:
+                config_digest = image.manifest['config']['digest']
+                data = read_cached_blob(store_dir, config_digest)
+                if data is None:
+                    _ensure_auth(image)
+                    try:
+                        data = fetch_blob_bytes(session, blobs[config_digest][0], image.auth_head, config_digest)
+                    except (requests.exceptions.RequestException, ValueError) as e:
+                        # 取不到配置时无法判断哪些层可以省略，该镜像按完整内容打包
+                        logger.warning(f'⚠️ {image.ref} 获取配置失败，差量包中包含其全部层: {e}')
+                        continue
+                    (store_dir / config_digest[7:]).write_bytes(data)
+                    progress_manager.update_layer_status(config_digest, 'completed', path=str(store_dir / config_digest[7:]))
+                diff_ids = json.loads(data).get('rootfs', {}).get('diff_ids', [])
+                for layer, diff_id in zip(image.manifest['layers'], diff_ids):
+                    if baseline.has_layer(layer['digest'], diff_id):
+                        omitted[layer['digest']] = {'size': layer.get('size', 0), 'diffID': diff_id}
+            for digest in omitted:
+                blobs.pop(digest, None)
+            logger.info(
+                f'📦 目标环境已有 {len(omitted)} 个层 ({LayerProgress.format_size(sum(o["size"] for o in omitted.values()))})，'
+                f'差量包只包含其余 {len(blobs)} 个 blob ({LayerProgress.format_size(sum(b[1] for b in blobs.values()))})'
+            )
+
+        # 3. 在统一的并发预算下下载所有尚未完成的 blob
+        pending = [
+            digest for digest in blobs
+            if not (progress_manager.is_layer_completed(digest) and (store_dir / digest[7:]).exists())
+        ]
+        if len(pending) < len(blobs):
+            logger.info(f'📦 跳过 {len(blobs) - len(pending)} 个已下载的 blob，还需下载 {len(pending)} 个')
+        for idx, digest in enumerate(pending):
+            ctx.progress.add_layer(digest[:12], blobs[digest][1], idx + 1, len(pending))
+
+        for digest in pending:
+            _ensure_auth(blobs[digest][2])
+
+        failed = set()
+
+        def _on_blob_done(digest: str, ok: bool):
+            if ok:
+                progress_manager.update_layer_status(digest, 'completed', path=str(store_dir / digest[7:]))
+            else:
+                progress_manager.update_layer_status(digest, 'failed')
+                failed.add(digest)
+
+        if engine == 'async' and any(session.proxies.values()):
+            logger.warning('⚠️ asyncio 引擎不支持代理，改用线程引擎')
+            engine = 'thread'
+
+        if pending:
+            ctx.progress.print_initial()
+            ctx.progress.start_render_timer()
+            try:
+                if engine == 'async':
+                    jobs = [(blobs[d][0], str(store_dir / d[7:]), d[:12], d, blobs[d][2].auth_head) for d in pending]
+                    AsyncDownloadEngine(max_streams=max_streams, ctx=ctx).run(jobs, {}, ctx.stats, _on_blob_done)
+                else:
+                    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                        futures = {
+                            executor.submit(
+                                ctx.run, download_file_with_progress, session, blobs[d][0], blobs[d][2].auth_head,
+                                str(store_dir / d[7:]), d[:12], expected_digest=d, stats=ctx.stats,
+                                expected_size=blobs[d][1], ctx=ctx
+                            ): d
+                            for d in pending
+                        }
+                        for future in as_completed(futures):
+                            digest = futures[future]
+                            try:
+                                ok = future.result()
+                            except Exception as e:
+                                logger.error(f'❌ {digest[:19]} 下载异常: {e}')
+                                ok = False
+                            _on_blob_done(digest, ok)
+            finally:
+                ctx.progress.stop_render_timer()
+            ctx.progress._refresh_display()
+            if sys.stdout and hasattr(sys.stdout, 'write'):
+                print()
+            registries = {blobs[d][2].info.registry for d in pending}
+            if len(registries) == 1 and ctx.stats.start_time > 0 and not failed:
+                record_throughput(registries.pop(), ctx.stats.total_size, time.time() - ctx.stats.start_time)
+        if ctx.is_set():
+            raise KeyboardInterrupt("用户已取消操作")
+
+        exportable = [image for image in resolved_images if not any(b['digest'] in failed for b in image.blobs)]
+        for image in resolved_images:
+            if image not in exportable:
+                logger.error(f'❌ {image.ref} ({image.arch}) 有 blob 下载失败，跳过导出')
+        failed_count += len(resolved_images) - len(exportable)
+
+        if bundle:
+            write_delta_bundle(bundle, exportable, store_dir, omitted)
+            for image in exportable:
+                if on_exported:
+                    on_exported(image, bundle)
+            logger.info(f'✅ {len(exportable)} 个镜像（平台）已保存为差量包: {bundle}')
+            logger.info(f'📊 批量拉取完成：成功 {len(exportable)} 个，失败 {failed_count} 个，blob 缓存保留在 {store_dir}')
+            return failed_count == 0
+
+        if oci_dir:
+            # OCI 布局直接保存压缩的 blob，不需要解压
+            write_oci_layout(oci_dir, exportable, store_dir)
+            for image in exportable:
+                if on_exported:
+                    on_exported(image, oci_dir)
+            logger.info(f'✅ {len(exportable)} 个镜像（平台）已保存为 OCI 镜像布局: {oci_dir}')
+            logger.info(f'📊 批量拉取完成：成功 {len(exportable)} 个，失败 {failed_count} 个，blob 缓存保留在 {store_dir}')
+            return failed_count == 0
+
+        # 4. 每个层只解压一次，导出时以硬链接复用
+        layer_digests = list(dict.fromkeys(layer['digest'] for image in exportable for layer in image.manifest['layers']))
+        with ThreadPoolExecutor(max_workers=max(1, min(len(layer_digests), os.cpu_count() or 1))) as executor:
+            futures = {
+                d: executor.submit(ctx.run, gunzip_file, str(store_dir / d[7:]), str(store_dir / f'{d[7:]}.tar'), index)
+                for d in layer_digests if not (store_dir / f'{d[7:]}.tar').exists()
+            }
+            rows_by_digest = {d: future.result() for d, future in futures.items()}
+
+        # 解压时得到的文件列表按 diff_id 归档，与导出目录中各镜像配置的 rootfs 对应
+        layer_index: Dict[str, List[Tuple]] = {}
+        if index:
+            for image in exportable:
+                config = json.loads(read_cached_blob(store_dir, image.manifest['config']['digest']) or b'{}')
+                for layer, diff_id in zip(image.manifest['layers'], config.get('rootfs', {}).get('diff_ids', [])):
+                    if rows_by_digest.get(layer['digest']) is not None:
+                        layer_index[diff_id] = rows_by_digest[layer['digest']]
+
+        # 5. 导出：每个镜像一个 tar，或全部写入同一个多镜像 docker-archive
+        staging_dir = base_dir / '.staging'
+        exported = 0
+        if archive:
+            imgdir = str(staging_dir / 'archive')
+            os.makedirs(imgdir, exist_ok=True)
+            entries, repositories = [], {}
+            for image, tag in zip(exportable, _archive_tags(exportable)):
+                entry, name, top = _export_image_layout(imgdir, image, store_dir, tag)
+                entries.append(entry)
+                repositories.setdefault(name, {})[tag] = top
+            _write_archive_metadata(imgdir, entries, repositories)
+            if squash:
+                squash_image_dir(imgdir, ctx)
+            if index:
+                write_image_index(index_path_for(archive), imgdir, layer_index)
+            with open_archive_writer(archive, CompressionOptions.for_path(archive, compression)) as tar:
+                tar.add(imgdir, arcname='/')
+            shutil.rmtree(imgdir, ignore_errors=True)
+            exported = len(entries)
+            for image in exportable:
+                if on_exported:
+                    on_exported(image, archive)
+            if archive == '-':
+                logger.info(f'✅ {exported} 个镜像已写到标准输出')
+            else:
+                logger.info(f'✅ {exported} 个镜像已保存为: {archive}')
+                logger.info(f'💡 导入命令: docker load -i {archive}')
+        else:
+            for image in exportable:
+                safe_name = f'{image.info.repository.replace("/", "_")}_{image.info.tag}_{platform_label(image.arch)}'
+                imgdir = str(staging_dir / safe_name)
+                os.makedirs(imgdir, exist_ok=True)
+                entry, name, top = _export_image_layout(imgdir, image, store_dir)
+                _write_archive_metadata(imgdir, [entry], {name: {image.info.tag: top}})
+                if squash:
+                    squash_image_dir(imgdir, ctx)
+                if index:
+                    write_image_index(index_path_for(image_tar_path(image.info.repository, image.info.tag, image.arch, base_dir)),
+                                      imgdir, layer_index)
+                output_file = create_image_tar(imgdir, image.info.repository, image.info.tag, image.arch, base_dir, compression)
+                logger.info(f'✅ {image.ref} ({image.arch}) 已保存为: {output_file}')
+                exported += 1
+                if on_exported:
+                    on_exported(image, output_file)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+        # 解压后的层只用于导出；压缩的 blob 保留，下次批量拉取可直接复用
+        for digest in layer_digests:
+            tar_path = store_dir / f'{digest[7:]}.tar'
+            if tar_path.exists():
+                tar_path.unlink()
+
+        logger.info(f'📊 批量拉取完成：成功 {exported} 个，失败 {failed_count} 个，blob 缓存保留在 {store_dir}')
+        return failed_count == 0
+
+    except KeyboardInterrupt:
+        logger.info('⚠️ 用户取消操作。')
+        return False
+    finally:
+        if progress_manager:
+            progress_manager.close()
+        ctx.close()
+        _current_pull.reset(ctx_token)
+
+
+class RegistryAuthCache:
+    """批量请求共用的认证缓存：每个仓库只探测一次 /v2/，Bearer token 按镜像仓库路径缓存复用。
+
+    同一个键同时只有一个线程去探测或换取 token，其余线程等待后直接复用结果。
+    凭据优先级与 _handle_authentication 相同：传入参数 > auth.json > 环境变量。
+    """
+
+    def __init__(self, session: requests.Session, username: Optional[str] = None, password: Optional[str] = None):
+        self.session = session
+        self.username = username
+        self.password = password
+        self._challenges: Dict[Tuple[str, str], Tuple[Optional[str], Optional[str], Optional[str]]] = {}
+        self._heads: Dict[Tuple, Dict[str, str]] = {}
+        self._key_locks: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key: Tuple) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _credentials(self, registry: str) -> Tuple[Optional[str], Optional[str]]:
+        if self.username and self.password:
+            return self.username, self.password
+        username, password = load_auth_credentials(registry)
+        if username and password:
+            return username, password
+        return (os.environ.get('DOCKER_REGISTRY_USERNAME') or os.environ.get('REGISTRY_USERNAME'),
+                os.environ.get('DOCKER_REGISTRY_PASSWORD') or os.environ.get('REGISTRY_PASSWORD'))
+
+    def _challenge(self, registry: str, protocol: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """探测仓库的认证方式（结果按仓库缓存），无需认证时返回 (None, None, None)"""
+        key = (protocol, registry)
+        with self._key_lock(key):
+            if key not in self._challenges:
+                url = f'{protocol}://{registry}/v2/'
+                resp = request_with_retry(self.session, 'GET', url, '探测仓库', max_retries=3, verify=False)
+                if resp.status_code == 200:
+                    self._challenges[key] = (None, None, None)
+                elif resp.status_code == 401:
+                    self._challenges[key] = parse_www_authenticate(resp.headers.get('WWW-Authenticate', ''))
+                else:
+                    raise requests.exceptions.HTTPError(f'仓库返回错误状态码: {resp.status_code}', response=resp)
+            return self._challenges[key]
+
+    def auth_head(self, image_info: ImageInfo, actions: str = 'pull', mount_from: Tuple[str, ...] = ()) -> Dict[str, str]:
+        """返回访问该镜像仓库的请求头，token 已缓存时不发请求。
+
+        actions 为申请的权限（推送时为 pull,push），mount_from 为跨仓库挂载时还需要读取权限的同一仓库中的其他镜像仓库。
+        """
+        scheme, auth_url, reg_service = self._challenge(image_info.registry, image_info.protocol)
+        scheme = (scheme or '').lower()
+        if scheme.startswith('basic'):
+            username, password = self._credentials(image_info.registry)
+            if not username or not password:
+                raise PermissionError('该仓库需要 Basic 认证，但未提供用户名和密码')
+            return _create_basic_auth_head(username, password)
+        if not (scheme.startswith('bearer') and auth_url and reg_service):
+            return _get_default_auth_head()
+
+        key = (image_info.protocol, image_info.registry, image_info.repository, actions, mount_from)
+        with self._key_lock(key):
+            if key not in self._heads:
+                username, password = self._credentials(image_info.registry)
+                self._heads[key] = get_auth_head(
+                    self.session, auth_url, reg_service, image_info.repository, username, password,
+                    actions=actions, extra_scopes=tuple(f'repository:{repo}:pull' for repo in mount_from)
+                )
+            return self._heads[key]
+
+    def invalidate(self, image_info: ImageInfo):
+        """丢弃该镜像仓库缓存的 token（过期或被拒绝后重新获取）"""
+        token_cache.invalidate(image_info.repository)
+        with self._lock:
+            for key in [k for k in self._heads if k[:3] == (image_info.protocol, image_info.registry, image_info.repository)]:
+                self._heads.pop(key, None)
+
+
+class ManifestResolver:
+    """只读取清单、不下载层的批量 digest 解析器。
+
+    标签用 HEAD 解析为 digest（Docker Hub 不计入拉取限额），清单和配置按 digest 缓存，
+    多个标签指向同一索引或共享平台清单时只 GET 一次。
+    """
+
+    def __init__(self, session: requests.Session, auth: RegistryAuthCache, registry: Optional[str] = None,
+                 arch: str = 'all', head_only: bool = False):
+        self.session = session
+        self.auth = auth
+        self.registry = registry
+        self.archs = parse_arch_list(arch)
+        self.head_only = head_only
+        self._cache: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, image_info: ImageInfo, auth_head: Dict[str, str], reference: str,
+             kind: str = 'manifests') -> Tuple[Dict, str]:
+        """GET 清单（或 blobs 下的配置），返回 (内容, digest)；按 digest 引用的内容直接取缓存"""
+        with self._lock:
+            if reference in self._cache:
+                return self._cache[reference], reference
+        url = f'{image_info.protocol}://{image_info.registry}/v2/{image_info.repository}/{kind}/{reference}'
+        resp = request_with_retry(
+            self.session, 'GET', url, '清单请求' if kind == 'manifests' else '配置请求',
+            max_retries=3, paced=kind == 'manifests', headers=auth_head, verify=False
+        )
+        resp.raise_for_status()
+        digest = resp.headers.get('Docker-Content-Digest') or 'sha256:' + hashlib.sha256(resp.content).hexdigest()
+        data = resp.json()
+        with self._lock:
+            self._cache[digest] = data
+        return data, digest
+
+    def _head(self, image_info: ImageInfo) -> Tuple[Dict[str, str], requests.Response, Optional[str]]:
+        auth_head = self.auth.auth_head(image_info)
+        resp, digest = head_manifest(
+            self.session, image_info.registry, image_info.repository, image_info.reference, auth_head, image_info.protocol
+        )
+        if resp.status_code == 401:
+            # token 过期或权限变化，重新获取一次
+            self.auth.invalidate(image_info)
+            auth_head = self.auth.auth_head(image_info)
+            resp, digest = head_manifest(
+                self.session, image_info.registry, image_info.repository, image_info.reference, auth_head, image_info.protocol
+            )
+        if resp.status_code == 404:
+            raise LookupError(f'镜像 {image_info.repository}:{image_info.reference} 不存在')
+        resp.raise_for_status()
+        return auth_head, resp, digest
+
+    def _platform(self, image_info: ImageInfo, auth_head: Dict[str, str], digest: str,
+                  platform: Optional[Dict] = None) -> Dict:
+        """读取单个平台的清单，汇总压缩后大小；platform 为空时从配置中读取"""
+        manifest, digest = self._get(image_info, auth_head, digest)
+        if platform is None:
+            config, _ = self._get(image_info, auth_head, manifest['config']['digest'], 'blobs')
+            platform = {k: config[k] for k in ('os', 'architecture', 'variant') if config.get(k)}
+        name = '/'.join(platform[k] for k in ('os', 'architecture', 'variant') if platform.get(k))
+        layers = manifest.get('layers', [])
+        return {
+            'platform': name,
+            'digest': digest,
+            'size': manifest['config'].get('size', 0) + sum(layer.get('size', 0) for layer in layers),
+            'layers': len(layers),
+        }
+
+    def resolve(self, ref: str) -> Dict[str, Any]:
+        """解析一个镜像引用，失败时记录在 error 字段中而不是抛出异常"""
+        record: Dict[str, Any] = {'ref': ref}
+        try:
+            image_info = parse_image_input(ref, self.registry)
+            record['image'] = f'{image_info.registry}/{image_info.repository}:{image_info.tag}'
+            auth_head, resp, digest = self._head(image_info)
+            record['digest'] = digest
+            record['media_type'] = resp.headers.get('Content-Type', '').split(';')[0] or None
+            if self.head_only and digest:
+                return record
+
+            manifest, record['digest'] = self._get(image_info, auth_head, digest or image_info.tag)
+            record['media_type'] = manifest.get('mediaType', record['media_type'])
+            if 'manifests' not in manifest:
+                record['platforms'] = [self._platform(image_info, auth_head, record['digest'])]
+                return record
+
+            entries = [m for m in manifest['manifests']
+                       if m.get('platform', {}).get('architecture') not in (None, 'unknown')]
+            if self.archs != ['all']:
+                selected = {arch: select_manifest(entries, arch) for arch in self.archs}
+                missing = [arch for arch, digest in selected.items() if not digest]
+                if missing:
+                    record['missing'] = missing
+                entries = [m for m in entries if m.get('digest') in selected.values()]
+            record['platforms'] = [
+                self._platform(image_info, auth_head, m['digest'], m['platform']) for m in entries
+            ]
+        except Exception as e:
+            record['error'] = str(e)
+        return record
+
+
+RESOLVE_CSV_FIELDS = ['ref', 'image', 'digest', 'media_type', 'platform', 'platform_digest', 'size', 'layers', 'error']
+
+
+def _resolve_csv_rows(record: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """把一条解析结果展开为 CSV 行，每个平台一行"""
+    base = {k: record.get(k) for k in ('ref', 'image', 'digest', 'media_type', 'error')}
+    if record.get('missing'):
+        base['error'] = f'缺少平台: {", ".join(record["missing"])}'
+    platforms = record.get('platforms') or [{}]
+    return [dict(base, platform=p.get('platform'), platform_digest=p.get('digest'),
+                 size=p.get('size'), layers=p.get('layers')) for p in platforms]
+
+
+def cmd_resolve(argv: List[str]) -> int:
+    """resolve 子命令：批量解析镜像的 digest、平台列表和压缩后大小，不下载任何层"""
+    parser = argparse.ArgumentParser(
+        prog=f'{os.path.basename(sys.argv[0])} resolve',
+        description="批量解析镜像引用的 digest、各平台清单 digest 和压缩后大小（只读取清单）"
+    )
+    parser.add_argument("file", help="镜像列表文件（每行一个，- 表示标准输入）")
+    parser.add_argument("-r", "--custom-registry", help="自定义仓库地址（例如：harbor.abc.com）")
+    parser.add_argument("-a", "--arch", default="all", help="只输出指定平台（逗号分隔），默认 all")
+    parser.add_argument("-u", "--username", help="Docker 仓库用户名")
+    parser.add_argument("-p", "--password", help="Docker 仓库密码")
+    parser.add_argument("-o", "--output", help="输出文件，默认输出到标准输出")
+    parser.add_argument("--format", choices=['ndjson', 'csv'], default='ndjson', help="输出格式，默认 ndjson")
+    parser.add_argument("--workers", type=int, default=32, help="并发解析的镜像数，默认32")
+    parser.add_argument("--head-only", action="store_true", help="只用 HEAD 获取标签的 digest，不读取清单内容")
+    parser.add_argument("--no-http2", action="store_true", help="禁用 HTTP/2 传输")
+    parser.add_argument("--debug", action="store_true", help="启用调试模式")
+    args = parser.parse_args(argv)
+
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    if args.no_http2:
+        SessionManager.http2_enabled = False
+    refs = read_image_list(args.file)
+    if not refs:
+        logger.error("错误：镜像列表为空。")
+        return 1
+
+    session = SessionManager.get_session()
+    resolver = ManifestResolver(
+        session, RegistryAuthCache(session, args.username, args.password),
+        registry=args.custom_registry, arch=args.arch, head_only=args.head_only
+    )
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    writer = csv.DictWriter(out, fieldnames=RESOLVE_CSV_FIELDS) if args.format == 'csv' else None
+    if writer:
+        writer.writeheader()
+
+    started_at = time.time()
+    failed = 0
+    logger.info(f'🔍 解析 {len(refs)} 个镜像引用...')
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(args.workers, len(refs)))) as executor:
+            # map 按输入顺序产出结果，先完成的结果在前面的引用完成后立即写出
+            for record in executor.map(resolver.resolve, refs):
+                if record.get('error') or record.get('missing'):
+                    failed += 1
+                    logger.warning(f'⚠️ {record["ref"]}: {record.get("error") or "缺少平台 " + ", ".join(record["missing"])}')
+                if writer:
+                    writer.writerows(_resolve_csv_rows(record))
+                else:
+                    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        SessionManager.close_session()
+
+    logger.info(f'📊 解析完成：{len(refs) - failed}/{len(refs)} 个成功，用时 {time.time() - started_at:.2f} 秒')
+    return 1 if failed else 0
+
+
+SYNC_STATE_FILE = 'sync-state.json'
+SYNC_REPORT_FILE = 'sync-report.ndjson'
+
+
+def _load_sync_state(path: Path) -> Dict[str, Dict[str, Any]]:
+    """读取同步状态（每个镜像引用上次导出的 digest 和相对输出目录的文件路径），不存在或损坏时返回空状态"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('images', {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f'读取同步状态失败，将重新导出全部镜像: {e}')
+        return {}
+
+
+def _save_sync_state(path: Path, state: Dict[str, Dict[str, Any]]):
+    """保存同步状态（临时文件 + fsync + 原子重命名）"""
+    tmp_path = path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'images': state}, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def sync_images(
+    refs: List[str],
+    output_dir: Path,
+    state: Dict[str, Dict[str, Any]],
+    resolver: ManifestResolver,
+    arch: str = 'amd64',
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    workers: int = 4,
+    engine: str = 'thread',
+    max_streams: int = 64,
+    deadline: Optional[float] = None
+) -> Dict[str, Any]:
+    """执行一轮同步：HEAD 检查每个标签的 digest，只重新拉取、导出 digest 变化或导出文件丢失的镜像。
+
+    拉取前按各仓库的剩余限额决定本轮处理多少个镜像，超出的推迟到下一轮。
+    拉取固定到 HEAD 得到的 digest，共享的层由 blob 缓存复用。state 原地更新，返回本轮的变更报告。
+    """
+    started_at = time.time()
+    report: Dict[str, Any] = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'checked': len(refs), 'unchanged': 0, 'changed': [], 'failed': [], 'deferred': [],
+    }
+
+    # 1. 并发 HEAD 所有标签（Docker Hub 不计入拉取限额）
+    with ThreadPoolExecutor(max_workers=max(1, min(32, len(refs)))) as executor:
+        records = list(executor.map(resolver.resolve, refs))
+
+    # 2. 与上次导出的 digest 比较
+    changed = []
+    for record in records:
+        if record.get('error') or not record.get('digest'):
+            report['failed'].append({'ref': record['ref'], 'error': record.get('error') or '仓库未返回 digest'})
+            continue
+        previous = state.get(record['ref'], {})
+        files = previous.get('files') or []
+        if previous.get('digest') == record['digest'] and files and all((output_dir / f).exists() for f in files):
+            report['unchanged'] += 1
+        else:
+            changed.append(record)
+
+    # 3. 按剩余限额挑选本轮拉取的镜像：多架构索引按 索引 + 各平台清单 估算 GET 次数
+    archs = parse_arch_list(arch)
+    selected = []
+    spent: Dict[str, int] = {}
+    for record in changed:
+        registry = record['image'].split('/', 1)[0]
+        budget = rate_limiter.budget(registry)
+        if budget and budget.limit:
+            is_index = 'index' in (record.get('media_type') or '') or 'list' in (record.get('media_type') or '')
+            cost = 1 + (len(archs) if archs != ['all'] else 1) if is_index else 1
+            reserve = max(1, int(budget.limit * rate_limiter.reserve_ratio))
+            if spent.get(registry, 0) + cost > budget.remaining - reserve:
+                report['deferred'].append({'ref': record['ref'], 'digest': record['digest'], 'registry': registry})
+                continue
+            spent[registry] = spent.get(registry, 0) + cost
+        selected.append(record)
+    if report['deferred']:
+        logger.warning(f'⚠️ 仓库剩余限额不足，{len(report["deferred"])} 个镜像推迟到下一轮同步')
+
+    # 4. 固定到 HEAD 得到的 digest 拉取，避免检查与拉取之间标签再次变化
+    if selected:
+        pinned = {record['ref'] if '@' in record['ref'] else f'{record["ref"]}@{record["digest"]}': record
+                  for record in selected}
+        exported: Dict[str, List[str]] = {}
+        pull_images_batch(
+            list(pinned), registry=resolver.registry, arch=arch, username=username, password=password,
+            output_path=str(output_dir), workers=workers, engine=engine, max_streams=max_streams, deadline=deadline,
+            on_exported=lambda image, path: exported.setdefault(image.ref, []).append(os.path.relpath(path, output_dir))
+        )
+        for pinned_ref, record in pinned.items():
+            files = exported.get(pinned_ref, [])
+            if not files or (archs != ['all'] and len(files) < len(archs)):
+                report['failed'].append({'ref': record['ref'], 'error': '拉取或导出失败'})
+                continue
+            report['changed'].append({
+                'ref': record['ref'], 'old': state.get(record['ref'], {}).get('digest'),
+                'new': record['digest'], 'files': files,
+            })
+            state[record['ref']] = {
+                'digest': record['digest'], 'files': files, 'exported_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            }
+
+    report['duration'] = round(time.time() - started_at, 2)
+    return report
+
+
+def cmd_sync(argv: List[str]) -> int:
+    """sync 子命令：定期检查镜像列表中的标签，只重新导出 digest 变化的镜像"""
+    parser = argparse.ArgumentParser(
+        prog=f'{os.path.basename(sys.argv[0])} sync',
+        description="离线镜像同步：定期 HEAD 检查每个标签，只拉取并重新导出 digest 变化的镜像"
+    )
+    parser.add_argument("file", help="镜像列表文件（每行一个，每轮同步前重新读取）")
+    parser.add_argument("-o", "--output", help="输出目录（tar、blob 缓存和同步状态），默认为当前目录")
+    parser.add_argument("-r", "--custom-registry", help="自定义仓库地址（例如：harbor.abc.com）")
+    parser.add_argument("-a", "--arch", default="amd64", help="架构，多个架构用逗号分隔，all 表示全部平台，默认 amd64")
+    parser.add_argument("-u", "--username", help="Docker 仓库用户名")
+    parser.add_argument("-p", "--password", help="Docker 仓库密码")
+    parser.add_argument("--interval", type=float, default=86400, help="两轮同步之间的间隔（秒），默认 86400")
+    parser.add_argument("--jitter", type=float, default=300, help="间隔的随机抖动范围（±秒），默认 300")
+    parser.add_argument("--once", action="store_true", help="只同步一轮后退出，有失败时退出码为 1")
+    parser.add_argument("--report", help=f"变更报告文件（每轮追加一行 JSON），默认为输出目录下的 {SYNC_REPORT_FILE}")
+    parser.add_argument("--workers", type=int, default=4, help="并发下载线程数，默认4")
+    parser.add_argument("--engine", choices=['thread', 'async'], default='thread', help="下载引擎，默认 thread")
+    parser.add_argument("--streams", type=int, default=64, help="async 引擎的最大并发下载流数，默认64")
+    parser.add_argument("--deadline", type=float, default=None, help="每轮拉取的最长耗时（秒），默认不限制")
+    parser.add_argument("--no-http2", action="store_true", help="禁用 HTTP/2 传输")
+    parser.add_argument("--debug", action="store_true", help="启用调试模式")
+    args = parser.parse_args(argv)
+
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    if args.no_http2:
+        SessionManager.http2_enabled = False
+    output_dir = Path(args.output) if args.output else Path.cwd()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    state_path = output_dir / SYNC_STATE_FILE
+    report_path = Path(args.report) if args.report else output_dir / SYNC_REPORT_FILE
+
+    cycle = 0
+    while True:
+        cycle += 1
+        refs = read_image_list(args.file)
+        if not refs:
+            logger.error("错误：镜像列表为空。")
+            return 1
+        session = SessionManager.get_session()
+        resolver = ManifestResolver(
+            session, RegistryAuthCache(session, args.username, args.password),
+            registry=args.custom_registry, head_only=True
+        )
+        state = _load_sync_state(state_path)
+        logger.info(f'🔄 第 {cycle} 轮同步：检查 {len(refs)} 个镜像')
+        report = sync_images(
+            refs, output_dir, state, resolver, arch=args.arch, username=args.username, password=args.password,
+            workers=args.workers, engine=args.engine, max_streams=args.streams, deadline=args.deadline
+        )
+        report['cycle'] = cycle
+        _save_sync_state(state_path, state)
+        with open(report_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(report, ensure_ascii=False) + '\n')
+        logger.info(
+            f'📊 第 {cycle} 轮同步完成：更新 {len(report["changed"])} 个，未变化 {report["unchanged"]} 个，'
+            f'失败 {len(report["failed"])} 个，推迟 {len(report["deferred"])} 个，用时 {report["duration"]:.1f} 秒'
+        )
+
+        if args.once:
+            return 1 if report['failed'] else 0
+        # 加入随机抖动，多个同步实例不会在同一时刻访问仓库
+        delay = max(0.0, args.interval + random.uniform(-args.jitter, args.jitter))
+        logger.info(f'⏰ 下一轮同步在 {delay:.0f} 秒后开始')
+        if stop_event.wait(delay):
+            return 0
+
+
+def _extract_tar(tar_path: str, dest: Path):
+    """解压 tar 到 dest；支持时使用 data 过滤器，拒绝绝对路径、.. 和设备文件等成员"""
+    dest.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(tar_path) as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(str(dest), filter='data')
+        else:
+            tar.extractall(str(dest))
+
+
+def _layout_images(layout_dir: Path) -> List[BatchImage]:
+    """读取 OCI 镜像布局 index.json 引用的所有单平台镜像（名称取自 io.containerd.image.name 注解）"""
+    blob_dir = layout_dir / 'blobs' / 'sha256'
+
+    def _load(digest: str) -> Dict:
+        with open(blob_dir / digest[7:], 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    with open(layout_dir / 'index.json', 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    images = []
+    for entry in index.get('manifests', []):
+        name = entry.get('annotations', {}).get('io.containerd.image.name')
+        if not name:
+            continue
+        media_type = entry.get('mediaType', '')
+        descriptors = _load(entry['digest'])['manifests'] if 'index' in media_type or 'list' in media_type else [entry]
+        for descriptor in descriptors:
+            platform = descriptor.get('platform', {})
+            arch = platform.get('architecture', 'unknown') + (f'/{platform["variant"]}' if platform.get('variant') else '')
+            images.append(BatchImage(name, parse_image_input(name), None, _load(descriptor['digest']), arch,
+                                     descriptor['digest']))
+    return images
+
+
+def _apply_to_oci_layout(layout: Path, metadata: Dict, target: Path, check_only: bool) -> bool:
+    """把差量包合并到 OCI 镜像布局目录：补齐 blob，按镜像名替换 index.json 中的条目"""
+    target_blobs = target / 'blobs' / 'sha256'
+    missing = [d for d in metadata['omitted']
+               if not (target_blobs / d[7:]).exists() or file_digest(str(target_blobs / d[7:])) != d]
+    if missing:
+        logger.error(f'❌ 目标缺少差量包依赖的 {len(missing)} 个层: {", ".join(d[:19] for d in missing[:5])}')
+        return False
+    if check_only:
+        logger.info(f'✅ 检查通过：目标 {target} 已有差量包依赖的全部 {len(metadata["omitted"])} 个层')
+        return True
+
+    target_blobs.mkdir(parents=True, exist_ok=True)
+    for digest in metadata['blobs']:
+        dst = target_blobs / digest[7:]
+        if not dst.exists():
+            _link_or_copy(str(layout / 'blobs' / 'sha256' / digest[7:]), str(dst))
+
+    index_path = target / 'index.json'
+    if index_path.exists():
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    else:
+        index = {'schemaVersion': 2, 'mediaType': OCI_IMAGE_INDEX, 'manifests': []}
+    with open(layout / 'index.json', 'r', encoding='utf-8') as f:
+        new_entries = json.load(f)['manifests']
+    names = {entry.get('annotations', {}).get('io.containerd.image.name') for entry in new_entries}
+    index['manifests'] = [
+        entry for entry in index.get('manifests', [])
+        if entry.get('annotations', {}).get('io.containerd.image.name') not in names
+    ] + new_entries
+    if not (target / 'oci-layout').exists():
+        with open(target / 'oci-layout', 'w') as file:
+            json.dump({'imageLayoutVersion': '1.0.0'}, file)
+    with open(f'{index_path}.tmp', 'w') as file:
+        json.dump(index, file)
+    os.replace(f'{index_path}.tmp', index_path)
+    logger.info(f'✅ 已合并 {len(new_entries)} 个镜像到 OCI 镜像布局: {target}')
+    return True
+
+
+def _apply_to_archive(layout: Path, metadata: Dict, target: Path, staging: Path, check_only: bool) -> bool:
+    """把差量包合并到 docker-archive：省略的层按 diff_id 从原归档中取出，重新写出包含新旧镜像的归档"""
+    imgdir = staging / 'archive'
+    imgdir.mkdir(parents=True, exist_ok=True)
+    entries: List[Dict] = []
+    repositories: Dict[str, Dict[str, str]] = {}
+    layer_by_diff_id: Dict[str, Path] = {}
+    if target.exists():
+        _extract_tar(str(target), imgdir)
+        with open(imgdir / 'manifest.json', 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        if (imgdir / 'repositories').exists():
+            with open(imgdir / 'repositories', 'r', encoding='utf-8') as f:
+                repositories = json.load(f)
+        for entry in entries:
+            with open(imgdir / entry['Config'], 'r', encoding='utf-8') as f:
+                diff_ids = json.load(f).get('rootfs', {}).get('diff_ids', [])
+            for layer_path, diff_id in zip(entry['Layers'], diff_ids):
+                layer_by_diff_id.setdefault(diff_id, imgdir / layer_path)
+
+    # 省略的层必须在原归档中存在，且内容与 diff_id 一致
+    store_dir = staging / 'store'
+    store_dir.mkdir(parents=True, exist_ok=True)
+    missing = []
+    for digest, info in metadata['omitted'].items():
+        src = layer_by_diff_id.get(info.get('diffID'))
+        if src is None or file_digest(str(src)) != info.get('diffID'):
+            missing.append(digest)
+        elif not check_only:
+            _link_or_copy(str(src), str(store_dir / f'{digest[7:]}.tar'))
+    if missing:
+        logger.error(f'❌ 目标缺少差量包依赖的 {len(missing)} 个层: {", ".join(d[:19] for d in missing[:5])}')
+        return False
+    if check_only:
+        logger.info(f'✅ 检查通过：目标 {target} 已有差量包依赖的全部 {len(metadata["omitted"])} 个层')
+        return True
+
+    blob_dir = layout / 'blobs' / 'sha256'
+    images = _layout_images(layout)
+    for image in images:
+        config_digest = image.manifest['config']['digest']
+        if not (store_dir / config_digest[7:]).exists():
+            _link_or_copy(str(blob_dir / config_digest[7:]), str(store_dir / config_digest[7:]))
+        for layer in image.manifest['layers']:
+            tar_path = store_dir / f'{layer["digest"][7:]}.tar'
+            if not tar_path.exists():
+                gunzip_file(str(blob_dir / layer['digest'][7:]), str(tar_path))
+
+    new_entries = []
+    for image, tag in zip(images, _archive_tags(images)):
+        entry, name, top = _export_image_layout(str(imgdir), image, store_dir, tag)
+        new_entries.append(entry)
+        repositories.setdefault(name, {})[tag] = top
+    new_tags = {tag for entry in new_entries for tag in entry['RepoTags']}
+    entries = [entry for entry in entries if not set(entry.get('RepoTags') or []) & new_tags] + new_entries
+    _write_archive_metadata(str(imgdir), entries, repositories)
+
+    # 被新镜像替换掉的旧镜像不再引用的层和配置不写入新归档
+    referenced = {'manifest.json', 'repositories'} | {entry['Config'] for entry in entries} | \
+        {layer.split('/')[0] for entry in entries for layer in entry['Layers']}
+    for name in os.listdir(imgdir):
+        if name not in referenced:
+            path = imgdir / name
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+
+    with tarfile.open(f'{target}.tmp', 'w') as tar:
+        tar.add(str(imgdir), arcname='/')
+    os.replace(f'{target}.tmp', target)
+    logger.info(f'✅ 已合并 {len(new_entries)} 个镜像到 docker-archive: {target}')
+    return True
+
+
+def apply_delta_bundle(bundle_path: str, target: str, check_only: bool = False) -> bool:
+    """在目标环境应用差量包：先校验包内每个 blob 和目标中省略的层，全部通过后才修改目标。
+
+    target 为 OCI 镜像布局目录，或 docker-archive tar 文件（以 .tar 结尾或已存在的文件）；不存在时新建。
+    check_only 为 True 时只校验，不修改目标。
+    """
+    target_path = Path(target)
+    staging = Path(f'{target.rstrip("/")}.apply')
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        layout = staging / 'bundle'
+        _extract_tar(bundle_path, layout)
+        with open(layout / BUNDLE_FILE, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        blob_dir = layout / 'blobs' / 'sha256'
+        corrupt = [d for d in metadata['blobs']
+                   if not (blob_dir / d[7:]).exists() or file_digest(str(blob_dir / d[7:])) != d]
+        if corrupt:
+            logger.error(f'❌ 差量包已损坏，{len(corrupt)} 个 blob 缺失或校验失败: {", ".join(d[:19] for d in corrupt[:5])}')
+            return False
+        logger.info(
+            f'✅ 差量包校验通过：{len(metadata["images"])} 个镜像，{len(metadata["blobs"])} 个 blob，'
+            f'依赖目标已有的 {len(metadata["omitted"])} 个层'
+        )
+        if target_path.is_file() or target.endswith('.tar'):
+            return _apply_to_archive(layout, metadata, target_path, staging, check_only)
+        return _apply_to_oci_layout(layout, metadata, target_path, check_only)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def cmd_apply(argv: List[str]) -> int:
+    """apply 子命令：把差量包合并到目标环境已有的 OCI 镜像布局或 docker-archive"""
+    parser = argparse.ArgumentParser(
+        prog=f'{os.path.basename(sys.argv[0])} apply',
+        description="把 --bundle 生成的差量包合并到已有的 OCI 镜像布局目录或 docker-archive tar"
+    )
+    parser.add_argument("bundle", help="差量包文件")
+    parser.add_argument("target", help="OCI 镜像布局目录，或 docker-archive tar 文件（不存在时新建）")
+    parser.add_argument("--check", action="store_true", help="只校验差量包和目标中依赖的层，不修改目标")
+    parser.add_argument("--debug", action="store_true", help="启用调试模式")
+    args = parser.parse_args(argv)
+
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    return 0 if apply_delta_bundle(args.bundle, args.target, args.check) else 1
+
+
+def query_image_index(db_path: str, find: Optional[str] = None, largest: int = 0) -> List[Dict[str, Any]]:
+    """查询 write_image_index 写入的文件索引。
+
+    find 为路径（含 * ? [ 时按 glob 匹配），返回提供该路径的层；largest 为每层最大的 N 个文件；
+    都不指定时返回每层的文件数和文件总大小。
+    """
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        select = 'SELECT i.tags, l.position, l.diff_id, l.path AS layer_path'
+        joins = 'FROM layers l JOIN images i ON i.id = l.image'
+        if find:
+            pattern = find.lstrip('/')
+            op = 'GLOB' if any(c in pattern for c in '*?[') else '='
+            rows = conn.execute(
+                f'{select}, f.path, f.size, f.mode, f.type, f.offset {joins} JOIN files f ON f.layer = l.diff_id '
+                f'WHERE f.path {op} ? ORDER BY i.id, l.position, f.path', (pattern,))
+        elif largest:
+            rows = conn.execute(
+                f'{select}, f.path, f.size, f.mode, f.type, f.offset {joins} JOIN files f ON f.layer = l.diff_id '
+                f'AND f.rowid IN (SELECT rowid FROM files WHERE layer = l.diff_id ORDER BY size DESC LIMIT ?) '
+                f'ORDER BY i.id, l.position, f.size DESC', (largest,))
+        else:
+            rows = conn.execute(
+                f'{select}, l.size AS layer_size, COUNT(f.path) AS files, COALESCE(SUM(f.size), 0) AS file_bytes '
+                f'{joins} LEFT JOIN files f ON f.layer = l.diff_id GROUP BY l.image, l.position ORDER BY i.id, l.position')
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def cmd_files(argv: List[str]) -> int:
+    """files 子命令：查询 --index 生成的文件索引，不需要解开镜像 tar"""
+    parser = argparse.ArgumentParser(
+        prog=f'{os.path.basename(sys.argv[0])} files',
+        description="查询 --index 生成的文件索引：哪一层提供了某个文件、每层最大的文件、每层的文件数和大小",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  %(prog)s ./offline/*.index.db --find /usr/lib/libcuda.so
+  %(prog)s ./offline/images.index.db --find '/usr/lib/*.so*'
+  %(prog)s ./offline/images.tar --largest 10
+            """
+    )
+    parser.add_argument("index", nargs='+', help="文件索引（.index.db），也可以直接给出对应的镜像 tar")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--find", metavar="PATH", help="查找提供该路径的层，可以使用 * ? [] 通配符")
+    group.add_argument("--largest", type=int, default=0, metavar="N", help="列出每层最大的 N 个文件")
+    parser.add_argument("--json", action="store_true", help="每行输出一条 JSON 记录，便于脚本处理")
+    args = parser.parse_args(argv)
+
+    found = False
+    for path in args.index:
+        db_path = index_path_for(path) if is_archive_path(path) else path
+        if not os.path.exists(db_path):
+            logger.error(f'❌ 找不到文件索引: {db_path}')
+            return 1
+        for record in query_image_index(db_path, args.find, args.largest):
+            found = True
+            record = {'index': db_path, **record}
+            if args.json:
+                print(json.dumps(record, ensure_ascii=False))
+            elif 'files' in record:
+                print(f"{record['tags']}\t#{record['position']}\t{record['diff_id'][:19]}\t"
+                      f"{LayerProgress.format_size(record['layer_size'])}\t{record['files']} 个文件\t"
+                      f"{LayerProgress.format_size(record['file_bytes'])}")
+            else:
+                print(f"{record['tags']}\t#{record['position']}\t{record['diff_id'][:19]}\t"
+                      f"{LayerProgress.format_size(record['size'])}\t/{record['path']}")
+    if args.find and not found:
+        logger.info(f'🔍 没有层包含 {args.find}')
+    return 0 if found or not args.find else 1
+
+
+def cmd_inspect(argv: List[str]) -> int:
+    """inspect 子命令：输出拉取计划（与 --dry-run 相同），可以输出 JSON 供脚本判断"""
+    parser = argparse.ArgumentParser(
+        prog=f'{os.path.basename(sys.argv[0])} inspect',
+        description="只获取清单和配置，输出每层大小、缓存情况、需下载的字节数、估计耗时和磁盘检查结果，不下载任何层",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  %(prog)s nginx:1.27 redis:7 -o ./offline --archive ./offline/images.tar
+  %(prog)s --from-file images.txt -a amd64,arm64 --json
+            """
+    )
+    parser.add_argument("images", nargs='*', help="镜像引用")
+    parser.add_argument("--from-file", metavar="FILE", help="从文件读取镜像列表（每行一个，- 表示标准输入）")
+    parser.add_argument("-r", "--custom-registry", help="自定义仓库地址（例如：harbor.abc.com）")
+    parser.add_argument("-a", "--arch", default="amd64", help="架构，多个用逗号分隔，all 表示全部平台，默认 amd64")
+    parser.add_argument("-u", "--username", help="Docker 仓库用户名")
+    parser.add_argument("-p", "--password", help="Docker 仓库密码")
+    parser.add_argument("-o", "--output", help="拉取时使用的输出目录（用于判断已缓存的层和检查磁盘空间），默认当前目录")
+    parser.add_argument("--archive", metavar="FILE", help="按导出到同一个多镜像 tar 计算输出需要的空间")
+    parser.add_argument("--oci", metavar="DIR", help="按 OCI 镜像布局输出计算")
+    parser.add_argument("--squash", action="store_true", help="按合并为单层导出计算")
+    parser.add_argument("--json", action="store_true", help="把拉取计划以 JSON 输出到标准输出")
+    parser.add_argument("--no-http2", action="store_true", help="禁用 HTTP/2 传输")
+    parser.add_argument("--debug", action="store_true", help="启用调试模式")
+    args = parser.parse_args(argv)
+
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    if args.no_http2:
+        SessionManager.http2_enabled = False
+    refs = args.images + (read_image_list(args.from_file) if args.from_file else [])
+    if not refs:
+        parser.error("需要至少一个镜像引用或 --from-file")
+
+    plans = []
+    ok = pull_images_batch(
+        refs,
+        registry=args.custom_registry,
+        arch=args.arch,
+        username=args.username,
+        password=args.password,
+        output_path=args.output,
+        archive=args.archive,
+        oci_dir=args.oci,
+        squash=args.squash,
+        dry_run=True,
+        on_plan=plans.append
+    )
+    if args.json and plans:
+        print(json.dumps(plans[0].to_json(), ensure_ascii=False, indent=2))
+    return 0 if ok else 1
+
+
+# 子命令：第一个参数是子命令名时交给对应函数处理，返回值作为退出码
+class _CountingWriter:
+    """只统计写入字节数的输出，用于测量压缩吞吐量"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def benchmark_compression(data: bytes, compression: CompressionOptions) -> Tuple[float, int]:
+    """压缩 data 一遍，返回 (耗时秒数, 压缩后字节数)；按 RECV_BUFFER_SIZE 分块写入，与导出时相同"""
+    sink = _CountingWriter()
+    started = time.perf_counter()
+    stream = open_compressor(sink, compression)
+    view = memoryview(data)
+    for offset in range(0, len(data), RECV_BUFFER_SIZE):
+        stream.write(view[offset:offset + RECV_BUFFER_SIZE])
+    stream.close()
+    return time.perf_counter() - started, sink.size
+
+
+def cmd_bench(argv: List[str]) -> int:
+    """bench 子命令：测量导出压缩在各压缩级别和线程数下的吞吐量，用于选择 --compress-level 和 --compress-threads"""
+    parser = argparse.ArgumentParser(
+        prog=f'{os.path.basename(sys.argv[0])} bench',
+        description="用已导出的镜像 tar 测量 gzip / zstd 在各压缩级别和线程数下的吞吐量和压缩率（只在内存中压缩，不写文件）",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  %(prog)s ./offline/nginx_1.27_amd64.tar
+  %(prog)s ./offline/images.tar --format gzip --levels 1,6,9 --threads 1,2,4,8
+            """
+    )
+    parser.add_argument("file", help="用于测试的文件，通常是未压缩的镜像 tar")
+    parser.add_argument("--format", choices=['gzip', 'zstd'], action="append",
+                        help="测试的压缩格式，可重复指定，默认 gzip（安装了 zstandard 时同时测试 zstd）")
+    parser.add_argument("--levels", help="逗号分隔的压缩级别，默认 gzip 为 1,6,9、zstd 为 1,3,9,19")
+    parser.add_argument("--threads", help="逗号分隔的线程数，默认 1,2,4 直到 CPU 数")
+    parser.add_argument("--size", type=int, default=256, help="从文件开头读取多少 MB 用于测试，默认256")
+    parser.add_argument("--json", action="store_true", help="每行输出一条 JSON 记录")
+    args = parser.parse_args(argv)
+
+    formats = args.format or (['gzip', 'zstd'] if zstandard is not None else ['gzip'])
+    if 'zstd' in formats and zstandard is None:
+        logger.error('❌ 测试 zstd 需要安装 zstandard（pip install zstandard）')
+        return 1
+    cpus = os.cpu_count() or 1
+    threads = [int(t) for t in args.threads.split(',')] if args.threads else \
+        sorted({t for t in (1, 2, 4, 8, 16, 32) if t < cpus} | {cpus})
+    with open(args.file, 'rb') as f:
+        data = f.read(args.size * 1024 * 1024)
+    if not data:
+        logger.error(f'❌ 文件为空: {args.file}')
+        return 1
+    logger.info(f'📏 测试数据：{LayerProgress.format_size(len(data))}，{cpus} 个 CPU')
+
+    for fmt in formats:
+        levels = [int(level) for level in args.levels.split(',')] if args.levels else \
+            ([1, 6, 9] if fmt == 'gzip' else [1, 3, 9, 19])
+        for level in levels:
+            for count in threads:
+                seconds, size = benchmark_compression(data, CompressionOptions(fmt, level, count))
+                record = {'format': fmt, 'level': level, 'threads': count,
+                          'mb_per_second': round(len(data) / seconds / 1024 / 1024, 1),
+                          'ratio': round(size / len(data), 4), 'compressed_bytes': size}
+                if args.json:
+                    print(json.dumps(record))
+                else:
+                    print(f"{fmt}\t级别 {level}\t{count} 线程\t{record['mb_per_second']} MB/s\t"
+                          f"压缩后 {record['ratio']:.1%}")
+    return 0
+
+
+# verify 已校验文件的大小、修改时间和 digest，未变化的文件不再读取；按用户保存，不随工作目录变化
+VERIFY_STATE_FILE = str(user_state_dir() / 'verify-state.json')
+VERIFY_READ_SIZE = 8 * 1024 * 1024       # verify 顺序读取的块大小
+VERIFY_SMALL_MEMBER = 4 * 1024 * 1024    # 清单、配置等需要解析的小文件的大小上限
+FS_IOC_FIEMAP = 0xC020660B
+OCI_GZIP_LAYER_TYPES = ('application/vnd.oci.image.layer.v1.tar+gzip',
+                        'application/vnd.docker.image.rootfs.diff.tar.gzip')
+
+
+def _physical_offset(path: str) -> Tuple[int, int]:
+    """文件所在设备和第一个数据块的物理位置（Linux 上用 FIEMAP），不支持时退回 inode 号，用于按磁盘顺序安排读取"""
+    st = os.stat(path)
+    try:
+        import fcntl
+        # struct fiemap（32 字节）后跟一个 struct fiemap_extent（56 字节）
+        request = bytearray(struct.pack('=QQIIII', 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) + bytes(56))
+        with open(path, 'rb') as f:
+            fcntl.ioctl(f.fileno(), FS_IOC_FIEMAP, request)
+        if struct.unpack_from('=I', request, 20)[0]:
+            return st.st_dev, struct.unpack_from('=Q', request, 40)[0]
+    except (ImportError, OSError):
+        pass
+    return st.st_dev, st.st_ino
+
+
+def _verify_hash_job(job: Tuple[str, int, int, bool]) -> Tuple[Optional[str], Optional[str], int, Optional[str], Optional[str]]:
+    """在 verify 的进程池中计算文件一段内容的 sha256，大块顺序读取。
+
+    job 为 (路径, 偏移, 长度, 是否 gzip 解压)，解压时同时计算解压后内容的 sha256（层的 diff_id）。
+    返回 (sha256, 解压后的 sha256, 实际读到的字节数, 读取错误, 解压错误)。
+    """
+    path, offset, length, decompress = job
+    digest = hashlib.sha256()
+    inner = hashlib.sha256() if decompress else None
+    decompressor = zlib.decompressobj(31) if decompress else None
+    buffer = bytearray(min(VERIFY_READ_SIZE, max(length, 1)))
+    view = memoryview(buffer)
+    done = 0
+    inner_error = None
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), offset, length, os.POSIX_FADV_SEQUENTIAL)
+            f.seek(offset)
+            while done < length:
+                n = f.readinto(view[:min(length - done, len(buffer))])
+                if not n:
+                    break
+                chunk = view[:n]
+                digest.update(chunk)
+                done += n
+                try:
+                    while decompressor is not None and chunk:
+                        inner.update(decompressor.decompress(chunk))
+                        if not decompressor.eof:
+                            break
+                        # gzip 允许多个成员首尾相连
+                        chunk = decompressor.unused_data
+                        decompressor = zlib.decompressobj(31)
+                except zlib.error as e:
+                    decompressor, inner, inner_error = None, None, f'解压失败: {e}'
+    except OSError as e:
+        return None, None, done, str(e), None
+    return ('sha256:' + digest.hexdigest(), 'sha256:' + inner.hexdigest() if inner else None, done, None, inner_error)
+
+
+def _verify_compressed_archive(path: str) -> Tuple[Dict[str, Tuple[int, str]], Dict[str, bytes], Optional[str]]:
+    """压缩的 tar 只能顺序解压：在一个进程中解压一遍，返回每个成员的 (大小, sha256)、小成员的内容和错误信息"""
+    members: Dict[str, Tuple[int, str]] = {}
+    small: Dict[str, bytes] = {}
+    try:
+        with open(path, 'rb') as raw:
+            if raw.read(4) == b'\x28\xb5\x2f\xfd':
+                if zstandard is None:
+                    return members, small, '校验 zstd 压缩的 tar 需要安装 zstandard（pip install zstandard）'
+                raw.seek(0)
+                stream = zstandard.ZstdDecompressor().stream_reader(raw)
+                tar = tarfile.open(fileobj=stream, mode='r|')
+            else:
+                raw.seek(0)
+                tar = tarfile.open(fileobj=raw, mode='r|*')
+            with tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    name = _archive_member_name(member.name)
+                    digest = hashlib.sha256()
+                    source = tar.extractfile(member)
+                    data = bytearray()
+                    while True:
+                        chunk = source.read(VERIFY_READ_SIZE)
+                        if not chunk:
+                            break
+                        digest.update(chunk)
+                        if member.size <= VERIFY_SMALL_MEMBER:
+                            data += chunk
+                    members[name] = (member.size, 'sha256:' + digest.hexdigest())
+                    if member.size <= VERIFY_SMALL_MEMBER:
+                        small[name] = bytes(data)
+    except (OSError, EOFError, tarfile.TarError, zlib.error) as e:
+        return members, small, str(e)
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            return members, small, str(e)
+        raise
+    return members, small, None
+
+
+def _verify_dir_kind(path: str) -> Optional[str]:
+    """目录的类型：有 index.json 的是 OCI 镜像布局（'oci'），有以 digest 命名的文件的是 blob 仓库（'cache'），其他返回 None"""
+    if os.path.exists(os.path.join(path, 'index.json')):
+        return 'oci'
+    if any(re.fullmatch(r'[0-9a-f]{64}(\.tar)?', name) for name in os.listdir(path)):
+        return 'cache'
+    return None
+
+
+def expand_verify_paths(paths: List[str]) -> List[str]:
+    """verify 的路径参数：文件、OCI 镜像布局和 blob 仓库原样保留；其他目录（如拉取的输出目录）递归展开为
+    其中的 tar（含 .tar.gz / .tar.zst）、OCI 镜像布局和 blob 仓库，什么都没有的目录原样保留，校验时报告无法识别"""
+    def _walk(path: str) -> List[str]:
+        if _verify_dir_kind(path):
+            return [path]
+        found = []
+        for name in sorted(os.listdir(path)):
+            full = os.path.join(path, name)
+            if os.path.isdir(full):
+                found.extend(_walk(full))
+            elif name.endswith(('.tar', '.tar.gz', '.tgz', '.tar.zst')):
+                found.append(full)
+        return found
+
+    expanded = []
+    for path in paths:
+        expanded.extend((_walk(path) or [path]) if os.path.isdir(path) else [path])
+    return expanded
+
+
+def _archive_member_name(name: str) -> str:
+    """规范化 tar 成员名（去掉开头的 / 和 ./）"""
+    while name.startswith(('/', './')):
+        name = name[2:] if name.startswith('./') else name[1:]
+    return name
+
+
+class VerifySource:
+    """verify 的一个检查对象：docker-archive / 差量包的 tar（可以是压缩的）、OCI 镜像布局目录或 blob 仓库目录，
+    无法识别的目录 kind 为 'dir'，没有成员。
+
+    members 为成员名 → (所在文件, 偏移, 大小)；压缩的 tar 无法按偏移读取，由 _verify_compressed_archive
+    解压一遍后填入 digests（成员名 → (大小, sha256)）和 small（小成员的内容）。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.kind = 'archive'
+        self.members: Dict[str, Tuple[str, int, int]] = {}
+        self.digests: Dict[str, Tuple[int, str]] = {}
+        self.small: Dict[str, bytes] = {}
+        self.error: Optional[str] = None
+        if os.path.isdir(path):
+            self.kind = _verify_dir_kind(path) or 'dir'
+            if self.kind == 'oci':
+                for root, _, files in os.walk(path):
+                    for name in files:
+                        full = os.path.join(root, name)
+                        self.members[os.path.relpath(full, path).replace(os.sep, '/')] = (full, 0, os.path.getsize(full))
+            elif self.kind == 'cache':
+                for name in os.listdir(path):
+                    if re.fullmatch(r'[0-9a-f]{64}(\.tar)?', name):
+                        full = os.path.join(path, name)
+                        self.members[name] = (full, 0, os.path.getsize(full))
+            return
+        with open(path, 'rb') as f:
+            magic = f.read(4)
+        if magic[:2] == b'\x1f\x8b' or magic == b'\x28\xb5\x2f\xfd':
+            self.kind = 'compressed'
+            return
+        try:
+            with tarfile.open(path, 'r:') as tar:
+                for member in tar:
+                    if member.isfile():
+                        self.members[_archive_member_name(member.name)] = (path, member.offset_data, member.size)
+        except (OSError, tarfile.TarError) as e:
+            self.error = str(e)
+
+    def names(self) -> set:
+        return set(self.members) | set(self.digests)
+
+    def read(self, name: str) -> Optional[bytes]:
+        """读取清单、配置等小成员，不存在或过大时返回 None"""
+        if name in self.small:
+            return self.small[name]
+        if name not in self.members:
+            return None
+        file, offset, size = self.members[name]
+        if size > VERIFY_SMALL_MEMBER:
+            return None
+        with open(file, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def read_json(self, name: str) -> Any:
+        data = self.read(name)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def plan_checks(self, deep: bool = False) -> Tuple[List[Tuple[str, str, Optional[int], bool, str]], List[Dict[str, Any]]]:
+        """按清单、配置和 diff_id 列出要校验的成员，返回 (检查项, 结构问题)。
+
+        检查项为 (成员名, 期望的 sha256, 期望的大小, 是否按解压后内容校验, 说明)；
+        deep 时 OCI 布局中的 gzip 层也解压校验 diff_id。
+        """
+        checks: Dict[Tuple[str, bool], Tuple[str, str, Optional[int], bool, str]] = {}
+        problems: List[Dict[str, Any]] = []
+        names = self.names()
+
+        def _check(name: str, expected: str, size: Optional[int], decompressed: bool, what: str):
+            checks.setdefault((name, decompressed), (name, expected, size, decompressed, what))
+
+        def _missing(name: str, what: str):
+            problems.append({'member': name, 'problem': 'missing', 'kind': what})
+
+        if self.kind == 'cache':
+            # blob 仓库：文件名即 digest；解压后的层按缓存的清单和配置中的 diff_id 校验
+            diff_ids: Dict[str, str] = {}
+            for name in names:
+                if not name.endswith('.tar'):
+                    _check(name, f'sha256:{name}', None, False, 'blob')
+                    manifest = self.read_json(name)
+                    if isinstance(manifest, dict) and 'layers' in manifest and 'config' in manifest:
+                        config = self.read_json(manifest['config'].get('digest', '')[7:])
+                        if isinstance(config, dict):
+                            diff_ids.update(zip((layer['digest'] for layer in manifest['layers']),
+                                                config.get('rootfs', {}).get('diff_ids', [])))
+            for name in names:
+                if name.endswith('.tar') and f'sha256:{name[:-4]}' in diff_ids:
+                    _check(name, diff_ids[f'sha256:{name[:-4]}'], None, False, '解压后的层')
+            return list(checks.values()), problems
+
+        if 'manifest.json' not in names and 'index.json' not in names:
+            problems.append({'member': '', 'problem': 'unrecognized', 'kind': '既没有 manifest.json 也没有 index.json'})
+            return [], problems
+
+        # docker-archive：配置文件名是配置的 digest，每层的 layer.tar 对应配置中的 diff_id
+        for entry in self.read_json('manifest.json') or []:
+            config_name = entry.get('Config', '')
+            match = re.search(r'([0-9a-f]{64})(\.json)?$', config_name)
+            if config_name not in names:
+                _missing(config_name, 'config')
+                continue
+            if match:
+                _check(config_name, f'sha256:{match.group(1)}', None, False, 'config')
+            config = self.read_json(config_name) or {}
+            expected = config.get('rootfs', {}).get('diff_ids', [])
+            layers = entry.get('Layers', [])
+            if len(layers) != len(expected):
+                problems.append({'member': config_name, 'problem': 'mismatch',
+                                 'kind': f'manifest.json 有 {len(layers)} 层，配置中有 {len(expected)} 个 diff_id'})
+            for layer, diff_id in zip(layers, expected):
+                if layer in names:
+                    _check(layer, diff_id, None, False, 'layer')
+                else:
+                    _missing(layer, 'layer')
+
+        # OCI 布局（目录、差量包或新版 docker save 的输出）：从 index.json 沿描述符遍历
+        if 'index.json' in names:
+            omitted = (self.read_json(BUNDLE_FILE) or {}).get('omitted', {})
+            pending = list((self.read_json('index.json') or {}).get('manifests', []))
+            seen = set()
+            while pending:
+                descriptor = pending.pop()
+                digest = descriptor.get('digest', '')
+                if digest in seen:
+                    continue
+                seen.add(digest)
+                media_type = descriptor.get('mediaType', '')
+                name = f'blobs/sha256/{digest[7:]}'
+                if name not in names:
+                    if digest not in omitted:
+                        _missing(name, media_type or 'blob')
+                    continue
+                _check(name, digest, descriptor.get('size'), False, media_type or 'blob')
+                document = self.read_json(name) if 'manifest' in media_type or 'index' in media_type else None
+                if not isinstance(document, dict):
+                    continue
+                pending.extend(document.get('manifests', []))
+                if 'config' in document:
+                    pending.append(document['config'])
+                    pending.extend(document.get('layers', []))
+                    if deep:
+                        config = self.read_json(f"blobs/sha256/{document['config'].get('digest', '')[7:]}") or {}
+                        for layer, diff_id in zip(document.get('layers', []), config.get('rootfs', {}).get('diff_ids', [])):
+                            layer_name = f"blobs/sha256/{layer['digest'][7:]}"
+                            if layer_name in names and layer.get('mediaType') in OCI_GZIP_LAYER_TYPES:
+                                _check(layer_name, diff_id, None, True, 'diff_id')
+            # 没有被引用的 blob 也按文件名校验
+            for name in names:
+                if name.startswith('blobs/sha256/') and (name, False) not in checks:
+                    _check(name, f'sha256:{name[13:]}', None, False, 'blob')
+        return list(checks.values()), problems
+
+
+def _load_verify_state(path: str) -> Dict[str, Dict[str, Any]]:
+    """读取 verify 的增量状态（每个文件的大小、修改时间和已算出的 digest），不存在或损坏时返回空状态"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('files', {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f'读取校验状态失败，将重新校验全部文件: {e}')
+        return {}
+
+
+def _save_verify_state(path: str, state: Dict[str, Dict[str, Any]]):
+    """保存 verify 的增量状态（临时文件 + 原子重命名）"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'files': state}, f)
+    os.replace(tmp_path, path)
+
+
+def verify_paths(
+    paths: List[str],
+    jobs: int = 0,
+    deep: bool = False,
+    state_path: Optional[str] = VERIFY_STATE_FILE,
+    full: bool = False,
+    on_issue: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> Tuple[int, int]:
+    """校验 docker-archive tar、差量包、OCI 镜像布局和 blob 仓库中每个 blob 的 sha256，返回 (检查项数, 问题数)。
+
+    目录按 expand_verify_paths 展开；没有任何可校验内容的路径（空目录、空的 blob 仓库等）报告为无法识别。
+    读取和计算 sha256 分配到 jobs 个进程（默认 CPU 数），按文件在磁盘上的物理位置排序后顺序读取；
+    state_path 记录每个文件的大小、修改时间和算出的 digest，两者都未变化的文件不再读取（full 时全部重新读取，
+    但仍更新状态）；压缩的 tar 只能整体校验，上次没有问题且未变化时整个跳过。每个问题（缺失、损坏、大小不符等）以字典传给 on_issue。
+    """
+    state = _load_verify_state(state_path) if state_path else {}
+    paths = expand_verify_paths(paths)
+    sources = []
+    issues = 0
+    failed = set()
+
+    def _unchanged(path: str) -> Optional[Dict[str, Any]]:
+        st = os.stat(path)
+        entry = state.get(os.path.abspath(path))
+        if full or not entry or entry.get('size') != st.st_size or entry.get('mtime_ns') != st.st_mtime_ns:
+            return None
+        return entry
+
+    def _report(source: VerifySource, issue: Dict[str, Any]):
+        nonlocal issues
+        issues += 1
+        failed.add(source.path)
+        issue = {'path': source.path, **issue}
+        if on_issue:
+            on_issue(issue)
+
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as executor:
+        # 压缩的 tar 只能整体顺序解压，每个占用一个进程，先提交
+        streamed = {}
+        for path in paths:
+            source = VerifySource(path)
+            if source.kind == 'compressed' and (_unchanged(path) or {}).get('verified'):
+                logger.info(f'⏭️ {path} 上次校验通过且未变化，跳过')
+                continue
+            sources.append(source)
+            if source.kind == 'compressed':
+                streamed[executor.submit(_verify_compressed_archive, path)] = source
+
+        # 其余按成员所在文件和偏移生成读取任务，已校验且未变化的跳过
+        planned = []
+        wanted: Dict[Tuple[str, int, int], bool] = {}
+        for source in sources:
+            if source.kind == 'compressed':
+                continue
+            if source.error:
+                _report(source, {'member': '', 'problem': 'unreadable', 'kind': 'archive', 'error': source.error})
+                continue
+            checks, problems = source.plan_checks(deep)
+            if not checks and not problems:
+                problems.append({'member': '', 'problem': 'unrecognized', 'kind': '没有可校验的内容'})
+            for problem in problems:
+                _report(source, problem)
+            planned.append((source, checks))
+            for name, _, _, decompressed, _ in checks:
+                location = source.members[name]
+                wanted[location] = wanted.get(location, False) or decompressed
+
+        stats: Dict[str, os.stat_result] = {}
+        results: Dict[Tuple[str, int, int, bool], Tuple[Optional[str], int, Optional[str]]] = {}
+        pending = []
+        for (file, offset, size), decompressed in wanted.items():
+            if file not in stats:
+                stats[file] = os.stat(file)
+            cached = _unchanged(file)
+            if cached:
+                raw = cached.get('digests', {}).get(f'{offset}:{size}')
+                inner = cached.get('digests', {}).get(f'{offset}:{size}:gunzip')
+                if raw and (inner or not decompressed):
+                    results[(file, offset, size, False)] = (raw, size, None)
+                    if inner:
+                        results[(file, offset, size, True)] = (inner, size, None)
+                    continue
+            pending.append((file, offset, size, decompressed))
+
+        locations = {file: _physical_offset(file) for file in {job[0] for job in pending}}
+        pending.sort(key=lambda job: (locations[job[0]][0], locations[job[0]][1] + job[1]))
+        total = sum(job[2] for job in pending)
+        skipped = len(wanted) - len(pending)
+        logger.info(f'🔍 校验 {len(sources)} 个路径：读取 {len(pending)} 个文件/成员（{LayerProgress.format_size(total)}），'
+                    f'跳过 {skipped} 个未变化的')
+        started = last_log = time.time()
+        done_bytes = 0
+        chunksize = max(1, min(64, len(pending) // ((jobs or os.cpu_count() or 1) * 8)))
+        for job, (raw, inner, read, error, inner_error) in zip(pending, executor.map(_verify_hash_job, pending,
+                                                                                  chunksize=chunksize)):
+            file, offset, size, decompressed = job
+            results[(file, offset, size, False)] = (raw, read, error)
+            if decompressed:
+                results[(file, offset, size, True)] = (inner, read, error or inner_error)
+            if not error and read == size:
+                entry = state.setdefault(os.path.abspath(file), {})
+                if entry.get('size') != stats[file].st_size or entry.get('mtime_ns') != stats[file].st_mtime_ns:
+                    entry.clear()
+                    entry.update(size=stats[file].st_size, mtime_ns=stats[file].st_mtime_ns, digests={})
+                entry['digests'][f'{offset}:{size}'] = raw
+                if inner:
+                    entry['digests'][f'{offset}:{size}:gunzip'] = inner
+            done_bytes += size
+            if time.time() - last_log >= 5:
+                last_log = time.time()
+                speed = done_bytes / max(last_log - started, 1e-6)
+                logger.info(f'⏳ 已校验 {LayerProgress.format_size(done_bytes)} / {LayerProgress.format_size(total)}'
+                            f'（{LayerProgress.format_size(speed)}/s）')
+
+        checked = 0
+        for source, checks in planned:
+            for name, expected, expected_size, decompressed, what in checks:
+                checked += 1
+                file, offset, size = source.members[name]
+                actual, read, error = results[(file, offset, size, decompressed)]
+                if error or read != size:
+                    _report(source, {'member': name, 'problem': 'unreadable', 'kind': what,
+                                     'error': error or f'只读到 {read} / {size} 字节'})
+                elif actual != expected:
+                    _report(source, {'member': name, 'problem': 'corrupted', 'kind': what,
+                                     'expected': expected, 'actual': actual})
+                elif expected_size is not None and expected_size != size:
+                    _report(source, {'member': name, 'problem': 'size', 'kind': what,
+                                     'expected': expected_size, 'actual': size})
+
+        for future, source in streamed.items():
+            source.digests, source.small, source.error = future.result()
+            if source.error:
+                # 解压中断时后面的成员都读不到，不再逐项报告缺失
+                _report(source, {'member': '', 'problem': 'unreadable', 'kind': 'archive', 'error': source.error})
+                continue
+            checks, problems = source.plan_checks()
+            if not checks and not problems:
+                problems.append({'member': '', 'problem': 'unrecognized', 'kind': '没有可校验的内容'})
+            for problem in problems:
+                _report(source, problem)
+            for name, expected, expected_size, _, what in checks:
+                checked += 1
+                size, actual = source.digests[name]
+                if actual != expected:
+                    _report(source, {'member': name, 'problem': 'corrupted', 'kind': what,
+                                     'expected': expected, 'actual': actual})
+                elif expected_size is not None and expected_size != size:
+                    _report(source, {'member': name, 'problem': 'size', 'kind': what,
+                                     'expected': expected_size, 'actual': size})
+            st = os.stat(source.path)
+            state[os.path.abspath(source.path)] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                                                   'verified': source.path not in failed}
+
+    if state_path:
+        _save_verify_state(state_path, state)
+    elapsed = time.time() - started
+    logger.info(f'📊 校验完成：{checked} 项，问题 {issues} 个，读取 {LayerProgress.format_size(done_bytes)}，'
+                f'耗时 {DownloadStats().format_time(elapsed)}'
+                + (f'（{LayerProgress.format_size(done_bytes / elapsed)}/s）' if elapsed > 0 and done_bytes else ''))
+    return checked, issues
+
+
+VERIFY_PROBLEMS = {'missing': '缺失', 'corrupted': '损坏', 'size': '大小不符', 'unreadable': '无法读取',
+                   'mismatch': '不一致', 'unrecognized': '无法识别'}
+
+
+def cmd_verify(argv: List[str]) -> int:
+    """verify 子命令：校验导出的 tar、差量包、OCI 镜像布局和 blob 仓库的完整性"""
+    parser = argparse.ArgumentParser(
+        prog=f'{os.path.basename(sys.argv[0])} verify',
+        description="校验 docker-archive tar（含 .tar.gz / .tar.zst）、差量包、OCI 镜像布局目录和 blob 仓库目录："
+                    "按清单、配置和 diff_id 计算每个 blob 的 sha256，报告缺失或损坏的成员",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  %(prog)s ./offline/images.tar ./offline/blobs
+  %(prog)s ./output
+  %(prog)s ./offline/*.tar --jobs 8 --json > verify-report.ndjson
+  %(prog)s ./oci-layout --deep --full
+            """
+    )
+    parser.add_argument("paths", nargs='+', help="docker-archive tar、差量包、OCI 镜像布局目录或 blob 仓库目录（输出目录下的 blobs）；"
+                                                 "其他目录（如输出目录）展开为其中的 tar、OCI 镜像布局和 blob 仓库")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="计算 sha256 的进程数，默认 CPU 数")
+    parser.add_argument("--deep", action="store_true", help="OCI 布局中的 gzip 层也解压校验 diff_id（需要额外的 CPU）")
+    parser.add_argument("--state", default=VERIFY_STATE_FILE,
+                        help=f"增量校验状态文件，大小和修改时间都未变化的文件不再读取，默认 {VERIFY_STATE_FILE}")
+    parser.add_argument("--full", action="store_true", help="忽略增量状态，重新读取全部文件")
+    parser.add_argument("--json", action="store_true", help="每个问题输出一行 JSON 记录，便于脚本处理")
+    parser.add_argument("--debug", action="store_true", help="启用调试模式")
+    args = parser.parse_args(argv)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    for path in args.paths:
+        if not os.path.exists(path):
+            logger.error(f'❌ 路径不存在: {path}')
+            return 1
+
+    def _on_issue(issue: Dict[str, Any]):
+        if args.json:
+            print(json.dumps(issue, ensure_ascii=False))
+            return
+        detail = f"：期望 {issue['expected']}，实际 {issue['actual']}" if 'expected' in issue else \
+            f"：{issue['error']}" if 'error' in issue else ''
+        logger.error(f"❌ {VERIFY_PROBLEMS[issue['problem']]} {issue['path']} {issue['member']} ({issue['kind']}){detail}")
+
+    _, issues = verify_paths(args.paths, jobs=args.jobs, deep=args.deep, state_path=args.state, full=args.full,
+                             on_issue=_on_issue)
+    return 0 if issues == 0 else 1
+
+
+COPY_CHUNK_SIZE = 16 * 1024 * 1024   # copy 每次 PATCH 上传的块大小，每个在途 blob 最多缓冲约 4 块
+
+
+class RegistryCopier:
+    """仓库到仓库的镜像复制：blob 从源仓库流式读取后直接分块上传到目标仓库，不写本地文件。
+
+    目标仓库已有的 blob（HEAD 检查）跳过；同一目标仓库中其他镜像仓库已有的 blob 用跨仓库挂载，
+    候选来源为本次已推送过的镜像仓库、mount_from 和（源、目标是同一仓库时）源镜像仓库。
+    需要上传的 blob 在 workers 个线程中并发复制，单个 blob 的块按顺序 PATCH（协议要求），
+    下一块在上传当前块时预读，内存占用约为 workers × 4 × chunk_size。清单在全部 blob 就绪后最后推送。
+    """
+
+    def __init__(self, session: requests.Session, src_auth: RegistryAuthCache, dst_auth: RegistryAuthCache,
+                 workers: int = 4, chunk_size: int = COPY_CHUNK_SIZE, mount_from: Tuple[str, ...] = (),
+                 ctx: Optional[PullContext] = None):
+        self.session = session
+        self.ctx = ctx
+        self.src_auth = src_auth
+        self.dst_auth = dst_auth
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.mount_from = tuple(mount_from)
+        self.stats = {'existing': 0, 'mounted': 0, 'uploaded': 0, 'uploaded_bytes': 0}
+        self._known: Dict[Tuple[str, str], set] = {}   # (目标仓库, digest) → 已知含有该 blob 的镜像仓库
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        """是否已取消（所属上下文被取消或收到全局停止信号）"""
+        return (self.ctx or stop_event).is_set()
+
+    def _check_cancelled(self):
+        if self.cancelled:
+            raise InterruptedError('用户已取消操作')
+
+    def _request(self, auth: RegistryAuthCache, image: ImageInfo, method: str, url: str, desc: str,
+                 actions: str = 'pull', mount_from: Tuple[str, ...] = (), headers: Optional[Dict[str, str]] = None,
+                 **kwargs) -> requests.Response:
+        """带认证的请求，401 时丢弃缓存的 token 重试一次"""
+        for attempt in range(2):
+            request_headers = {**auth.auth_head(image, actions, mount_from), **(headers or {})}
+            resp = request_with_retry(self.session, method, url, desc, max_retries=3, headers=request_headers,
+                                      verify=False, ctx=self.ctx, **kwargs)
+            if resp.status_code != 401 or attempt:
+                return resp
+            resp.close()
+            auth.invalidate(image)
+        return resp
+
+    def _dst(self, image: ImageInfo, method: str, url: str, desc: str, **kwargs) -> requests.Response:
+        return self._request(self.dst_auth, image, method, url, desc, actions='pull,push', **kwargs)
+
+    def _remember(self, dst: ImageInfo, digest: str):
+        with self._lock:
+            self._known.setdefault((dst.registry, digest), set()).add(dst.repository)
+
+    def fetch_manifest(self, src: ImageInfo, reference: str) -> Tuple[bytes, str, str]:
+        """按标签或 digest 获取源清单的原始内容，返回 (内容, mediaType, digest)；推送时原样使用，digest 不变"""
+        url = f'{src.protocol}://{src.registry}/v2/{src.repository}/manifests/{reference}'
+        resp = self._request(self.src_auth, src, 'GET', url, '清单请求', paced=True)
+        if resp.status_code == 404:
+            raise LookupError(f'镜像 {src.repository}:{reference} 不存在')
+        resp.raise_for_status()
+        data = resp.content
+        digest = 'sha256:' + hashlib.sha256(data).hexdigest()
+        if reference.startswith('sha256:') and digest != reference:
+            raise ValueError(f'清单内容与 digest 不符: 期望 {reference}，实际 {digest}')
+        media_type = json.loads(data).get('mediaType') or resp.headers.get('Content-Type', '').split(';')[0]
+        return data, media_type, digest
+
+    def _read_chunks(self, resp: requests.Response, chunks: 'queue.Queue', stop: threading.Event):
+        """预读线程：把源 blob 切成 chunk_size 的块放入有界队列，出错时放入异常，结束时放入 None"""
+        def _put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            buffer = bytearray()
+            for piece in resp.iter_content(RECV_BUFFER_SIZE):
+                buffer += piece
+                if len(buffer) >= self.chunk_size:
+                    if not _put(bytes(buffer)):
+                        return
+                    buffer.clear()
+            if buffer and not _put(bytes(buffer)):
+                return
+            _put(None)
+        except Exception as e:
+            _put(e)
+        finally:
+            resp.close()
+
+    def copy_blob(self, src: ImageInfo, dst: ImageInfo, descriptor: Dict, attempts: int = 3) -> str:
+        """把一个 blob 复制到目标仓库，返回 existing（已存在）、mounted（跨仓库挂载）或 uploaded。
+
+        传输中断时重新开始上传，最多 attempts 次；取消时抛出 InterruptedError。
+        """
+        for attempt in range(1, attempts + 1):
+            try:
+                return self._copy_blob_once(src, dst, descriptor)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if attempt == attempts or self.cancelled:
+                    raise
+                logger.warning(f'复制 blob {descriptor["digest"][:19]} 失败，重新上传 ({attempt}/{attempts}): {e}')
+
+    def _copy_blob_once(self, src: ImageInfo, dst: ImageInfo, descriptor: Dict) -> str:
+        self._check_cancelled()
+        digest = descriptor['digest']
+        base = f'{dst.protocol}://{dst.registry}/v2/{dst.repository}/blobs'
+        resp = self._dst(dst, 'HEAD', f'{base}/{digest}', 'blob 检查')
+        if resp.status_code == 200:
+            self._remember(dst, digest)
+            return 'existing'
+
+        with self._lock:
+            candidates = set(self._known.get((dst.registry, digest), set())) | set(self.mount_from)
+        if src.registry == dst.registry:
+            candidates.add(src.repository)
+        candidates.discard(dst.repository)
+        location = None
+        for repo in sorted(candidates)[:3]:
+            resp = self._dst(dst, 'POST', f'{base}/uploads/?mount={quote(digest)}&from={quote(repo)}', '跨仓库挂载',
+                             mount_from=(repo,))
+            if resp.status_code == 201:
+                self._remember(dst, digest)
+                return 'mounted'
+            if resp.status_code == 202:
+                # 挂载不成功时仓库直接开始普通上传
+                location = urljoin(resp.url, resp.headers['Location'])
+                break
+        if location is None:
+            resp = self._dst(dst, 'POST', f'{base}/uploads/', '开始上传')
+            if resp.status_code != 202:
+                resp.raise_for_status()
+                raise requests.exceptions.HTTPError(f'开始上传返回 {resp.status_code}', response=resp)
+            location = urljoin(resp.url, resp.headers['Location'])
+
+        src_url = f'{src.protocol}://{src.registry}/v2/{src.repository}/blobs/{digest}'
+        source = self._request(self.src_auth, src, 'GET', src_url, '下载 blob', stream=True)
+        source.raise_for_status()
+        chunks: queue.Queue = queue.Queue(maxsize=2)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read_chunks, args=(source, chunks, stop), daemon=True)
+        reader.start()
+        sha256_hash = hashlib.sha256()
+        offset = 0
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                self._check_cancelled()
+                sha256_hash.update(chunk)
+                resp = self._dst(dst, 'PATCH', location, '上传 blob', data=chunk, headers={
+                    'Content-Type': 'application/octet-stream',
+                    'Content-Range': f'{offset}-{offset + len(chunk) - 1}',
+                })
+                if resp.status_code != 202:
+                    resp.raise_for_status()
+                    raise requests.exceptions.HTTPError(f'上传 blob 返回 {resp.status_code}', response=resp)
+                location = urljoin(location, resp.headers.get('Location', location))
+                offset += len(chunk)
+        except BaseException:
+            # 放弃本次上传会话，重试时重新开始
+            try:
+                self._dst(dst, 'DELETE', location, '取消上传')
+            except requests.exceptions.RequestException:
+                pass
+            raise
+        finally:
+            stop.set()
+            reader.join()
+
+        actual = 'sha256:' + sha256_hash.hexdigest()
+        if actual != digest:
+            self._dst(dst, 'DELETE', location, '取消上传')
+            raise ValueError(f'blob 内容与 digest 不符: 期望 {digest}，实际 {actual}')
+        separator = '&' if '?' in location else '?'
+        resp = self._dst(dst, 'PUT', f'{location}{separator}digest={quote(digest)}', '完成上传',
+                         headers={'Content-Length': '0'})
+        if resp.status_code not in (201, 204):
+            resp.raise_for_status()
+            raise requests.exceptions.HTTPError(f'完成上传返回 {resp.status_code}', response=resp)
+        self._remember(dst, digest)
+        with self._lock:
+            self.stats['uploaded_bytes'] += offset
+        return 'uploaded'
+
+    def push_manifest(self, dst: ImageInfo, reference: str, data: bytes, media_type: str):
+        """推送清单的原始内容（按 digest 或标签）"""
+        url = f'{dst.protocol}://{dst.registry}/v2/{dst.repository}/manifests/{reference}'
+        resp = self._dst(dst, 'PUT', url, '推送清单', data=data, headers={'Content-Type': media_type})
+        if resp.status_code not in (200, 201, 202):
+            raise requests.exceptions.HTTPError(f'推送清单 {reference} 返回 {resp.status_code}: {resp.text[:200]}',
+                                                response=resp)
+
+    def copy(self, src: ImageInfo, dst: ImageInfo, arch: str = 'all') -> bool:
+        """复制一个镜像：arch 为 all 时原样复制索引（digest 不变），否则只复制指定平台。
+
+        目标为 digest 引用（repo@sha256:...）时只能原样复制，且源清单的 digest 必须与之相同。
+        """
+        target = f'{dst.registry}/{dst.repository}' + (f'@{dst.digest}' if dst.digest else f':{dst.tag}')
+        if dst.digest and parse_arch_list(arch) != ['all']:
+            raise ValueError(f'目标 {target} 是 digest 引用，不能只复制部分平台（重新生成的清单 digest 不同）')
+        data, media_type, digest = self.fetch_manifest(src, src.reference)
+        if dst.digest and digest != dst.digest:
+            raise ValueError(f'源清单的 digest {digest} 与目标 {target} 不符')
+        manifest = json.loads(data)
+        platforms: List[Tuple[bytes, str, str]] = []
+        top: Optional[Tuple[bytes, str]] = (data, media_type)
+        if 'manifests' in manifest:
+            entries = [m for m in manifest['manifests'] if m.get('platform', {}).get('architecture') not in (None, 'unknown')]
+            archs = parse_arch_list(arch)
+            if archs != ['all']:
+                selected = {a: select_manifest(entries, a) for a in archs}
+                missing = [a for a, d in selected.items() if not d]
+                if missing:
+                    raise LookupError(f'{src.repository}:{src.tag} 没有以下平台: {", ".join(missing)}')
+                kept = [m for m in manifest['manifests'] if m['digest'] in selected.values()]
+                if len(kept) == 1:
+                    top = None
+                else:
+                    # 只保留选中平台的新索引，digest 与源索引不同
+                    top = (json.dumps({**manifest, 'manifests': kept}).encode('utf-8'), media_type)
+                children = kept
+            else:
+                children = manifest['manifests']
+            platforms = [self.fetch_manifest(src, d) for d in dict.fromkeys(child['digest'] for child in children)]
+            if top is None:
+                top = platforms[0][:2]
+        else:
+            platforms = [(data, media_type, digest)]
+
+        # 所有平台的 blob 去重后并发复制，跳过不可分发的外部层
+        blobs: Dict[str, Dict] = {}
+        for platform_data, _, _ in platforms:
+            platform_manifest = json.loads(platform_data)
+            for descriptor in [platform_manifest['config']] + platform_manifest.get('layers', []):
+                if descriptor.get('urls') and 'foreign' in descriptor.get('mediaType', ''):
+                    continue
+                blobs.setdefault(descriptor['digest'], descriptor)
+        total = sum(d.get('size', 0) for d in blobs.values())
+        logger.info(f'📋 {src.registry}/{src.repository}:{src.tag} → {target}：'
+                    f'{len(platforms)} 个平台，{len(blobs)} 个 blob（{LayerProgress.format_size(total)}）')
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.copy_blob, src, dst, d): d for d in blobs.values()}
+            for future in as_completed(futures):
+                descriptor = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed += 1
+                    logger.error(f'❌ 复制 blob {descriptor["digest"][:19]} 失败: {e}')
+                    continue
+                with self._lock:
+                    self.stats[result] += 1
+                label = {'existing': '已存在，跳过', 'mounted': '跨仓库挂载', 'uploaded': '已上传'}[result]
+                logger.info(f'{"⬆️" if result == "uploaded" else "⏭️"} {descriptor["digest"][:19]} '
+                            f'({LayerProgress.format_size(descriptor.get("size", 0))}) {label}')
+        if failed or self.cancelled:
+            logger.error(f'❌ {failed} 个 blob 复制失败或已取消，不推送清单')
+            return False
+
+        # blob 全部就绪后再推送清单：先各平台清单（按 digest），最后是标签指向的索引或清单
+        if len(platforms) > 1 or top[0] is not platforms[0][0]:
+            for platform_data, platform_type, platform_digest in platforms:
+                self.push_manifest(dst, platform_digest, platform_data, platform_type)
+        self.push_manifest(dst, dst.digest or dst.tag, *top)
+        logger.info(f'✅ 已复制到 {target}')
+        return True
+
 
-    # 添加GUI日志处理器
-    gui_handler = None
-    if log_callback:
-        gui_handler = GUILogHandler(log_callback)
-        gui_handler.setLevel(logging.INFO)
-        formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
-        gui_handler.setFormatter(formatter)
-        logger.addHandler(gui_handler)
-        
-        # 配置 urllib3 日志，使其在连接超时时能在GUI中显示警告信息
-        # 这样可以捕获类似 "Retrying...connection broken by 'ConnectTimeoutError'..." 的警告
-        urllib3_logger = logging.getLogger("urllib3.connectionpool")
-        urllib3_logger.setLevel(logging.WARNING)
-        urllib3_logger.addHandler(gui_handler)
+def _copy_target(ref: str) -> Tuple[str, str]:
+    """解析 copy --from-file 中的一行：源镜像和目标镜像以空白分隔"""
+    parts = ref.split()
+    if len(parts) != 2:
+        raise ValueError(f'格式应为 "SRC DST": {ref}')
+    return parts[0], parts[1]
+
+
+def cmd_copy(argv: List[str]) -> int:
+    """copy 子命令：把镜像从一个仓库直接复制到另一个仓库，不落盘、不需要 Docker"""
+    parser = argparse.ArgumentParser(
+        prog=f'{os.path.basename(sys.argv[0])} copy',
+        description="把镜像（默认含全部平台）从源仓库直接复制到目标仓库：blob 流式转发、目标已有的跳过，清单最后推送",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  %(prog)s nginx:1.27 harbor.example.com/library/nginx:1.27 --dest-username admin --dest-password secret
+  %(prog)s alpine:3.20 http://127.0.0.1:5000/mirror/alpine -a amd64,arm64
+  %(prog)s --from-file mirror.txt -r docker.1ms.run
+            """
+    )
+    parser.add_argument("src", nargs='?', help="源镜像（例如 nginx:1.27 或 ghcr.io/org/app@sha256:...）")
+    parser.add_argument("dst", nargs='?', help="目标镜像（例如 harbor.example.com/library/nginx:1.27，不写标签时沿用源标签）")
+    parser.add_argument("--from-file", metavar="FILE", help="从文件读取要复制的镜像，每行一对 SRC DST")
+    parser.add_argument("-r", "--custom-registry", help="源镜像的仓库地址（镜像站），目标镜像需写完整地址")
+    parser.add_argument("-a", "--arch", default="all",
+                        help="要复制的平台，默认 all（原样复制索引）；多个用逗号分隔。目标为 digest 引用时只能为 all")
+    parser.add_argument("-u", "--username", help="源仓库用户名")
+    parser.add_argument("-p", "--password", help="源仓库密码")
+    parser.add_argument("--dest-username", help="目标仓库用户名")
+    parser.add_argument("--dest-password", help="目标仓库密码")
+    parser.add_argument("--workers", type=int, default=4, help="同时复制的 blob 数，默认4")
+    parser.add_argument("--chunk-size", type=int, default=COPY_CHUNK_SIZE // 1024 // 1024,
+                        help=f"每次上传的块大小（MB），默认{COPY_CHUNK_SIZE // 1024 // 1024}")
+    parser.add_argument("--mount-from", action="append", default=[], metavar="REPO",
+                        help="目标仓库中可能已有相同层的镜像仓库（例如 library/nginx），用于跨仓库挂载，可重复指定")
+    parser.add_argument("--no-http2", action="store_true", help="禁用 HTTP/2 传输")
+    parser.add_argument("--debug", action="store_true", help="启用调试模式")
+    args = parser.parse_args(argv)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    if args.no_http2:
+        SessionManager.http2_enabled = False
 
     try:
-        if debug:
-            logger.setLevel(logging.DEBUG)
+        if args.from_file:
+            pairs = [_copy_target(line) for line in read_image_list(args.from_file)]
+        elif args.src and args.dst:
+            pairs = [(args.src, args.dst)]
+        else:
+            parser.error('需要 SRC 和 DST，或者 --from-file')
+    except (OSError, ValueError) as e:
+        logger.error(f'❌ {e}')
+        return 1
+
+    session = SessionManager.get_session()
+    copier = RegistryCopier(
+        session,
+        RegistryAuthCache(session, args.username, args.password),
+        RegistryAuthCache(session, args.dest_username, args.dest_password),
+        workers=args.workers,
+        chunk_size=args.chunk_size * 1024 * 1024,
+        mount_from=tuple(args.mount_from),
+    )
+    started = time.time()
+    failed = 0
+    for position, (src_ref, dst_ref) in enumerate(pairs):
+        if copier.cancelled:
+            logger.info('⚠️ 用户取消操作。')
+            failed += len(pairs) - position
+            break
+        try:
+            src = parse_image_input(src_ref, args.custom_registry)
+            dst = parse_image_input(dst_ref)
+            if ':' not in dst_ref.split('@')[0].rsplit('/', 1)[-1]:
+                dst.tag = src.tag
+            if not copier.copy(src, dst, args.arch):
+                failed += 1
+        except Exception as e:
+            failed += 1
+            logger.error(f'❌ 复制 {src_ref} 失败: {e}')
+    elapsed = time.time() - started
+    stats = copier.stats
+    logger.info(f'📊 复制完成：成功 {len(pairs) - failed} 个，失败 {failed} 个；blob 已存在 {stats["existing"]} 个，'
+                f'跨仓库挂载 {stats["mounted"]} 个，上传 {stats["uploaded"]} 个'
+                f'（{LayerProgress.format_size(stats["uploaded_bytes"])}，'
+                f'{LayerProgress.format_size(stats["uploaded_bytes"] / max(elapsed, 1e-6))}/s）')
+    return 0 if failed == 0 else 1
 
-        logger.info("准备下载...")
-        
-        image_info = parse_image_input(image, registry)
-        
-        logger.info(f"开始拉取镜像：{image_info.image_name}:{image_info.tag}")
-        logger.info(f"仓库地址：{image_info.registry}")
-        logger.info(f"架构：{arch}")
 
-        session = SessionManager.get_session()
-        
-        # 处理认证
-        auth_head, auth_success, error_msg = _handle_authentication(
-            session, image_info.registry, image_info.repository, username, password, image_info.protocol
-        )
-        
-        if not auth_success:
-            logger.error(f'❌ {error_msg}')
-            if 'auth.json' in str(error_msg) or '用户名' in str(error_msg):
-                logger.info('💡 提示：可以在 auth.json 文件中配置认证信息，或使用环境变量 DOCKER_REGISTRY_USERNAME/PASSWORD')
-            return
-        
-        # 获取manifest
-        resp, http_code = fetch_manifest(
-            session, image_info.registry, image_info.repository,
-            image_info.tag, auth_head, image_info.protocol
-        )
-        
-        # 如果返回401，尝试重新认证（某些仓库在获取manifest时才需要认证）
-        if http_code == 401:
-            logger.warning('⚠️ 获取清单时需要重新认证')
-            www_auth = resp.headers.get('WWW-Authenticate', '')
-            scheme, auth_url, reg_service = parse_www_authenticate(www_auth)
-            
-            # 重新加载凭据
-            user_from_file, pwd_from_file = load_auth_credentials(image_info.registry)
-            effective_username = username or user_from_file or os.environ.get('DOCKER_REGISTRY_USERNAME') or os.environ.get('REGISTRY_USERNAME')
-            effective_password = password or pwd_from_file or os.environ.get('DOCKER_REGISTRY_PASSWORD') or os.environ.get('REGISTRY_PASSWORD')
-            
-            if scheme and scheme.lower().startswith('bearer') and auth_url and reg_service and effective_username and effective_password:
-                try:
-                    auth_head = get_auth_head(
-                        session, auth_url, reg_service, image_info.repository,
-                        effective_username, effective_password
-                    )
-                    # 重试获取manifest
-                    resp, http_code = fetch_manifest(
-                        session, image_info.registry, image_info.repository,
-                        image_info.tag, auth_head, image_info.protocol
-                    )
-                except Exception as e:
-                    logger.error(f'❌ 重新认证失败: {e}')
-                    return
-            elif scheme and scheme.lower().startswith('basic') and effective_username and effective_password:
-                auth_head = _create_basic_auth_head(effective_username, effective_password)
-                resp, http_code = fetch_manifest(
-                    session, image_info.registry, image_info.repository,
-                    image_info.tag, auth_head, image_info.protocol
-                )
-            
-            if http_code == 401:
-                logger.error('❌ 认证失败，无法访问该镜像')
-                logger.info('💡 提示：请检查用户名和密码是否正确')
-                return
+SERVE_TAG_TTL = 60   # serve 缓存标签 → digest 解析结果的时间（秒），过期后向上游重新确认
+REGISTRY_NAME_RE = re.compile(r'^/v2/(?P<name>[a-z0-9]+(?:[._-]+[a-z0-9]+)*(?:/[a-z0-9]+(?:[._-]+[a-z0-9]+)*)*)'
+                              r'/(?P<kind>manifests|blobs)/(?P<ref>[^/]+)$')
 
-        if http_code != 200:
-            logger.error(f'❌ 获取清单失败，HTTP状态码: {http_code}')
-            return
 
+class _BlobFetch:
+    """一次进行中的上游 blob 下载：边下载边写入 .partial 文件，等待的客户端从文件中读取已到达的部分"""
+
+    def __init__(self, partial_path: Path):
+        self.partial_path = partial_path
+        self.file = open(partial_path, 'wb')
+        self.cond = threading.Condition()
+        self.size: Optional[int] = None
+        self.written = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.path: Optional[Path] = None
+
+
+class PullThroughRegistry:
+    """serve 的只读镜像仓库：清单和 blob 来自 blob 仓库（与批量拉取共用），缺失时通过上游拉取并缓存。
+
+    同一 blob 的并发请求只向上游发起一次下载，所有等待的客户端边下载边从同一个临时文件读取。
+    标签按 tag_ttl 缓存解析结果，上游不可用时使用过期的结果。
+    """
+
+    def __init__(self, store_dir: Path, upstream: str, protocol: str, auth: RegistryAuthCache,
+                 session: requests.Session, tag_ttl: float = SERVE_TAG_TTL):
+        self.store_dir = store_dir
+        self.upstream = upstream
+        self.protocol = protocol
+        self.auth = auth
+        self.session = session
+        self.tag_ttl = tag_ttl
+        self.stats = {'requests': 0, 'bytes': 0, 'hits': 0, 'upstream': 0, 'coalesced': 0}
+        self._tags: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._fetches: Dict[str, _BlobFetch] = {}
+        self._lock = threading.Lock()
+
+    def _image(self, name: str, reference: str) -> ImageInfo:
+        digest = reference if reference.startswith('sha256:') else None
+        return ImageInfo(self.upstream, name, name.rsplit('/', 1)[-1], reference if not digest else 'latest',
+                         self.protocol, digest)
+
+    def _auth_head(self, image: ImageInfo) -> Dict[str, str]:
+        return self.auth.auth_head(image)
+
+    def _count(self, key: str, value: int = 1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _resolve_tag(self, name: str, tag: str) -> str:
+        """标签 → 清单 digest：缓存未过期时直接使用，否则向上游 HEAD 确认，上游不可用时使用过期的缓存"""
+        with self._lock:
+            cached = self._tags.get((name, tag))
+        if cached and time.time() - cached[1] < self.tag_ttl:
+            return cached[0]
+        image = self._image(name, tag)
         try:
-            resp_json = resp.json()
-        except Exception as e:
-            logger.error(f'❌ 解析清单失败: {e}')
+            resp, digest = head_manifest(self.session, self.upstream, name, tag, self._auth_head(image), self.protocol)
+            if resp.status_code == 401:
+                self.auth.invalidate(image)
+                resp, digest = head_manifest(self.session, self.upstream, name, tag, self._auth_head(image), self.protocol)
+            if resp.status_code == 404:
+                raise LookupError(f'{name}:{tag} 不存在')
+            resp.raise_for_status()
+            if not digest:
+                # 个别仓库的 HEAD 不返回 digest，GET 一次并按内容计算
+                url = f'{self.protocol}://{self.upstream}/v2/{name}/manifests/{tag}'
+                resp = request_with_retry(self.session, 'GET', url, '清单请求', max_retries=3, paced=True,
+                                          headers=self._auth_head(image), verify=False)
+                resp.raise_for_status()
+                digest = 'sha256:' + hashlib.sha256(resp.content).hexdigest()
+                if read_cached_blob(self.store_dir, digest) is None:
+                    cache_blob_bytes(self.store_dir, digest, resp.content)
+        except requests.exceptions.RequestException as e:
+            if not cached:
+                raise
+            logger.warning(f'⚠️ 上游不可用，使用缓存的 {name}:{tag} → {cached[0][:19]}: {e}')
+            return cached[0]
+        with self._lock:
+            self._tags[(name, tag)] = (digest, time.time())
+        return digest
+
+    def manifest(self, name: str, reference: str) -> Tuple[bytes, str, str]:
+        """返回清单的 (原始内容, mediaType, digest)；按 digest 缓存在 blob 仓库中，缺失时从上游获取"""
+        digest = reference if reference.startswith('sha256:') else self._resolve_tag(name, reference)
+        data = read_cached_blob(self.store_dir, digest)
+        if data is None:
+            image = self._image(name, digest)
+            self._count('upstream')
+            fetch_pinned_manifest(self.session, image, digest, self.store_dir, lambda: self._auth_head(image))
+            data = read_cached_blob(self.store_dir, digest)
+        else:
+            self._count('hits')
+        document = json.loads(data)
+        media_type = document.get('mediaType') or (OCI_IMAGE_INDEX if 'manifests' in document else OCI_IMAGE_MANIFEST)
+        return data, media_type, digest
+
+    def blob(self, name: str, digest: str) -> Tuple[Optional[Path], Optional[_BlobFetch]]:
+        """已缓存时返回 (文件路径, None)，否则返回 (None, 进行中的上游下载)，同一 digest 只下载一次"""
+        path = self.store_dir / digest[7:]
+        if path.exists():
+            self._count('hits')
+            return path, None
+        with self._lock:
+            fetch = self._fetches.get(digest)
+            if fetch is not None:
+                self.stats['coalesced'] += 1
+                return None, fetch
+            if path.exists():
+                self.stats['hits'] += 1
+                return path, None
+            fetch = _BlobFetch(self.store_dir / f'{digest[7:]}.{threading.get_ident()}.partial')
+            self._fetches[digest] = fetch
+            self.stats['upstream'] += 1
+        threading.Thread(target=self._fetch_blob, args=(self._image(name, digest), digest, fetch, path),
+                         daemon=True).start()
+        return None, fetch
+
+    def _fetch_blob(self, image: ImageInfo, digest: str, fetch: _BlobFetch, path: Path):
+        url = f'{self.protocol}://{self.upstream}/v2/{image.repository}/blobs/{digest}'
+        try:
+            with fetch.file:
+                resp = request_with_retry(self.session, 'GET', url, 'blob 下载', max_retries=3,
+                                          headers=self._auth_head(image), verify=False, stream=True)
+                if resp.status_code == 401:
+                    resp.close()
+                    self.auth.invalidate(image)
+                    resp = request_with_retry(self.session, 'GET', url, 'blob 下载', max_retries=3,
+                                              headers=self._auth_head(image), verify=False, stream=True)
+                if resp.status_code == 404:
+                    raise LookupError(f'blob {digest} 不存在')
+                resp.raise_for_status()
+                with fetch.cond:
+                    length = resp.headers.get('Content-Length')
+                    fetch.size = int(length) if length and 'Content-Encoding' not in resp.headers else None
+                    fetch.cond.notify_all()
+                sha256_hash = hashlib.sha256()
+                with resp:
+                    for piece in resp.iter_content(RECV_BUFFER_SIZE):
+                        fetch.file.write(piece)
+                        fetch.file.flush()
+                        sha256_hash.update(piece)
+                        with fetch.cond:
+                            fetch.written += len(piece)
+                            fetch.cond.notify_all()
+            actual = 'sha256:' + sha256_hash.hexdigest()
+            if actual != digest:
+                raise ValueError(f'blob 内容与 digest 不符: 期望 {digest}，实际 {actual}')
+            with fetch.cond:
+                os.replace(fetch.partial_path, path)
+                fetch.path = path
+                fetch.size = fetch.written
+                fetch.done = True
+                fetch.cond.notify_all()
+            logger.info(f'📥 已缓存 {digest[:19]} ({LayerProgress.format_size(fetch.written)})')
+        except BaseException as e:
+            logger.error(f'❌ 从上游获取 blob {digest[:19]} 失败: {e}')
+            with fetch.cond:
+                fetch.error = e
+                fetch.cond.notify_all()
+            try:
+                os.remove(fetch.partial_path)
+            except OSError:
+                pass
+        finally:
+            with self._lock:
+                self._fetches.pop(digest, None)
+
+
+def _parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """解析单个字节范围的 Range 头，返回 (起始, 结束)（含结束位置）；没有或格式不支持时返回 None，无法满足时抛出 ValueError"""
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else:
+        start, end = max(size - int(match.group(2)), 0), size - 1
+    if start >= size or start > end:
+        raise ValueError('range not satisfiable')
+    return start, end
+
+
+class _RegistryRequestHandler(http.server.BaseHTTPRequestHandler):
+    """只读 Docker Registry v2 API：/v2/、清单和 blob（支持 Range），其他请求返回 UNSUPPORTED"""
+    protocol_version = 'HTTP/1.1'
+    server_version = f'docker-image-puller/{VERSION}'
+    registry: PullThroughRegistry
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+    def _error(self, status: int, code: str, message: str):
+        body = json.dumps({'errors': [{'code': code, 'message': message}]}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Docker-Distribution-API-Version', 'registry/2.0')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_headers(self, status: int, headers: Dict[str, str]):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Docker-Distribution-API-Version', 'registry/2.0')
+        self.end_headers()
+
+    def do_GET(self):
+        self.registry._count('requests')
+        if self.path.split('?')[0] in ('/v2', '/v2/'):
+            self._send_headers(200, {'Content-Type': 'application/json', 'Content-Length': '2'})
+            if self.command != 'HEAD':
+                self.wfile.write(b'{}')
+            return
+        match = REGISTRY_NAME_RE.match(self.path.split('?')[0])
+        if not match:
+            return self._error(404, 'NAME_UNKNOWN', '不支持的路径')
+        name, kind, ref = match.group('name', 'kind', 'ref')
+        if (kind == 'blobs' or ref.startswith('sha256:')) and not re.fullmatch(r'sha256:[0-9a-f]{64}', ref):
+            return self._error(400, 'DIGEST_INVALID', f'无效的 digest: {ref}')
+        try:
+            if kind == 'manifests':
+                self._serve_manifest(name, ref)
+            else:
+                self._serve_blob(name, ref)
+        except LookupError as e:
+            self._error(404, 'MANIFEST_UNKNOWN' if kind == 'manifests' else 'BLOB_UNKNOWN', str(e))
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code if e.response is not None else 502
+            if status in (401, 403):
+                self._error(status, 'DENIED', str(e))
+            elif status == 404:
+                self._error(404, 'MANIFEST_UNKNOWN' if kind == 'manifests' else 'BLOB_UNKNOWN', str(e))
+            else:
+                self._error(502, 'UNAVAILABLE', f'上游返回错误: {e}')
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self._error(502, 'UNAVAILABLE', f'上游不可用: {e}')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        except OSError as e:
+            # 缓存文件在发送过程中被删除或替换等：响应头可能已发出，只能断开连接让客户端重试
+            logger.warning(f'⚠️ 读取缓存失败 {self.path}: {e}')
+            self.close_connection = True
+
+    do_HEAD = do_GET
+
+    def _unsupported(self):
+        self._error(405, 'UNSUPPORTED', '只读仓库，不支持推送')
+
+    do_POST = do_PUT = do_PATCH = do_DELETE = _unsupported
+
+    def _serve_manifest(self, name: str, reference: str):
+        data, media_type, digest = self.registry.manifest(name, reference)
+        self._send_headers(200, {'Content-Type': media_type, 'Content-Length': str(len(data)),
+                                 'Docker-Content-Digest': digest, 'ETag': f'"{digest}"'})
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+            self.registry._count('bytes', len(data))
+
+    def _serve_blob(self, name: str, digest: str):
+        path, fetch = self.registry.blob(name, digest)
+        if fetch is not None:
+            with fetch.cond:
+                while fetch.size is None and not fetch.done and fetch.error is None:
+                    fetch.cond.wait()
+                if fetch.error is not None and fetch.written == 0:
+                    raise fetch.error
+                size = fetch.size
+                if fetch.done:
+                    path, fetch = fetch.path, None
+        if path is not None:
+            size = path.stat().st_size
+        if size is None:
+            # 上游没有给出长度：等下载完成后再从缓存发送
+            with fetch.cond:
+                while not fetch.done and fetch.error is None:
+                    fetch.cond.wait()
+                if fetch.error is not None:
+                    raise fetch.error
+                path, size, fetch = fetch.path, fetch.size, None
+
+        headers = {'Content-Type': 'application/octet-stream', 'Docker-Content-Digest': digest,
+                   'Accept-Ranges': 'bytes', 'ETag': f'"{digest}"'}
+        try:
+            byte_range = _parse_range(self.headers.get('Range'), size)
+        except ValueError:
+            return self._send_headers(416, {'Content-Range': f'bytes */{size}', 'Content-Length': '0'})
+        start, end = byte_range or (0, size - 1)
+        if byte_range:
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        headers['Content-Length'] = str(end - start + 1)
+        self._send_headers(206 if byte_range else 200, headers)
+        if self.command == 'HEAD' or size == 0:
             return
+        if fetch is None:
+            with open(path, 'rb') as f:
+                sent = self.connection.sendfile(f, start, end - start + 1)
+        else:
+            sent = self._stream_fetch(fetch, start, end)
+        self.registry._count('bytes', sent)
+
+    def _stream_fetch(self, fetch: _BlobFetch, start: int, end: int) -> int:
+        """从进行中的下载转发 [start, end]：已写入临时文件的部分立即发送，其余等待下载线程写入"""
+        with fetch.cond:
+            file = open(fetch.path if fetch.done else fetch.partial_path, 'rb')
+        position = start
+        with file:
+            while position <= end:
+                with fetch.cond:
+                    while fetch.written <= position and not fetch.done and fetch.error is None:
+                        fetch.cond.wait()
+                    if fetch.error is not None and fetch.written <= position:
+                        # 已经发送了响应头，只能断开连接让客户端重试
+                        self.close_connection = True
+                        raise ConnectionResetError(str(fetch.error))
+                    available = min(fetch.written, end + 1)
+                file.seek(position)
+                data = file.read(min(available - position, RECV_BUFFER_SIZE))
+                self.wfile.write(data)
+                position += len(data)
+        return position - start
+
+
+def cmd_serve(argv: List[str]) -> int:
+    """serve 子命令：把 blob 仓库作为只读的拉取缓存仓库提供给局域网中的其他机器"""
+    parser = argparse.ArgumentParser(
+        prog=f'{os.path.basename(sys.argv[0])} serve',
+        description="以只读 Docker Registry v2 API 提供 blob 仓库中的镜像，缓存中没有的清单和 blob 从上游拉取并缓存，"
+                    "其他机器可以直接 docker pull",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+  %(prog)s -o ./offline --listen 0.0.0.0:5000
+  %(prog)s -o ./cache -r docker.1ms.run
+  # 其他机器（需要把该地址加入 insecure-registries）：docker pull 192.168.1.10:5000/library/nginx:1.27
+            """
+    )
+    parser.add_argument("--listen", default="0.0.0.0:5000", help="监听地址，默认 0.0.0.0:5000")
+    parser.add_argument("-o", "--output", help="缓存目录（其中的 blobs 与批量拉取共用），默认为当前目录")
+    parser.add_argument("-r", "--custom-registry", default="registry-1.docker.io",
+                        help="上游仓库地址（可以是镜像站，http:// 前缀表示不使用 TLS），默认 Docker Hub")
+    parser.add_argument("-u", "--username", help="上游仓库用户名")
+    parser.add_argument("-p", "--password", help="上游仓库密码")
+    parser.add_argument("--tag-ttl", type=float, default=SERVE_TAG_TTL,
+                        help=f"标签解析结果的缓存时间（秒），默认{SERVE_TAG_TTL}；上游不可用时继续使用过期的结果")
+    parser.add_argument("--no-http2", action="store_true", help="禁用访问上游的 HTTP/2 传输")
+    parser.add_argument("--debug", action="store_true", help="启用调试模式，记录每个请求")
+    args = parser.parse_args(argv)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    if args.no_http2:
+        SessionManager.http2_enabled = False
+
+    upstream = args.custom_registry
+    protocol = 'http' if upstream.startswith('http://') else 'https'
+    upstream = upstream.split('://', 1)[-1].rstrip('/')
+    host, _, port = args.listen.rpartition(':')
+    store_dir = (Path(args.output) if args.output else Path.cwd()) / 'blobs'
+    store_dir.mkdir(parents=True, exist_ok=True)
+    for stale in store_dir.glob('*.partial'):
+        stale.unlink()
+
+    session = SessionManager.get_session()
+    registry = PullThroughRegistry(store_dir, upstream, protocol, RegistryAuthCache(session, args.username, args.password),
+                                   session, args.tag_ttl)
+    handler = type('RegistryRequestHandler', (_RegistryRequestHandler,), {'registry': registry})
+    server = http.server.ThreadingHTTPServer((host or '0.0.0.0', int(port)), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'🌐 只读镜像仓库已启动: http://{host or "0.0.0.0"}:{port}/v2/，上游 {protocol}://{upstream}，缓存 {store_dir}')
+    logger.info('💡 按 Ctrl+C 停止')
+    started = time.time()
+    try:
+        while not stop_event.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
+    server.server_close()
+    elapsed = time.time() - started
+    stats = registry.stats
+    logger.info(f'📊 共处理 {stats["requests"]} 个请求，发送 {LayerProgress.format_size(stats["bytes"])}'
+                f'（平均 {LayerProgress.format_size(stats["bytes"] / max(elapsed, 1e-6))}/s），'
+                f'缓存命中 {stats["hits"]} 次，上游获取 {stats["upstream"]} 次，合并的并发请求 {stats["coalesced"]} 次')
+    return 0
 
 
-        manifests = resp_json.get('manifests')
-        if manifests is not None:
-            archs = [
-                m.get('annotations', {}).get('com.docker.official-images.bashbrew.arch') or
-                m.get('platform', {}).get('architecture')
-                for m in manifests if m.get('platform', {}).get('os') == 'linux'
-            ]
+DAEMON_ADDRESS = '127.0.0.1:5100'
+DAEMON_EVENT_BUFFER = 2000   # 每个任务保留的事件数，超出后丢弃最早的日志（进度事件只保留最新一条）
+DAEMON_JOB_HISTORY = 200     # 保留的已结束任务数
+DAEMON_JOB_OPTIONS = ('images', 'registry', 'arch', 'username', 'password', 'squash', 'index',
+                      'compress', 'compress_level', 'compress_threads')
+
+
+def _context_downloaded(ctx: PullContext) -> int:
+    """拉取上下文中各层已下载的字节数（取自进度显示）"""
+    return sum(layer.downloaded_size for layer in list(ctx.progress.layers.values()))
+
+
+class DaemonJob:
+    """daemon 中的一个拉取任务：请求参数、状态和事件缓冲（日志、进度、导出结果、状态变化）"""
+
+    def __init__(self, job_id: str, request: Dict[str, Any]):
+        self.id = job_id
+        self.request = request
+        self.state = 'queued'
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.outputs: List[str] = []
+        self.clients = 1
+        self.ctx: Optional[PullContext] = None
+        self.downloaded = 0
+        self._events: 'collections.deque[Dict[str, Any]]' = collections.deque(maxlen=DAEMON_EVENT_BUFFER)
+        self._next_seq = 0
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ('succeeded', 'failed', 'cancelled')
+
+    def event(self, kind: str, **fields):
+        """追加一个事件并唤醒等待的客户端；连续的进度事件只保留最新一条"""
+        with self._cond:
+            if kind == 'progress' and self._events and self._events[-1]['type'] == 'progress':
+                self._events.pop()
+            self._events.append(dict(fields, seq=self._next_seq, type=kind, time=time.time()))
+            self._next_seq += 1
+            self._cond.notify_all()
+
+    def log(self, message: str):
+        """拉取上下文的日志回调：进度块（含进度条）和普通日志分开记录"""
+        message = message.rstrip('\n')
+        if message:
+            self.event('progress' if '█' in message or '░' in message else 'log', message=message)
+
+    def set_state(self, state: str):
+        self.state = state
+        if state == 'running':
+            self.started_at = time.time()
+        elif self.finished:
+            self.finished_at = time.time()
+        self.event('state', state=state)
+
+    def wait_events(self, since: int, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        """返回序号不小于 since 的事件，没有新事件时最多等待 timeout 秒；第二个值表示任务是否已结束"""
+        with self._cond:
+            if not self.finished and (not self._events or self._events[-1]['seq'] < since):
+                self._cond.wait(timeout)
+            return [e for e in self._events if e['seq'] >= since], self.finished
+
+    def to_dict(self) -> Dict[str, Any]:
+        """任务的公开信息（不包含密码）"""
+        downloaded = _context_downloaded(self.ctx) if self.ctx and self.state == 'running' else self.downloaded
+        return {
+            'id': self.id,
+            'state': self.state,
+            'request': {k: v for k, v in self.request.items() if k != 'password'},
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'outputs': self.outputs,
+            'clients': self.clients,
+            'downloaded': downloaded,
+        }
 
-            if archs:
-                logger.info(f'📋 当前可用架构：{", ".join(archs)}')
 
-            if len(archs) == 1:
-                arch = archs[0]
-                logger.info(f'✅ 自动选择唯一可用架构: {arch}')
+class PullDaemon:
+    """常驻的拉取服务：会话、token、清单和 blob 缓存在各次拉取之间保持，任务按提交顺序执行。
 
-            if arch not in archs:
-                logger.error(f'在清单中找不到指定的架构 {arch}')
-                logger.info(f'可用架构: {", ".join(archs)}')
-                return
+    所有任务共用输出目录下的 blobs（与批量拉取相同的 blob 缓存和进度日志），同一时间只运行一个任务，
+    任务内部的镜像仍按批量模式并发下载。标签先用 HEAD 解析为 digest，再按固定 digest 拉取，
+    因此重复拉取时清单直接从缓存读取。参数完全相同的任务在排队或运行期间只执行一次，后来的提交共享同一个任务。
+    """
 
-            digest = select_manifest(manifests, arch)
-            if not digest:
-                logger.error(f'在清单中找不到指定的架构 {arch}')
-                return
+    def __init__(self, output_path: Path, workers: int = 4, engine: str = 'thread', max_streams: int = 64):
+        self.output_path = output_path
+        self.workers = workers
+        self.engine = engine
+        self.max_streams = max_streams
+        self.session = SessionManager.get_session()
+        self.started_at = time.time()
+        self.counters = {'submitted': 0, 'coalesced': 0, 'succeeded': 0, 'failed': 0, 'cancelled': 0}
+        self.downloaded = 0
+        self.busy_time = 0.0
+        self._jobs: Dict[str, DaemonJob] = {}
+        self._pending: Dict[str, DaemonJob] = {}
+        self._queue: 'queue.Queue[Optional[DaemonJob]]' = queue.Queue()
+        self._resolvers: Dict[Tuple, ManifestResolver] = {}
+        self._lock = threading.Lock()
+        self._runner = threading.Thread(target=self._run_jobs, name='daemon-runner', daemon=True)
+
+    def start(self):
+        self._runner.start()
+
+    def stop(self):
+        """停止接收任务：取消运行中和排队的任务，等待当前任务结束"""
+        with self._lock:
+            jobs = list(self._pending.values())
+        for job in jobs:
+            self.cancel(job.id)
+        self._queue.put(None)
+        self._runner.join(timeout=30)
 
-            url = f'{image_info.protocol}://{image_info.registry}/v2/{image_info.repository}/manifests/{digest}'
-            logger.debug(f'获取架构清单: {url}')
+    @staticmethod
+    def _key(request: Dict[str, Any]) -> str:
+        return json.dumps([request.get(k) for k in DAEMON_JOB_OPTIONS], sort_keys=True)
+
+    def submit(self, request: Dict[str, Any]) -> Tuple[DaemonJob, bool]:
+        """提交拉取任务，返回 (任务, 是否与进行中的相同任务合并)"""
+        images = request.get('images')
+        if not images or not isinstance(images, list) or not all(isinstance(ref, str) and ref for ref in images):
+            raise ValueError('images 必须是非空的镜像引用列表')
+        if request.get('compress') not in (None, 'gzip', 'zstd'):
+            raise ValueError('compress 只能是 gzip 或 zstd')
+        if request.get('compress') == 'zstd' and zstandard is None:
+            raise ValueError('导出 zstd 需要在 daemon 所在环境安装 zstandard')
+        request = {k: request[k] for k in DAEMON_JOB_OPTIONS if request.get(k) not in (None, False)}
+        request.setdefault('arch', 'amd64')
+        key = self._key(request)
+        with self._lock:
+            self.counters['submitted'] += 1
+            job = self._pending.get(key)
+            if job is not None:
+                job.clients += 1
+                self.counters['coalesced'] += 1
+                return job, True
+            job = DaemonJob(f'{int(time.time() * 1000):x}-{len(self._jobs):04x}', request)
+            self._jobs[job.id] = job
+            self._pending[key] = job
+            finished = [j for j in self._jobs.values() if j.finished]
+            for old in finished[:max(0, len(finished) - DAEMON_JOB_HISTORY)]:
+                self._jobs.pop(old.id, None)
+        job.event('state', state='queued')
+        self._queue.put(job)
+        logger.info(f'📨 任务 {job.id}: {", ".join(request["images"])} ({request["arch"]})')
+        return job, False
+
+    def job(self, job_id: str) -> Optional[DaemonJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[DaemonJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[DaemonJob]:
+        """取消任务：排队中的直接标记为已取消，运行中的取消其拉取上下文"""
+        job = self.job(job_id)
+        if job is None or job.finished:
+            return job
+        with self._lock:
+            queued = job.state == 'queued'
+            if queued:
+                job.state = 'cancelled'
+                self._pending.pop(self._key(job.request), None)
+                self.counters['cancelled'] += 1
+        if queued:
+            job.set_state('cancelled')
+        elif job.ctx is not None:
+            job.ctx.cancel()
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        """队列深度、各状态任务数、累计下载量和吞吐量"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+            counters = dict(self.counters)
+            downloaded, busy_time = self.downloaded, self.busy_time
+        running = [job for job in jobs if job.state == 'running']
+        current_speed = 0.0
+        for job in running:
+            if job.ctx is not None:
+                job_downloaded = _context_downloaded(job.ctx)
+                downloaded += job_downloaded
+                busy_time += time.time() - job.started_at
+                if job.ctx.stats.start_time:
+                    current_speed += job_downloaded / max(time.time() - job.ctx.stats.start_time, 1e-6)
+        return dict(
+            counters,
+            queued=sum(1 for job in jobs if job.state == 'queued'),
+            running=len(running),
+            downloaded=downloaded,
+            busy_seconds=round(busy_time, 3),
+            throughput=downloaded / busy_time if busy_time else 0.0,
+            current_speed=current_speed,
+            uptime=round(time.time() - self.started_at, 3),
+        )
 
-            manifest_resp = session.get(url, headers=auth_head, verify=False, timeout=60)
-            try:
-                manifest_resp.raise_for_status()
-                resp_json = manifest_resp.json()
-            except Exception as e:
-                logger.error(f'获取架构清单失败: {e}')
+    def _pin(self, ref: str, request: Dict[str, Any]) -> str:
+        """把标签解析为 digest（HEAD，token 由常驻的认证缓存复用），失败时保留原引用，由拉取流程处理"""
+        if '@' in ref:
+            return ref
+        key = (request.get('registry'), request.get('username'), request.get('password'))
+        with self._lock:
+            resolver = self._resolvers.get(key)
+            if resolver is None:
+                auth = RegistryAuthCache(self.session, request.get('username'), request.get('password'))
+                resolver = self._resolvers[key] = ManifestResolver(self.session, auth, request.get('registry'),
+                                                                   head_only=True)
+        record = resolver.resolve(ref)
+        if record.get('error') or not record.get('digest'):
+            logger.debug(f'{ref} 未能按 HEAD 解析 digest: {record.get("error")}')
+            return ref
+        return f'{ref}@{record["digest"]}'
+
+    def _run_jobs(self):
+        while True:
+            job = self._queue.get()
+            if job is None or stop_event.is_set():
                 return
-
-            if 'layers' not in resp_json:
-                logger.error('错误：清单中没有层')
+            self._run(job)
+
+    def _run(self, job: DaemonJob):
+        request = job.request
+        ctx = PullContext(log_callback=job.log, cli_output=False, session=self.session)
+        with self._lock:
+            # 出队后、开始前可能已被取消
+            if job.state != 'queued':
+                ctx.close()
                 return
-
-            if 'config' not in resp_json:
-                logger.error('错误：清单中没有配置信息')
+            job.ctx = ctx
+            job.state = 'running'
+        job.set_state('running')
+        handler = GUILogHandler(job.log, context=ctx)
+        handler.setLevel(logging.INFO)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+        # 只转发本任务线程的日志，其他请求线程（如新任务提交）的日志不混入
+        handler.addFilter(lambda record: current_pull_context() is ctx)
+        logger.addHandler(handler)
+        ok = False
+        try:
+            images = ctx.run(lambda: [self._pin(ref, request) for ref in request['images']])
+            compression = CompressionOptions(request['compress'], request.get('compress_level'),
+                                             request.get('compress_threads', 0)) if request.get('compress') else None
+            ok = pull_images_batch(
+                images,
+                registry=request.get('registry'),
+                arch=request['arch'],
+                username=request.get('username'),
+                password=request.get('password'),
+                output_path=str(self.output_path),
+                workers=self.workers,
+                engine=self.engine,
+                max_streams=self.max_streams,
+                ctx=ctx,
+                squash=request.get('squash', False),
+                index=request.get('index', False),
+                compression=compression,
+                on_exported=lambda image, path: (job.outputs.append(path),
+                                                 job.event('exported', image=image.ref, arch=image.arch, path=path))
+            )
+        except Exception as e:
+            logger.error(f'❌ 任务 {job.id} 失败: {e}')
+        finally:
+            logger.removeHandler(handler)
+            cleanup_tmp_dir()
+        state = 'cancelled' if ctx.is_set() else ('succeeded' if ok else 'failed')
+        with self._lock:
+            job.downloaded = _context_downloaded(ctx)
+            self.downloaded += job.downloaded
+            self.busy_time += time.time() - job.started_at
+            self.counters[state] += 1
+            self._pending.pop(self._key(request), None)
+        job.ctx = None
+        job.set_state(state)
+        logger.info(f'{"✅" if ok else "❌"} 任务 {job.id} {state}，用时 {DownloadStats().format_time(time.time() - job.started_at)}')
+
+
+class _DaemonRequestHandler(http.server.BaseHTTPRequestHandler):
+    """daemon 的本地 JSON API：
+
+    POST /v1/jobs 提交任务，GET /v1/jobs[/ID] 查询，DELETE /v1/jobs/ID 取消，
+    GET /v1/jobs/ID/events?since=N 以 NDJSON 流式返回事件直到任务结束，GET /v1/stats 返回队列和吞吐量
+    """
+    protocol_version = 'HTTP/1.1'
+    server_version = f'docker-image-puller/{VERSION}'
+    daemon: PullDaemon
+
+    def log_message(self, format, *args):
+        logger.debug(f'daemon API: {format % args}')
+
+    def _json(self, status: int, payload: Any):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self) -> Tuple[List[str], Dict[str, str]]:
+        path, _, query = self.path.partition('?')
+        params = dict(item.partition('=')[::2] for item in query.split('&') if item)
+        return [part for part in path.split('/') if part], params
+
+    def _job_or_404(self, job_id: str) -> Optional[DaemonJob]:
+        job = self.daemon.job(job_id)
+        if job is None:
+            self._json(404, {'error': f'任务 {job_id} 不存在'})
+        return job
+
+    def do_GET(self):
+        parts, params = self._route()
+        if parts == ['v1', 'stats']:
+            return self._json(200, self.daemon.stats())
+        if parts == ['v1', 'jobs']:
+            return self._json(200, [job.to_dict() for job in self.daemon.jobs()])
+        if len(parts) in (3, 4) and parts[:2] == ['v1', 'jobs'] and parts[3:] in ([], ['events']):
+            job = self._job_or_404(parts[2])
+            if job is None:
                 return
-        else:
-            config_digest = resp_json.get('config', {}).get('digest')
-            if config_digest:
-                config_url = f'{image_info.protocol}://{image_info.registry}/v2/{image_info.repository}/blobs/{config_digest}'
-                logger.debug(f'获取镜像配置: {config_url}')
-                try:
-                    config_resp = session.get(config_url, headers=auth_head, verify=False, timeout=60)
-                    config_resp.raise_for_status()
-                    config_json = config_resp.json()
-                    actual_arch = config_json.get('architecture', 'unknown')
-                    actual_os = config_json.get('os', 'unknown')
-                    logger.info(f'📋 镜像实际架构: {actual_os}/{actual_arch}')
-                except Exception as e:
-                    logger.warning(f'获取镜像配置失败: {e}')
+            if len(parts) == 3:
+                return self._json(200, job.to_dict())
+            return self._stream_events(job, int(params.get('since') or 0))
+        self._json(404, {'error': '未知的路径'})
+
+    def do_POST(self):
+        parts, _ = self._route()
+        if parts != ['v1', 'jobs']:
+            return self._json(404, {'error': '未知的路径'})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError('请求体必须是 JSON 对象')
+            job, coalesced = self.daemon.submit(request)
+        except ValueError as e:
+            return self._json(400, {'error': str(e)})
+        self._json(200 if coalesced else 202, dict(job.to_dict(), coalesced=coalesced))
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) != 3 or parts[:2] != ['v1', 'jobs']:
+            return self._json(404, {'error': '未知的路径'})
+        if self._job_or_404(parts[2]) is not None:
+            self._json(200, self.daemon.cancel(parts[2]).to_dict())
+
+    def _stream_events(self, job: DaemonJob, since: int):
+        """逐行发送 JSON 事件，任务结束并发送完全部事件后关闭连接"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                events, finished = job.wait_events(since, timeout=1)
+                for event in events:
+                    self.wfile.write(json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n')
+                    since = event['seq'] + 1
+                self.wfile.flush()
+                if finished and not events:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            pass
 
-        if 'layers' not in resp_json or 'config' not in resp_json:
-            logger.error('错误：清单格式不完整，缺少必要字段')
-            return
 
-        # 计算镜像总大小
-        total_size = 0
-        if 'layers' in resp_json:
-            for layer in resp_json['layers']:
-                total_size += layer.get('size', 0)
-        if 'config' in resp_json and resp_json['config'].get('size', 0):
-            total_size += resp_json['config'].get('size', 0)
-        
-        # 格式化大小显示
-        def format_size(size: int) -> str:
-            for unit in ['B', 'KB', 'MB', 'GB']:
-                if size < 1024:
-                    return f"{size:.1f}{unit}"
-                size /= 1024
-            return f"{size:.1f}TB"
-        
-        size_str = format_size(total_size)
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
 
-        logger.info(f'📦 仓库地址：{image_info.registry}')
-        logger.info(f'📦 镜像：{image_info.repository}')
-        logger.info(f'📦 标签：{image_info.tag}')
-        logger.info(f'📦 架构：{arch}')
-        logger.info(f'📦 镜像大小（压缩后的）：{size_str}')
 
-        output_dir = get_output_dir(image_info.repository, image_info.tag, arch)
-        imgdir = str(output_dir / 'layers')
-        os.makedirs(imgdir, exist_ok=True)
-        logger.info(f'📁 输出目录：{output_dir}')
-        logger.info('📥 开始下载...')
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """通过 Unix 套接字连接 daemon 的 HTTP 连接"""
 
-        if image_info.registry in ('registry-1.docker.io', 'registry.hub.docker.com', 'docker.io') and image_info.repository.startswith('library/'):
-            imgparts = []
-        else:
-            imgparts = image_info.repository.split('/')[:-1]
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
 
-        download_layers(
-            session, image_info.registry, image_info.repository,
-            resp_json['layers'], auth_head, imgdir, resp_json,
-            imgparts, image_info.image_name, image_info.tag, arch,
-            output_dir,
-            log_callback=log_callback,
-            protocol=image_info.protocol
-        )
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
 
-        output_file = create_image_tar(imgdir, image_info.repository, image_info.tag, arch, output_dir)
-        logger.info(f'✅ 镜像已保存为: {output_file}')
-        logger.info(f'💡 导入命令: docker load -i {output_file}')
 
+class DaemonClient:
+    """daemon 本地 API 的客户端。address 为 HOST:PORT、http://HOST:PORT 或 Unix 套接字路径（unix:PATH 或以 / 开头）"""
+
+    def __init__(self, address: str = DAEMON_ADDRESS):
+        self.address = address
+        if address.startswith('unix:'):
+            self.unix_path: Optional[str] = address[5:]
+        elif address.startswith(('/', './')):
+            self.unix_path = address
+        else:
+            self.unix_path = None
+            self.host, _, port = address.split('://', 1)[-1].rstrip('/').rpartition(':')
+            self.port = int(port)
+
+    def _connection(self, timeout: Optional[float]) -> http.client.HTTPConnection:
+        if self.unix_path:
+            return _UnixHTTPConnection(self.unix_path, timeout=timeout)
+        return http.client.HTTPConnection(self.host or '127.0.0.1', self.port, timeout=timeout)
+
+    def request(self, method: str, path: str, payload: Any = None, timeout: Optional[float] = 30) -> Any:
+        """发送请求并返回解析后的 JSON；daemon 返回错误时抛出 RuntimeError"""
+        conn = self._connection(timeout)
+        try:
+            body = json.dumps(payload).encode('utf-8') if payload is not None else None
+            conn.request(method, path, body=body, headers={'Content-Type': 'application/json'} if body else {})
+            resp = conn.getresponse()
+            data = json.loads(resp.read() or b'null')
+            if resp.status >= 400:
+                raise RuntimeError((data or {}).get('error') or f'daemon 返回 HTTP {resp.status}')
+            return data
+        finally:
+            conn.close()
+
+    def submit(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return self.request('POST', '/v1/jobs', request)
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        return self.request('DELETE', f'/v1/jobs/{job_id}')
+
+    def stats(self) -> Dict[str, Any]:
+        return self.request('GET', '/v1/stats')
+
+    def events(self, job_id: str, since: int = 0):
+        """逐个产出任务事件，任务结束后返回"""
+        conn = self._connection(None)
+        try:
+            conn.request('GET', f'/v1/jobs/{job_id}/events?since={since}')
+            resp = conn.getresponse()
+            if resp.status >= 400:
+                raise RuntimeError((json.loads(resp.read() or b'null') or {}).get('error') or f'daemon 返回 HTTP {resp.status}')
+            for line in resp:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            conn.close()
+
+
+def pull_via_daemon(
+    address: str,
+    images: List[str],
+    registry: Optional[str] = None,
+    arch: str = 'amd64',
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    squash: bool = False,
+    index: bool = False,
+    compression: Optional[CompressionOptions] = None,
+    log_callback: Optional[Callable] = None
+) -> bool:
+    """把拉取交给 daemon 执行并跟随其进度，供 CLI（--daemon）和 GUI 作为轻量客户端使用。
+
+    日志和进度交给 log_callback，未指定时输出到终端；stop_event（Ctrl+C、GUI 取消）触发时取消 daemon 中的任务。
+    与进行中的相同任务合并时跟随该任务的进度。任务成功时返回 True。
+    """
+    client = DaemonClient(address)
+    request = {'images': images, 'registry': registry, 'arch': arch, 'username': username, 'password': password,
+               'squash': squash, 'index': index}
+    if compression:
+        request.update(compress=compression.format, compress_level=compression.level,
+                       compress_threads=compression.threads)
+    job = client.submit(request)
+    logger.info(f'📨 已提交到 daemon（{address}），任务 {job["id"]}'
+                f'{"，与进行中的相同任务合并" if job.get("coalesced") else ""}')
+
+    events: 'queue.Queue[Any]' = queue.Queue()
+
+    def _read():
+        try:
+            for event in client.events(job['id']):
+                events.put(event)
+        except Exception as e:
+            events.put(e)
+        events.put(None)
+
+    threading.Thread(target=_read, daemon=True).start()
+    state, cancelled, progress_lines = job['state'], False, 0
+    while True:
+        if stop_event.is_set() and not cancelled:
+            cancelled = True
+            logger.info(f'⚠️ 正在取消 daemon 任务 {job["id"]}...')
+            try:
+                client.cancel(job['id'])
+            except (OSError, RuntimeError) as e:
+                logger.warning(f'⚠️ 取消任务失败: {e}')
+        try:
+            event = events.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        if event is None:
+            break
+        if isinstance(event, Exception):
+            logger.error(f'❌ 与 daemon 的连接中断: {event}')
+            return False
+        if event['type'] == 'state':
+            state = event['state']
+        elif event['type'] in ('log', 'progress'):
+            if log_callback:
+                log_callback(event['message'] + '\n')
+            elif event['type'] == 'progress':
+                # 与 ProgressDisplay 相同，用 ANSI 转义码原地刷新进度块
+                sys.stdout.write('\033[F' * progress_lines + ('\033[J' if progress_lines else ''))
+                print(event['message'], flush=True)
+                progress_lines = event['message'].count('\n') + 1
+            else:
+                print(event['message'], flush=True)
+                progress_lines = 0
+    return state == 'succeeded'
+
+
+def cmd_daemon(argv: List[str]) -> int:
+    """daemon 子命令：常驻进程，保持会话、token 和清单缓存，通过本地 API 接收拉取任务"""
+    parser = argparse.ArgumentParser(
+        prog=f'{os.path.basename(sys.argv[0])} daemon',
+        description="以常驻进程运行拉取服务：连接池、token、清单和 blob 缓存在各次拉取之间保持，"
+                    "通过本地 HTTP 或 Unix 套接字 API 提交、跟随和取消拉取；CLI 的 --daemon 和 GUI 作为客户端使用",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+示例:
+  %(prog)s -o ./images
+  %(prog)s -o ./images --socket /tmp/docker-image-puller.sock
+  # 客户端
+  {os.path.basename(sys.argv[0])} --daemon {DAEMON_ADDRESS} -i nginx:1.27
+  curl -s http://{DAEMON_ADDRESS}/v1/stats
+            """
+    )
+    parser.add_argument("--listen", default=DAEMON_ADDRESS,
+                        help=f"API 监听地址，默认 {DAEMON_ADDRESS}（API 不做认证，只应监听本机地址）")
+    parser.add_argument("--socket", metavar="PATH", help="改为监听 Unix 套接字（权限 0600）")
+    parser.add_argument("-o", "--output", help="输出目录（其中的 blobs 为共用的 blob 缓存），默认为当前目录")
+    parser.add_argument("--workers", type=int, default=4, help="每个任务的并发下载数，默认4")
+    parser.add_argument("--engine", choices=['thread', 'async'], default='thread', help="下载引擎，默认 thread")
+    parser.add_argument("--streams", type=int, default=64, help="async 引擎的最大并发下载流数，默认64")
+    parser.add_argument("--limit-rate", help="全局下载限速（字节/秒，支持 K/M/G 后缀）")
+    parser.add_argument("--no-http2", action="store_true", help="禁用 HTTP/2 传输")
+    parser.add_argument("--debug", action="store_true", help="启用调试模式")
+    args = parser.parse_args(argv)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+    if args.no_http2:
+        SessionManager.http2_enabled = False
+    if args.limit_rate:
+        bandwidth_limiter.set_global_rate(BandwidthLimiter.parse_rate(args.limit_rate))
+
+    output = Path(args.output) if args.output else Path.cwd()
+    output.mkdir(parents=True, exist_ok=True)
+    daemon = PullDaemon(output.resolve(), args.workers, args.engine, args.streams)
+    handler = type('DaemonRequestHandler', (_DaemonRequestHandler,), {'daemon': daemon})
+    if args.socket:
+        if os.path.lexists(args.socket):
+            # 只清理上次遗留的套接字文件，不误删同名的普通文件
+            if not stat.S_ISSOCK(os.lstat(args.socket).st_mode):
+                logger.error(f'❌ {args.socket} 已存在且不是套接字文件，拒绝覆盖')
+                return 1
+            os.unlink(args.socket)
+        server = _UnixHTTPServer(args.socket, handler)
+        os.chmod(args.socket, 0o600)
+        address = f'unix:{args.socket}'
+    else:
+        host, _, port = args.listen.rpartition(':')
+        server = http.server.ThreadingHTTPServer((host or '127.0.0.1', int(port)), handler)
+        server.daemon_threads = True
+        address = f'{host or "127.0.0.1"}:{port}'
+    daemon.start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'🛰️ daemon 已启动: {address}，输出目录 {output}')
+    logger.info('💡 按 Ctrl+C 停止')
+    try:
+        while not stop_event.wait(1):
+            pass
     except KeyboardInterrupt:
-        logger.info('⚠️ 用户取消操作。')
-    except Exception as e:
-        logger.error(f'❌ 程序运行过程中发生异常: {e}')
-        raise
-    finally:
-        cleanup_tmp_dir()
+        pass
+    server.shutdown()
+    server.server_close()
+    daemon.stop()
+    if args.socket and os.path.exists(args.socket):
+        os.unlink(args.socket)
+    stats = daemon.stats()
+    logger.info(f'📊 共 {stats["submitted"]} 次提交（合并 {stats["coalesced"]} 次），成功 {stats["succeeded"]}，'
+                f'失败 {stats["failed"]}，取消 {stats["cancelled"]}，下载 {LayerProgress.format_size(stats["downloaded"])}')
+    return 0
+
+
+SUBCOMMANDS: Dict[str, Callable[[List[str]], int]] = {
+    'resolve': cmd_resolve,
+    'sync': cmd_sync,
+    'apply': cmd_apply,
+    'files': cmd_files,
+    'inspect': cmd_inspect,
+    'bench': cmd_bench,
+    'verify': cmd_verify,
+    'copy': cmd_copy,
+    'serve': cmd_serve,
+    'daemon': cmd_daemon,
+}
 
 
 # 命令行入口（主函数）
 def main():
+    # 子命令有各自的参数，不进入交互式拉取流程
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        sys.exit(SUBCOMMANDS[sys.argv[1]](sys.argv[2:]))
+
+    ctx = None
+    wait_for_enter = True
+    exit_code = 0
     try:
         parser = argparse.ArgumentParser(
             description="Docker 镜像拉取工具 - 无需Docker环境直接下载镜像",
@@ -1774,19 +8401,63 @@ def main():
   %(prog)s -i nginx:latest
   %(prog)s -i harbor.example.com/library/nginx:1.26.0 -u admin -p password
   %(prog)s -i alpine:latest -a arm64v8 -o ./downloads
+  %(prog)s --from-file images.txt -o ./offline --archive ./offline/images.tar
+  %(prog)s resolve images.txt -o images.lock && %(prog)s --lock images.lock -o ./offline
             """
         )
         parser.add_argument("-i", "--image", required=False,
                             help="Docker 镜像名称（例如：nginx:latest 或 harbor.abc.com/abc/nginx:1.26.0）")
         parser.add_argument("-q", "--quiet", action="store_true", help="静默模式，减少交互")
         parser.add_argument("-r", "--custom-registry", help="自定义仓库地址（例如：harbor.abc.com）")
-        parser.add_argument("-a", "--arch", default="amd64", help="架构,默认：amd64,常见：amd64, arm64v8等")
+        parser.add_argument("-a", "--arch", default="amd64",
+                            help="架构,默认：amd64,常见：amd64, arm64v8, arm/v7等；多个架构用逗号分隔，all 表示全部平台")
         parser.add_argument("-u", "--username", help="Docker 仓库用户名")
         parser.add_argument("-p", "--password", help="Docker 仓库密码")
         parser.add_argument("-o", "--output", help="输出目录，默认为当前目录下的镜像名_tag_arch目录")
         parser.add_argument("-v", "--version", action="version", version=f"%(prog)s {VERSION}", help="显示版本信息")
         parser.add_argument("--debug", action="store_true", help="启用调试模式，打印请求 URL 和连接状态")
         parser.add_argument("--workers", type=int, default=4, help="并发下载线程数，默认4")
+        parser.add_argument("--deadline", type=float, default=None, help="整次拉取的最长耗时（秒），超出后不再重试，默认不限制")
+        parser.add_argument("--limit-rate", help="全局下载限速（字节/秒，支持 K/M/G 后缀，例如 10M），默认不限速")
+        parser.add_argument("--limit-rate-registry", action="append", default=[], metavar="HOST=RATE",
+                            help="单个仓库的下载限速（例如 docker.1ms.run=5M），可重复指定")
+        parser.add_argument("--pipeline-memory", type=int, default=64,
+                            help="下载流水线缓冲区内存上限（MB，所有下载流共享），默认64")
+        parser.add_argument("--prewarm", type=int, default=4, help="认证期间预先建立的连接数（每个主机），0 表示关闭预热，默认4")
+        parser.add_argument("--engine", choices=['thread', 'async'], default='thread',
+                            help="下载引擎：thread（线程池，默认）或 async（asyncio 单事件循环，适合大量并发分片）")
+        parser.add_argument("--streams", type=int, default=64, help="async 引擎的最大并发下载流数，默认64")
+        parser.add_argument("--no-http2", action="store_true",
+                            help="禁用 HTTP/2 传输（默认在安装了 httpx[http2] 时启用）")
+        parser.add_argument("--from-file", metavar="FILE",
+                            help="批量模式：从文件读取镜像列表（每行一个，- 表示标准输入），共享的层只下载一次，不进行交互")
+        parser.add_argument("--archive", metavar="FILE",
+                            help="批量模式下把所有镜像导出到同一个多镜像 tar 文件（.tar.gz / .tar.zst 结尾时压缩，- 表示写到标准输出），默认每个镜像单独导出")
+        parser.add_argument("--lock", metavar="FILE",
+                            help="按锁定文件（resolve 子命令的输出或每行一个 镜像@sha256:...）中固定的 digest 批量拉取，已缓存的清单和层不再请求仓库")
+        parser.add_argument("--bundle", metavar="FILE",
+                            help="把拉取的镜像写成用于离线传输的差量包（配合 --baseline 只包含目标环境缺少的层），在目标环境用 apply 子命令合并")
+        parser.add_argument("--baseline", metavar="FILE",
+                            help="差量包的基线：digest 列表、以前的差量包、docker save 的 tar、OCI 镜像布局目录或 docker image inspect 的输出")
+        parser.add_argument("--squash", action="store_true",
+                            help="把每个镜像的所有层合并为一层再导出（处理删除标记，去除被覆盖的数据），docker load 更快")
+        parser.add_argument("--index", action="store_true",
+                            help="在导出的 tar 旁边写入 SQLite 文件索引（.index.db，解压时顺带生成），可用 files 子命令查询")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="只获取清单和配置，输出每层大小、缓存情况、需下载的字节数、估计耗时和磁盘检查结果，不下载任何层")
+        parser.add_argument("--skip-space-check", action="store_true",
+                            help="下载前不检查临时目录和输出位置的剩余空间")
+        parser.add_argument("--compress", choices=['gzip', 'zstd'],
+                            help="导出时边打包边多线程压缩（.tar.gz 或 .tar.zst，zstd 需要安装 zstandard），未压缩的 tar 不落盘")
+        parser.add_argument("--compress-level", type=int, default=None,
+                            help="压缩级别，默认 gzip 为 6（1-9）、zstd 为 3（1-22）")
+        parser.add_argument("--compress-threads", type=int, default=0,
+                            help="压缩线程数，默认使用全部 CPU")
+        parser.add_argument("--oci", metavar="DIR",
+                            help="把拉取的镜像（含多个平台）保存为 OCI 镜像布局目录，而不是 docker-archive tar")
+        parser.add_argument("--daemon", metavar="ADDR", nargs="?", const=DAEMON_ADDRESS,
+                            help=f"交给运行中的 daemon 拉取并跟随进度（HOST:PORT 或 Unix 套接字路径，默认 {DAEMON_ADDRESS}），"
+                                 "镜像保存在 daemon 的输出目录中")
 
         logger.info(f'🚀 Docker 镜像拉取工具 {VERSION}')
 
@@ -1795,6 +8466,91 @@ def main():
         if args.debug:
             logger.setLevel(logging.DEBUG)
 
+        buffer_pool.resize(args.pipeline_memory * 1024 * 1024)
+        if args.no_http2:
+            SessionManager.http2_enabled = False
+        if args.limit_rate:
+            bandwidth_limiter.set_global_rate(BandwidthLimiter.parse_rate(args.limit_rate))
+        for item in args.limit_rate_registry:
+            host, _, rate = item.partition('=')
+            bandwidth_limiter.set_registry_rate(host, BandwidthLimiter.parse_rate(rate))
+
+        if args.baseline and not args.bundle:
+            logger.error("错误：--baseline 需要与 --bundle 一起使用。")
+            exit_code = 1
+            return
+        if (args.squash or args.index or args.compress) and (args.oci or args.bundle):
+            logger.error("错误：--squash、--index 和 --compress 只适用于 docker-archive 输出，不能与 --oci 或 --bundle 一起使用。")
+            exit_code = 1
+            return
+        if args.index and args.archive == '-':
+            logger.error("错误：--index 需要把 tar 写到文件，不能与 --archive - 一起使用。")
+            exit_code = 1
+            return
+        compression = CompressionOptions(args.compress, args.compress_level, args.compress_threads) if args.compress else None
+        compression_check = CompressionOptions.for_path(args.archive or '', compression)
+        if compression_check and compression_check.format == 'zstd' and zstandard is None:
+            logger.error("错误：导出 zstd 需要安装 zstandard（pip install zstandard）。")
+            exit_code = 1
+            return
+        if args.archive == '-':
+            # tar 写到标准输出，进度和提示改为输出到标准错误
+            sys.stdout = sys.stderr
+        baseline = DeltaBaseline.load(args.baseline) if args.baseline else None
+
+        if args.daemon:
+            wait_for_enter = False
+            if args.output or args.archive or args.oci or args.bundle or args.dry_run:
+                logger.error("错误：--daemon 的输出位置由 daemon 决定，不能与 -o、--archive、--oci、--bundle 或 --dry-run 一起使用。")
+                exit_code = 1
+                return
+            images = (read_image_list(args.from_file) if args.from_file else []) + \
+                (read_lockfile(args.lock) if args.lock else []) + ([args.image] if args.image else [])
+            if not images:
+                logger.error("错误：请用 -i、--from-file 或 --lock 指定镜像。")
+                exit_code = 1
+                return
+            try:
+                ok = pull_via_daemon(args.daemon, images, args.custom_registry, args.arch, args.username, args.password,
+                                     args.squash, args.index, compression)
+            except (OSError, RuntimeError) as e:
+                logger.error(f'❌ daemon（{args.daemon}）请求失败: {e}')
+                ok = False
+            exit_code = 0 if ok else 1
+            return
+
+        if args.from_file or args.lock:
+            wait_for_enter = False
+            images = (read_image_list(args.from_file) if args.from_file else []) + \
+                (read_lockfile(args.lock) if args.lock else [])
+            if not images:
+                logger.error("错误：镜像列表为空。")
+                exit_code = 1
+                return
+            ok = pull_images_batch(
+                images,
+                registry=args.custom_registry,
+                arch=args.arch,
+                username=args.username,
+                password=args.password,
+                output_path=args.output,
+                archive=args.archive,
+                oci_dir=args.oci,
+                workers=args.workers,
+                engine=args.engine,
+                max_streams=args.streams,
+                deadline=args.deadline,
+                bundle=args.bundle,
+                baseline=baseline,
+                squash=args.squash,
+                index=args.index,
+                dry_run=args.dry_run,
+                space_check=not args.skip_space_check,
+                compression=compression
+            )
+            exit_code = 0 if ok else 1
+            return
+
         if not args.image:
             args.image = input("请输入 Docker 镜像名称（例如：nginx:latest 或 harbor.abc.com/abc/nginx:1.26.0）：").strip()
             if not args.image:
@@ -1824,7 +8580,38 @@ def main():
         if not args.password and not args.quiet:
             args.password = input("请输入镜像仓库密码：").strip() or None
 
+        archs = parse_arch_list(args.arch)
+        if len(archs) > 1 or archs == ['all'] or args.oci or args.bundle or '@' in args.image:
+            # 多平台拉取、OCI 布局和差量包输出、固定 digest 的拉取共用批量模式的调度和 blob 缓存
+            ok = pull_images_batch(
+                [args.image],
+                registry=args.custom_registry,
+                arch=args.arch,
+                username=args.username,
+                password=args.password,
+                output_path=args.output,
+                archive=args.archive,
+                oci_dir=args.oci,
+                workers=args.workers,
+                engine=args.engine,
+                max_streams=args.streams,
+                deadline=args.deadline,
+                bundle=args.bundle,
+                baseline=baseline,
+                squash=args.squash,
+                index=args.index,
+                dry_run=args.dry_run,
+                space_check=not args.skip_space_check,
+                compression=compression
+            )
+            exit_code = 0 if ok else 1
+            return
+
+        pull_started_at = time.time()
         session = SessionManager.get_session()
+        ctx = PullContext(deadline=args.deadline, session=session)
+        _current_pull.set(ctx)
+        prewarm_connections(session, image_info.registry, image_info.protocol, args.prewarm)
         
         # 处理认证
         auth_head, auth_success, error_msg = _handle_authentication(
@@ -1840,12 +8627,13 @@ def main():
         # 获取manifest
         resp, http_code = fetch_manifest(
             session, image_info.registry, image_info.repository,
-            image_info.tag, auth_head, image_info.protocol
+            image_info.reference, auth_head, image_info.protocol
         )
         
         # 如果返回401，尝试重新认证
         if http_code == 401:
             logger.warning('⚠️ 获取清单时需要认证')
+            token_cache.invalidate(image_info.repository)
             www_auth = resp.headers.get('WWW-Authenticate', '')
             scheme, auth_url, reg_service = parse_www_authenticate(www_auth)
             
@@ -1875,7 +8663,7 @@ def main():
             # 重试获取manifest
             resp, http_code = fetch_manifest(
                 session, image_info.registry, image_info.repository,
-                image_info.tag, auth_head, image_info.protocol
+                image_info.reference, auth_head, image_info.protocol
             )
 
         # 检查响应状态码和有效性
@@ -1904,11 +8692,7 @@ def main():
 
         manifests = resp_json.get('manifests')
         if manifests is not None:
-            archs = [
-                m.get('annotations', {}).get('com.docker.official-images.bashbrew.arch') or
-                m.get('platform', {}).get('architecture')
-                for m in manifests if m.get('platform', {}).get('os') == 'linux'
-            ]
+            archs = list_platforms(manifests)
 
             if archs:
                 logger.info(f'📋 当前可用架构：{", ".join(archs)}')
@@ -1917,65 +8701,29 @@ def main():
                 args.arch = archs[0]
                 logger.info(f'✅ 自动选择唯一可用架构: {args.arch}')
             elif not args.quiet:
-                default_arch = args.arch if args.arch in archs else 'amd64'
+                default_arch = args.arch if select_manifest(manifests, args.arch) else 'amd64'
                 user_arch = input(f"请输入架构（可选: {', '.join(archs)}，默认: {default_arch}）：").strip()
                 args.arch = user_arch if user_arch else default_arch
 
-            if args.arch not in archs:
-                logger.error(f'在清单中找不到指定的架构 {args.arch}')
-                logger.info(f'可用架构: {", ".join(archs)}')
-                return
-
-            digest = select_manifest(manifests, args.arch)
-            if not digest:
-                logger.error(f'在清单中找不到指定的架构 {args.arch}')
-                return
-
-            url = f'{image_info.protocol}://{image_info.registry}/v2/{image_info.repository}/manifests/{digest}'
-            logger.debug(f'获取架构清单: {url}')
-
-            manifest_resp = session.get(url, headers=auth_head, verify=False, timeout=60)
-            try:
-                manifest_resp.raise_for_status()
-                resp_json = manifest_resp.json()
-            except Exception as e:
-                logger.error(f'获取架构清单失败: {e}')
-                return
-
-            if 'layers' not in resp_json:
-                logger.error('错误：清单中没有层')
-                return
-
-            if 'config' not in resp_json:
-                logger.error('错误：清单中没有配置信息')
+            platform_manifest = fetch_platform_manifest(session, image_info, auth_head, manifests, args.arch)
+            if platform_manifest is None:
                 return
+            resp_json = platform_manifest[0]
         else:
-            config_digest = resp_json.get('config', {}).get('digest')
-            if config_digest:
-                config_url = f'{image_info.protocol}://{image_info.registry}/v2/{image_info.repository}/blobs/{config_digest}'
-                logger.debug(f'获取镜像配置: {config_url}')
-                try:
-                    config_resp = session.get(config_url, headers=auth_head, verify=False, timeout=60)
-                    config_resp.raise_for_status()
-                    config_json = config_resp.json()
-                    actual_arch = config_json.get('architecture', 'unknown')
-                    actual_os = config_json.get('os', 'unknown')
-                    logger.info(f'📋 镜像实际架构: {actual_os}/{actual_arch}')
-                    
-                    if actual_arch != args.arch:
-                        logger.warning(f'⚠️  镜像架构为 {actual_arch}，与请求的 {args.arch} 不匹配')
-                        if not args.quiet:
-                            use_actual = input(f'是否使用镜像实际架构 {actual_arch}？(y/n, 默认: y): ').strip().lower() or 'y'
-                            if use_actual == 'y':
-                                args.arch = actual_arch
-                    else:
-                        if not args.quiet:
-                            confirm = input(f'确认下载 {actual_os}/{actual_arch} 架构的镜像？(y/n, 默认: y): ').strip().lower() or 'y'
-                            if confirm != 'y':
-                                logger.info('用户取消下载')
-                                return
-                except Exception as e:
-                    logger.warning(f'获取镜像配置失败: {e}')
+            actual_arch = fetch_config_platform(session, image_info, auth_head, resp_json)
+            if actual_arch and not platform_matches(args.arch, actual_arch):
+                logger.warning(f'⚠️  镜像架构为 {actual_arch}，与请求的 {args.arch} 不匹配，按实际架构导出')
+                if not args.quiet:
+                    use_actual = input(f'是否下载镜像实际架构 {actual_arch}？(y/n, 默认: y): ').strip().lower() or 'y'
+                    if use_actual != 'y':
+                        logger.info('用户取消下载')
+                        return
+                args.arch = actual_arch
+            elif actual_arch and not args.quiet:
+                confirm = input(f'确认下载 {actual_arch} 架构的镜像？(y/n, 默认: y): ').strip().lower() or 'y'
+                if confirm != 'y':
+                    logger.info('用户取消下载')
+                    return
 
         if 'layers' not in resp_json or 'config' not in resp_json:
             logger.error('错误：清单格式不完整，缺少必要字段')
@@ -1987,8 +8735,17 @@ def main():
         logger.info(f'📦 标签：{image_info.tag}')
         logger.info(f'📦 架构：{args.arch}')
 
+        if args.dry_run or not args.skip_space_check:
+            plan = plan_single_pull(session, image_info, args.image, resp_json, args.arch, auth_head,
+                                    get_output_dir(image_info.repository, image_info.tag, args.arch, args.output, create=False),
+                                    args.squash, fetch_config=args.dry_run, compressed_output=compression is not None)
+            if not preflight_pull(plan, args.dry_run):
+                exit_code = 0 if args.dry_run and plan.disk_ok else 1
+                return
+
         output_dir = get_output_dir(image_info.repository, image_info.tag, args.arch, args.output)
         imgdir = str(output_dir / 'layers')
+        ctx.claim_scratch_dir(imgdir)
         os.makedirs(imgdir, exist_ok=True)
         logger.info(f'📁 输出目录：{output_dir}')
         logger.info('📥 开始下载...')
@@ -1998,15 +8755,26 @@ def main():
         else:
             imgparts = image_info.repository.split('/')[:-1]
 
+        layer_index = {} if args.index else None
         download_layers(
             session, image_info.registry, image_info.repository,
             resp_json['layers'], auth_head, imgdir, resp_json,
             imgparts, image_info.image_name, image_info.tag, args.arch,
             output_dir,
-            protocol=image_info.protocol
+            protocol=image_info.protocol,
+            pull_started_at=pull_started_at,
+            engine=args.engine,
+            max_streams=args.streams,
+            ctx=ctx,
+            layer_index=layer_index
         )
 
-        output_file = create_image_tar(imgdir, image_info.repository, image_info.tag, args.arch, output_dir)
+        if args.squash:
+            squash_image_dir(imgdir, ctx)
+        if args.index:
+            write_image_index(index_path_for(image_tar_path(image_info.repository, image_info.tag, args.arch, output_dir)),
+                              imgdir, layer_index)
+        output_file = create_image_tar(imgdir, image_info.repository, image_info.tag, args.arch, output_dir, compression)
         logger.info(f'✅ 镜像已保存为: {output_file}')
         logger.info(f'💡 导入命令: docker load -i {output_file}')
         if image_info.registry not in ("registry-1.docker.io", "registry.hub.docker.com", "docker.io"):
@@ -2028,12 +8796,15 @@ def main():
         logger.debug(traceback.format_exc())
 
     finally:
+        if ctx:
+            ctx.close()
         cleanup_tmp_dir()
-        try:
-            input("\n按回车键退出程序...")
-        except (KeyboardInterrupt, EOFError):
-            pass
-        sys.exit(0)
+        if wait_for_enter:
+            try:
+                input("\n按回车键退出程序...")
+            except (KeyboardInterrupt, EOFError):
+                pass
+        sys.exit(exit_code)
 
 
 if __name__ == '__main__':
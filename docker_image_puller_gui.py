@@ -24,13 +24,14 @@ from PyQt6.QtWidgets import (
     QTableWidget,
     QTableWidgetItem,
     QHeaderView,
-    QMenu
+    QMenu,
+    QSpinBox
 )
 from PyQt6.QtGui import QIcon, QFont, QColor, QPalette
 from PyQt6.QtCore import Qt, pyqtSignal, QObject, QSize, QTimer
 
 # 导入核心功能
-from docker_image_puller import pull_image_logic, stop_event, VERSION, cancel_current_pull
+from docker_image_puller import pull_image_logic, pull_via_daemon, stop_event, VERSION, cancel_current_pull, bandwidth_limiter
 from docker_images_search import DockerImageSearcher, DEFAULT_IMAGES_LIMIT, DEFAULT_TAGS_LIMIT
 
 class Worker(QObject):
@@ -65,15 +66,34 @@ class Worker(QObject):
                 }[self.language]
                 self.log_signal.emit(self.generation, auth_msg)
 
-            # 调用拉取逻辑，传入认证信息
-            pull_image_logic(
-                self.image,
-                registry=self.registry,
-                arch=self.arch,
-                username=self.username,
-                password=self.password,
-                log_callback=self._log_callback
-            )
+            # 设置了 DOCKER_PULLER_DAEMON 时交给常驻的 daemon 拉取（复用其连接、token 和缓存），否则在本进程内拉取
+            daemon_address = os.environ.get('DOCKER_PULLER_DAEMON')
+            if daemon_address:
+                ok = pull_via_daemon(
+                    daemon_address,
+                    [self.image],
+                    registry=self.registry,
+                    arch=self.arch,
+                    username=self.username,
+                    password=self.password,
+                    log_callback=self._log_callback
+                )
+                if not ok and not stop_event.is_set():
+                    error_msg = {
+                        "zh": f"[ERROR] daemon 拉取失败：{self.image}\n",
+                        "en": f"[ERROR] Daemon pull failed: {self.image}\n"
+                    }[self.language]
+                    self.log_signal.emit(self.generation, error_msg)
+            else:
+                # 调用拉取逻辑，传入认证信息
+                pull_image_logic(
+                    self.image,
+                    registry=self.registry,
+                    arch=self.arch,
+                    username=self.username,
+                    password=self.password,
+                    log_callback=self._log_callback
+                )
 
         except Exception as e:
             error_msg = {
@@ -518,6 +538,35 @@ class DockerPullerGUI(QMainWindow):
 
         input_grid.addWidget(self.auth_input_widget, 4, 1)
 
+        # 下载限速（拉取过程中修改立即生效）
+        self.rate_limit_label = QLabel({
+            "zh": "下载限速：",
+            "en": "Rate Limit:"
+        }[self.language])
+        self.rate_limit_spin = QSpinBox()
+        self.rate_limit_spin.setRange(0, 10000)
+        self.rate_limit_spin.setSingleStep(1)
+        self.rate_limit_spin.setSuffix(" MB/s")
+        self.rate_limit_spin.setSpecialValueText({
+            "zh": "不限速",
+            "en": "Unlimited"
+        }[self.language])
+        # 按住微调按钮时数值连续变化，停止调整 500 毫秒后才应用一次
+        self.rate_limit_timer = QTimer(self)
+        self.rate_limit_timer.setSingleShot(True)
+        self.rate_limit_timer.setInterval(500)
+        self.rate_limit_timer.timeout.connect(self.apply_rate_limit)
+        self.rate_limit_spin.valueChanged.connect(self.on_rate_limit_changed)
+        # 通过 daemon 拉取时下载发生在 daemon 进程中，本地限速不起作用，限速由 daemon 的 --limit-rate 设置
+        if os.environ.get('DOCKER_PULLER_DAEMON'):
+            self.rate_limit_spin.setEnabled(False)
+            self.rate_limit_spin.setToolTip({
+                "zh": "通过 daemon 拉取时，限速由 daemon 的 --limit-rate 设置",
+                "en": "When pulling via the daemon, set the rate limit with the daemon's --limit-rate"
+            }[self.language])
+        input_grid.addWidget(self.rate_limit_label, 5, 0)
+        input_grid.addWidget(self.rate_limit_spin, 5, 1)
+
         input_group.setLayout(input_grid)
         pull_layout.addWidget(input_group)
 
@@ -565,10 +614,19 @@ class DockerPullerGUI(QMainWindow):
             self.image_label, self.image_entry,
             self.tag_label, self.tag_entry,
             self.arch_label, self.arch_combobox,
+            self.rate_limit_label, self.rate_limit_spin,
             self.search_entry
         ]:
             widget.setFont(font)
 
+    def on_rate_limit_changed(self, value):
+        """限速数值变化时重新开始计时，连续调整只在停止后应用一次"""
+        self.rate_limit_timer.start()
+
+    def apply_rate_limit(self):
+        """调整全局下载限速，正在进行的拉取立即生效"""
+        bandwidth_limiter.set_global_rate(self.rate_limit_spin.value() * 1024 * 1024)
+
     def create_auth_tab(self):
         """创建认证信息选项卡（样式与镜像拉取一致）"""
         auth_tab = QWidget()
@@ -935,6 +993,10 @@ class DockerPullerGUI(QMainWindow):
 
         self.is_pulling = True
         self.pull_button.setEnabled(False)
+        # 刚调整过、还未应用的限速在拉取开始前应用
+        if self.rate_limit_timer.isActive():
+            self.rate_limit_timer.stop()
+            self.apply_rate_limit()
         
         # 清空日志区域，显示等待进度条
         self.pull_log_text.clear()
@@ -1671,6 +1733,9 @@ class DockerPullerGUI(QMainWindow):
                 "image_label": "镜像名称：",
                 "tag_label": "标签版本：",
                 "arch_label": "系统架构：",
+                "rate_limit_label": "下载限速：",
+                "rate_limit_unlimited": "不限速",
+                "rate_limit_daemon": "通过 daemon 拉取时，限速由 daemon 的 --limit-rate 设置",
                 "auth_group": "",
                 "apply_auth": "保存认证",
                 "auth_placeholder": "{\n  \"registry\": \"your.registry.com\",\n  \"username\": \"your_user\",\n  \"password\": \"your_pass\"\n}"
@@ -1689,6 +1754,9 @@ class DockerPullerGUI(QMainWindow):
                 "image_label": "Image Name:",
                 "tag_label": "Tag:",
                 "arch_label": "Architecture:",
+                "rate_limit_label": "Rate Limit:",
+                "rate_limit_unlimited": "Unlimited",
+                "rate_limit_daemon": "When pulling via the daemon, set the rate limit with the daemon's --limit-rate",
                 "auth_group": "Auth Info",
                 "apply_auth": "Save Auth",
                 "auth_placeholder": "{\n  \"registry\": \"your.registry.com\",\n  \"username\": \"your_user\",\n  \"password\": \"your_pass\"\n}"
@@ -1709,6 +1777,10 @@ class DockerPullerGUI(QMainWindow):
         self.image_label.setText(trans["image_label"])
         self.tag_label.setText(trans["tag_label"])
         self.arch_label.setText(trans["arch_label"])
+        self.rate_limit_label.setText(trans["rate_limit_label"])
+        self.rate_limit_spin.setSpecialValueText(trans["rate_limit_unlimited"])
+        if os.environ.get('DOCKER_PULLER_DAEMON'):
+            self.rate_limit_spin.setToolTip(trans["rate_limit_daemon"])
         # 更新认证信息标签文本
         if hasattr(self, "auth_label"):
             self.auth_label.setText({
@@ -1781,7 +1853,6 @@ class DockerPullerGUI(QMainWindow):
             "zh": "镜像搜索数量：",
             "en": "Image Search Limit:"
         }[self.language])
-        from PyQt6.QtWidgets import QSpinBox
         images_limit_spin = QSpinBox()
         images_limit_spin.setRange(1, 100)
         images_limit_spin.setValue(self.images_limit)
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 吞吐历史等用户状态写到临时目录（路径在导入时确定，需在导入前设置）
+os.environ['XDG_STATE_HOME'] = tempfile.mkdtemp(prefix='docker-image-puller-state-')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import docker_image_puller as dip  # noqa: E402
+from fake_registry import FakeRegistry  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_retry_policy(monkeypatch):
+    """每个测试使用全新的熔断器，退避时间缩短"""
+    monkeypatch.setattr(dip, 'retry_policy', dip.RetryPolicy(base_delay=0.05, max_delay=0.2))
+    dip.stop_event.clear()
+    yield
+    dip.stop_event.clear()
+
+
+@pytest.fixture
+def registry():
+    with FakeRegistry() as reg:
+        yield reg
@@ -0,0 +1,396 @@
+"""测试用的本地镜像仓库：在后台线程中实现 Registry v2 拉取和推送接口的一个子集。
+
+行为与 registry:2 保持一致的部分：清单按标签或 digest 获取，blob 支持单段 Range，
+上传会话支持 POST / 分块 PATCH（校验 Content-Range 顺序）/ PUT ?digest= 完成，以及跨仓库 mount；
+推送清单时检查其引用的 blob 和子清单已存在。可选的 Bearer 认证按 repository:NAME:ACTION 发放令牌。
+
+可以按 digest 注入故障：truncate（响应体发送一半后断开）、corrupt（返回内容被篡改）；
+chunked 为 True 时 blob 以 Transfer-Encoding: chunked 发送，redirect_to 指定时 blob 请求 307 重定向到该地址。
+所有请求记录在 requests 中，供测试检查。
+
+也可以直接运行，生成一组随机 blob 后在子进程中提供服务（供 benchmarks 使用）：
+    python tests/fake_registry.py --blobs 16 --size 4194304
+启动后在标准输出打印一行 JSON：{"url": ..., "repository": ..., "blobs": [{"digest": ..., "size": ...}]}
+"""
+import argparse
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import socket
+import sys
+import tarfile
+import threading
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+DOCKER_MANIFEST = 'application/vnd.docker.distribution.manifest.v2+json'
+DOCKER_CONFIG = 'application/vnd.docker.container.image.v1+json'
+DOCKER_LAYER = 'application/vnd.docker.image.rootfs.diff.tar.gzip'
+OCI_IMAGE_INDEX = 'application/vnd.oci.image.index.v1+json'
+
+
+def sha256_digest(data: bytes) -> str:
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+def make_layer(files: Dict[str, bytes], compresslevel: int = 6) -> Tuple[bytes, bytes]:
+    """把 {路径: 内容} 打包成层，返回 (gzip 压缩后的 blob, 未压缩的 tar)"""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for path, data in files.items():
+            info = tarfile.TarInfo(path)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    raw = buf.getvalue()
+    return gzip.compress(raw, compresslevel=compresslevel, mtime=0), raw
+
+
+@dataclass
+class Request:
+    """记录的一次请求"""
+    method: str
+    path: str
+    range: Optional[str] = None
+
+
+class FakeRegistry:
+    """本地测试仓库，用作上下文管理器时自动启动和关闭"""
+
+    def __init__(self, auth: bool = False):
+        self.auth = auth
+        self.blobs: Dict[str, bytes] = {}
+        self.repo_blobs: Dict[str, Set[str]] = {}
+        self.manifests: Dict[Tuple[str, str], Tuple[bytes, str]] = {}
+        self.uploads: Dict[str, bytearray] = {}
+        self.requests: List[Request] = []
+        self.truncate: Set[str] = set()
+        self.corrupt: Set[str] = set()
+        self.corrupt_always: Set[str] = set()
+        self.chunked = False
+        self.redirect_to: Optional[str] = None
+        self.lock = threading.Lock()
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    # ---- 准备数据 ----
+
+    def add_blob(self, repository: str, data: bytes) -> str:
+        digest = sha256_digest(data)
+        with self.lock:
+            self.blobs[digest] = data
+            self.repo_blobs.setdefault(repository, set()).add(digest)
+        return digest
+
+    def add_manifest(self, repository: str, data: bytes, media_type: str, tag: Optional[str] = None) -> str:
+        digest = sha256_digest(data)
+        with self.lock:
+            self.manifests[(repository, digest)] = (data, media_type)
+            if tag:
+                self.manifests[(repository, tag)] = (data, media_type)
+        return digest
+
+    def add_image(self, repository: str, tag: Optional[str], layers: List[Tuple[bytes, bytes]],
+                  architecture: str = 'amd64', variant: Optional[str] = None) -> Tuple[str, bytes]:
+        """添加一个单平台镜像，layers 为 make_layer 的结果列表；返回 (清单 digest, 清单内容)"""
+        config = {
+            'architecture': architecture, 'os': 'linux', 'config': {},
+            'rootfs': {'type': 'layers', 'diff_ids': [sha256_digest(raw) for _, raw in layers]},
+            'history': [{'created_by': f'layer {i}'} for i in range(len(layers))],
+        }
+        if variant:
+            config['variant'] = variant
+        config_bytes = json.dumps(config).encode()
+        manifest = json.dumps({
+            'schemaVersion': 2, 'mediaType': DOCKER_MANIFEST,
+            'config': {'mediaType': DOCKER_CONFIG, 'size': len(config_bytes),
+                       'digest': self.add_blob(repository, config_bytes)},
+            'layers': [{'mediaType': DOCKER_LAYER, 'size': len(blob), 'digest': self.add_blob(repository, blob)}
+                       for blob, _ in layers],
+        }).encode()
+        return self.add_manifest(repository, manifest, DOCKER_MANIFEST, tag), manifest
+
+    def add_index(self, repository: str, tag: str, platforms: Dict[str, Tuple[str, bytes]]) -> str:
+        """添加多架构索引，platforms 为 {architecture[/variant]: add_image 的返回值}"""
+        entries = []
+        for name, (digest, manifest) in platforms.items():
+            architecture, _, variant = name.partition('/')
+            platform = {'architecture': architecture, 'os': 'linux'}
+            if variant:
+                platform['variant'] = variant
+            entries.append({'mediaType': DOCKER_MANIFEST, 'digest': digest, 'size': len(manifest), 'platform': platform})
+        index = json.dumps({'schemaVersion': 2, 'mediaType': OCI_IMAGE_INDEX, 'manifests': entries}).encode()
+        return self.add_manifest(repository, index, OCI_IMAGE_INDEX, tag)
+
+    def blob_requests(self, digest: str, method: str = 'GET') -> List[Request]:
+        return [r for r in self.requests if r.method == method and r.path.endswith('/' + digest)]
+
+    # ---- 服务 ----
+
+    @property
+    def host(self) -> str:
+        return f'127.0.0.1:{self.server.server_address[1]}'
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}'
+
+    def start(self) -> 'FakeRegistry':
+        self.server = _Server(('127.0.0.1', 0), _make_handler(self))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def __enter__(self) -> 'FakeRegistry':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024   # 数百个并发连接同时到达时不被拒绝
+
+
+def _make_handler(registry: FakeRegistry):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code: int, body: bytes = b'', headers: Optional[Dict[str, str]] = None):
+            self.send_response(code)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def _error(self, code: int, error: str, detail=None):
+            self._send(code, json.dumps({'errors': [{'code': error, 'message': error, 'detail': detail}]}).encode(),
+                       {'Content-Type': 'application/json'})
+
+        def _body(self) -> bytes:
+            length = int(self.headers.get('Content-Length') or 0)
+            return self.rfile.read(length) if length else b''
+
+        def _scopes(self) -> Optional[Dict[str, List[str]]]:
+            header = self.headers.get('Authorization', '')
+            if not header.startswith('Bearer '):
+                return None
+            return json.loads(base64.b64decode(header[7:]))
+
+        def _authorized(self, repository: str, action: str) -> bool:
+            if not registry.auth:
+                return True
+            scopes = self._scopes()
+            if scopes is not None and action in scopes.get(repository, []):
+                return True
+            self._body()
+            self._send(401, b'{}', {'WWW-Authenticate': f'Bearer realm="http://{self.headers["Host"]}/token",'
+                                                        f'service="fake",scope="repository:{repository}:{action}"'})
+            return False
+
+        def _send_blob(self, digest: str):
+            data = registry.blobs[digest]
+            with registry.lock:
+                corrupt = digest in registry.corrupt_always or digest in registry.corrupt
+                registry.corrupt.discard(digest)
+                truncate = self.command == 'GET' and digest in registry.truncate
+                registry.truncate.discard(digest)
+            if corrupt:
+                data = bytes([data[0] ^ 0xFF]) + data[1:]
+            start, end, code = 0, len(data) - 1, 200
+            headers = {'Docker-Content-Digest': digest, 'Content-Type': 'application/octet-stream'}
+            byte_range = self.headers.get('Range')
+            if byte_range and byte_range.startswith('bytes='):
+                first, _, last = byte_range[6:].partition('-')
+                start, end = int(first), min(int(last) if last else len(data) - 1, len(data) - 1)
+                if start >= len(data):
+                    return self._send(416, b'', {'Content-Range': f'bytes */{len(data)}'})
+                code = 206
+                headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+            body = data[start:end + 1]
+            if self.command == 'HEAD':
+                return self._head(code, headers, len(body))
+            self.send_response(code)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            if registry.chunked:
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for offset in range(0, len(body), 65536):
+                    piece = body[offset:offset + 65536]
+                    self.wfile.write(f'{len(piece):x}\r\n'.encode() + piece + b'\r\n')
+                self.wfile.write(b'0\r\n\r\n')
+                return
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if truncate:
+                # 发送一半后断开连接，模拟中途断线
+                self.wfile.write(body[:len(body) // 2])
+                self.wfile.flush()
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            self.wfile.write(body)
+
+        def _head(self, code: int, headers: Dict[str, str], length: int):
+            self.send_response(code)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(length))
+            self.end_headers()
+
+        def route(self):
+            url = urlsplit(self.path)
+            path, query = url.path, parse_qs(url.query)
+            with registry.lock:
+                registry.requests.append(Request(self.command, path, self.headers.get('Range')))
+
+            if path == '/token':
+                scopes: Dict[str, List[str]] = {}
+                for scope in query.get('scope', []):
+                    _, repository, actions = scope.split(':')
+                    scopes.setdefault(repository, []).extend(actions.split(','))
+                token = base64.b64encode(json.dumps(scopes).encode()).decode()
+                return self._send(200, json.dumps({'token': token, 'expires_in': 300}).encode())
+            if path == '/v2/':
+                if registry.auth and self._scopes() is None:
+                    return self._send(401, b'{}', {'WWW-Authenticate': f'Bearer realm="http://{self.headers["Host"]}/token",service="fake"'})
+                return self._send(200, b'{}', {'Docker-Distribution-API-Version': 'registry/2.0'})
+            if path.startswith('/cdn/'):
+                digest = path[len('/cdn/'):]
+                return self._send_blob(digest) if digest in registry.blobs else self._error(404, 'BLOB_UNKNOWN')
+            if not path.startswith('/v2/'):
+                return self._send(404)
+            rest = path[len('/v2/'):]
+
+            if '/blobs/uploads/' in rest or rest.endswith('/blobs/uploads'):
+                repository, _, upload_id = rest.partition('/blobs/uploads')
+                return self._upload(repository, upload_id.lstrip('/'), query)
+            if '/blobs/' in rest:
+                repository, _, digest = rest.rpartition('/blobs/')
+                if not self._authorized(repository, 'pull'):
+                    return
+                if digest not in registry.repo_blobs.get(repository, set()):
+                    return self._error(404, 'BLOB_UNKNOWN')
+                if registry.redirect_to and self.command == 'GET':
+                    return self._send(307, b'', {'Location': f'{registry.redirect_to}/cdn/{digest}'})
+                return self._send_blob(digest)
+            if '/manifests/' in rest:
+                repository, _, reference = rest.rpartition('/manifests/')
+                if self.command == 'PUT':
+                    return self._put_manifest(repository, reference)
+                if not self._authorized(repository, 'pull'):
+                    return
+                if (repository, reference) not in registry.manifests:
+                    return self._error(404, 'MANIFEST_UNKNOWN')
+                data, media_type = registry.manifests[(repository, reference)]
+                return self._send(200, data, {'Content-Type': media_type, 'Docker-Content-Digest': sha256_digest(data)})
+            self._send(404)
+
+        def _upload(self, repository: str, upload_id: str, query: Dict[str, List[str]]):
+            if not self._authorized(repository, 'push'):
+                return
+            if self.command == 'POST':
+                self._body()
+                if 'mount' in query:
+                    digest, source = query['mount'][0], query.get('from', [''])[0]
+                    readable = not registry.auth or 'pull' in (self._scopes() or {}).get(source, [])
+                    if readable and digest in registry.repo_blobs.get(source, set()):
+                        with registry.lock:
+                            registry.repo_blobs.setdefault(repository, set()).add(digest)
+                        return self._send(201, b'', {'Location': f'/v2/{repository}/blobs/{digest}',
+                                                     'Docker-Content-Digest': digest})
+                upload_id = uuid.uuid4().hex
+                with registry.lock:
+                    registry.uploads[upload_id] = bytearray()
+                return self._send(202, b'', {'Location': f'/v2/{repository}/blobs/uploads/{upload_id}?_state=0',
+                                             'Range': '0-0', 'Docker-Upload-UUID': upload_id})
+            if upload_id not in registry.uploads:
+                self._body()
+                return self._error(404, 'BLOB_UPLOAD_UNKNOWN')
+            buffer = registry.uploads[upload_id]
+            if self.command == 'PATCH':
+                data = self._body()
+                content_range = self.headers.get('Content-Range')
+                if content_range:
+                    first, last = map(int, content_range.split('-'))
+                    if first != len(buffer) or last - first + 1 != len(data):
+                        return self._send(416, b'', {'Range': f'0-{len(buffer) - 1}'})
+                buffer += data
+                return self._send(202, b'', {'Location': f'/v2/{repository}/blobs/uploads/{upload_id}?_state={len(buffer)}',
+                                             'Range': f'0-{len(buffer) - 1}', 'Docker-Upload-UUID': upload_id})
+            if self.command == 'PUT':
+                data = bytes(buffer) + self._body()
+                digest = query.get('digest', [''])[0]
+                if sha256_digest(data) != digest:
+                    return self._error(400, 'DIGEST_INVALID')
+                with registry.lock:
+                    registry.uploads.pop(upload_id, None)
+                    registry.blobs[digest] = data
+                    registry.repo_blobs.setdefault(repository, set()).add(digest)
+                return self._send(201, b'', {'Location': f'/v2/{repository}/blobs/{digest}', 'Docker-Content-Digest': digest})
+            if self.command == 'DELETE':
+                with registry.lock:
+                    registry.uploads.pop(upload_id, None)
+                return self._send(204)
+            self._send(405)
+
+        def _put_manifest(self, repository: str, reference: str):
+            if not self._authorized(repository, 'push'):
+                return
+            data = self._body()
+            manifest = json.loads(data)
+            missing = [child['digest'] for child in manifest.get('manifests', [])
+                       if (repository, child['digest']) not in registry.manifests]
+            blobs = ([manifest['config']] if 'config' in manifest else []) + manifest.get('layers', [])
+            missing += [blob['digest'] for blob in blobs if blob['digest'] not in registry.repo_blobs.get(repository, set())]
+            if missing:
+                return self._error(400, 'MANIFEST_BLOB_UNKNOWN', missing)
+            digest = sha256_digest(data)
+            if reference.startswith('sha256:') and reference != digest:
+                return self._error(400, 'DIGEST_INVALID')
+            registry.add_manifest(repository, data, self.headers.get('Content-Type', ''),
+                                  None if reference.startswith('sha256:') else reference)
+            self._send(201, b'', {'Location': f'/v2/{repository}/manifests/{digest}', 'Docker-Content-Digest': digest})
+
+        do_GET = do_HEAD = do_POST = do_PATCH = do_PUT = do_DELETE = route
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='在前台运行测试仓库，提供一组随机 blob')
+    parser.add_argument('--blobs', type=int, default=1, help='blob 数量')
+    parser.add_argument('--size', type=int, default=16 * 1024 * 1024, help='每个 blob 的字节数')
+    parser.add_argument('--repository', default='bench/app')
+    args = parser.parse_args()
+
+    registry = FakeRegistry()
+    blobs = []
+    for _ in range(args.blobs):
+        data = os.urandom(args.size)
+        blobs.append({'digest': registry.add_blob(args.repository, data), 'size': len(data)})
+    registry.start()
+    print(json.dumps({'url': registry.url, 'repository': args.repository, 'blobs': blobs}), flush=True)
+    try:
+        sys.stdin.read()
+    finally:
+        registry.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""copy：以本地测试仓库作为源和目标（registry:2 的上传、跨仓库挂载和认证协议）"""
+import json
+import os
+
+import pytest
+
+from conftest import dip
+from fake_registry import FakeRegistry, make_layer
+
+
+@pytest.fixture
+def source(registry):
+    """lib/app:multi 包含 amd64 和 arm64/v8 两个平台"""
+    platforms = {}
+    for name in ('amd64', 'arm64/v8'):
+        architecture, _, variant = name.partition('/')
+        layers = [make_layer({'data.bin': os.urandom(200_000)}), make_layer({'arch.txt': name.encode()})]
+        platforms[name] = registry.add_image('lib/app', None, layers, architecture, variant or None)
+    registry.index_digest = registry.add_index('lib/app', 'multi', platforms)
+    return registry
+
+
+@pytest.fixture
+def dest():
+    with FakeRegistry(auth=True) as reg:
+        yield reg
+
+
+def copy(source, dest, src='lib/app:multi', dst='mirror/app:multi', *args) -> int:
+    return dip.cmd_copy([f'{source.url}/{src}', f'{dest.url}/{dst}', '--chunk-size', '1', *args])
+
+
+def uploads(registry):
+    return [r for r in registry.requests if r.method == 'PUT' and '/blobs/uploads/' in r.path]
+
+
+def test_copy_all_platforms_keeps_digest(source, dest):
+    assert copy(source, dest) == 0
+    data, _ = dest.manifests[('mirror/app', 'multi')]
+    assert data == source.manifests[('lib/app', 'multi')][0]
+    assert dest.repo_blobs['mirror/app'] == source.repo_blobs['lib/app']
+    assert all(dest.blobs[d] == source.blobs[d] for d in dest.repo_blobs['mirror/app'])
+
+
+def test_recopy_skips_existing_blobs(source, dest):
+    assert copy(source, dest) == 0
+    dest.requests.clear()
+    assert copy(source, dest) == 0
+    assert uploads(dest) == []
+
+
+def test_mount_from_other_repository(source, dest):
+    assert copy(source, dest) == 0
+    dest.requests.clear()
+    assert copy(source, dest, 'lib/app:multi', 'other/app:multi', '--mount-from', 'mirror/app') == 0
+    assert uploads(dest) == []
+    assert any(r.method == 'POST' and r.path == '/v2/other/app/blobs/uploads/' for r in dest.requests)
+    assert dest.repo_blobs['other/app'] == source.repo_blobs['lib/app']
+
+
+def test_platform_subset(source, dest):
+    assert copy(source, dest, 'lib/app:multi', 'mirror/app:arm64', '-a', 'arm64') == 0
+    manifest = json.loads(dest.manifests[('mirror/app', 'arm64')][0])
+    assert 'config' in manifest
+    config = json.loads(dest.blobs[manifest['config']['digest']])
+    assert config['architecture'] == 'arm64'
+
+
+def test_digest_destination(source, dest):
+    assert copy(source, dest, 'lib/app:multi', f'mirror/app@{source.index_digest}') == 0
+    assert ('mirror/app', source.index_digest) in dest.manifests
+    assert ('mirror/app', 'multi') not in dest.manifests
+
+
+def test_digest_destination_rejects_subset(source, dest):
+    assert copy(source, dest, 'lib/app:multi', f'mirror/app@{source.index_digest}', '-a', 'amd64') == 1
+    assert copy(source, dest, 'lib/app:multi', f'mirror/app@sha256:{"0" * 64}') == 1
+    assert dest.manifests == {}
+    assert uploads(dest) == []
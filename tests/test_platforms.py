@@ -0,0 +1,58 @@
+"""架构选择：带 variant 的平台、bashbrew 风格别名，以及只有一个平台的镜像按实际平台命名"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, dip
+from fake_registry import make_layer
+
+
+@pytest.fixture
+def multi_arch(registry):
+    """lib/app:multi 包含 amd64、arm/v7 和 arm64/v8；lib/app:single 只有 arm64/v8"""
+    platforms = {}
+    for name in ('amd64', 'arm/v7', 'arm64/v8'):
+        architecture, _, variant = name.partition('/')
+        layer = make_layer({'arch.txt': name.encode()})
+        platforms[name] = registry.add_image('lib/app', None, [layer], architecture, variant or None)
+    registry.add_index('lib/app', 'multi', platforms)
+    registry.add_image('lib/app', 'single', [make_layer({'arch.txt': b'arm64/v8'})], 'arm64', 'v8')
+    return registry
+
+
+def exported(tmp_path):
+    return sorted(path.name for path in (tmp_path / 'out').glob('*.tar'))
+
+
+@pytest.mark.parametrize('arch, label', [
+    ('arm/v7', 'arm_v7'),
+    ('arm32v7', 'arm32v7'),
+    ('arm64', 'arm64'),
+    ('arm64v8', 'arm64v8'),
+])
+def test_batch_selects_variant_aliases(multi_arch, tmp_path, arch, label):
+    assert dip.pull_images_batch(['lib/app:multi'], registry=multi_arch.url, arch=arch, output_path=str(tmp_path / 'out'))
+    assert exported(tmp_path) == [f'lib_app_multi_{label}.tar']
+
+
+def test_single_platform_image_uses_actual_platform(multi_arch, tmp_path):
+    assert dip.pull_images_batch(['lib/app:single'], registry=multi_arch.url, arch='amd64', output_path=str(tmp_path / 'out'))
+    assert exported(tmp_path) == ['lib_app_single_arm64_v8.tar']
+
+
+def test_single_platform_image_keeps_matching_label(multi_arch, tmp_path):
+    assert dip.pull_images_batch(['lib/app:single'], registry=multi_arch.url, arch='arm64', output_path=str(tmp_path / 'out'))
+    assert exported(tmp_path) == ['lib_app_single_arm64.tar']
+
+
+@pytest.mark.parametrize('arch, label', [('arm/v7', 'arm_v7'), ('arm32v7', 'arm32v7'), ('arm64', 'arm64')])
+def test_cli_single_image_selects_variant_aliases(multi_arch, tmp_path, arch, label):
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'docker_image_puller.py'), '-q', '-i', 'lib/app:multi',
+         '-r', multi_arch.url, '-a', arch, '-o', str(tmp_path)],
+        input='\n', capture_output=True, text=True, timeout=120,
+        env={**os.environ, 'XDG_STATE_HOME': str(tmp_path / 'state')}
+    )
+    assert (tmp_path / f'lib_app_multi_{label}' / f'lib_app_multi_{label}.tar').is_file(), result.stderr
@@ -0,0 +1,83 @@
+"""serve：以本地测试仓库为上游的只读拉取缓存，并发请求合并为一次上游下载，blob 支持 Range"""
+import http.server
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from conftest import dip
+from fake_registry import make_layer
+
+
+@pytest.fixture
+def image(registry):
+    """lib/app:latest，返回 (清单 digest, 最大的层的 digest)"""
+    layer = make_layer({'data.bin': os.urandom(4 * 1024 * 1024)}, compresslevel=0)
+    digest, manifest = registry.add_image('lib/app', 'latest', [layer])
+    return digest, json.loads(manifest)['layers'][0]['digest']
+
+
+@pytest.fixture
+def serve(registry, tmp_path):
+    """启动 serve 的仓库，返回 (PullThroughRegistry, 地址)"""
+    session = dip.SessionManager.get_session()
+    store_dir = tmp_path / 'blobs'
+    store_dir.mkdir()
+    pull_through = dip.PullThroughRegistry(store_dir, registry.host, 'http', dip.RegistryAuthCache(session), session)
+    handler = type('RegistryRequestHandler', (dip._RegistryRequestHandler,), {'registry': pull_through})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield pull_through, f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_manifest_by_tag_is_cached(registry, image, serve):
+    pull_through, url = serve
+    for _ in range(2):
+        resp = requests.get(f'{url}/v2/lib/app/manifests/latest')
+        assert resp.status_code == 200
+        assert resp.headers['Docker-Content-Digest'] == image[0]
+    assert len([r for r in registry.requests if r.method == 'GET' and '/manifests/' in r.path]) == 1
+    assert pull_through.stats['hits'] == 1
+
+
+def test_concurrent_blob_requests_are_coalesced(registry, image, serve):
+    _, url = serve
+    digest = image[1]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        bodies = list(executor.map(lambda _: requests.get(f'{url}/v2/lib/app/blobs/{digest}').content, range(8)))
+    assert all(body == registry.blobs[digest] for body in bodies)
+    assert len(registry.blob_requests(digest)) == 1
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_blob_range(registry, image, serve, cached):
+    _, url = serve
+    digest = image[1]
+    data = registry.blobs[digest]
+    blob_url = f'{url}/v2/lib/app/blobs/{digest}'
+    if cached:
+        assert requests.get(blob_url).content == data
+
+    resp = requests.get(blob_url, headers={'Range': 'bytes=100-1099'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == f'bytes 100-1099/{len(data)}'
+    assert resp.content == data[100:1100]
+
+    resp = requests.get(blob_url, headers={'Range': 'bytes=-10'})
+    assert resp.status_code == 206 and resp.content == data[-10:]
+
+    resp = requests.get(blob_url, headers={'Range': f'bytes={len(data)}-'})
+    assert resp.status_code == 416
+    assert resp.headers['Content-Range'] == f'bytes */{len(data)}'
+    assert len(registry.blob_requests(digest)) == 1
+
+
+def test_push_is_unsupported(serve):
+    _, url = serve
+    assert requests.post(f'{url}/v2/lib/app/blobs/uploads/').status_code == 405
@@ -0,0 +1,58 @@
+"""verify：输出目录展开为其中的 tar 和 blob 仓库，没有可校验内容的目录报告为无法识别"""
+import os
+
+import pytest
+
+from conftest import dip
+from fake_registry import make_layer
+
+
+@pytest.fixture
+def output(registry, tmp_path):
+    registry.add_image('lib/app', 'latest', [make_layer({'data.bin': os.urandom(100_000)})])
+    assert dip.pull_images_batch(['lib/app:latest'], registry=registry.url, output_path=str(tmp_path / 'out'))
+    return tmp_path / 'out'
+
+
+def verify(tmp_path, *paths):
+    issues = []
+    checked, count = dip.verify_paths([str(path) for path in paths], jobs=1, state_path=str(tmp_path / 'state.json'),
+                                      on_issue=issues.append)
+    assert count == len(issues)
+    return checked, issues
+
+
+def test_output_directory_is_expanded(output, tmp_path):
+    assert dip.expand_verify_paths([str(output)]) == [str(output / 'blobs'), *map(str, sorted(output.glob('*.tar')))]
+    checked, issues = verify(tmp_path, output)
+    assert checked > 0 and issues == []
+
+
+def test_corrupted_blob_in_output_directory(output, tmp_path):
+    blob = max((path for path in (output / 'blobs').iterdir() if len(path.name) == 64), key=lambda path: path.stat().st_size)
+    data = bytearray(blob.read_bytes())
+    data[-1] ^= 0xff
+    blob.write_bytes(bytes(data))
+    _, issues = verify(tmp_path, output)
+    assert [(issue['member'], issue['problem']) for issue in issues] == [(blob.name, 'corrupted')]
+
+
+@pytest.mark.parametrize('layout', ['empty', 'unrelated', 'empty-blobs'])
+def test_nothing_to_check_is_reported(tmp_path, layout):
+    target = tmp_path / 'target'
+    target.mkdir()
+    if layout == 'unrelated':
+        (target / 'notes.txt').write_text('hello')
+    elif layout == 'empty-blobs':
+        (target / 'blobs').mkdir()
+    checked, issues = verify(tmp_path, target)
+    assert checked == 0
+    assert [issue['problem'] for issue in issues] == ['unrecognized']
+
+
+def test_cli_exit_code(output, tmp_path):
+    empty = tmp_path / 'empty'
+    empty.mkdir()
+    state = str(tmp_path / 'cli-state.json')
+    assert dip.cmd_verify([str(output), '--state', state]) == 0
+    assert dip.cmd_verify([str(empty), '--state', state]) == 1